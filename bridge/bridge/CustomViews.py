@@ -16,9 +16,10 @@
 #
 
 import os
+import re
 import mimetypes
 
-from django.http import StreamingHttpResponse, HttpResponseNotAllowed
+from django.http import StreamingHttpResponse, HttpResponseNotAllowed, HttpResponse
 from django.views.generic.base import View
 
 from rest_framework.exceptions import APIException
@@ -33,6 +34,63 @@ from bridge.utils import logger, BridgeException
 from users.utils import ViewData
 
 
+def get_byte_range(request, size):
+    """
+    Get the requested range of bytes from "Range" header.
+    :return: None if the whole content is requested, (start, end) tuple (end is included) or
+        (None, None) if the range is not satisfiable.
+    """
+    m = re.match(r'^bytes=(\d*)-(\d*)$', request.META.get('HTTP_RANGE', '').strip())
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+    if m.group(1):
+        start = int(m.group(1))
+        end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+    else:
+        # The last bytes are requested
+        start, end = max(size - int(m.group(2)), 0), size - 1
+    if start > end:
+        return None, None
+    return start, end
+
+
+def streaming_response(request, generator, file_name):
+    """
+    Stream generated file. Generators with known size and "iterate(start, end)" method support range requests,
+    so interrupted downloads can be resumed. Generators with "etag" attribute identify their content, so the
+    range is sent only if "If-Range" header matches it, otherwise the whole changed file is sent.
+    """
+    mimetype = mimetypes.guess_type(os.path.basename(file_name))[0]
+    file_size = getattr(generator, 'size', None)
+    etag = getattr(generator, 'etag', None)
+    byte_range = None
+    if file_size is not None and hasattr(generator, 'iterate'):
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range is None or (etag is not None and if_range.strip() == etag):
+            byte_range = get_byte_range(request, file_size)
+    if byte_range == (None, None):
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(file_size)
+        return response
+
+    if byte_range:
+        response = StreamingHttpResponse(
+            generator.iterate(byte_range[0], byte_range[1] + 1), status=206, content_type=mimetype
+        )
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(byte_range[0], byte_range[1], file_size)
+        response['Content-Length'] = byte_range[1] - byte_range[0] + 1
+    else:
+        response = StreamingHttpResponse(generator, content_type=mimetype)
+        if file_size is not None:
+            response['Content-Length'] = file_size
+    if hasattr(generator, 'iterate'):
+        response['Accept-Ranges'] = 'bytes'
+    if etag is not None:
+        response['ETag'] = etag
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(file_name)
+    return response
+
+
 class TemplateAPIRetrieveView(GenericAPIView):
     template_name = None
     renderer_classes = (TemplateHTMLRenderer,)
@@ -98,14 +156,7 @@ class StreamingResponseView(View):
         if not isinstance(file_name, str) or len(file_name) == 0:
             raise BridgeException()
 
-        file_size = getattr(generator, 'size', None)
-
-        mimetype = mimetypes.guess_type(os.path.basename(file_name))[0]
-        response = StreamingHttpResponse(generator, content_type=mimetype)
-        if file_size is not None:
-            response['Content-Length'] = file_size
-        response['Content-Disposition'] = 'attachment; filename="{}"'.format(file_name)
-        return response
+        return streaming_response(self.request, generator, file_name)
 
     def get(self, *args, **kwargs):
         if self.http_method != 'get':
@@ -143,14 +194,7 @@ class StreamingResponseAPIView(APIView):
         if not isinstance(file_name, str) or len(file_name) == 0:
             raise APIException()
 
-        file_size = getattr(generator, 'size', None)
-
-        mimetype = mimetypes.guess_type(os.path.basename(file_name))[0]
-        response = StreamingHttpResponse(generator, content_type=mimetype)
-        if file_size:
-            response['Content-Length'] = file_size
-        response['Content-Disposition'] = 'attachment; filename="{}"'.format(file_name)
-        return response
+        return streaming_response(self.request, generator, file_name)
 
     def get(self, *args, **kwargs):
         if self.http_method != 'get':
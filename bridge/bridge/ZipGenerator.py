@@ -16,14 +16,20 @@
 #
 
 import os
+import copy
+import hashlib
 import struct
+import threading
 import time
 import zlib
+from collections import OrderedDict
 
-from zipfile import ZipInfo, ZIP_DEFLATED, ZIP64_LIMIT, ZIP_FILECOUNT_LIMIT
+from zipfile import ZipInfo, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT, ZIP_FILECOUNT_LIMIT
 
 
 CHUNK_SIZE = 1024 * 64
+# Maximum number of CRCs of generated sources that are kept for resumed downloads
+CRC_CACHE_SIZE = 100000
 
 
 class LargeZipFile(Exception):
@@ -193,66 +199,364 @@ class ZipStream:
         self._filelist.append(zinfo)
 
     def close_stream(self):
-        data = []
-        pos1 = self._data_p
-        for zinfo in self._filelist:
-            dt = zinfo.date_time
-            dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
-            dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
-            extra = []
-            if zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT:
-                extra.append(zinfo.file_size)
-                extra.append(zinfo.compress_size)
-                file_size = 0xffffffff
-                compress_size = 0xffffffff
-            else:
-                file_size = zinfo.file_size
-                compress_size = zinfo.compress_size
+        data = central_directory(self._filelist, self._data_p)
+        return self.__get_data(data)
+
+
+def central_directory(filelist, offset):
+    """
+    Get zip archive central directory with the end of central directory record.
+    :param filelist: list of ZipInfo of archive members.
+    :param offset: the central directory offset.
+    :return: bytes.
+    """
+    data = []
+    for zinfo in filelist:
+        dt = zinfo.date_time
+        dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
+        dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
+        extra = []
+        if zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT:
+            extra.append(zinfo.file_size)
+            extra.append(zinfo.compress_size)
+            file_size = 0xffffffff
+            compress_size = 0xffffffff
+        else:
+            file_size = zinfo.file_size
+            compress_size = zinfo.compress_size
 
-            if zinfo.header_offset > ZIP64_LIMIT:
-                extra.append(zinfo.header_offset)
-                header_offset = 0xffffffff
+        if zinfo.header_offset > ZIP64_LIMIT:
+            extra.append(zinfo.header_offset)
+            header_offset = 0xffffffff
+        else:
+            header_offset = zinfo.header_offset
+
+        extra_data = zinfo.extra
+        min_version = 0
+        if extra:
+            extra_data = struct.pack('<HH' + 'Q'*len(extra), 1, 8*len(extra), *extra) + extra_data
+            min_version = 45
+
+        extract_version = max(min_version, zinfo.extract_version)
+        create_version = max(min_version, zinfo.create_version)
+        filename, flag_bits = zinfo._encodeFilenameFlags()
+
+        centdir = struct.pack(
+            structCentralDir, stringCentralDir,
+            create_version, zinfo.create_system, extract_version,
+            zinfo.reserved, flag_bits, zinfo.compress_type,
+            dostime, dosdate, zinfo.CRC, compress_size, file_size,
+            len(filename), len(extra_data), len(zinfo.comment),
+            0, zinfo.internal_attr, zinfo.external_attr, header_offset
+        )
+        data.append(centdir)
+        data.append(filename)
+        data.append(extra_data)
+        data.append(zinfo.comment)
+
+    dir_size = sum(len(x) for x in data)
+    pos2 = offset + dir_size
+    count = len(filelist)
+    dir_offset = offset
+    if count > ZIP_FILECOUNT_LIMIT or dir_offset > ZIP64_LIMIT or dir_size > ZIP64_LIMIT:
+        zip64endrec = struct.pack(
+            structEndArchive64, stringEndArchive64, 44, 45, 45, 0, 0, count, count, dir_size, dir_offset
+        )
+        data.append(zip64endrec)
+        zip64locrec = struct.pack(structEndArchive64Locator, stringEndArchive64Locator, 0, pos2, 1)
+        data.append(zip64locrec)
+        count = min(count, 0xFFFF)
+        dir_size = min(dir_size, 0xFFFFFFFF)
+        dir_offset = min(dir_offset, 0xFFFFFFFF)
+
+    endrec = struct.pack(structEndArchive, stringEndArchive, 0, 0, count, count, dir_size, dir_offset, 0)
+    data.append(endrec)
+    return b''.join(data)
+
+
+class _CRCCache:
+    """
+    CRCs of sources by their keys. Resumed downloads are served by new archive plans, so without it all members
+    preceding the requested range would be read again to get their CRCs for the central directory.
+    """
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._crcs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            crc = self._crcs.get(key)
+            if crc is not None:
+                self._crcs.move_to_end(key)
+            return crc
+
+    def set(self, key, crc):
+        if key is None:
+            return
+        with self._lock:
+            self._crcs[key] = crc
+            self._crcs.move_to_end(key)
+            while len(self._crcs) > self._max_size:
+                self._crcs.popitem(last=False)
+
+
+crc_cache = _CRCCache(CRC_CACHE_SIZE)
+
+
+class BytesSource:
+    # CRC of data is always known in advance, so the source does not need a key
+    key = None
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+
+    def iterate(self, start=0, end=None):
+        yield self.data[start:end]
+
+
+class FileSource:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        st = os.stat(file_path)
+        self.size = st.st_size
+        # The file content is identified by its path, size and modification time
+        self.key = 'file:{}:{}:{}'.format(file_path, st.st_size, st.st_mtime_ns)
+
+    def iterate(self, start=0, end=None):
+        end = self.size if end is None else end
+        with open(self.file_path, mode='rb') as fp:
+            fp.seek(start)
+            while start < end:
+                buf = fp.read(min(CHUNK_SIZE, end - start))
+                if not buf:
+                    raise RuntimeError('The file "{}" was changed while archiving'.format(self.file_path))
+                start += len(buf)
+                yield buf
+
+
+class DeflatedFileSource:
+    """
+    Data that is deflated into the file while it is written, so large generated archive members are not kept in
+    memory. CRC and size of the data are calculated while it is written.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.crc = 0
+        self.file_size = 0
+        self.size = self.key = None
+        self._digest = hashlib.sha1()
+        self._cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        self._buf = []
+        self._buf_size = 0
+        self._fp = open(file_path, mode='wb')
+        self._source = None
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._buf.append(data)
+        self._buf_size += len(data)
+        if self._buf_size >= CHUNK_SIZE:
+            self.__flush()
+
+    def __flush(self):
+        data = b''.join(self._buf)
+        self._buf = []
+        self._buf_size = 0
+        self.crc = zlib.crc32(data, self.crc) & 0xffffffff
+        self.file_size += len(data)
+        self._digest.update(data)
+        self._fp.write(self._cmpr.compress(data))
+
+    def close(self):
+        if self._source is not None:
+            return
+        self.__flush()
+        self._fp.write(self._cmpr.flush())
+        self._fp.close()
+        self._source = FileSource(self.file_path)
+        self.size = self._source.size
+        # Deflated data is the same for the same written data
+        self.key = 'deflated:{}'.format(self._digest.hexdigest())
+
+    def iterate(self, start=0, end=None):
+        return self._source.iterate(start, end)
+
+
+class _PlannedMember:
+    def __init__(self, zinfo, source):
+        self.zinfo = zinfo
+        self.source = source
+        if zinfo.CRC is None:
+            zinfo.CRC = crc_cache.get(source.key)
+        zip64 = zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT
+        self.header = zinfo.FileHeader(zip64)
+        self._descriptor_fmt = None
+        descriptor_size = 0
+        if zinfo.flag_bits & 0x08:
+            self._descriptor_fmt = '<4sLQQ' if zip64 else '<4sLLL'
+            descriptor_size = struct.calcsize(self._descriptor_fmt)
+        self.size = len(self.header) + zinfo.compress_size + descriptor_size
+
+    @property
+    def crc(self):
+        if self.zinfo.CRC is None:
+            crc = 0
+            for buf in self.source.iterate():
+                crc = zlib.crc32(buf, crc)
+            self.zinfo.CRC = crc & 0xffffffff
+            crc_cache.set(self.source.key, self.zinfo.CRC)
+        return self.zinfo.CRC
+
+    def iterate(self, start, end):
+        content_start = len(self.header)
+        content_end = content_start + self.zinfo.compress_size
+        if start < content_start:
+            yield self.header[start:end]
+        if start < content_end and end > content_start:
+            start_pos, end_pos = max(start - content_start, 0), min(end, content_end) - content_start
+            if self.zinfo.CRC is None and start_pos == 0 and end_pos == self.zinfo.compress_size:
+                # Calculate CRC while the whole member is generated
+                crc = 0
+                for buf in self.source.iterate(start_pos, end_pos):
+                    crc = zlib.crc32(buf, crc)
+                    yield buf
+                self.zinfo.CRC = crc & 0xffffffff
+                crc_cache.set(self.source.key, self.zinfo.CRC)
             else:
-                header_offset = zinfo.header_offset
-
-            extra_data = zinfo.extra
-            min_version = 0
-            if extra:
-                extra_data = struct.pack('<HH' + 'Q'*len(extra), 1, 8*len(extra), *extra) + extra_data
-                min_version = 45
-
-            extract_version = max(min_version, zinfo.extract_version)
-            create_version = max(min_version, zinfo.create_version)
-            filename, flag_bits = zinfo._encodeFilenameFlags()
-
-            centdir = struct.pack(
-                structCentralDir, stringCentralDir,
-                create_version, zinfo.create_system, extract_version,
-                zinfo.reserved, flag_bits, zinfo.compress_type,
-                dostime, dosdate, zinfo.CRC, compress_size, file_size,
-                len(filename), len(extra_data), len(zinfo.comment),
-                0, zinfo.internal_attr, zinfo.external_attr, header_offset
-            )
-            data.append(self.__get_data(centdir))
-            data.append(self.__get_data(filename))
-            data.append(self.__get_data(extra_data))
-            data.append(self.__get_data(zinfo.comment))
-
-        pos2 = self._data_p
-        count = len(self._filelist)
-        dir_size = pos2 - pos1
-        dir_offset = pos1
-        if count > ZIP_FILECOUNT_LIMIT or dir_offset > ZIP64_LIMIT or dir_size > ZIP64_LIMIT:
-            zip64endrec = struct.pack(
-                structEndArchive64, stringEndArchive64, 44, 45, 45, 0, 0, count, count, dir_size, dir_offset
+                yield from self.source.iterate(start_pos, end_pos)
+        if self._descriptor_fmt and end > content_end:
+            data_descriptor = struct.pack(
+                self._descriptor_fmt, stringDataDescriptor, self.crc, self.zinfo.compress_size, self.zinfo.file_size
             )
-            data.append(self.__get_data(zip64endrec))
-            zip64locrec = struct.pack(structEndArchive64Locator, stringEndArchive64Locator, 0, pos2, 1)
-            data.append(self.__get_data(zip64locrec))
-            count = min(count, 0xFFFF)
-            dir_size = min(dir_size, 0xFFFFFFFF)
-            dir_offset = min(dir_offset, 0xFFFFFFFF)
-
-        endrec = struct.pack(structEndArchive, stringEndArchive, 0, 0, count, count, dir_size, dir_offset, 0)
-        data.append(self.__get_data(endrec))
-        return b''.join(data)
+            yield data_descriptor[max(start - content_end, 0):end - content_end]
+
+
+class ZipArchivePlan:
+    """
+    Zip archive with all members known before generating it. Offsets of members and the archive size are calculated
+    in advance, so the archive can be generated from any position to resume interrupted downloads. Members which CRC
+    is unknown are stored with data descriptors and their CRC is calculated while they are generated. The archive is
+    a source itself, so it can be nested into other archives.
+    """
+    deflate_limit = 1024 * 1024
+
+    def __init__(self, date_time=None):
+        self._date_time = tuple(date_time or time.localtime(time.time())[:6])
+        self._members = []
+        self._offset = 0
+        self._size = None
+        self._key = None
+
+    def add_string(self, arcname, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        zinfo = ZipInfo(filename=arcname, date_time=self._date_time)
+        zinfo.compress_type = ZIP_DEFLATED
+        zinfo.external_attr = 0o600 << 16
+        zinfo.file_size = len(data)
+        zinfo.CRC = zlib.crc32(data) & 0xffffffff
+        cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        data = cmpr.compress(data) + cmpr.flush()
+        zinfo.compress_size = len(data)
+        self.__add(zinfo, BytesSource(data))
+
+    def add_file(self, file_path, arcname):
+        """
+        Add the file. Zip archives and large files are stored as is, other files are deflated.
+        """
+        st = os.stat(file_path)
+        if os.path.splitext(file_path)[-1] != '.zip' and st.st_size <= self.deflate_limit:
+            with open(file_path, mode='rb') as fp:
+                self.add_string(arcname, fp.read())
+            self._members[-1].zinfo.external_attr = (st[0] & 0xFFFF) << 16
+            return
+        self.add_source(arcname, FileSource(file_path), date_time=time.localtime(st.st_mtime)[:6])
+        self._members[-1].zinfo.external_attr = (st[0] & 0xFFFF) << 16
+
+    def add_deflated(self, arcname, source):
+        """
+        Store data of the closed DeflatedFileSource as deflated.
+        """
+        zinfo = ZipInfo(filename=arcname, date_time=self._date_time)
+        zinfo.compress_type = ZIP_DEFLATED
+        zinfo.external_attr = 0o600 << 16
+        zinfo.file_size = source.file_size
+        zinfo.compress_size = source.size
+        zinfo.CRC = source.crc
+        self.__add(zinfo, source)
+
+    def add_source(self, arcname, source, date_time=None):
+        """
+        Store data of the source which has "size" attribute and "iterate(start, end)" method.
+        """
+        zinfo = ZipInfo(filename=arcname, date_time=tuple(date_time or self._date_time))
+        zinfo.compress_type = ZIP_STORED
+        zinfo.external_attr = 0o600 << 16
+        zinfo.flag_bits = 0x08
+        zinfo.file_size = zinfo.compress_size = source.size
+        zinfo.CRC = None
+        self.__add(zinfo, source)
+
+    def __add(self, zinfo, source):
+        if self._size is not None:
+            raise RuntimeError('The archive plan is already completed')
+        zinfo.header_offset = self._offset
+        member = _PlannedMember(zinfo, source)
+        self._members.append(member)
+        self._offset += member.size
+
+    @property
+    def size(self):
+        if self._size is None:
+            filelist = []
+            for member in self._members:
+                zinfo = copy.copy(member.zinfo)
+                zinfo.CRC = 0
+                filelist.append(zinfo)
+            self._size = self._offset + len(central_directory(filelist, self._offset))
+        return self._size
+
+    @property
+    def key(self):
+        """
+        Identifier of the archive content. It is the same for plans of the same members with the same sources, or None
+        if some member sources can't be identified.
+        """
+        if self._key is None:
+            digest = hashlib.sha1(repr((self._date_time, self.size)).encode('utf-8'))
+            for member in self._members:
+                # Keys of sources do not change when CRCs are calculated
+                source_key = member.source.key if member.source.key is not None else member.zinfo.CRC
+                if source_key is None:
+                    return None
+                digest.update(member.header)
+                digest.update(repr((member.zinfo.external_attr, source_key)).encode('utf-8'))
+            self._key = 'plan:{}'.format(digest.hexdigest())
+        return self._key
+
+    def __iter__(self):
+        return self.iterate()
+
+    def iterate(self, start=0, end=None):
+        """
+        Generate the archive bytes from start to end (not included).
+        """
+        end = self.size if end is None else min(end, self.size)
+        for member in self._members:
+            member_start = member.zinfo.header_offset
+            if member_start >= end:
+                return
+            if member_start + member.size > start:
+                yield from member.iterate(max(start - member_start, 0), end - member_start)
+        if end > self._offset:
+            for member in self._members:
+                member.zinfo.CRC = member.crc
+            data = central_directory(list(member.zinfo for member in self._members), self._offset)
+            yield data[max(start - self._offset, 0):end - self._offset]
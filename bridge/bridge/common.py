@@ -44,6 +44,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE = (
+    'tools.profiling.QueryProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -258,9 +259,19 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': timedelta(hours=1),
         'args': (1,)  # Clear cache objects older than 1 hour
     },
+    'remove-old-error-trace-index-cache': {
+        'task': 'reports.tasks.clear_old_error_trace_index_cache',
+        'schedule': timedelta(hours=1),
+        'args': (24,)  # Clear cache objects older than 24 hours except ones for default settings
+    },
 }
 
 ENABLE_CALL_LOGS = False
+
+# Collect numbers of queries and SQL time of requests and celery tasks
+ENABLE_QUERY_PROFILING = False
+QUERY_PROFILING_BUFFER = 100000  # Number of kept profiles
+QUERY_PROFILING_TOP = 5  # Number of kept slowest and duplicated queries per profile
 ENABLE_UPLOAD_REPORTS_LOGS = False
 
 UPLOAD_LOG_FILE = 'upload.log'
@@ -0,0 +1,211 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import re
+import json
+import codecs
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+CHUNK_SIZE = 1024 * 1024
+
+# Any JSON token with preceding whitespaces
+TOKEN_RE = re.compile(
+    r'[ \t\n\r]*(?:([{}\[\],:])|("(?:[^"\\]|\\.)*")|(-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?)'
+    r'|(true|false|null))'
+)
+LITERALS = {'true': True, 'false': False, 'null': None}
+# Symbols that may continue the number at the end of the buffer
+NUMBER_TAIL_RE = re.compile(r'[0-9.eE+-]*')
+
+# Parser states
+VALUE, VALUE_OR_END, KEY, KEY_OR_END, COLON, COMMA_OR_END, DONE = range(7)
+
+
+def _tokens(fp, chunk_size):
+    decoder = codecs.getincrementaldecoder('utf8')()
+    buf = ''
+    pos = 0
+    eof = False
+    while True:
+        match = TOKEN_RE.match(buf, pos)
+        # The token may be continued in the next chunk, e.g. "12." or "1e" may be parts of "12.5" or "1e5"
+        if not eof and (match is None or match.end() == len(buf) or
+                        match.group(3) and NUMBER_TAIL_RE.fullmatch(buf, match.end())):
+            # Read more for long tokens to not scan them again and again
+            data = fp.read(max(chunk_size, len(buf) - pos))
+            eof = not data
+            buf = buf[pos:] + decoder.decode(data, final=eof)
+            pos = 0
+            continue
+        if match is None:
+            if buf[pos:].strip(' \t\n\r'):
+                raise ValueError('Unexpected symbol at "{}"'.format(buf[pos:pos + 20]))
+            return
+        pos = match.end()
+        punct, string, number, literal = match.groups()
+        if punct:
+            yield punct, None
+        elif string:
+            yield 'string', json.loads(string) if '\\' in string else string[1:-1]
+        elif number:
+            try:
+                yield 'number', int(number)
+            except ValueError:
+                yield 'number', float(number)
+        else:
+            yield 'literal', LITERALS[literal]
+
+
+def basic_parse(fp, chunk_size=CHUNK_SIZE):
+    """
+    Incremental JSON parser. Pure Python replacement of ijson.basic_parse().
+    :param fp: binary file object
+    :param chunk_size: number of bytes to read at once
+    :return: generator of (event, value) pairs
+    """
+    containers = []
+    state = VALUE
+    for token, value in _tokens(fp, chunk_size):
+        if state == COLON:
+            if token != ':':
+                raise ValueError('Colon expected')
+            state = VALUE
+            continue
+        if state == KEY or state == KEY_OR_END:
+            if token == 'string':
+                yield 'map_key', value
+                state = COLON
+                continue
+            if state == KEY or token != '}':
+                raise ValueError('Object key expected')
+        elif state == COMMA_OR_END:
+            if token == ',':
+                state = KEY if containers[-1] == '{' else VALUE
+                continue
+            if token not in {'}', ']'} or containers[-1] != ('{' if token == '}' else '['):
+                raise ValueError('Comma expected')
+        elif state == DONE:
+            raise ValueError('Extra data')
+        elif token == ']' and state == VALUE_OR_END:
+            pass
+        elif token == '{':
+            containers.append(token)
+            state = KEY_OR_END
+            yield 'start_map', None
+            continue
+        elif token == '[':
+            containers.append(token)
+            state = VALUE_OR_END
+            yield 'start_array', None
+            continue
+        elif token in {'string', 'number'}:
+            yield token, value
+        elif token == 'literal':
+            yield 'null' if value is None else 'boolean', value
+        else:
+            raise ValueError('Value expected')
+
+        if token in {'}', ']'}:
+            containers.pop()
+            yield 'end_map' if token == '}' else 'end_array', None
+        state = COMMA_OR_END if containers else DONE
+    if state != DONE:
+        raise ValueError('Unexpected end of data')
+
+
+def json_events(fp):
+    if ijson is not None:
+        for event, value in ijson.basic_parse(fp, use_float=True):
+            if event in {'integer', 'double'}:
+                event = 'number'
+            yield event, value
+    else:
+        yield from basic_parse(fp)
+
+
+def json_value(events, event, value):
+    """
+    Build the JSON value which starts with the given event.
+    :param events: iterator over (event, value) pairs from json_events()
+    :param event: the first event of the value
+    :param value: the first event value
+    :return: the value
+    """
+    containers = []
+    keys = []
+    while True:
+        if event == 'map_key':
+            keys[-1] = value
+        elif event in {'start_map', 'start_array'}:
+            containers.append({} if event == 'start_map' else [])
+            keys.append(None)
+        else:
+            if event in {'end_map', 'end_array'}:
+                value = containers.pop()
+                keys.pop()
+            if not containers:
+                return value
+            if isinstance(containers[-1], list):
+                containers[-1].append(value)
+            else:
+                containers[-1][keys[-1]] = value
+        event, value = next(events)
+
+
+def skip_json_value(events, event):
+    depth = 1 if event in {'start_map', 'start_array'} else 0
+    while depth:
+        event = next(events)[0]
+        if event in {'start_map', 'start_array'}:
+            depth += 1
+        elif event in {'end_map', 'end_array'}:
+            depth -= 1
+
+
+def json_array_items(events, event):
+    """
+    Iterate over items of the JSON array without building the whole array.
+    :param events: iterator over (event, value) pairs from json_events()
+    :param event: the first event of the array
+    :return: generator of items
+    """
+    if event != 'start_array':
+        raise ValueError('JSON array is expected')
+    for event, value in events:
+        if event == 'end_array':
+            return
+        yield json_value(events, event, value)
+
+
+def json_map_items(events, event):
+    """
+    Iterate over keys of the JSON object without building the whole object. The caller must consume each value
+    (with json_value(), skip_json_value() or nested iterators) before getting the next key.
+    :param events: iterator over (event, value) pairs from json_events()
+    :param event: the first event of the object
+    :return: generator of (key, the first event of the value, the first event value)
+    """
+    if event != 'start_map':
+        raise ValueError('JSON object is expected')
+    for event, key in events:
+        if event == 'end_map':
+            return
+        yield (key,) + tuple(next(events))
@@ -37,7 +37,7 @@ from django.http import HttpResponseBadRequest, Http404
 from django.template import loader
 from django.template.defaultfilters import filesizeformat
 from django.test import Client, TestCase, override_settings
-from django.urls import reverse
+from django.urls import reverse, Resolver404
 from django.utils.timezone import now, activate as activate_timezone
 from django.utils.translation import gettext_lazy as _, activate
 
@@ -174,6 +174,10 @@ class WithFilesMixin:
             if isinstance(field, FileField):
                 yield field.name
 
+    def file_is_used(self, name):
+        # Instances that can share files with other instances should check that the file is not used anymore
+        return False
+
 
 def remove_instance_files(**kwargs):
     instance = kwargs['instance']
@@ -181,7 +185,7 @@ def remove_instance_files(**kwargs):
         return
     for name in instance.file_fields():
         file = getattr(instance, name)
-        if file and os.path.isfile(file.path):
+        if file and os.path.isfile(file.path) and not instance.file_is_used(name):
             file.storage.delete(file.path)
 
 
@@ -216,14 +220,40 @@ def tests_logging_conf():
     return tests_logging
 
 
+class QueryBudgetClient(Client):
+    def __init__(self, budgets, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._budgets = budgets
+
+    def request(self, **request):
+        if not self._budgets:
+            return super().request(**request)
+        from tools.profiling import QueryRecorder
+
+        with QueryRecorder() as recorder:
+            response = super().request(**request)
+        try:
+            view_name = response.resolver_match.view_name
+        except Resolver404:
+            return response
+        if view_name in self._budgets and recorder.queries > self._budgets[view_name]:
+            raise AssertionError('View "{}" executed {} queries while its budget is {}. Duplicated queries: {}'.format(
+                view_name, recorder.queries, self._budgets[view_name], recorder.duplicates
+            ))
+        return response
+
+
 # Logging overriding does not work (does not override it for tests but override it after tests done)
 # Maybe it's Django's bug (LOGGING=tests_logging_conf())
 @override_settings(MEDIA_ROOT=os.path.join(settings.MEDIA_ROOT, TESTS_DIR))
 class KleverTestCase(TestCase):
+    # View name -> maximum number of queries the view can execute during one request
+    query_budgets = {}
+
     def setUp(self):
         if not os.path.exists(os.path.join(settings.MEDIA_ROOT, TESTS_DIR)):
             os.makedirs(os.path.join(settings.MEDIA_ROOT, TESTS_DIR).encode("utf8"))
-        self.client = Client()
+        self.client = QueryBudgetClient(self.query_budgets)
         super(KleverTestCase, self).setUp()
 
     def tearDown(self):
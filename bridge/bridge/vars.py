@@ -19,6 +19,13 @@ from django.utils.translation import gettext_lazy as _, pgettext_lazy as __
 
 ETV_FORMAT = 1
 
+# Format of sources index data stored by columns
+SOURCES_INDEX_FORMAT = 2
+
+# Member of task archives that maps names of files uploaded separately as blobs to their checksums. Bridge is deployed
+# without Klever Core, so it should be the same as klever.core.utils.TASK_BLOBS_MANIFEST
+TASK_BLOBS_MANIFEST = 'blobs.json'
+
 DATAFORMAT = (
     ('raw', _('Raw')),
     ('hum', _('Human-readable')),
@@ -291,3 +298,8 @@ PRESET_JOB_TYPE = (
     ('1', _('Leaf')),  # Preset tree leaf
     ('2', _('Custom directory')),  # Created directory for the leaf
 )
+
+QUERY_PROFILE_KIND = (
+    ('0', _('Request')),
+    ('1', _('Task')),
+)
@@ -0,0 +1,199 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import copy
+import random
+
+from django.db.models import Q
+
+from bridge.utils import KleverTestCase
+from bridge.vars import SAFE_VERDICTS, UNSAFE_VERDICTS, MARK_SAFE, MARK_UNSAFE, MARK_STATUS, ASSOCIATION_TYPE
+
+from reports.models import ReportSafe, ReportUnsafe, ReportUnknown
+from marks.models import MarkSafe, MarkUnsafe, MarkUnknown, MarkSafeReport, MarkUnsafeReport, MarkUnknownReport
+from caches.models import ReportSafeCache, ReportUnsafeCache, ReportUnknownCache
+from reports.verdicts import safe_verdicts_sum, unsafe_verdicts_sum, BugStatusCollector
+
+from caches.utils import (
+    SafeCacheAggregation, UnsafeCacheAggregation, UnknownCacheAggregation,
+    RecalculateSafeCache, RecalculateUnsafeCache, RecalculateUnknownCache,
+    UpdateSafeCachesOnMarkChange, UpdateUnsafeCachesOnMarkChange, UpdateUnknownCachesOnMarkChange
+)
+
+from reports.test import create_job, create_decision
+
+REPORTS_NUMBER = 30
+MARKS_NUMBER = 15
+TAGS = ['tag1', 'tag2', 'tag3', 'tag4']
+PROBLEMS = ['problem1', 'problem2', 'problem3']
+
+
+def _markreport_qs(model, reports_ids):
+    return model.objects.filter(
+        Q(type__in=[ASSOCIATION_TYPE[2][0], ASSOCIATION_TYPE[3][0]]) & Q(report_id__in=reports_ids)
+    )
+
+
+def _count_marks(new_data, mr):
+    new_data[mr.report_id]['marks_automatic'] += int(mr.type == ASSOCIATION_TYPE[2][0])
+    if not mr.associated:
+        return False
+    new_data[mr.report_id]['marks_total'] += 1
+    new_data[mr.report_id]['marks_confirmed'] += int(mr.type == ASSOCIATION_TYPE[3][0])
+    return True
+
+
+def _add_tags(tags, tags_list):
+    for tag in tags_list:
+        tags.setdefault(tag, 0)
+        tags[tag] += 1
+
+
+def cache_in_python(leaf_type, reports_ids, markreports_order='id'):
+    # Reference implementation of leaves cache calculation
+    initial_data = {
+        'safe': {'tags': {}, 'verdict': SAFE_VERDICTS[4][0]},
+        'unsafe': {'tags': {}, 'verdict': UNSAFE_VERDICTS[5][0], 'status': None},
+        'unknown': {'problems': {}}
+    }[leaf_type]
+    new_data = dict((report_id, dict(
+        copy.deepcopy(initial_data), marks_total=0, marks_automatic=0, marks_confirmed=0
+    )) for report_id in reports_ids)
+    markreport_model = {'safe': MarkSafeReport, 'unsafe': MarkUnsafeReport, 'unknown': MarkUnknownReport}[leaf_type]
+    statuses_collector = BugStatusCollector()
+    for mr in _markreport_qs(markreport_model, reports_ids).select_related('mark').order_by(markreports_order):
+        if not _count_marks(new_data, mr):
+            continue
+        report_data = new_data[mr.report_id]
+        if leaf_type == 'safe':
+            report_data['verdict'] = safe_verdicts_sum(report_data['verdict'], mr.mark.verdict)
+        elif leaf_type == 'unsafe':
+            report_data['verdict'] = unsafe_verdicts_sum(report_data['verdict'], mr.mark.verdict)
+            statuses_collector.add(mr.report_id, mr.mark.verdict, mr.mark.status)
+        if leaf_type == 'unknown':
+            _add_tags(report_data['problems'], [mr.problem])
+        else:
+            _add_tags(report_data['tags'], mr.mark.cache_tags)
+    for report_id, status in statuses_collector.result.items():
+        new_data[report_id]['status'] = status
+    return new_data
+
+
+class TestCacheAggregation(KleverTestCase):
+    def setUp(self):
+        super().setUp()
+        self.random = random.Random(2019)
+        self.decision = create_decision(create_job())
+
+    def __associate(self, model, marks, reports, **kwargs):
+        associations = []
+        for report in reports:
+            for mark in self.random.sample(marks, self.random.randint(0, len(marks))):
+                association_type = self.random.choice(ASSOCIATION_TYPE)[0]
+                associated = association_type in {ASSOCIATION_TYPE[2][0], ASSOCIATION_TYPE[3][0]} and \
+                    self.random.random() > 0.2
+                associations.append(model(
+                    mark=mark, report=report, type=association_type, associated=associated,
+                    **dict((name, self.random.choice(values)) for name, values in kwargs.items())
+                ))
+        model.objects.bulk_create(associations)
+
+    def __tags(self):
+        return self.random.sample(TAGS, self.random.randint(0, len(TAGS)))
+
+    def __compare(self, cache_model, reports_ids, expected):
+        self.assertEqual(
+            dict((cache_obj.report_id, dict((field, getattr(cache_obj, field)) for field in expected[report_id]))
+                 for report_id, cache_obj in ((c.report_id, c) for c in cache_model.objects.filter(
+                     report_id__in=reports_ids))),
+            expected
+        )
+
+    def __update_on_mark_change(self, update_class, cache_model, mark, reports_ids, expected):
+        # Mark change handlers save new values got with the aggregation
+        cache_model.objects.filter(report_id__in=reports_ids)\
+            .update(marks_total=0, marks_automatic=0, marks_confirmed=0)
+        cache_upd = update_class(mark, set(reports_ids), set(reports_ids))
+        cache_upd.update_all()
+        cache_upd.save()
+        self.__compare(cache_model, reports_ids, expected)
+
+    def test_safes(self):
+        reports = list(ReportSafe.objects.create(
+            decision=self.decision, identifier='safe{}'.format(i)
+        ) for i in range(REPORTS_NUMBER))
+        ReportSafeCache.objects.bulk_create(list(
+            ReportSafeCache(decision=self.decision, report=report) for report in reports
+        ))
+        marks = list(MarkSafe.objects.create(
+            verdict=self.random.choice(MARK_SAFE)[0], cache_tags=self.__tags()
+        ) for _ in range(MARKS_NUMBER))
+        self.__associate(MarkSafeReport, marks, reports)
+
+        reports_ids = list(r.id for r in reports)
+        expected = cache_in_python('safe', reports_ids)
+        self.assertEqual(SafeCacheAggregation(reports_ids).select(), expected)
+        RecalculateSafeCache(reports_ids)
+        self.__compare(ReportSafeCache, reports_ids, expected)
+        self.__update_on_mark_change(UpdateSafeCachesOnMarkChange, ReportSafeCache, marks[0], reports_ids, expected)
+
+    def test_unsafes(self):
+        reports = list(ReportUnsafe.objects.create(
+            decision=self.decision, identifier='unsafe{}'.format(i), error_trace='error-trace.zip'
+        ) for i in range(REPORTS_NUMBER))
+        ReportUnsafeCache.objects.bulk_create(list(
+            ReportUnsafeCache(decision=self.decision, report=report) for report in reports
+        ))
+        marks = []
+        for _ in range(MARKS_NUMBER):
+            verdict = self.random.choice(MARK_UNSAFE)[0]
+            marks.append(MarkUnsafe.objects.create(
+                function='thread_call_forests', verdict=verdict, cache_tags=self.__tags(),
+                status=self.random.choice(MARK_STATUS)[0] if verdict == MARK_UNSAFE[1][0] else None
+            ))
+        self.__associate(MarkUnsafeReport, marks, reports, result=[0.0, 0.5, 1.0])
+
+        reports_ids = list(r.id for r in reports)
+        expected = cache_in_python('unsafe', reports_ids)
+        # The result must not depend on the order of associations
+        self.assertEqual(cache_in_python('unsafe', reports_ids, '-id'), expected)
+        self.assertEqual(UnsafeCacheAggregation(reports_ids).select(), expected)
+        RecalculateUnsafeCache(reports_ids)
+        self.__compare(ReportUnsafeCache, reports_ids, expected)
+        self.__update_on_mark_change(UpdateUnsafeCachesOnMarkChange, ReportUnsafeCache, marks[0], reports_ids, expected)
+
+    def test_unknowns(self):
+        reports = list(ReportUnknown.objects.create(
+            decision=self.decision, identifier='unknown{}'.format(i), component='Core',
+            problem_description='problem-description.zip'
+        ) for i in range(REPORTS_NUMBER))
+        ReportUnknownCache.objects.bulk_create(list(
+            ReportUnknownCache(decision=self.decision, report=report) for report in reports
+        ))
+        marks = list(MarkUnknown.objects.create(
+            component='Core', function='error', problem_pattern=self.random.choice(PROBLEMS)
+        ) for _ in range(MARKS_NUMBER))
+        self.__associate(MarkUnknownReport, marks, reports, problem=PROBLEMS)
+
+        reports_ids = list(r.id for r in reports)
+        expected = cache_in_python('unknown', reports_ids)
+        self.assertEqual(UnknownCacheAggregation(reports_ids).select(), expected)
+        RecalculateUnknownCache(reports_ids)
+        self.__compare(ReportUnknownCache, reports_ids, expected)
+        self.__update_on_mark_change(
+            UpdateUnknownCachesOnMarkChange, ReportUnknownCache, marks[0], reports_ids, expected
+        )
@@ -16,14 +16,15 @@
 #
 
 import copy
+import json
 import uuid
 from collections import defaultdict
 
-from django.db import transaction
-from django.db.models import Q, F, Count
+from django.db import connection, transaction
+from django.db.models import F, JSONField
 from django.utils.functional import cached_property
 
-from bridge.vars import SAFE_VERDICTS, UNSAFE_VERDICTS, ASSOCIATION_TYPE
+from bridge.vars import SAFE_VERDICTS, UNSAFE_VERDICTS, UNSAFE_STATUS, MARK_UNSAFE, ASSOCIATION_TYPE
 
 from marks.models import (
     MarkSafe, MarkSafeHistory, MarkUnsafe, MarkUnsafeHistory, MarkUnknown,
@@ -38,12 +39,196 @@ from reports.verdicts import safe_verdicts_sum, unsafe_verdicts_sum, BugStatusCo
 
 @transaction.atomic
 def update_cache_atomic(queryset, data):
+    changed_objects = []
+    changed_fields = set()
     for rep_cache in queryset.select_for_update():
         if rep_cache.report_id not in data:
             continue
         for field, value in data[rep_cache.report_id].items():
             setattr(rep_cache, field, value)
-        rep_cache.save()
+            changed_fields.add(field)
+        changed_objects.append(rep_cache)
+    if changed_objects and changed_fields:
+        queryset.model.objects.bulk_update(changed_objects, sorted(changed_fields), batch_size=1000)
+
+
+class CacheAggregation:
+    """
+    Calculates leaf reports cache fields from marks associations in the database
+    with one aggregate query instead of summing associations in Python.
+    """
+    cache_model = None
+    markreport_model = None
+    mark_model = None
+
+    def __init__(self, reports_ids):
+        self._params = {
+            'reports': list(reports_ids),
+            'automatic': ASSOCIATION_TYPE[2][0],
+            'confirmed': ASSOCIATION_TYPE[3][0]
+        }
+
+    @property
+    def _aggregates(self):
+        # Aggregates over associations of each report, "mr" is association and "m" is mark
+        return [
+            'COUNT(mr.id) FILTER (WHERE mr.type = %(automatic)s) AS automatic',
+            'COUNT(mr.id) FILTER (WHERE mr.associated) AS total',
+            'COUNT(mr.id) FILTER (WHERE mr.associated AND mr.type = %(confirmed)s) AS confirmed'
+        ]
+
+    @property
+    def _fields(self):
+        # Cache fields values, "c" is row with aggregates and "o" is row with counted objects
+        return {
+            'marks_automatic': 'c.automatic',
+            'marks_total': 'c.total',
+            'marks_confirmed': 'c.confirmed'
+        }
+
+    # Name of counted objects (tags or problems), "mr" is association, "m" is mark and "tag" is mark tag
+    _object_name = None
+
+    @property
+    def _common_tables(self):
+        mark_join = cross_join = ''
+        if self.mark_model:
+            mark_join = 'LEFT JOIN {} m ON m.id = mr.mark_id'.format(getattr(self.mark_model, '_meta').db_table)
+        if self._object_name == 'tag':
+            cross_join = 'CROSS JOIN LATERAL unnest(m.cache_tags) AS tag'
+        return """WITH c AS (
+    SELECT rc.report_id, {aggregates}
+    FROM {cache_table} rc
+    LEFT JOIN {markreport_table} mr ON mr.report_id = rc.report_id AND mr.type IN (%(automatic)s, %(confirmed)s)
+    {mark_join}
+    WHERE rc.report_id = ANY(%(reports)s)
+    GROUP BY rc.report_id
+), o AS (
+    SELECT report_id, jsonb_object_agg(name, number) AS value FROM (
+        SELECT mr.report_id, {object_name} AS name, COUNT(*) AS number
+        FROM {markreport_table} mr {mark_join} {cross_join}
+        WHERE mr.report_id = ANY(%(reports)s) AND mr.associated AND mr.type IN (%(automatic)s, %(confirmed)s)
+        GROUP BY 1, 2
+    ) AS objects GROUP BY report_id
+)""".format(
+            aggregates=', '.join(self._aggregates), object_name=self._object_name,
+            cache_table=getattr(self.cache_model, '_meta').db_table,
+            markreport_table=getattr(self.markreport_model, '_meta').db_table,
+            mark_join=mark_join, cross_join=cross_join
+        )
+
+    @property
+    def _new_values(self):
+        return 'SELECT c.report_id, {} FROM c LEFT JOIN o ON o.report_id = c.report_id'.format(
+            ', '.join('{} AS {}'.format(expr, name) for name, expr in self._fields.items())
+        )
+
+    def select(self):
+        """
+        Calculate cache fields without changing the cache.
+        :return: dictionary {<report id>: {<field>: <value>}}
+        """
+        if not self._params['reports']:
+            return {}
+        with connection.cursor() as cursor:
+            cursor.execute('{} {}'.format(self._common_tables, self._new_values), self._params)
+            columns = [col[0] for col in cursor.description]
+            rows = cursor.fetchall()
+
+        # Django does not decode JSON values got with raw queries
+        json_columns = set(name for name in columns[1:] if isinstance(
+            getattr(self.cache_model, '_meta').get_field(name), JSONField
+        ))
+        return dict((row[0], dict(
+            (name, json.loads(value) if name in json_columns and isinstance(value, str) else value)
+            for name, value in zip(columns[1:], row[1:])
+        )) for row in rows)
+
+    def update(self):
+        """Calculate cache fields and save them to the cache."""
+        if not self._params['reports']:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('{}, n AS ({}) UPDATE {} AS rc SET {} FROM n WHERE rc.report_id = n.report_id'.format(
+                self._common_tables, self._new_values, getattr(self.cache_model, '_meta').db_table,
+                ', '.join('{0} = n.{0}'.format(name) for name in self._fields)
+            ), self._params)
+
+
+class SafeCacheAggregation(CacheAggregation):
+    cache_model = ReportSafeCache
+    markreport_model = MarkSafeReport
+    mark_model = MarkSafe
+    _object_name = 'tag'
+
+    def __init__(self, reports_ids):
+        super().__init__(reports_ids)
+        self._params['no_marks'] = SAFE_VERDICTS[4][0]
+        self._params['incompatible'] = SAFE_VERDICTS[3][0]
+
+    @property
+    def _aggregates(self):
+        # The verdict is the same as safe_verdicts_sum() returns
+        return super()._aggregates + [
+            'COUNT(DISTINCT m.verdict) FILTER (WHERE mr.associated AND m.verdict <> %(no_marks)s) AS verdicts',
+            'MIN(m.verdict) FILTER (WHERE mr.associated AND m.verdict <> %(no_marks)s) AS verdict'
+        ]
+
+    @property
+    def _fields(self):
+        fields = super()._fields
+        fields['verdict'] = 'CASE WHEN c.verdicts = 0 THEN %(no_marks)s ' \
+                            'WHEN c.verdicts = 1 THEN c.verdict ELSE %(incompatible)s END'
+        fields['tags'] = "COALESCE(o.value, '{}'::jsonb)"
+        return fields
+
+
+class UnsafeCacheAggregation(CacheAggregation):
+    cache_model = ReportUnsafeCache
+    markreport_model = MarkUnsafeReport
+    mark_model = MarkUnsafe
+    _object_name = 'tag'
+
+    def __init__(self, reports_ids):
+        super().__init__(reports_ids)
+        self._params['no_marks'] = UNSAFE_VERDICTS[5][0]
+        self._params['incompatible'] = UNSAFE_VERDICTS[4][0]
+        self._params['bug'] = MARK_UNSAFE[1][0]
+        self._params['incompatible_status'] = UNSAFE_STATUS[4][0]
+
+    @property
+    def _aggregates(self):
+        # The verdict is the same as unsafe_verdicts_sum() returns and the status is the same as BugStatusCollector's
+        return super()._aggregates + [
+            'COUNT(DISTINCT m.verdict) FILTER (WHERE mr.associated AND m.verdict <> %(no_marks)s) AS verdicts',
+            'MIN(m.verdict) FILTER (WHERE mr.associated AND m.verdict <> %(no_marks)s) AS verdict',
+            'COUNT(mr.id) FILTER (WHERE mr.associated AND m.verdict = %(bug)s) AS bugs',
+            'COUNT(mr.id) FILTER (WHERE mr.associated AND m.verdict <> %(bug)s) AS not_bugs',
+            "COUNT(DISTINCT COALESCE(m.status, '')) FILTER (WHERE mr.associated AND m.verdict = %(bug)s) AS statuses",
+            'MIN(m.status) FILTER (WHERE mr.associated AND m.verdict = %(bug)s) AS status'
+        ]
+
+    @property
+    def _fields(self):
+        fields = super()._fields
+        fields['verdict'] = 'CASE WHEN c.verdicts = 0 THEN %(no_marks)s ' \
+                            'WHEN c.verdicts = 1 THEN c.verdict ELSE %(incompatible)s END'
+        fields['status'] = 'CASE WHEN c.bugs = 0 THEN NULL WHEN c.not_bugs = 0 AND c.statuses = 1 THEN c.status ' \
+                           'ELSE %(incompatible_status)s END'
+        fields['tags'] = "COALESCE(o.value, '{}'::jsonb)"
+        return fields
+
+
+class UnknownCacheAggregation(CacheAggregation):
+    cache_model = ReportUnknownCache
+    markreport_model = MarkUnknownReport
+    _object_name = 'mr.problem'
+
+    @property
+    def _fields(self):
+        fields = super()._fields
+        fields['problems'] = "COALESCE(o.value, '{}'::jsonb)"
+        return fields
 
 
 class UpdateSafeCachesOnMarkChange:
@@ -81,26 +266,8 @@ class UpdateSafeCachesOnMarkChange:
     def update_all(self):
         if 'verdicts' in self._collected and 'tags' in self._collected:
             return
-        for cache_obj in self._cache_queryset:
-            self._new_data[cache_obj.report_id]['verdict'] = SAFE_VERDICTS[4][0]
-            self._new_data[cache_obj.report_id]['tags'] = {}
-            self._new_data[cache_obj.report_id]['marks_total'] = 0
-            self._new_data[cache_obj.report_id]['marks_confirmed'] = 0
-            self._new_data[cache_obj.report_id]['marks_automatic'] = 0
-
-        # Count automatic associations
-        automatic_qs = MarkSafeReport.objects\
-            .filter(report_id__in=self._affected_reports, type=ASSOCIATION_TYPE[2][0]).values('report_id')\
-            .annotate(number=Count('report_id')).values_list('report_id', 'number')
-        for report_id, automatic_num in automatic_qs:
-            self._new_data[report_id]['marks_automatic'] = automatic_num
-
-        for mr in self._markreport_qs:
-            self.__add_verdict(mr.report_id, mr.mark.verdict)
-            self.__add_tags(mr.report_id, mr.mark.cache_tags)
-            self._new_data[mr.report_id]['marks_total'] += 1
-            self._new_data[mr.report_id]['marks_confirmed'] += int(mr.type == ASSOCIATION_TYPE[3][0])
-
+        for report_id, new_data in SafeCacheAggregation(self._affected_reports).select().items():
+            self._new_data[report_id].update(new_data)
         self._collected.add('verdicts')
         self._collected.add('tags')
 
@@ -207,33 +374,8 @@ class UpdateUnsafeCachesOnMarkChange:
     def update_all(self):
         if 'verdicts' in self._collected and 'tags' in self._collected:
             return
-
-        for cache_obj in self._cache_queryset:
-            self._new_data[cache_obj.report_id]['verdict'] = UNSAFE_VERDICTS[5][0]
-            self._new_data[cache_obj.report_id]['status'] = None
-            self._new_data[cache_obj.report_id]['tags'] = {}
-            self._new_data[cache_obj.report_id]['marks_total'] = 0
-            self._new_data[cache_obj.report_id]['marks_confirmed'] = 0
-            self._new_data[cache_obj.report_id]['marks_automatic'] = 0
-
-        # Count automatic associations
-        automatic_qs = MarkUnsafeReport.objects \
-            .filter(report_id__in=self._affected_reports, type=ASSOCIATION_TYPE[2][0]).values('report_id') \
-            .annotate(number=Count('report_id')).values_list('report_id', 'number')
-        for report_id, automatic_num in automatic_qs:
-            self._new_data[report_id]['marks_automatic'] = automatic_num
-
-        statuses_collector = BugStatusCollector()
-        for mr in self._markreport_qs:
-            self.__add_verdict(mr.report_id, mr.mark.verdict)
-            statuses_collector.add(mr.report_id, mr.mark.verdict, mr.mark.status)
-            self.__add_tags(mr.report_id, mr.mark.cache_tags)
-            self._new_data[mr.report_id]['marks_total'] += 1
-            self._new_data[mr.report_id]['marks_confirmed'] += int(mr.type == ASSOCIATION_TYPE[3][0])
-
-        for report_id, status in statuses_collector.result.items():
-            self._new_data[report_id]['status'] = status
-
+        for report_id, new_data in UnsafeCacheAggregation(self._affected_reports).select().items():
+            self._new_data[report_id].update(new_data)
         self._collected.add('verdicts')
         self._collected.add('statuses')
         self._collected.add('tags')
@@ -355,25 +497,8 @@ class UpdateUnknownCachesOnMarkChange:
         return dict((cache_obj.report_id, {}) for cache_obj in self._cache_queryset)
 
     def update_all(self):
-        for cache_obj in self._cache_queryset:
-            self._new_data[cache_obj.report_id]['problems'] = {}
-            self._new_data[cache_obj.report_id]['marks_total'] = 0
-            self._new_data[cache_obj.report_id]['marks_confirmed'] = 0
-            self._new_data[cache_obj.report_id]['marks_automatic'] = 0
-
-        # Count automatic associations
-        automatic_qs = MarkUnknownReport.objects \
-            .filter(report_id__in=self._affected_reports, type=ASSOCIATION_TYPE[2][0]).values('report_id') \
-            .annotate(number=Count('report_id')).values_list('report_id', 'number')
-        for report_id, automatic_num in automatic_qs:
-            self._new_data[report_id]['marks_automatic'] = automatic_num
-
-        for mr in self._markreport_qs:
-            self._new_data[mr.report_id]['problems'].setdefault(mr.problem, 0)
-            self._new_data[mr.report_id]['problems'][mr.problem] += 1
-            self._new_data[mr.report_id]['marks_total'] += 1
-            self._new_data[mr.report_id]['marks_confirmed'] += int(mr.type == ASSOCIATION_TYPE[3][0])
-
+        for report_id, new_data in UnknownCacheAggregation(self._affected_reports).select().items():
+            self._new_data[report_id].update(new_data)
         self._collected = True
 
     def __get_change_kind(self, report_id):
@@ -426,6 +551,7 @@ class UpdateCachesOnMarkPopulate:
 
     @transaction.atomic
     def __update_safes(self):
+        changed_objects = []
         for cache_obj in ReportSafeCache.objects.filter(report_id__in=self._new_links).select_for_update():
             # All safe links after the population are automatic
             cache_obj.marks_automatic += 1
@@ -437,7 +563,10 @@ class UpdateCachesOnMarkPopulate:
                 cache_obj.marks_total += 1
 
             # Populated mark can't be confirmed, so we don't need to update confirmed number
-            cache_obj.save()
+            changed_objects.append(cache_obj)
+        ReportSafeCache.objects.bulk_update(
+            changed_objects, ['marks_automatic', 'verdict', 'tags', 'marks_total'], batch_size=1000
+        )
 
     def __update_unsafes(self):
         # Filter new_links with automatic associations as just such associations can affect report's cache
@@ -446,6 +575,7 @@ class UpdateCachesOnMarkPopulate:
         ).values_list('report_id', flat=True))
 
         with transaction.atomic():
+            changed_objects = []
             for cache_obj in ReportUnsafeCache.objects.filter(report_id__in=affected_reports).select_for_update():
                 cache_obj.marks_automatic += 1
                 if cache_obj.marks_confirmed == 0:
@@ -455,12 +585,16 @@ class UpdateCachesOnMarkPopulate:
                     cache_obj.tags = self.__sum_tags(cache_obj.tags)
                     cache_obj.marks_total += 1
                 # Populated mark can't be confirmed, so we don't need to update confirmed number
-                cache_obj.save()
+                changed_objects.append(cache_obj)
+            ReportUnsafeCache.objects.bulk_update(
+                changed_objects, ['marks_automatic', 'verdict', 'status', 'tags', 'marks_total'], batch_size=1000
+            )
 
     def __update_unknowns(self):
         new_problems = dict(MarkUnknownReport.objects.filter(mark=self._mark).values_list('report_id', 'problem'))
 
         with transaction.atomic():
+            changed_objects = []
             for cache_obj in ReportUnknownCache.objects.filter(report_id__in=self._new_links)\
                     .select_for_update():
                 # All unknown links after the population are automatic
@@ -474,7 +608,10 @@ class UpdateCachesOnMarkPopulate:
                     cache_obj.marks_total += 1
 
                 # Populated mark can't be confirmed, so we don't need to update confirmed number
-                cache_obj.save()
+                changed_objects.append(cache_obj)
+            ReportUnknownCache.objects.bulk_update(
+                changed_objects, ['marks_automatic', 'problems', 'marks_total'], batch_size=1000
+            )
 
     def __sum_tags(self, old_tags):
         old_tags = copy.deepcopy(old_tags)
@@ -486,130 +623,17 @@ class UpdateCachesOnMarkPopulate:
 
 class RecalculateSafeCache:
     def __init__(self, report_s):
-        if isinstance(report_s, int):
-            self._qs_filter = Q(report_id=report_s)
-        else:
-            self._qs_filter = Q(report_id__in=report_s)
-        self.__recalculate()
-
-    def __recalculate(self):
-        cache_queryset = ReportSafeCache.objects.filter(self._qs_filter)
-
-        # Initialize default values
-        new_data = {}
-        for cache_obj in cache_queryset:
-            new_data[cache_obj.report_id] = {
-                'tags': {},
-                'verdict': SAFE_VERDICTS[4][0],
-                'marks_total': 0,
-                'marks_automatic': 0,
-                'marks_confirmed': 0
-            }
-
-        # Collect safes cache (just automatic and confirmed associations can affect the cache)
-        markreport_qs = MarkSafeReport.objects.filter(
-            Q(type__in=[ASSOCIATION_TYPE[2][0], ASSOCIATION_TYPE[3][0]]) & self._qs_filter
-        ).select_related('mark').only('type', 'mark__verdict', 'mark__cache_tags', 'report_id', 'associated')
-        for mr in markreport_qs:
-            new_data[mr.report_id]['marks_automatic'] += int(mr.type == ASSOCIATION_TYPE[2][0])
-            if not mr.associated:
-                continue
-            new_data[mr.report_id]['marks_total'] += 1
-            new_data[mr.report_id]['marks_confirmed'] += int(mr.type == ASSOCIATION_TYPE[3][0])
-            new_data[mr.report_id]['verdict'] = safe_verdicts_sum(
-                new_data[mr.report_id]['verdict'], mr.mark.verdict
-            )
-            for tag in mr.mark.cache_tags:
-                new_data[mr.report_id]['tags'].setdefault(tag, 0)
-                new_data[mr.report_id]['tags'][tag] += 1
-
-        update_cache_atomic(cache_queryset, new_data)
+        SafeCacheAggregation([report_s] if isinstance(report_s, int) else report_s).update()
 
 
 class RecalculateUnsafeCache:
     def __init__(self, report_s):
-        if isinstance(report_s, int):
-            self._qs_filter = Q(report_id=report_s)
-        else:
-            self._qs_filter = Q(report_id__in=report_s)
-        self.__recalculate()
-
-    def __recalculate(self):
-        cache_queryset = ReportUnsafeCache.objects.filter(self._qs_filter)
-
-        # Initialize default values
-        new_data = {}
-        for cache_obj in cache_queryset:
-            new_data[cache_obj.report_id] = {
-                'tags': {},
-                'verdict': UNSAFE_VERDICTS[5][0],
-                'status': None,
-                'marks_total': 0,
-                'marks_automatic': 0,
-                'marks_confirmed': 0
-            }
-
-        statuses_collector = BugStatusCollector()
-
-        # Collect unsafes cache (just automatic and confirmed associations can affect the cache)
-        markreport_qs = MarkUnsafeReport.objects.filter(
-            Q(type__in=[ASSOCIATION_TYPE[2][0], ASSOCIATION_TYPE[3][0]]) & self._qs_filter
-        ).select_related('mark').only('type', 'mark__verdict', 'mark__cache_tags', 'report_id', 'associated')
-        for mr in markreport_qs:
-            new_data[mr.report_id]['marks_automatic'] += int(mr.type == ASSOCIATION_TYPE[2][0])
-            if not mr.associated:
-                continue
-            new_data[mr.report_id]['marks_total'] += 1
-            new_data[mr.report_id]['marks_confirmed'] += int(mr.type == ASSOCIATION_TYPE[3][0])
-            new_data[mr.report_id]['verdict'] = unsafe_verdicts_sum(
-                new_data[mr.report_id]['verdict'], mr.mark.verdict
-            )
-            statuses_collector.add(mr.report_id, mr.mark.verdict, mr.mark.status)
-            for tag in mr.mark.cache_tags:
-                new_data[mr.report_id]['tags'].setdefault(tag, 0)
-                new_data[mr.report_id]['tags'][tag] += 1
-
-        for report_id, status in statuses_collector.result.items():
-            new_data[report_id]['status'] = status
-
-        update_cache_atomic(cache_queryset, new_data)
+        UnsafeCacheAggregation([report_s] if isinstance(report_s, int) else report_s).update()
 
 
 class RecalculateUnknownCache:
     def __init__(self, report_s):
-        if isinstance(report_s, int):
-            self._qs_filter = Q(report_id=report_s)
-        else:
-            self._qs_filter = Q(report_id__in=report_s)
-        self.__recalculate()
-
-    def __recalculate(self):
-        cache_queryset = ReportUnknownCache.objects.filter(self._qs_filter)
-
-        # Initialize default values
-        new_data = {}
-        for cache_obj in cache_queryset:
-            new_data[cache_obj.report_id] = {
-                'problems': {},
-                'marks_total': 0,
-                'marks_automatic': 0,
-                'marks_confirmed': 0
-            }
-
-        # Collect unsafes cache (just automatic and confirmed associations can affect the cache)
-        markreport_qs = MarkUnknownReport.objects.filter(
-            Q(type__in=[ASSOCIATION_TYPE[2][0], ASSOCIATION_TYPE[3][0]]) & self._qs_filter
-        ).only('type', 'problem', 'report_id', 'associated')
-        for mr in markreport_qs:
-            new_data[mr.report_id]['marks_automatic'] += int(mr.type == ASSOCIATION_TYPE[2][0])
-            if not mr.associated:
-                continue
-            new_data[mr.report_id]['marks_total'] += 1
-            new_data[mr.report_id]['marks_confirmed'] += int(mr.type == ASSOCIATION_TYPE[3][0])
-            new_data[mr.report_id]['problems'].setdefault(mr.problem, 0)
-            new_data[mr.report_id]['problems'][mr.problem] += 1
-
-        update_cache_atomic(cache_queryset, new_data)
+        UnknownCacheAggregation([report_s] if isinstance(report_s, int) else report_s).update()
 
 
 class UpdateMarksTags:
@@ -17,24 +17,28 @@
 
 import os
 import json
+import tempfile
 import zipfile
+from contextlib import contextmanager
 
 from wsgiref.util import FileWrapper
 
 from django.conf import settings
 from django.core.files import File
+from django.db import connection, transaction
 from django.db.models import Q
 from django.urls import reverse
 from django.utils.functional import cached_property
+from django.utils.timezone import localtime
 from django.utils.translation import gettext_lazy as _
 
-from bridge.utils import extract_archive, BridgeException
-from bridge.ZipGenerator import ZipStream, CHUNK_SIZE
+from bridge.utils import extract_archive, file_checksum, BridgeException
+from bridge.ZipGenerator import ZipStream, ZipArchivePlan, DeflatedFileSource, CHUNK_SIZE
 
 from jobs.models import Job, JobFile, FileSystem, Decision
 from reports.models import (
     ReportSafe, ReportUnsafe, ReportUnknown, ReportComponent, ReportAttr,
-    CoverageArchive, OriginalSources, AdditionalSources, DecisionCache
+    CoverageArchive, OriginalSources, DecisionCache
 )
 
 from jobs.serializers import UploadedJobArchiveSerializer
@@ -47,6 +51,8 @@ from jobs.DownloadSerializers import (
     DecisionCacheSerializer, DownloadDecisionSerializer
 )
 
+BLOBS_DIR = 'blobs'
+
 
 def get_jobs_to_download(user, job_ids, decision_ids):
     jobs_qs_filter = Q()
@@ -101,33 +107,124 @@ class KleverCoreArchiveGen:
         yield self.stream.close_stream()
 
 
+class ArchiveBlobs:
+    """
+    Files referenced from job archive JSON files. Files with the same content are added to the archive just once.
+    Checksums are calculated just for files of the same size.
+    """
+
+    def __init__(self):
+        self.files = []
+        self._names = {}
+        self._by_size = {}
+
+    def add(self, file_path):
+        if file_path in self._names:
+            return self._names[file_path]
+        similar_files = self._by_size.setdefault(os.path.getsize(file_path), [])
+        checksum = None
+        if similar_files:
+            checksum = self.__checksum(file_path)
+            for similar_file in similar_files:
+                if similar_file[1] is None:
+                    similar_file[1] = self.__checksum(similar_file[0])
+                if similar_file[1] == checksum:
+                    self._names[file_path] = similar_file[2]
+                    return similar_file[2]
+        arcname = '/'.join([BLOBS_DIR, str(len(self.files)), os.path.basename(file_path)])
+        similar_files.append([file_path, checksum, arcname])
+        self.files.append((file_path, arcname))
+        self._names[file_path] = arcname
+        return arcname
+
+    def __checksum(self, file_path):
+        with open(file_path, mode='rb') as fp:
+            return file_checksum(fp)
+
+
 class JobArchiveGenerator:
+    """
+    Job archive which plan is prepared in advance, so it can be generated from any position. JSON files are spooled
+    to temporary files that are removed when the generator is closed or garbage collected.
+    """
+
     def __init__(self, job, decisions_ids=None):
         self.job = job
         self._decisions_ids = list(map(int, decisions_ids)) if decisions_ids else None
         self.name = 'Job-{}.zip'.format(self.job.identifier)
-        self._arch_files = set()
-        self.stream = ZipStream()
+        self._blobs = ArchiveBlobs()
+        self._job_files = set()
+        self._encoder = json.JSONEncoder(ensure_ascii=False, sort_keys=True, indent=2)
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.archive = ZipArchivePlan(date_time=localtime(self.job.creation_date).timetuple()[:6])
+        try:
+            self.__fill_archive()
+        except Exception:
+            self.close()
+            raise
+        self.size = self.archive.size
+
+    @property
+    def etag(self):
+        key = self.archive.key
+        return '"{}"'.format(key) if key else None
 
     def __iter__(self):
-        # Job data
-        yield from self.stream.compress_string('job.json', self.__get_job_data())
-        yield from self.stream.compress_string('{}.json'.format(Decision.__name__), self.__add_decisions_data())
-        yield from self.stream.compress_string('{}.json'.format(DecisionCache.__name__), self.__get_decision_cache())
-        yield from self.stream.compress_string('{}.json'.format(OriginalSources.__name__), self.__get_original_src())
-        yield from self.stream.compress_string('{}.json'.format(ReportComponent.__name__), self.__get_reports_data())
-        yield from self.stream.compress_string('{}.json'.format(ReportSafe.__name__), self.__get_safes_data())
-        yield from self.stream.compress_string('{}.json'.format(ReportUnsafe.__name__), self.__get_unsafes_data())
-        yield from self.stream.compress_string('{}.json'.format(ReportUnknown.__name__), self.__get_unknowns_data())
-        yield from self.stream.compress_string('{}.json'.format(ReportAttr.__name__), self.__get_attrs_data())
-        yield from self.stream.compress_string('{}.json'.format(CoverageArchive.__name__), self.__get_coverage_data())
-
-        self.__add_job_files()
-        self.__add_additional_sources()
-
-        for file_path, arcname in self._arch_files:
-            yield from self.stream.compress_file(file_path, arcname)
-        yield self.stream.close_stream()
+        return self.iterate()
+
+    def iterate(self, start=0, end=None):
+        # The generator refers to self, so spooled files are not removed until the archive is generated
+        yield from self.archive.iterate(start, end)
+
+    def close(self):
+        self._tmp_dir.cleanup()
+
+    def __fill_archive(self):
+        json_files = [
+            ('job.json', self.__get_job_data),
+            ('{}.json'.format(Decision.__name__), self.__get_decisions_data),
+            ('{}.json'.format(DecisionCache.__name__), self.__get_decision_cache),
+            ('{}.json'.format(OriginalSources.__name__), self.__get_original_src),
+            ('{}.json'.format(ReportComponent.__name__), self.__get_reports_data),
+            ('{}.json'.format(ReportSafe.__name__), self.__get_safes_data),
+            ('{}.json'.format(ReportUnsafe.__name__), self.__get_unsafes_data),
+            ('{}.json'.format(ReportUnknown.__name__), self.__get_unknowns_data),
+            ('{}.json'.format(ReportAttr.__name__), self.__get_attrs_data),
+            ('{}.json'.format(CoverageArchive.__name__), self.__get_coverage_data),
+        ]
+        with self.__snapshot():
+            for arcname, func in json_files:
+                data, files = func()
+                for container, key in files:
+                    container[key] = self._blobs.add(container[key])
+                self.__add_json(arcname, data)
+            self.__add_job_files()
+
+        for file_path, arcname in sorted(self._job_files):
+            self.archive.add_file(file_path, arcname)
+        for file_path, arcname in self._blobs.files:
+            self.archive.add_file(file_path, arcname)
+
+    @staticmethod
+    @contextmanager
+    def __snapshot():
+        # All JSON files are collected from the same snapshot, so they are consistent even if reports are uploaded
+        # meanwhile. The isolation level can be set just for a new transaction.
+        in_transaction = connection.in_atomic_block
+        with transaction.atomic():
+            if not in_transaction:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            yield
+
+    def __add_json(self, arcname, data):
+        source = DeflatedFileSource(os.path.join(self._tmp_dir.name, arcname))
+        try:
+            for chunk in self._encoder.iterencode(data):
+                source.write(chunk)
+        finally:
+            source.close()
+        self.archive.add_deflated(arcname, source)
 
     @cached_property
     def _decision_filter(self):
@@ -136,16 +233,13 @@ class JobArchiveGenerator:
         return Q(decision__job_id=self.job.id)
 
     def __get_job_data(self):
-        return self.__get_json(DownloadJobSerializer(instance=self.job).data)
+        return DownloadJobSerializer(instance=self.job).data, []
 
     def __add_job_files(self):
-        job_files = {}
         for fs in FileSystem.objects.filter(decision__job=self.job).select_related('file'):
-            job_files[fs.file.hash_sum] = (fs.file.file.path, fs.file.file.name)
-        for f_path, arcname in job_files.values():
-            self._arch_files.add((f_path, arcname))
+            self._job_files.add((fs.file.file.path, fs.file.file.name))
 
-    def __add_decisions_data(self):
+    def __get_decisions_data(self):
         if self._decisions_ids:
             qs_filter = Q(id__in=self._decisions_ids)
         else:
@@ -153,13 +247,11 @@ class JobArchiveGenerator:
         decisions_list = []
         for decision in Decision.objects.filter(qs_filter).select_related('scheduler', 'configuration'):
             decisions_list.append(DownloadDecisionSerializer(instance=decision).data)
-            self._arch_files.add((decision.configuration.file.path, decision.configuration.file.name))
-        return self.__get_json(decisions_list)
+            self._job_files.add((decision.configuration.file.path, decision.configuration.file.name))
+        return decisions_list, []
 
     def __get_decision_cache(self):
-        return self.__get_json(DecisionCacheSerializer(
-            instance=DecisionCache.objects.filter(self._decision_filter), many=True
-        ).data)
+        return DecisionCacheSerializer(instance=DecisionCache.objects.filter(self._decision_filter), many=True).data, []
 
     def __get_original_src(self):
         if self._decisions_ids:
@@ -167,47 +259,56 @@ class JobArchiveGenerator:
         else:
             qs_filter = Q(reportcomponent__decision__job_id=self.job.id)
         sources = {}
-        for src_arch in OriginalSources.objects.filter(qs_filter):
-            sources[src_arch.identifier] = src_arch.archive.name
-            self._arch_files.add((src_arch.archive.path, src_arch.archive.name))
-        return self.__get_json(sources)
+        for src_arch in OriginalSources.objects.filter(qs_filter).distinct():
+            sources[src_arch.identifier] = src_arch.archive.path
+        return sources, list((sources, identifier) for identifier in sorted(sources))
 
     def __get_reports_data(self):
         reports = []
+        files = []
         for report in ReportComponent.objects.filter(self._decision_filter)\
-                .select_related('parent', 'computer', 'original_sources', 'additional_sources').order_by('level'):
+                .select_related('parent', 'computer', 'original_sources', 'additional_sources')\
+                .order_by('level', 'id'):
             report_data = DownloadReportComponentSerializer(instance=report).data
 
             # Add report files
             if report_data['log']:
-                self._arch_files.add((report.log.path, report_data['log']))
+                report_data['log'] = report.log.path
+                files.append((report_data, 'log'))
             if report_data['verifier_files']:
-                self._arch_files.add((report.verifier_files.path, report_data['verifier_files']))
+                report_data['verifier_files'] = report.verifier_files.path
+                files.append((report_data, 'verifier_files'))
+            if report_data['additional_sources']:
+                report_data['additional_sources'] = report.additional_sources.archive.path
+                files.append((report_data, 'additional_sources'))
             reports.append(report_data)
-
-        return self.__get_json(reports)
+        return reports, files
 
     def __get_safes_data(self):
         safes_queryset = ReportSafe.objects.filter(self._decision_filter).select_related('parent').order_by('id')
-        return self.__get_json(DownloadReportSafeSerializer(instance=safes_queryset, many=True).data)
+        return DownloadReportSafeSerializer(instance=safes_queryset, many=True).data, []
 
     def __get_unsafes_data(self):
         reports = []
+        files = []
         for report in ReportUnsafe.objects.filter(self._decision_filter).select_related('parent').order_by('id'):
             report_data = DownloadReportUnsafeSerializer(instance=report).data
             if report_data['error_trace']:
-                self._arch_files.add((report.error_trace.path, report_data['error_trace']))
+                report_data['error_trace'] = report.error_trace.path
+                files.append((report_data, 'error_trace'))
             reports.append(report_data)
-        return self.__get_json(reports)
+        return reports, files
 
     def __get_unknowns_data(self):
         reports = []
+        files = []
         for report in ReportUnknown.objects.filter(self._decision_filter).select_related('parent').order_by('id'):
             report_data = DownloadReportUnknownSerializer(instance=report).data
             if report_data['problem_description']:
-                self._arch_files.add((report.problem_description.path, report_data['problem_description']))
+                report_data['problem_description'] = report.problem_description.path
+                files.append((report_data, 'problem_description'))
             reports.append(report_data)
-        return self.__get_json(reports)
+        return reports, files
 
     def __get_attrs_data(self):
         if self._decisions_ids:
@@ -216,14 +317,16 @@ class JobArchiveGenerator:
             qs_filter = Q(report__decision__job_id=self.job.id)
 
         attrs_data = {}
+        files = []
         for ra in ReportAttr.objects.filter(qs_filter).select_related('data', 'report').order_by('id'):
             data = DownloadReportAttrSerializer(instance=ra).data
             if data['data_file']:
-                self._arch_files.add((ra.data.file.path, data['data_file']))
+                data['data_file'] = ra.data.file.path
+                files.append((data, 'data_file'))
             attrs_data.setdefault(ra.report.decision_id, {})
             attrs_data[ra.report.decision_id].setdefault(ra.report.identifier, [])
             attrs_data[ra.report.decision_id][ra.report.identifier].append(data)
-        return self.__get_json(attrs_data)
+        return attrs_data, files
 
     def __get_coverage_data(self):
         if self._decisions_ids:
@@ -237,21 +340,18 @@ class JobArchiveGenerator:
                 'decision': carch.report.decision_id,
                 'report': carch.report.identifier,
                 'identifier': carch.identifier,
-                'archive': carch.archive.name,
+                'archive': carch.archive.path,
                 'name': carch.name
             })
-            self._arch_files.add((carch.archive.path, carch.archive.name))
-        return self.__get_json(coverage_data)
-
-    def __add_additional_sources(self):
-        for src_arch in AdditionalSources.objects.filter(self._decision_filter):
-            self._arch_files.add((src_arch.archive.path, src_arch.archive.name))
-
-    def __get_json(self, data):
-        return json.dumps(data, ensure_ascii=False, sort_keys=True, indent=2)
+        return coverage_data, list((data, 'archive') for data in coverage_data)
 
 
 class JobsArchivesGen:
+    """
+    Archive of job archives. Each job archive is prepared just when it is generated, so the size of the whole archive
+    is not known in advance and its downloading can not be resumed.
+    """
+
     def __init__(self, jobs_to_download):
         self.jobs = jobs_to_download
         self.stream = ZipStream()
@@ -268,9 +368,12 @@ class JobsArchivesGen:
             yield buf
 
     def __iter__(self):
-        for job_id in self.jobs:
+        for job_id in sorted(self.jobs):
             jobgen = JobArchiveGenerator(self.jobs[job_id]['instance'], decisions_ids=self.jobs[job_id]['decisions'])
-            yield from self.generate_job(jobgen)
+            try:
+                yield from self.generate_job(jobgen)
+            finally:
+                jobgen.close()
         yield self.stream.close_stream()
 
 
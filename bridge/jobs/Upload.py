@@ -18,17 +18,20 @@
 import os
 import json
 import time
+import zipfile
 
 from django.conf import settings
 from django.core.files import File
-from django.db import transaction
+from django.db import connection, transaction
+from django.db.models import Max
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
 from rest_framework import exceptions
 
 from bridge.vars import JOB_UPLOAD_STATUS, DECISION_STATUS, PRESET_JOB_TYPE
-from bridge.utils import BridgeException, RequreLock, extract_archive
+from bridge.utils import BridgeException, RequreLock, file_checksum
+from bridge.json_stream import json_events, json_value, json_array_items, json_map_items
 
 from jobs.models import JOBFILE_DIR, PresetJob, UploadedJobArchive
 from reports.models import (
@@ -49,15 +52,108 @@ from reports.coverage import FillCoverageStatistics
 from tools.utils import Recalculation
 
 
+def bulk_create_reports(model, reports):
+    """
+    Insert reports of the model inherited from Report. Django bulk_create() does not support multi-table inheritance,
+    so rows of the Report table are inserted with bulk_create() and rows of the model table are inserted with one
+    INSERT statement. MPTT fields of reports must be already filled.
+    :param model: ReportComponent, ReportSafe, ReportUnsafe or ReportUnknown.
+    :param reports: list of model instances.
+    """
+    base_fields = list(field for field in getattr(Report, '_meta').concrete_fields if not field.primary_key)
+    base_reports = Report.objects.bulk_create(list(Report(**dict(
+        (field.attname, getattr(report, field.attname)) for field in base_fields
+    )) for report in reports))
+    for report, base_report in zip(reports, base_reports):
+        report.id = report.report_ptr_id = base_report.id
+        report._state.adding = False
+        report._state.db = base_report._state.db
+
+    fields = getattr(model, '_meta').local_concrete_fields
+    row_placeholders = '({})'.format(', '.join(['%s'] * len(fields)))
+    with connection.cursor() as cursor:
+        cursor.execute('INSERT INTO {} ({}) VALUES {}'.format(
+            connection.ops.quote_name(getattr(model, '_meta').db_table),
+            ', '.join(connection.ops.quote_name(field.column) for field in fields),
+            ', '.join([row_placeholders] * len(reports))
+        ), list(field.get_db_prep_save(field.pre_save(report, True), connection)
+                for report in reports for field in fields))
+
+
+class ReportsTreeLayout:
+    """
+    MPTT values of uploaded reports trees. Leaves of each component are placed after its component children.
+    """
+
+    def __init__(self, components, leaves_number):
+        """
+        :param components: dictionary {(decision id, identifier): parent identifier or None}
+        :param leaves_number: dictionary {(decision id, parent identifier): number of leaves}
+        """
+        self.first_tree_id = 1
+        self._nodes = {}
+        self._leaves_lft = {}
+        self.roots = []
+
+        children = {}
+        for key, parent in components.items():
+            if parent is None:
+                self.roots.append(key)
+            elif (key[0], parent) in components:
+                children.setdefault((key[0], parent), []).append(key)
+            else:
+                raise BridgeException(_('Reports data was corrupted'))
+        for tree_index, root in enumerate(self.roots):
+            self.__fill_tree(tree_index, root, children, leaves_number)
+        if len(self._nodes) != len(components) or set(leaves_number) - set(self._nodes):
+            raise BridgeException(_('Reports data was corrupted'))
+
+        # Parents go before their children, so reports can be uploaded level by level
+        self.order = sorted(self._nodes, key=lambda x: (self._nodes[x][2], self._nodes[x][0]))
+
+    def __fill_tree(self, tree_index, root, children, leaves_number):
+        cnt = 1
+        stack = [(root, 0, False)]
+        while stack:
+            key, level, closing = stack.pop()
+            if closing:
+                self._leaves_lft[key] = cnt
+                cnt += 2 * leaves_number.get(key, 0)
+                self._nodes[key][1] = cnt
+            else:
+                self._nodes[key] = [cnt, None, level, tree_index]
+                stack.append((key, level, True))
+                stack.extend((child, level + 1, False) for child in reversed(children.get(key, [])))
+            cnt += 1
+
+    def level(self, key):
+        return self._nodes[key][2]
+
+    def component(self, key):
+        lft, rght, level, tree_index = self._nodes[key]
+        return {'lft': lft, 'rght': rght, 'level': level, 'tree_id': self.first_tree_id + tree_index}
+
+    def leaf(self, decision_id, parent):
+        key = (decision_id, parent)
+        if key not in self._leaves_lft or self._leaves_lft[key] >= self._nodes[key][1]:
+            raise BridgeException(_('Reports data was corrupted'))
+        lft = self._leaves_lft[key]
+        self._leaves_lft[key] += 2
+        return {'lft': lft, 'rght': lft + 1, 'level': self._nodes[key][2] + 1,
+                'tree_id': self.first_tree_id + self._nodes[key][3]}
+
+
 class JobArchiveUploader:
     reports_chunk_size = 500
+    attrs_chunk_size = 10000
 
     def __init__(self, upload_obj):
         self._upload_obj = upload_obj
         self._logger = UploadLogger(upload_obj)
         self.job = None
 
-        self._jobdir = None
+        self._zip = None
+        self._members = {}
         self._decisions = {}
         self._final_statuses = {}
         self._identifiers_in_use = {}
@@ -66,7 +162,9 @@ class JobArchiveUploader:
         self.saved_reports = {}
         self._leaves_ids = set()
         self._computers = {}
-        self._reports_chunk = []
+        self._layout = None
+        # (decision id, CRC, size) -> list of [archive file name, saved file name, checksum]
+        self._report_files = {}
 
     def __enter__(self):
         self.job = None
@@ -75,7 +173,7 @@ class JobArchiveUploader:
     def __exit__(self, exc_type, exc_val, exc_tb):
         if exc_val:
             if self._decisions:
-                Decision.objects.filter(id__in=self._decisions).delete()
+                Decision.objects.filter(id__in=self._decisions.values()).delete()
             if self.job:
                 self._upload_obj.job = self.job
             self._upload_obj.error = str(exc_val)
@@ -89,20 +187,24 @@ class JobArchiveUploader:
         self._upload_obj.save()
 
     def upload(self):
-        # Extract job archive
+        # Job archive members are read in place
         self._logger.log('=' * 30)
         self._logger.start(JOB_UPLOAD_STATUS[1][0])
-        with self._upload_obj.archive.file as fp:
-            job_dir = extract_archive(fp)
-        self._jobdir = job_dir.name
-
+        if os.path.splitext(self._upload_obj.archive.name)[-1] != '.zip':
+            raise ValueError('Only zip archives are supported')
+        with zipfile.ZipFile(self._upload_obj.archive.path, mode='r') as zfp:
+            self._zip = zfp
+            self._members = dict((info.filename, info) for info in zfp.infolist() if not info.is_dir())
+            self.__upload()
+
+    def __upload(self):
         # Upload job files
         self._logger.start(JOB_UPLOAD_STATUS[2][0])
-        self.__upload_job_files(os.path.join(job_dir.name, JOBFILE_DIR))
+        self.__upload_job_files()
 
         # Save job
         self._logger.start(JOB_UPLOAD_STATUS[3][0])
-        serializer_data = self.__parse_job_json(os.path.join(job_dir.name, 'job.json'))
+        serializer_data = self.__parse_job_json('job.json')
         serializer = DownloadJobSerializer(data=serializer_data)
         serializer.is_valid(raise_exception=True)
         self.job = serializer.save(
@@ -153,22 +255,20 @@ class JobArchiveUploader:
         )
         return preset_dir.id
 
-    def __upload_job_files(self, files_dir):
-        if not os.path.isdir(files_dir):
-            # If 'JobFiles' doesn't exist then the job doesn't have decisions or archive is corrupted.
-            # It'll be checked while files tree is uploading on decisions creation.
-            return
-        for dir_path, dir_names, file_names in os.walk(files_dir):
-            for file_name in file_names:
-                with open(os.path.join(dir_path, file_name), mode='rb') as fp:
-                    serializer = JobFileSerializer(data={'file': File(fp, name=file_name)})
+    def __upload_job_files(self):
+        # If 'JobFile' directory doesn't exist then the job doesn't have decisions or archive is corrupted.
+        # It'll be checked while files tree is uploading on decisions creation.
+        for file_path in self._members:
+            if file_path.startswith(JOBFILE_DIR + '/'):
+                with self.__open_file(file_path) as fp:
+                    serializer = JobFileSerializer(data={'file': fp})
                     serializer.is_valid(raise_exception=True)
                     serializer.save()
 
     def __parse_job_json(self, file_path):
-        if not os.path.exists(file_path):
+        if file_path not in self._members:
             raise BridgeException('Required job.json file was not found in job archive')
-        with open(file_path, encoding='utf8') as fp:
+        with self._zip.open(file_path) as fp:
             return json.load(fp)
 
     def __upload_decisions(self):
@@ -225,42 +325,59 @@ class JobArchiveUploader:
                     src_obj = OriginalSources.objects.get(identifier=src_id)
                 except OriginalSources.DoesNotExist:
                     src_obj = OriginalSources(identifier=src_id)
-                    with open(self.__full_path(src_path), mode='rb') as fp:
+                    with self.__open_file(src_path) as fp:
                         src_obj.add_archive(fp, save=True)
             self._original_sources[src_id] = src_obj.id
 
     def __upload_reports(self):
-        # Upload components tree
-        reports_tree_data = self.__read_json_file('{}.json'.format(ReportComponent.__name__), required=True)
-        self._logger.start(JOB_UPLOAD_STATUS[6][0], len(reports_tree_data))
-        chunk_size = 0
-        for report_data in reports_tree_data:
+        # Components are validated before uploading to lay out reports trees
+        components = {}
+        parents = {}
+        for report_data in self.__iterate_json_array('{}.json'.format(ReportComponent.__name__), required=True):
             decision_id = self.__get_decision_id(report_data['decision'])
-            if report_data['parent'] and (decision_id, report_data['parent']) not in self.saved_reports:
-                self.__upload_reports_chunk()
-                self._logger.update(chunk_size)
-                chunk_size = 0
-                if (decision_id, report_data['parent']) not in self.saved_reports:
-                    raise BridgeException(_('Reports data was corrupted'))
-            elif chunk_size > self.reports_chunk_size:
-                self.__upload_reports_chunk()
-                self._logger.update(chunk_size)
-                chunk_size = 0
-            self._reports_chunk.append(
-                self.__get_report_save_kwargs(decision_id, report_data)
-            )
-            chunk_size += 1
-        self.__upload_reports_chunk()
-        self._logger.update(chunk_size)
+            save_kwargs = self.__get_report_save_kwargs(decision_id, report_data)
+            components[(decision_id, save_kwargs['identifier'])] = save_kwargs
+            parents[(decision_id, save_kwargs['identifier'])] = report_data['parent']
+        self._layout = ReportsTreeLayout(parents, self.__count_leaves())
+
+        self._logger.start(JOB_UPLOAD_STATUS[6][0], len(components))
+
+        # New trees identifiers are reserved by inserting roots
+        with RequreLock(Report):
+            self._layout.first_tree_id = (Report.objects.aggregate(max_id=Max('tree_id'))['max_id'] or 0) + 1
+            self.__upload_components_chunk(list(
+                self.__get_component(components, parents, key) for key in self._layout.roots
+            ))
+        self._logger.update(len(self._layout.roots))
+
+        # Chunks do not mix levels, so all parents of the chunk are already saved
+        reports_chunk = []
+        for key in self._layout.order[len(self._layout.roots):]:
+            if reports_chunk and (len(reports_chunk) >= self.reports_chunk_size or
+                                  self._layout.level(key) != reports_chunk[-1].level):
+                self.__upload_components_chunk(reports_chunk)
+                self._logger.update(len(reports_chunk))
+                reports_chunk = []
+            reports_chunk.append(self.__get_component(components, parents, key))
+        self.__upload_components_chunk(reports_chunk)
+        self._logger.update(len(reports_chunk))
         self._logger.end()
 
         # Upload leaves
-        self.__upload_safes()
-        self.__upload_unsafes()
-        self.__upload_unknowns()
+        self.__upload_leaves(ReportSafe, ReportSafeCache, JOB_UPLOAD_STATUS[7][0], self.__get_safe)
+        self.__upload_leaves(ReportUnsafe, ReportUnsafeCache, JOB_UPLOAD_STATUS[8][0], self.__get_unsafe)
+        self.__upload_leaves(ReportUnknown, ReportUnknownCache, JOB_UPLOAD_STATUS[9][0], self.__get_unknown)
         self.__upload_attrs()
         self.__upload_coverage()
 
+    def __count_leaves(self):
+        leaves_number = {}
+        for model in (ReportSafe, ReportUnsafe, ReportUnknown):
+            for report_data in self.__iterate_json_array('{}.json'.format(model.__name__)):
+                key = (self.__get_decision_id(report_data.get('decision')), report_data.get('parent'))
+                leaves_number[key] = leaves_number.get(key, 0) + 1
+        return leaves_number
+
     def __get_report_save_kwargs(self, decision_id, report_data):
         save_kwargs = {
             'decision_id': decision_id,
@@ -272,9 +389,7 @@ class JobArchiveUploader:
         save_kwargs.update(serializer.validated_data)
 
         computer_obj = self.__get_computer(report_data.get('computer'))
-        save_kwargs.update({
-            'computer_id': computer_obj.pk, 'parent_id': self.saved_reports.get((decision_id, report_data['parent']))
-        })
+        save_kwargs['computer_id'] = computer_obj.pk
 
         if report_data.get('additional_sources'):
             add_sources_obj = self.__get_additional_sources(decision_id, report_data['additional_sources'])
@@ -284,215 +399,175 @@ class JobArchiveUploader:
             save_kwargs['original_sources_id'] = self._original_sources[report_data['original_sources']]
 
         if report_data.get('log'):
-            save_kwargs['log'] = self.__full_path(report_data['log'])
+            save_kwargs['log'] = self.__get_member(report_data['log']).filename
 
         if report_data.get('verifier_files'):
-            save_kwargs['verifier_files'] = self.__full_path(report_data['verifier_files'])
+            save_kwargs['verifier_files'] = self.__get_member(report_data['verifier_files']).filename
 
         return save_kwargs
 
-    def __upload_reports_chunk(self):
-        with transaction.atomic():
-            with Report.objects.delay_mptt_updates():
-                for report_save_data in self._reports_chunk:
-                    log_file = report_save_data.pop('log', None)
-                    verifier_files_arch = report_save_data.pop('verifier_files', None)
-
-                    report = ReportComponent(**report_save_data)
-                    if log_file:
-                        with open(log_file, mode='rb') as fp:
-                            report.add_log(fp, save=False)
-                    if verifier_files_arch:
-                        with open(verifier_files_arch, mode='rb') as fp:
-                            report.add_verifier_files(fp, save=False)
-                    report.save()
-                    self.saved_reports[(report.decision_id, report.identifier)] = report.id
-        self._reports_chunk = []
-
-    def __upload_safes(self):
-        safes_data = self.__read_json_file('{}.json'.format(ReportSafe.__name__))
-        if not safes_data:
+    def __get_component(self, components, parents, key):
+        save_kwargs = components.pop(key)
+        log_file = save_kwargs.pop('log', None)
+        verifier_files_arch = save_kwargs.pop('verifier_files', None)
+
+        parent_id = self.saved_reports[(key[0], parents[key])] if parents[key] else None
+        report = ReportComponent(parent_id=parent_id, **save_kwargs, **self._layout.component(key))
+        if log_file:
+            self.__add_report_file(report, 'log', report.add_log, log_file)
+        if verifier_files_arch:
+            self.__add_report_file(report, 'verifier_files', report.add_verifier_files, verifier_files_arch)
+        return report
+
+    def __add_report_file(self, report, field_name, add_file, file_path):
+        # The same files of the decision are stored just once and removed with the last report that refers them.
+        # Members CRC and size are known without reading them, so checksums are calculated just for probable duplicates.
+        member = self.__get_member(file_path)
+        similar_files = self._report_files.setdefault(
+            (report.decision_id, field_name, member.CRC, member.file_size), []
+        )
+        checksum = None
+        if similar_files:
+            checksum = self.__checksum(file_path)
+            for similar_file in similar_files:
+                if similar_file[2] is None:
+                    similar_file[2] = self.__checksum(similar_file[0])
+                if similar_file[2] == checksum:
+                    setattr(report, field_name, similar_file[1])
+                    return
+        with self.__open_file(file_path) as fp:
+            add_file(fp, save=False)
+        similar_files.append([file_path, getattr(report, field_name).name, checksum])
+
+    def __upload_components_chunk(self, reports):
+        if not reports:
             return
-
-        self._logger.start(JOB_UPLOAD_STATUS[7][0])
-
-        safes_cache = []
-        new_reports = []
-        for report_data in safes_data:
-            decision_id = self.__get_decision_id(report_data.get('decision'))
-            parent_id = self.saved_reports[(decision_id, report_data.pop('parent'))]
-            identifier = self.__validate_report_identifier(decision_id, report_data.pop('identifier'))
-            serializer = UploadReportSafeSerializer(data=report_data)
-            serializer.is_valid(raise_exception=True)
-            new_reports.append(ReportSafe(
-                decision_id=decision_id, identifier=identifier, parent_id=parent_id, **serializer.validated_data
-            ))
-
         with transaction.atomic():
-            with Report.objects.delay_mptt_updates():
-                for report in new_reports:
-                    report.save()
-
-        reports_qs = ReportSafe.objects.filter(decision_id__in=list(self._decisions.values()))\
-            .only('id', 'identifier', 'decision_id')
-        for report in reports_qs:
+            bulk_create_reports(ReportComponent, reports)
+        for report in reports:
             self.saved_reports[(report.decision_id, report.identifier)] = report.id
-            self._leaves_ids.add(report.id)
-            safes_cache.append(ReportSafeCache(decision_id=report.decision_id, report_id=report.id))
 
-        ReportSafeCache.objects.bulk_create(safes_cache)
-        self._logger.end()
-
-    def __upload_unsafes(self):
-        unsafes_data = self.__read_json_file('{}.json'.format(ReportUnsafe.__name__))
-        if not unsafes_data:
+    def __upload_leaves(self, model, cache_model, status, get_report):
+        file_name = '{}.json'.format(model.__name__)
+        if file_name not in self._members:
             return
-        self._logger.start(JOB_UPLOAD_STATUS[8][0])
+        self._logger.start(status)
 
-        unsafes_cache = []
-        new_reports = []
-        for report_data in unsafes_data:
+        reports_chunk = []
+        for report_data in self.__iterate_json_array(file_name):
             decision_id = self.__get_decision_id(report_data.get('decision'))
-            parent_id = self.saved_reports[(decision_id, report_data.pop('parent'))]
-            identifier = self.__validate_report_identifier(decision_id, report_data.pop('identifier'))
-            error_trace = self.__full_path(report_data['error_trace'])
-            serializer = UploadReportUnsafeSerializer(data=report_data)
-            serializer.is_valid(raise_exception=True)
-
-            report = ReportUnsafe(
-                identifier=identifier, decision_id=decision_id, parent_id=parent_id, **serializer.validated_data
+            parent = report_data.pop('parent')
+            report = get_report(
+                report_data, decision_id=decision_id, parent_id=self.saved_reports[(decision_id, parent)],
+                identifier=self.__validate_report_identifier(decision_id, report_data.pop('identifier')),
+                **self._layout.leaf(decision_id, parent)
             )
-            with open(error_trace, mode='rb') as fp:
-                report.add_trace(fp, save=False)
-            new_reports.append(report)
-
-        with transaction.atomic():
-            with Report.objects.delay_mptt_updates():
-                for report in new_reports:
-                    report.save()
-
-        reports_qs = ReportUnsafe.objects.filter(decision_id__in=list(self._decisions.values()))\
-            .only('id', 'identifier', 'decision_id')
-        for report in reports_qs:
-            self.saved_reports[(report.decision_id, report.identifier)] = report.id
-            self._leaves_ids.add(report.id)
-            unsafes_cache.append(ReportUnsafeCache(decision_id=report.decision_id, report_id=report.id))
-
-        ReportUnsafeCache.objects.bulk_create(unsafes_cache)
+            reports_chunk.append(report)
+            if len(reports_chunk) >= self.reports_chunk_size:
+                self.__upload_leaves_chunk(model, cache_model, reports_chunk)
+                reports_chunk = []
+        self.__upload_leaves_chunk(model, cache_model, reports_chunk)
         self._logger.end()
 
-    def __upload_unknowns(self):
-        unknowns_data = self.__read_json_file('{}.json'.format(ReportUnknown.__name__))
-        if not unknowns_data:
+    def __upload_leaves_chunk(self, model, cache_model, reports):
+        if not reports:
             return
-        self._logger.start(JOB_UPLOAD_STATUS[9][0])
-
-        unknowns_cache = []
-        new_reports = []
-        for report_data in unknowns_data:
-            decision_id = self.__get_decision_id(report_data.get('decision'))
-            parent_id = self.saved_reports[(decision_id, report_data.pop('parent'))]
-            identifier = self.__validate_report_identifier(decision_id, report_data.pop('identifier'))
-            problem_description = self.__full_path(report_data['problem_description'])
-            serializer = UploadReportUnknownSerializer(data=report_data)
-            serializer.is_valid(raise_exception=True)
-
-            report = ReportUnknown(
-                decision_id=decision_id, parent_id=parent_id, identifier=identifier, **serializer.validated_data
-            )
-            with open(problem_description, mode='rb') as fp:
-                report.add_problem_desc(fp, save=False)
-            new_reports.append(report)
-
         with transaction.atomic():
-            with Report.objects.delay_mptt_updates():
-                for report in new_reports:
-                    report.save()
-
-        reports_qs = ReportUnknown.objects.filter(decision_id__in=list(self._decisions.values()))\
-            .only('id', 'identifier', 'decision_id')
-        for report in reports_qs:
+            bulk_create_reports(model, reports)
+            cache_model.objects.bulk_create(list(
+                cache_model(decision_id=report.decision_id, report_id=report.id) for report in reports
+            ))
+        for report in reports:
             self.saved_reports[(report.decision_id, report.identifier)] = report.id
             self._leaves_ids.add(report.id)
-            unknowns_cache.append(ReportUnknownCache(decision_id=report.decision_id, report_id=report.id))
 
-        ReportUnknownCache.objects.bulk_create(unknowns_cache)
-        self._logger.end()
+    def __get_safe(self, report_data, **kwargs):
+        serializer = UploadReportSafeSerializer(data=report_data)
+        serializer.is_valid(raise_exception=True)
+        return ReportSafe(**kwargs, **serializer.validated_data)
+
+    def __get_unsafe(self, report_data, **kwargs):
+        error_trace = report_data['error_trace']
+        serializer = UploadReportUnsafeSerializer(data=report_data)
+        serializer.is_valid(raise_exception=True)
+        report = ReportUnsafe(**kwargs, **serializer.validated_data)
+        with self.__open_file(error_trace) as fp:
+            report.add_trace(fp, save=False)
+        return report
+
+    def __get_unknown(self, report_data, **kwargs):
+        problem_description = report_data['problem_description']
+        serializer = UploadReportUnknownSerializer(data=report_data)
+        serializer.is_valid(raise_exception=True)
+        report = ReportUnknown(**kwargs, **serializer.validated_data)
+        with self.__open_file(problem_description) as fp:
+            report.add_problem_desc(fp, save=False)
+        return report
 
     def __upload_attrs(self):
-        attrs_data = self.__read_json_file('{}.json'.format(ReportAttr.__name__), required=True)
+        file_name = '{}.json'.format(ReportAttr.__name__)
+        if file_name not in self._members:
+            raise BridgeException(
+                _('Required file was not found in job archive: %(filename)s') % {'filename': file_name}
+            )
         attrs_cache = {}
+        attr_files = {}
         new_attrs = []
-        new_attr_files = {}
-        cnt = 0
-        self._logger.start(JOB_UPLOAD_STATUS[10][0], total=100)
-        for old_d_id in attrs_data:
-            decision_id = self.__get_decision_id(int(old_d_id))
-            for r_id in attrs_data[old_d_id]:
-                for adata in attrs_data[old_d_id][r_id]:
+        self._logger.start(JOB_UPLOAD_STATUS[10][0], total=len(self.saved_reports))
+        with self._zip.open(file_name) as fp:
+            events = json_events(fp)
+            for old_d_id, event, _value in json_map_items(events, next(events)[0]):
+                decision_id = self.__get_decision_id(int(old_d_id))
+                for r_id, event, value in json_map_items(events, event):
                     report_id = self.saved_reports[(decision_id, r_id)]
-                    data_file = adata.pop('data_file', None)
-
-                    serializer = DownloadReportAttrSerializer(data=adata)
-                    serializer.is_valid(raise_exception=True)
-                    validated_data = serializer.validated_data
-
-                    new_attrs.append(ReportAttr(report_id=report_id, **validated_data))
-                    if data_file is not None:
-                        file_key = (decision_id, data_file)
-                        new_attr_files.setdefault(file_key, [])
-                        new_attr_files[file_key].append(cnt)
-                    cnt += 1
-
-                    if report_id in self._leaves_ids:
-                        attrs_cache.setdefault(report_id, {'attrs': {}})
-                        attrs_cache[report_id]['attrs'][validated_data['name']] = validated_data['value']
-        self._logger.update(10)
-
-        attr_file_number = len(new_attr_files)
-        if attr_file_number > 0:
-            # Upload attributes' files
-            with transaction.atomic():
-                step_percent_number = int(attr_file_number / 70)
-                attr_file_cnt = 0
-                for decision_id, file_path in new_attr_files:
-                    attr_file_obj = AttrFile(decision_id=decision_id)
-                    with open(self.__full_path(file_path), mode='rb') as fp:
-                        attr_file_obj.file.save(os.path.basename(file_path), File(fp), save=True)
-
-                    for i in new_attr_files[(decision_id, file_path)]:
-                        # Add link to file for attributes that have it
-                        new_attrs[i].data_id = attr_file_obj.id
-                    attr_file_cnt += 1
-                    if attr_file_cnt > step_percent_number:
-                        self._logger.update(int(70 * attr_file_cnt / attr_file_number))
-                        attr_file_cnt = 0
-        else:
-            self._logger.update(70)
-
+                    for adata in json_value(events, event, value):
+                        data_file = adata.pop('data_file', None)
+
+                        serializer = DownloadReportAttrSerializer(data=adata)
+                        serializer.is_valid(raise_exception=True)
+                        validated_data = serializer.validated_data
+
+                        attr = ReportAttr(report_id=report_id, **validated_data)
+                        if data_file is not None:
+                            if (decision_id, data_file) not in attr_files:
+                                attr_files[(decision_id, data_file)] = self.__save_attr_file(decision_id, data_file)
+                            attr.data_id = attr_files[(decision_id, data_file)]
+                        new_attrs.append(attr)
+
+                        if report_id in self._leaves_ids:
+                            attrs_cache.setdefault(report_id, {'attrs': {}})
+                            attrs_cache[report_id]['attrs'][validated_data['name']] = validated_data['value']
+                    if len(new_attrs) >= self.attrs_chunk_size:
+                        ReportAttr.objects.bulk_create(new_attrs)
+                        new_attrs = []
+                    self._logger.update()
         ReportAttr.objects.bulk_create(new_attrs)
-        self._logger.update(10)
 
         decisions_ids = list(self._decisions.values())
         update_cache_atomic(ReportSafeCache.objects.filter(report__decision_id__in=decisions_ids), attrs_cache)
         update_cache_atomic(ReportUnsafeCache.objects.filter(report__decision_id__in=decisions_ids), attrs_cache)
         update_cache_atomic(ReportUnknownCache.objects.filter(report__decision_id__in=decisions_ids), attrs_cache)
-        self._logger.update(10)
         self._logger.end()
 
+    def __save_attr_file(self, decision_id, file_path):
+        attr_file_obj = AttrFile(decision_id=decision_id)
+        with self.__open_file(file_path) as fp:
+            attr_file_obj.file.save(os.path.basename(file_path), fp, save=True)
+        return attr_file_obj.id
+
     def __upload_coverage(self):
-        coverage_data = self.__read_json_file('{}.json'.format(CoverageArchive.__name__))
-        if not coverage_data:
+        file_name = '{}.json'.format(CoverageArchive.__name__)
+        if file_name not in self._members:
             return
-        self._logger.start(JOB_UPLOAD_STATUS[11][0], len(coverage_data))
+        self._logger.start(JOB_UPLOAD_STATUS[11][0])
 
-        for coverage in coverage_data:
+        for coverage in self.__iterate_json_array(file_name):
             decision_id = self.__get_decision_id(coverage['decision'])
             instance = CoverageArchive(
                 report_id=self.saved_reports[(decision_id, coverage['report'])],
                 identifier=coverage['identifier'], name=coverage.get('name', '...')
             )
-            with open(self.__full_path(coverage['archive']), mode='rb') as fp:
+            with self.__open_file(coverage['archive']) as fp:
                 instance.add_coverage(fp, save=False)
             instance.save()
 
@@ -500,7 +575,6 @@ class JobArchiveUploader:
             instance.total = res.total_coverage
             instance.has_extra = res.has_extra
             instance.save()
-            self._logger.update()
         self._logger.end()
 
     def __get_decision_id(self, old_id):
@@ -529,23 +603,32 @@ class JobArchiveUploader:
     def __get_additional_sources(self, decision_id, rel_path):
         if rel_path not in self._additional_sources:
             add_inst = AdditionalSources(decision_id=decision_id)
-            with open(self.__full_path(rel_path), mode='rb') as fp:
+            with self.__open_file(rel_path) as fp:
                 add_inst.add_archive(fp, save=True)
             self._additional_sources[rel_path] = add_inst
         return self._additional_sources[rel_path]
 
-    def __full_path(self, rel_path):
-        full_path = os.path.join(self._jobdir, rel_path)
-        if not os.path.exists(full_path):
+    def __get_member(self, rel_path):
+        if rel_path not in self._members:
             raise BridgeException(
                 _('Required file was not found in job archive: %(filename)s') % {'filename': rel_path}
             )
-        return full_path
+        return self._members[rel_path]
+
+    def __open_file(self, rel_path):
+        member = self.__get_member(rel_path)
+        file = File(self._zip.open(member), name=os.path.basename(rel_path))
+        # Otherwise the size is calculated by decompressing the member
+        file.size = member.file_size
+        return file
+
+    def __checksum(self, rel_path):
+        with self._zip.open(self.__get_member(rel_path)) as fp:
+            return file_checksum(fp)
 
     def __read_json_file(self, rel_path, required=False):
-        full_path = os.path.join(self._jobdir, rel_path)
-        if os.path.exists(full_path):
-            with open(full_path, encoding='utf8') as fp:
+        if rel_path in self._members:
+            with self._zip.open(rel_path) as fp:
                 return json.load(fp)
         if required:
             raise BridgeException(
@@ -553,6 +636,15 @@ class JobArchiveUploader:
             )
         return None
 
+    def __iterate_json_array(self, rel_path, required=False):
+        if rel_path not in self._members:
+            if required:
+                self.__get_member(rel_path)
+            return
+        with self._zip.open(rel_path) as fp:
+            events = json_events(fp)
+            yield from json_array_items(events, next(events)[0])
+
 
 class UploadLogger:
     def __init__(self, upload_obj: UploadedJobArchive):
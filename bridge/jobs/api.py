@@ -289,6 +289,7 @@ class StopDecisionView(LoggedCallMixin, APIView):
         # If there are a lot of tasks that are not still deleted it could be too long
         # as there is request to DB for each task here (pre_delete signal)
         decision.tasks.all().delete()
+        decision.task_blobs.all().delete()
         return Response({})
 
 
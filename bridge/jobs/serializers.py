@@ -37,8 +37,10 @@ from jobs.models import (
     PRESET_JOB_TYPE, Job, Decision, JobFile, FileSystem, UserRole, UploadedJobArchive, PresetJob, PresetFile,
     DefaultDecisionConfiguration
 )
-from reports.models import Report, AttrFile, AdditionalSources, CompareDecisionsInfo, DecisionCache
-from service.models import Task
+from reports.models import (
+    Report, AttrFile, AdditionalSources, CompareDecisionsInfo, DecisionCache, LeafSignature
+)
+from service.models import Task, TaskBlob
 
 from jobs.configuration import get_default_configuration, GetConfiguration
 from jobs.utils import JSTreeConverter, validate_scheduler, copy_files_with_replace
@@ -288,8 +290,10 @@ class RestartDecisionSerializer(serializers.ModelSerializer):
         AttrFile.objects.filter(decision=instance).delete()
         AdditionalSources.objects.filter(decision=instance).delete()
         CompareDecisionsInfo.objects.filter(Q(decision1=instance) | Q(decision2=instance)).delete()
+        LeafSignature.objects.filter(decision=instance).delete()
         DecisionCache.objects.filter(decision=instance).delete()
         Task.objects.filter(decision=instance).delete()
+        TaskBlob.objects.filter(decision=instance).delete()
 
     def validate(self, attrs):
         conf_data = validate_configuration(attrs['operator'], attrs.pop('configuration'))
@@ -15,10 +15,27 @@
 # limitations under the License.
 #
 
+import io
+import os
 import json
-from bridge.utils import file_get_or_create
+import random
+import tempfile
+import zipfile
 
+from unittest import mock
+
+from django.test import SimpleTestCase, RequestFactory
+
+from bridge.utils import KleverTestCase, file_get_or_create, BridgeException
+from bridge.CustomViews import streaming_response
+from bridge.ZipGenerator import ZipArchivePlan, FileSource, _CRCCache
+
+from jobs.Download import JobArchiveGenerator, JobsArchivesGen
 from jobs.models import JobFile
+from jobs.Upload import ReportsTreeLayout, bulk_create_reports
+from reports.models import ReportComponent
+
+from reports.test import create_job, create_decision, create_computer
 
 
 def create_jobfile():
@@ -26,3 +43,288 @@ def create_jobfile():
     res = file_get_or_create(json.dumps(data), 'test.json', JobFile)
     print("The db file:", res, res.pk)
     print("Delete:", res.delete())
+
+
+class TestReportsTreeLayout(SimpleTestCase):
+    def test_nested_sets(self):
+        rnd = random.Random(2021)
+        components = {(1, 'root'): None, (2, 'root'): None}
+        for i in range(200):
+            decision_id = rnd.choice([1, 2])
+            parent = rnd.choice(list(identifier for d_id, identifier in components if d_id == decision_id))
+            components[(decision_id, 'c{}'.format(i))] = parent
+        leaves = list((d_id, rnd.choice(list(identifier for i, identifier in components if i == d_id)))
+                      for d_id in (rnd.choice([1, 2]) for _ in range(300)))
+        leaves_number = dict((key, leaves.count(key)) for key in set(leaves))
+
+        layout = ReportsTreeLayout(components, leaves_number)
+        layout.first_tree_id = 10
+        nodes = dict((key, layout.component(key)) for key in components)
+        nodes.update(((key, i), layout.leaf(*key)) for i, key in enumerate(leaves))
+
+        # Nested sets of each tree are numbered from 1 without gaps
+        for tree_id in (10, 11):
+            numbers = sorted(n for node in nodes.values() if node['tree_id'] == tree_id
+                             for n in (node['lft'], node['rght']))
+            self.assertEqual(numbers, list(range(1, len(numbers) + 1)))
+
+        # Parents intervals contain children intervals
+        children = list((key, (key[0], parent)) for key, parent in components.items() if parent is not None)
+        children.extend(((key, i), key) for i, key in enumerate(leaves))
+        for key, parent_key in children:
+            self.assertEqual(nodes[key]['tree_id'], nodes[parent_key]['tree_id'])
+            self.assertEqual(nodes[key]['level'], nodes[parent_key]['level'] + 1)
+            self.assertTrue(nodes[parent_key]['lft'] < nodes[key]['lft'] < nodes[key]['rght'] <
+                            nodes[parent_key]['rght'])
+
+        # Parents go before children
+        order = dict((key, i) for i, key in enumerate(layout.order))
+        for key, parent in components.items():
+            if parent is not None:
+                self.assertLess(order[(key[0], parent)], order[key])
+
+        # There are no free places for extra leaves
+        with self.assertRaises(BridgeException):
+            layout.leaf(*leaves[0])
+
+    def test_corrupted(self):
+        with self.assertRaises(BridgeException):
+            ReportsTreeLayout({(1, 'root'): None, (1, 'child'): 'unknown'}, {})
+        with self.assertRaises(BridgeException):
+            ReportsTreeLayout({(1, 'root'): None}, {(1, 'unknown'): 1})
+
+
+class TestBulkCreateReports(KleverTestCase):
+    def test_shared_log(self):
+        decision = create_decision(create_job())
+        computer = create_computer()
+        layout = ReportsTreeLayout({
+            (decision.id, '/'): None, (decision.id, '/vtg'): '/', (decision.id, '/vtgw'): '/'
+        }, {})
+        layout.first_tree_id = 1
+
+        root = ReportComponent(
+            decision=decision, identifier='/', component='Core', computer=computer,
+            **layout.component((decision.id, '/'))
+        )
+        root.add_log(io.BytesIO(b'Log'))
+        bulk_create_reports(ReportComponent, [root])
+        # Children have the same log as their parent
+        children = list(ReportComponent(
+            decision=decision, parent_id=root.id, identifier=identifier, component=identifier[1:].upper(),
+            computer=computer, log=root.log.name, **layout.component((decision.id, identifier))
+        ) for identifier in ('/vtg', '/vtgw'))
+        bulk_create_reports(ReportComponent, children)
+
+        root = ReportComponent.objects.get(id=root.id)
+        self.assertEqual(list(report.id for report in root.get_descendants()), list(child.id for child in children))
+        self.assertEqual(ReportComponent.objects.filter(log=root.log.name).count(), 3)
+        log_path = root.log.path
+        with open(log_path, mode='rb') as fp:
+            self.assertEqual(fp.read(), b'Log')
+
+        # The log is removed with the last report that refers it
+        ReportComponent.objects.filter(id=children[0].id).delete()
+        self.assertTrue(os.path.isfile(log_path))
+        root.delete()
+        self.assertEqual(ReportComponent.objects.filter(decision=decision).count(), 0)
+        self.assertFalse(os.path.isfile(log_path))
+
+
+class _RangeGenerator:
+    def __init__(self, archive):
+        self.archive = archive
+        self.size = archive.size
+        self.etag = '"{}"'.format(archive.key)
+
+    def __iter__(self):
+        return self.archive.iterate()
+
+    def iterate(self, start=0, end=None):
+        return self.archive.iterate(start, end)
+
+
+class TestZipArchivePlan(SimpleTestCase):
+    leaves_number = 50000
+    date_time = (2021, 1, 1, 12, 0, 0)
+
+    def setUp(self):
+        # Each test starts without CRCs calculated by other tests
+        crc_cache_patcher = mock.patch('bridge.ZipGenerator.crc_cache', _CRCCache(1000))
+        crc_cache_patcher.start()
+        self.addCleanup(crc_cache_patcher.stop)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.blobs = []
+        for i in range(3):
+            file_path = os.path.join(self.tmp_dir.name, 'ErrorTrace{}.zip'.format(i))
+            with zipfile.ZipFile(file_path, mode='w', compression=zipfile.ZIP_DEFLATED) as zfp:
+                zfp.writestr('error trace.json', json.dumps({'trace': [i] * 1000}))
+            self.blobs.append(file_path)
+        self.text_file = os.path.join(self.tmp_dir.name, 'data.txt')
+        with open(self.text_file, mode='w', encoding='utf-8') as fp:
+            fp.write('attribute data\n' * 100)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def __archive(self):
+        # Synthetic job archive with the JSON file of leaves and nested archive
+        archive = ZipArchivePlan(date_time=self.date_time)
+        archive.add_string('ReportUnsafe.json', json.dumps(list({
+            'identifier': 'unsafe{}'.format(i), 'error_trace': 'blobs/{}/ErrorTrace.zip'.format(i % len(self.blobs))
+        } for i in range(self.leaves_number))))
+        for i in range(self.leaves_number // 10):
+            archive.add_string('attrs/{}.json'.format(i), json.dumps({'name': 'attr', 'value': str(i)}))
+        for i, file_path in enumerate(self.blobs):
+            archive.add_file(file_path, 'blobs/{}/ErrorTrace.zip'.format(i))
+        archive.add_file(self.text_file, 'data.txt')
+        nested = ZipArchivePlan(date_time=self.date_time)
+        nested.add_file(self.blobs[0], 'ErrorTrace.zip')
+        archive.add_source('nested.zip', nested)
+        return archive
+
+    def test_archive(self):
+        archive = self.__archive()
+        content = b''.join(archive)
+        self.assertEqual(len(content), archive.size)
+        with zipfile.ZipFile(io.BytesIO(content)) as zfp:
+            self.assertIsNone(zfp.testzip())
+            self.assertEqual(len(zfp.namelist()), self.leaves_number // 10 + 6)
+            self.assertEqual(len(json.loads(zfp.read('ReportUnsafe.json'))), self.leaves_number)
+            # Archives are stored, other files are deflated
+            self.assertEqual(zfp.getinfo('blobs/0/ErrorTrace.zip').compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zfp.getinfo('data.txt').compress_type, zipfile.ZIP_DEFLATED)
+            with open(self.blobs[1], mode='rb') as fp:
+                self.assertEqual(zfp.read('blobs/1/ErrorTrace.zip'), fp.read())
+            with zipfile.ZipFile(io.BytesIO(zfp.read('nested.zip'))) as nested_zfp:
+                self.assertIsNone(nested_zfp.testzip())
+
+        # Any part of the archive can be generated by a new archive plan without generating preceding members
+        for start, end in [(0, 100), (1000, 200000), (archive.size - 5000, archive.size), (12345, None)]:
+            self.assertEqual(b''.join(self.__archive().iterate(start, end)), content[start:end])
+
+    def test_range_response(self):
+        archive = self.__archive()
+        content = b''.join(archive)
+        factory = RequestFactory()
+
+        response = streaming_response(factory.get('/'), _RangeGenerator(archive), 'Job.zip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(int(response['Content-Length']), len(content))
+        # New plans of the same archive have the same strong ETag
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(_RangeGenerator(self.__archive()).etag, etag)
+
+        response = streaming_response(
+            factory.get('/', HTTP_RANGE='bytes=1000-', HTTP_IF_RANGE=etag), _RangeGenerator(self.__archive()), 'Job.zip'
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), content[1000:])
+
+        # The whole archive is sent if it was changed
+        response = streaming_response(
+            factory.get('/', HTTP_RANGE='bytes=1000-', HTTP_IF_RANGE='"plan:changed"'),
+            _RangeGenerator(self.__archive()), 'Job.zip'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Range', response)
+        self.assertEqual(b''.join(response.streaming_content), content)
+
+        response = streaming_response(
+            factory.get('/', HTTP_RANGE='bytes=1000-'), _RangeGenerator(self.__archive()), 'Job.zip'
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 1000-{0}/{1}'.format(len(content) - 1, len(content)))
+        self.assertEqual(b''.join(response.streaming_content), content[1000:])
+
+        response = streaming_response(
+            factory.get('/', HTTP_RANGE='bytes=-100'), _RangeGenerator(self.__archive()), 'Job.zip'
+        )
+        self.assertEqual(b''.join(response.streaming_content), content[-100:])
+
+        response = streaming_response(
+            factory.get('/', HTTP_RANGE='bytes={}-'.format(len(content))), _RangeGenerator(archive), 'Job.zip'
+        )
+        self.assertEqual(response.status_code, 416)
+
+    def test_cached_crc(self):
+        file_source_iterate = FileSource.iterate
+        read_files = []
+
+        def iterate(source, *args, **kwargs):
+            read_files.append(source.file_path)
+            return file_source_iterate(source, *args, **kwargs)
+
+        with mock.patch.object(FileSource, 'iterate', iterate):
+            archive = self.__archive()
+            tail = b''.join(archive.iterate(archive.size - 100))
+            self.assertTrue(read_files)
+
+            content = b''.join(archive)
+            self.assertEqual(content[-100:], tail)
+
+            # The central directory of the archive generated once does not require reading files again
+            read_files.clear()
+            archive = self.__archive()
+            self.assertEqual(b''.join(archive.iterate(archive.size - 100)), tail)
+            self.assertEqual(read_files, [])
+
+            # Files changed since then are identified by their modification time
+            with open(self.text_file, mode='a', encoding='utf-8') as fp:
+                fp.write('changed')
+            self.assertNotEqual(self.__archive().key, archive.key)
+
+
+class TestJobsArchivesGen(KleverTestCase):
+    def test_job_archive(self):
+        job = create_job()
+        generator = JobArchiveGenerator(job)
+        tmp_dir = generator._tmp_dir.name  #pylint:disable=protected-access
+        content = b''.join(generator)
+        self.assertEqual(len(content), generator.size)
+        # JSON files are spooled, so the archive is the same each time
+        self.assertEqual(JobArchiveGenerator(job).etag, generator.etag)
+        with zipfile.ZipFile(io.BytesIO(content)) as zfp:
+            self.assertIsNone(zfp.testzip())
+            self.assertEqual(zfp.getinfo('job.json').compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(json.loads(zfp.read('job.json'))['name'], job.name)
+        self.assertTrue(os.listdir(tmp_dir))
+        generator.close()
+        self.assertFalse(os.path.exists(tmp_dir))
+
+    def test_decision_reports(self):
+        # Reports of the decision are collected on the connection of the request, so they are visible in a transaction
+        decision = create_decision(create_job())
+        decision.configuration = file_get_or_create('{}', 'conf.json', JobFile)
+        decision.save()
+        root = ReportComponent(decision=decision, identifier='/', component='Core', computer=create_computer())
+        root.add_log(io.BytesIO(b'Log'), save=True)
+
+        generator = JobArchiveGenerator(decision.job)
+        with zipfile.ZipFile(io.BytesIO(b''.join(generator))) as zfp:
+            self.assertEqual(list(d['identifier'] for d in json.loads(zfp.read('Decision.json'))), [
+                str(decision.identifier)
+            ])
+            reports = json.loads(zfp.read('ReportComponent.json'))
+            self.assertEqual(list(report['identifier'] for report in reports), ['/'])
+            self.assertEqual(zfp.read(reports[0]['log']), b'Log')
+        generator.close()
+
+    def test_jobs_archives(self):
+        jobs = [create_job(), create_job()]
+        jobs_to_download = dict((job.id, {'instance': job, 'decisions': None}) for job in jobs)
+
+        with mock.patch('jobs.Download.JobArchiveGenerator', wraps=JobArchiveGenerator) as job_generator:
+            generator = JobsArchivesGen(jobs_to_download)
+            # Job archives are prepared one by one while the archive is generated
+            self.assertEqual(job_generator.call_count, 0)
+            content = b''.join(generator)
+            self.assertEqual(job_generator.call_count, len(jobs))
+
+        with zipfile.ZipFile(io.BytesIO(content)) as zfp:
+            self.assertIsNone(zfp.testzip())
+            for job in jobs:
+                with zipfile.ZipFile(io.BytesIO(zfp.read('Job-{}.zip'.format(job.identifier)))) as job_zfp:
+                    self.assertEqual(json.loads(job_zfp.read('job.json'))['name'], job.name)
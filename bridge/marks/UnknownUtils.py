@@ -104,6 +104,21 @@ class UnconfirmUnknownMark(UnconfirmAssociationBase):
         RecalculateUnknownCache(report_id)
 
 
+def compile_unknown_function(mark):
+    """
+    Compile regexp of the unknown mark to use it for many reports.
+    :param mark: MarkUnknown object;
+    :return: compiled pattern or original function if it is not a valid regexp or the mark does not use regexps.
+    """
+    if not mark.is_regexp:
+        return mark.function
+    try:
+        return re.compile(mark.function, re.MULTILINE)
+    except Exception:
+        # The error will be logged on matching
+        return mark.function
+
+
 class MatchUnknown:
     def __init__(self, description, func, pattern, is_regexp):
         self.description = description
@@ -122,7 +137,10 @@ class MatchUnknown:
 
     def __match_desc_regexp(self):
         try:
-            m = re.search(self.function, self.description, re.MULTILINE)
+            if isinstance(self.function, re.Pattern):
+                m = self.function.search(self.description)
+            else:
+                m = re.search(self.function, self.description, re.MULTILINE)
         except Exception as e:
             logger.exception("Regexp error: %s" % e, stack_info=True)
             return None
@@ -165,6 +183,7 @@ class ConnectUnknownMark:
 
         new_links = set()
         associations = []
+        function = compile_unknown_function(self._mark)
         for report in ReportUnknown.objects\
                 .filter(component=self._mark.component, cache__attrs__contains=self._mark.cache_attrs)\
                 .select_related('cache').only('id', 'problem_description', 'cache__marks_confirmed'):
@@ -172,8 +191,7 @@ class ConnectUnknownMark:
             if not unknown_desc:
                 continue
             problem = MatchUnknown(
-                unknown_desc, self._mark.function,
-                self._mark.problem_pattern, self._mark.is_regexp
+                unknown_desc, function, self._mark.problem_pattern, self._mark.is_regexp
             ).problem
             if not problem:
                 continue
@@ -31,7 +31,9 @@ from bridge.vars import ASSOCIATION_TYPE, UNKNOWN_ERROR, ERROR_TRACE_FILE, COMPA
 from bridge.utils import logger, BridgeException, ArchiveFileContent, RequreLock, file_checksum, require_lock
 
 from reports.models import ReportUnsafe
-from marks.models import MarkUnsafe, MarkUnsafeHistory, MarkUnsafeReport, UnsafeConvertionCache, ConvertedTrace
+from marks.models import (
+    MarkUnsafe, MarkUnsafeHistory, MarkUnsafeReport, UnsafeConvertionCache, ConvertedTrace, ConvertedTraceForest
+)
 
 from marks.utils import ConfirmAssociationBase, UnconfirmAssociationBase
 from caches.utils import RecalculateUnsafeCache, UpdateUnsafeCachesOnMarkChange
@@ -115,6 +117,27 @@ def jaccard(forest1: set, forest2: set):
     return similar / res
 
 
+def get_similar_forests(forests: set, traces_ids):
+    """
+    Get forests of converted error traces that have at least one forest in common with the given ones.
+    Jaccard index for the rest traces is 0, so there is no need to compare them.
+    :param forests: set of forests hash sums;
+    :param traces_ids: identifiers of ConvertedTrace to search in;
+    :return: dictionary {<trace id>: <set of forests hash sums>}
+    """
+    queryset = ConvertedTraceForest.objects.filter(trace_id__in=traces_ids)
+    if forests:
+        queryset = queryset.filter(trace_id__in=ConvertedTraceForest.objects.filter(
+            forest_hash__in=forests, trace_id__in=traces_ids
+        ).values('trace_id'))
+    # Otherwise all traces are required since empty traces are similar to the empty forests set
+
+    traces_forests = {}
+    for trace_id, forest_hash in queryset.values_list('trace_id', 'forest_hash'):
+        traces_forests.setdefault(trace_id, set()).add(forest_hash)
+    return traces_forests
+
+
 def regexp_match(error_trace_text: str, regexp: str):
     return int(bool(re.search(re.escape(regexp[1:-1]) if regexp[0] == regexp[-1] == '"'
                               else re.compile(regexp, flags=re.M | re.S), error_trace_text)))
@@ -153,6 +176,11 @@ class ErrorTraceConverter:
             conv.trace_cache = {'forest': forests_hashsums}
 
         conv.file.save(ET_FILE_NAME, File(fp), save=True)
+        if forests:
+            ConvertedTraceForest.objects.bulk_create(list(
+                ConvertedTraceForest(trace=conv, forest_hash=forest_hash)
+                for forest_hash in set(conv.trace_cache['forest'])
+            ))
         return conv
 
     def save_forests(self, forests):
@@ -406,7 +434,7 @@ class CompareMark:
         reports_cache = {}
         for conv in UnsafeConvertionCache.objects\
                 .filter(unsafe_id__in=reports_ids, converted__function=convert_function)\
-                .select_related('converted'):
+                .select_related('converted').defer('converted__trace_cache'):
             reports_cache[conv.unsafe_id] = conv.converted
 
         for report in reports_qs:
@@ -428,11 +456,14 @@ class CompareMark:
         results = {}
         reports_cache = self.__get_reports_cache(reports_qs)
 
-        mark_forests = None
+        mark_forests = traces_forests = None
         if self._mark.function == 'regexp_match':
             pass
         elif self._mark.error_trace:
             mark_forests = set(self._mark.error_trace.trace_cache['forest'])
+            traces_forests = get_similar_forests(mark_forests, set(
+                conv.id for conv in reports_cache.values() if conv is not None
+            ))
         else:
             raise ValueError("The mark does not have an error trace")
 
@@ -452,7 +483,7 @@ class CompareMark:
                     raw_trace = fp.read()
                 res = regexp_match(raw_trace, self._mark.regexp)
             else:
-                res = jaccard(mark_forests, set(reports_cache[report_id].trace_cache['forest']))
+                res = jaccard(mark_forests, traces_forests.get(reports_cache[report_id].id, set()))
 
             is_associated = bool(res > 0 and res >= self._mark.threshold)
             results[report_id] = {
@@ -468,6 +499,7 @@ class CompareReport:
         self._new_converted_cache = []
         self._raw_trace_cache = {}
         self._trace_forests_cache = {}
+        self._similar_forests_cache = {}
 
     @cached_property
     def _error_trace(self):
@@ -498,8 +530,19 @@ class CompareReport:
                 self._trace_forests_cache[convert_function] = set(conv.trace_cache['forest'])
         return self._trace_forests_cache[convert_function]
 
+    def __get_similar_forests(self, convert_function, marks_qs):
+        if convert_function not in self._similar_forests_cache:
+            self._similar_forests_cache[convert_function] = get_similar_forests(
+                self.__get_trace_forests(convert_function), set(
+                    mark.error_trace_id for mark in marks_qs if mark.error_trace_id
+                    and COMPARE_FUNCTIONS[mark.function]['convert'] == convert_function
+                )
+            )
+        return self._similar_forests_cache[convert_function]
+
     def compare(self, marks_qs):
-        # WARNING: ensure there is select_related('error_trace') for marks queryset
+        # Forests of marks error traces are taken from ConvertedTraceForest,
+        # so marks queryset can be without select_related('error_trace')
 
         results = {}
         for mark in marks_qs:
@@ -509,10 +552,11 @@ class CompareReport:
                 raw_trace = self.__get_raw_trace(convert_func)
                 if raw_trace is not None:
                     res = regexp_match(raw_trace, mark.regexp)
-            elif mark.error_trace:
+            elif mark.error_trace_id:
                 report_forests = self.__get_trace_forests(convert_func)
                 if report_forests is not None:
-                    res = jaccard(set(mark.error_trace.trace_cache['forest']), report_forests)
+                    marks_forests = self.__get_similar_forests(convert_func, marks_qs)
+                    res = jaccard(marks_forests.get(mark.error_trace_id, set()), report_forests)
             else:
                 # Ignore non-regexp marks without error trace
                 continue
@@ -0,0 +1,49 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from django.db import migrations, models
+
+
+def index_forests(apps, schema_editor):
+    ConvertedTrace = apps.get_model('marks', 'ConvertedTrace')
+    ConvertedTraceForest = apps.get_model('marks', 'ConvertedTraceForest')
+    new_forests = []
+    for trace_id, trace_cache in ConvertedTrace.objects.values_list('id', 'trace_cache').iterator():
+        for forest_hash in set(trace_cache.get('forest', [])):
+            new_forests.append(ConvertedTraceForest(trace_id=trace_id, forest_hash=forest_hash))
+    ConvertedTraceForest.objects.bulk_create(new_forests, batch_size=10000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('marks', '0004_alter_marksafe_verdict_alter_marksafehistory_verdict_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConvertedTraceForest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('forest_hash', models.CharField(db_index=True, max_length=32)),
+                ('trace', models.ForeignKey(
+                    on_delete=models.deletion.CASCADE, related_name='forests', to='marks.convertedtrace'
+                )),
+            ],
+            options={'db_table': 'cache_marks_trace_forest'},
+        ),
+        migrations.RunPython(index_forests, migrations.RunPython.noop),
+    ]
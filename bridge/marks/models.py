@@ -50,6 +50,14 @@ class ConvertedTrace(WithFilesMixin, models.Model):
         return self.hash_sum
 
 
+class ConvertedTraceForest(models.Model):
+    trace = models.ForeignKey(ConvertedTrace, models.CASCADE, related_name='forests')
+    forest_hash = models.CharField(max_length=32, db_index=True)
+
+    class Meta:
+        db_table = 'cache_marks_trace_forest'
+
+
 # Abstract tables
 class Mark(models.Model):
     identifier = models.UUIDField(unique=True, default=uuid.uuid4)
@@ -17,7 +17,7 @@
 
 from datetime import timedelta
 
-from django.db.models import F, Count, Case, When, Sum, Q
+from django.db.models import F, Count, Case, When, Sum, Q, CharField
 from django.db.models.expressions import RawSQL
 from django.template import loader
 from django.urls import reverse
@@ -43,7 +43,7 @@ from caches.models import SafeMarkAssociationChanges, UnsafeMarkAssociationChang
 
 from reports.verdicts import safe_color, unsafe_color, bug_status_color
 
-from users.utils import HumanizedValue, paginate_queryset
+from users.utils import HumanizedValue, paginate_queryset, paginate_by_keyset, ordering_keys
 from jobs.utils import decisions_with_view_access
 from marks.utils import MarkAccess
 
@@ -485,22 +485,22 @@ class MarksTableBase:
             qs_filters['mark__component__{}'.format(self.view['component'][0])] = self.view['component'][1]
 
         # Sorting
-        ordering = 'id'
+        ordering = None
         if 'order' in self.view:
             if self.view['order'][1] == 'change_date':
                 ordering = 'change_date'
             elif self.view['order'][1] == 'component':
-                ordering = 'mark__component'
+                # Links to neighbour pages take values of keys from attributes of mark versions
+                annotations['ordering_component'] = F('mark__component')
+                ordering = 'ordering_component'
             elif self.view['order'][1] == 'attr':
-                annotations['ordering_attr'] = RawSQL(
+                ordering = RawSQL(
                     "\"{}\".\"cache_attrs\"->>%s".format(self.mark_table),
-                    (self.view['order'][2],)
-                )
-                ordering = 'ordering_attr'
+                    (self.view['order'][2],), output_field=CharField()
+                ), ''
             elif self.view['order'][1] == 'num_of_links' and 'num_of_links' in annotations:
                 ordering = 'num_of_links'
-            if self.view['order'][0] == 'up':
-                ordering = '-' + ordering
+        keys = ordering_keys(annotations, ordering, 'order' in self.view and self.view['order'][0] == 'up')
 
         select_only = ['mark__id']
         select_related = ['mark']
@@ -508,7 +508,8 @@ class MarksTableBase:
             select_only.append('mark__identifier')
         if 'source' in view_columns:
             select_only.append('mark__source')
-        if 'change_date' in view_columns:
+        # Values of ordering keys are needed for links to neighbour pages
+        if 'change_date' in view_columns or ordering == 'change_date':
             select_only.append('change_date')
         if 'author' in view_columns:
             select_related.append('author')
@@ -529,9 +530,9 @@ class MarksTableBase:
         queryset = self.versions_model.objects
         if annotations:
             queryset = queryset.annotate(**annotations)
-        queryset = queryset.filter(**qs_filters).order_by(ordering).select_related(*select_related).only(*select_only)
+        queryset = queryset.filter(**qs_filters).select_related(*select_related).only(*select_only)
         num_per_page = self.view['elements'][0] if self.view['elements'] else None
-        return paginate_queryset(queryset, self._page_number, num_per_page)
+        return paginate_by_keyset(queryset, keys, self._page_number, num_per_page)
 
     @cached_property
     def marks_ids(self):
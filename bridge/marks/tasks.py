@@ -15,56 +15,111 @@
 # limitations under the License.
 #
 
+import json
+
 from celery import shared_task
 
 from bridge.vars import PROBLEM_DESC_FILE, ASSOCIATION_TYPE
-from bridge.utils import BridgeException, ArchiveFileContent
+from bridge.utils import logger, ArchiveFileContent
 
 from reports.models import ReportSafe, ReportUnsafe, ReportUnknown
 from marks.models import MarkSafe, MarkSafeReport, MarkUnsafe, MarkUnsafeReport, MarkUnknown, MarkUnknownReport
 
 from marks.UnsafeUtils import CompareReport
-from marks.UnknownUtils import MatchUnknown
+from marks.UnknownUtils import MatchUnknown, compile_unknown_function
 from caches.utils import RecalculateSafeCache, RecalculateUnsafeCache, RecalculateUnknownCache
 
 
+# Maximum number of reports to connect with marks in one task
+CONNECT_BATCH_SIZE = 1000
+
+
+def group_by_attrs(queryset, *fields):
+    """
+    Group reports by their cache attributes and given fields to get marks for each group just once.
+    :param queryset: reports queryset with selected cache;
+    :param fields: additional report fields marks are filtered by;
+    :return: list of (<report attributes>, <fields values>, <list of reports>)
+    """
+    groups = {}
+    for report in queryset:
+        key = (json.dumps(report.cache.attrs, sort_keys=True),) + tuple(getattr(report, f) for f in fields)
+        groups.setdefault(key, (report.cache.attrs, key[1:], []))[2].append(report)
+    return list(groups.values())
+
+
+@shared_task
+def connect_safe_reports(reports_ids):
+    new_markreports = []
+    queryset = ReportSafe.objects.filter(id__in=reports_ids).select_related('cache').only('id', 'cache__attrs')
+    for attrs, _, reports in group_by_attrs(queryset):
+        marks_ids = list(MarkSafe.objects.filter(cache_attrs__contained_by=attrs).values_list('id', flat=True))
+        new_markreports.extend(
+            MarkSafeReport(mark_id=m_id, report=report, associated=True, type=ASSOCIATION_TYPE[2][0])
+            for report in reports for m_id in marks_ids
+        )
+    MarkSafeReport.objects.bulk_create(new_markreports)
+    RecalculateSafeCache(list(reports_ids))
+
+
+@shared_task
+def connect_unsafe_reports(reports_ids):
+    new_markreports = []
+    queryset = ReportUnsafe.objects.filter(id__in=reports_ids).select_related('cache')
+    for attrs, _, reports in group_by_attrs(queryset):
+        marks = list(MarkUnsafe.objects.filter(cache_attrs__contained_by=attrs))
+        for report in reports:
+            compare_results = CompareReport(report).compare(marks)
+            new_markreports.extend(MarkUnsafeReport(
+                mark_id=mark.id, report=report, **compare_results[mark.id]
+            ) for mark in marks)
+    MarkUnsafeReport.objects.bulk_create(new_markreports)
+    RecalculateUnsafeCache(list(reports_ids))
+
+
+@shared_task
+def connect_unknown_reports(reports_ids):
+    new_markreports = []
+    queryset = ReportUnknown.objects.filter(id__in=reports_ids).select_related('cache')
+    for attrs, (component,), reports in group_by_attrs(queryset, 'component'):
+        marks = list(MarkUnknown.objects.filter(component=component, cache_attrs__contained_by=attrs))
+        functions = dict((mark.id, compile_unknown_function(mark)) for mark in marks)
+        for report in reports:
+            try:
+                problem_desc = ArchiveFileContent(
+                    report, 'problem_description', PROBLEM_DESC_FILE
+                ).content.decode('utf8')
+            except Exception as e:
+                # Do not break connection of other reports in the batch
+                logger.error("Can't read problem description for unknown '{}': {}".format(report.id, e))
+                continue
+            for mark in marks:
+                problem = MatchUnknown(problem_desc, functions[mark.id], mark.problem_pattern, mark.is_regexp).problem
+                if not problem:
+                    continue
+                new_markreports.append(MarkUnknownReport(
+                    mark_id=mark.id, report=report, problem=problem, associated=True, type=ASSOCIATION_TYPE[2][0]
+                ))
+    MarkUnknownReport.objects.bulk_create(new_markreports)
+    RecalculateUnknownCache(list(reports_ids))
+
+
 @shared_task
 def connect_safe_report(report_id):
-    report = ReportSafe.objects.select_related('cache').get(pk=report_id)
-    marks_qs = MarkSafe.objects.filter(cache_attrs__contained_by=report.cache.attrs)
-    MarkSafeReport.objects.bulk_create(list(
-        MarkSafeReport(mark_id=m_id, report=report, associated=True, type=ASSOCIATION_TYPE[2][0])
-        for m_id in marks_qs.values_list('id', flat=True)
-    ))
-    RecalculateSafeCache(report.id)
+    connect_safe_reports([report_id])
 
 
 @shared_task
 def connect_unsafe_report(report_id):
-    report = ReportUnsafe.objects.select_related('cache').get(pk=report_id)
-    marks_qs = MarkUnsafe.objects.filter(cache_attrs__contained_by=report.cache.attrs).select_related('error_trace')
-    compare_results = CompareReport(report).compare(marks_qs)
-
-    MarkUnsafeReport.objects.bulk_create(list(MarkUnsafeReport(
-        mark_id=mark.id, report=report, **compare_results[mark.id]
-    ) for mark in marks_qs))
-    RecalculateUnsafeCache(report.id)
+    connect_unsafe_reports([report_id])
 
 
 @shared_task
 def connect_unknown_report(report_id):
-    report = ReportUnknown.objects.select_related('cache').get(pk=report_id)
-    try:
-        problem_desc = ArchiveFileContent(report, 'problem_description', PROBLEM_DESC_FILE).content.decode('utf8')
-    except Exception as e:
-        raise BridgeException("Can't read problem description for unknown '{}': {}".format(report.id, e))
-    new_markreports = []
-    for mark in MarkUnknown.objects.filter(component=report.component, cache_attrs__contained_by=report.cache.attrs):
-        problem = MatchUnknown(problem_desc, mark.function, mark.problem_pattern, mark.is_regexp).problem
-        if not problem:
-            continue
-        new_markreports.append(MarkUnknownReport(
-            mark_id=mark.id, report=report, problem=problem, associated=True, type=ASSOCIATION_TYPE[2][0]
-        ))
-    MarkUnknownReport.objects.bulk_create(new_markreports)
-    RecalculateUnknownCache(report.id)
+    connect_unknown_reports([report_id])
+
+
+def connect_reports_in_batches(task, reports_ids):
+    reports_ids = list(reports_ids)
+    for i in range(0, len(reports_ids), CONNECT_BATCH_SIZE):
+        task.delay(reports_ids[i:i + CONNECT_BATCH_SIZE])
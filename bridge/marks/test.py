@@ -17,9 +17,13 @@
 
 import os
 import json
+import zipfile
+from io import BytesIO
+from unittest import mock
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 
 from bridge.utils import KleverTestCase, ArchiveFileContent
@@ -29,14 +33,19 @@ from bridge.vars import (
 
 from users.models import User
 from jobs.models import Job
+from bridge.celery import app as celery_app
 from reports.models import ReportSafe, ReportUnsafe, ReportUnknown, ReportComponent
+from caches.models import ReportSafeCache, ReportUnknownCache
 from marks.models import (
     MarkSafe, MarkUnsafe, MarkUnknown, MarkSafeHistory, MarkUnsafeHistory, MarkUnknownHistory,
     MarkSafeTag, MarkUnsafeTag, MarkSafeReport, MarkUnsafeReport, MarkUnknownReport,
-    SafeAssociationLike, UnsafeAssociationLike, UnknownAssociationLike
+    SafeAssociationLike, UnsafeAssociationLike, UnknownAssociationLike, ConvertedTraceForest
 )
+from marks.UnsafeUtils import ErrorTraceConverter, jaccard, get_similar_forests
+from marks.tasks import connect_safe_reports, connect_unknown_reports, connect_reports_in_batches
+from marks.tables import SafeMarksTable
 
-from reports.test import DecideJobs, SJC_1
+from reports.test import DecideJobs, SJC_1, create_job, create_decision
 
 REPORT_ARCHIVES = os.path.join(settings.BASE_DIR, 'reports', 'test_files')
 
@@ -1282,3 +1291,186 @@ class TestMarks(KleverTestCase):
         if os.path.exists(os.path.join(settings.MEDIA_ROOT, self.all_marks_arch)):
             os.remove(os.path.join(settings.MEDIA_ROOT, self.all_marks_arch))
         super(TestMarks, self).tearDown()
+
+
+class TestUnsafeForests(KleverTestCase):
+    def test_similar_forests(self):
+        forests = [[{'f%s' % i: []}] for i in range(6)]
+        converter = ErrorTraceConverter('thread_call_forests')
+        traces = [
+            converter.save_forests(forests[:3]),
+            converter.save_forests(forests[2:5]),
+            converter.save_forests(forests[5:]),
+            converter.save_forests(forests[5:] * 2),
+            converter.save_forests([])
+        ]
+        self.assertEqual(ConvertedTraceForest.objects.filter(trace=traces[3]).count(), 1)
+
+        traces_ids = set(conv.id for conv in traces)
+        for conv1 in traces:
+            forests1 = set(conv1.trace_cache['forest'])
+            similar = get_similar_forests(forests1, traces_ids)
+            for conv2 in traces:
+                self.assertEqual(
+                    jaccard(forests1, similar.get(conv2.id, set())),
+                    jaccard(forests1, set(conv2.trace_cache['forest']))
+                )
+
+
+class TestConnectReportsInBatches(KleverTestCase):
+    def setUp(self):
+        super().setUp()
+        # Tasks are executed by delay() as celery workers would do it
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        self.decision = create_decision(create_job())
+        # Reports with the same requirement are grouped to get their marks just once
+        self.requirements = [
+            'linux:mutex', 'linux:spinlock', 'linux:mutex', None, 'linux:spinlock', 'linux:mutex', None
+        ]
+
+    def __connect(self, task, reports):
+        with mock.patch('marks.tasks.CONNECT_BATCH_SIZE', 3), \
+                mock.patch.object(task, 'delay', wraps=task.delay) as delay:
+            connect_reports_in_batches(task, list(report.id for report in reports))
+        self.assertEqual(list(len(args[0]) for args, _ in delay.call_args_list), [3, 3, 1])
+
+    def __attrs(self, requirement):
+        return {'Requirement': requirement} if requirement else {}
+
+    def test_safes(self):
+        reports = []
+        for i, requirement in enumerate(self.requirements):
+            reports.append(ReportSafe.objects.create(decision=self.decision, identifier='safe{}'.format(i)))
+            ReportSafeCache.objects.create(decision=self.decision, report=reports[-1], attrs=self.__attrs(requirement))
+        mutex = MarkSafe.objects.create(
+            verdict=MARK_SAFE[1][0], cache_tags=['tag1'], cache_attrs={'Requirement': 'linux:mutex'}
+        )
+        common = MarkSafe.objects.create(verdict=MARK_SAFE[1][0], cache_tags=['tag2'])
+        MarkSafe.objects.create(verdict=MARK_SAFE[2][0], cache_attrs={'Requirement': 'linux:rcu'})
+
+        self.__connect(connect_safe_reports, reports)
+        for report, requirement in zip(reports, self.requirements):
+            marks = [mutex, common] if requirement == 'linux:mutex' else [common]
+            self.assertEqual(
+                set(MarkSafeReport.objects.filter(report=report, type=ASSOCIATION_TYPE[2][0], associated=True)
+                    .values_list('mark_id', flat=True)), set(mark.id for mark in marks)
+            )
+            cache = ReportSafeCache.objects.get(report=report)
+            self.assertEqual(cache.marks_automatic, len(marks))
+            self.assertEqual(cache.marks_total, len(marks))
+            self.assertEqual(cache.verdict, SAFE_VERDICTS[1][0])
+            self.assertEqual(cache.tags, dict((mark.cache_tags[0], 1) for mark in marks))
+
+    def test_unknowns(self):
+        reports = []
+        for i, requirement in enumerate(self.requirements):
+            archive = BytesIO()
+            with zipfile.ZipFile(archive, mode='w') as zfp:
+                zfp.writestr(PROBLEM_DESC_FILE, 'Error: problem{}\n'.format(i))
+            reports.append(ReportUnknown.objects.create(
+                decision=self.decision, identifier='unknown{}'.format(i), component='Core' if i % 2 else 'EMG',
+                problem_description=SimpleUploadedFile('problem.zip', archive.getvalue())
+            ))
+            ReportUnknownCache.objects.create(
+                decision=self.decision, report=reports[-1], attrs=self.__attrs(requirement)
+            )
+        MarkUnknown.objects.create(
+            component='Core', function=r'Error: (problem\d+)', problem_pattern='{0}',
+            cache_attrs={'Requirement': 'linux:mutex'}
+        )
+        MarkUnknown.objects.create(component='EMG', function='problem', is_regexp=False, problem_pattern='Problem')
+
+        self.__connect(connect_unknown_reports, reports)
+        for i, (report, requirement) in enumerate(zip(reports, self.requirements)):
+            problems = {}
+            if i % 2 and requirement == 'linux:mutex':
+                problems['problem{}'.format(i)] = 1
+            elif not i % 2:
+                problems['Problem'] = 1
+            self.assertEqual(set(MarkUnknownReport.objects.filter(report=report).values_list('problem', flat=True)),
+                             set(problems))
+            cache = ReportUnknownCache.objects.get(report=report)
+            self.assertEqual(cache.marks_total, len(problems))
+            self.assertEqual(cache.problems, problems)
+
+
+class TestMarksTablePagination(KleverTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='user')
+        decision = create_decision(create_job())
+        safes = list(ReportSafe.objects.create(decision=decision, identifier='safe{}'.format(i)) for i in range(3))
+
+        # Mark identifier -> (number of links, requirement)
+        self.marks = {}
+        for i in range(11):
+            requirement = [None, 'linux:mutex', 'linux:spinlock'][i % 3]
+            mark = MarkSafe.objects.create(
+                verdict=MARK_SAFE[1][0], cache_attrs={'Requirement': requirement} if requirement else {}
+            )
+            MarkSafeHistory.objects.create(mark=mark, version=mark.version, verdict=mark.verdict)
+            for safe in safes[:i % 4]:
+                MarkSafeReport.objects.create(mark=mark, report=safe)
+            self.marks[mark.id] = (i % 4, requirement)
+
+    def __expected(self, ordering=None, descending=False):
+        def key(mark_id):
+            if ordering is None:
+                return mark_id,
+            value = self.marks[mark_id][ordering]
+            # NULL values are the greatest ones
+            return value is None, '' if value is None else value, mark_id
+        return sorted(self.marks, key=key, reverse=descending)
+
+    def __pages(self, view, backward=False):
+        view = dict({'elements': [3], 'columns': ['num_of_links']}, **view)
+        table = SafeMarksTable(self.user, view, {'page': 'last' if backward else '1'})
+        pages = [table.page]
+        while table.page.has_previous() if backward else table.page.has_next():
+            page = table.page.previous_page_number() if backward else table.page.next_page_number()
+            table = SafeMarksTable(self.user, view, {'page': page})
+            pages.append(table.page)
+        if backward:
+            pages.reverse()
+        self.assertEqual(list(page.number for page in pages), list(range(1, len(pages) + 1)))
+        self.assertEqual(len(pages), table.paginator.num_pages)
+        return list(mark_version.mark_id for page in pages for mark_version in page)
+
+    def test_orderings(self):
+        for backward in (False, True):
+            self.assertEqual(self.__pages({}, backward), self.__expected())
+            self.assertEqual(
+                self.__pages({'order': ['up', 'num_of_links']}, backward), self.__expected(0, True)
+            )
+            self.assertEqual(
+                self.__pages({'order': ['down', 'attr', 'Requirement']}, backward), self.__expected(1)
+            )
+            self.assertEqual(self.__pages({'order': ['down', 'change_date']}, backward), self.__expected())
+
+    def test_out_of_range(self):
+        # Numbers of pages that do not exist any more refer to the last page
+        table = SafeMarksTable(self.user, {'elements': [3], 'columns': ['num_of_links']}, {'page': '10'})
+        self.assertEqual(table.page.number, 4)
+        self.assertTrue(table.page.has_previous())
+        self.assertFalse(table.page.has_next())
+        self.assertEqual(list(mark_version.mark_id for mark_version in table.page), self.__expected()[9:])
+
+        # The only page does not refer to the previous one
+        table = SafeMarksTable(self.user, {'elements': [20], 'columns': ['num_of_links']}, {'page': '2'})
+        self.assertEqual(table.page.number, 1)
+        self.assertFalse(table.page.has_previous())
+        self.assertFalse(table.page.has_next())
+        self.assertEqual(list(mark_version.mark_id for mark_version in table.page), self.__expected())
+
+    def test_empty_table(self):
+        MarkSafe.objects.all().delete()
+        for page in ('1', '2', 'last'):
+            table = SafeMarksTable(self.user, {'elements': [3], 'columns': ['num_of_links']}, {'page': page})
+            self.assertEqual(len(table.page), 0)
+            self.assertEqual(table.page.number, 1)
+            self.assertFalse(table.page.has_previous())
+            self.assertFalse(table.page.has_next())
+            # Links to neighbour pages are rendered with numbers as there are no marks to get cursors
+            self.assertEqual(table.page.previous_page_number(), 0)
+            self.assertEqual(table.page.next_page_number(), 2)
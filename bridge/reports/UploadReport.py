@@ -16,7 +16,6 @@
 #
 
 import os
-import json
 import time
 import zipfile
 from collections import OrderedDict
@@ -24,13 +23,15 @@ from collections import OrderedDict
 from django.core.files import File
 from django.db import transaction
 from django.db.models import Q
+from django.utils.encoding import smart_str
 from django.utils.timezone import now
 
 from rest_framework import exceptions, fields, serializers
 from rest_framework.settings import api_settings
 
 from bridge.vars import ERROR_TRACE_FILE, REPORT_ARCHIVE, DECISION_STATUS, SUBJOB_NAME, NAME_ATTR, MPTT_FIELDS
-from bridge.utils import logger, extract_archive
+from bridge.utils import logger, extract_archive, remove_instance_files
+from bridge.json_stream import CHUNK_SIZE
 
 from reports.models import (
     ReportComponent, ReportSafe, ReportUnsafe, ReportUnknown, ReportAttr, ReportComponentLeaf,
@@ -40,12 +41,15 @@ from service.models import Task
 from caches.models import ReportSafeCache, ReportUnsafeCache, ReportUnknownCache
 
 from reports.serializers import ReportAttrSerializer, ComputerSerializer
-from reports.tasks import fill_coverage_statistics
-from marks.tasks import connect_safe_report, connect_unsafe_report, connect_unknown_report
+from reports.trace_validator import ErrorTraceValidator, ErrorTraceError
+from reports.tasks import fill_coverage_statistics, build_error_trace_indexes
+from marks.tasks import CONNECT_BATCH_SIZE, connect_safe_reports, connect_unsafe_reports, connect_unknown_reports
 from service.utils import FinishDecision
 
 from reports.test import ReportsLogging
 
+ATTR_FIELDS = ['name', 'value', 'compare', 'associate', 'data_id']
+
 
 class ReportParentField(serializers.SlugRelatedField):
     queryset = ReportComponent.objects
@@ -57,6 +61,15 @@ class ReportParentField(serializers.SlugRelatedField):
     def get_queryset(self):
         return super().get_queryset().filter(decision=getattr(self.root, 'decision'))
 
+    def to_internal_value(self, data):
+        batch = getattr(self.root, 'batch', None)
+        if batch is None:
+            return super().to_internal_value(data)
+        parent = batch.get_parent(data)
+        if parent is None:
+            self.fail('does_not_exist', slug_name=self.slug_field, value=smart_str(data))
+        return parent
+
 
 class ReportAttrsField(fields.ListField):
     default_error_messages = {
@@ -118,6 +131,7 @@ class UploadBaseSerializer(serializers.ModelSerializer):
     def __init__(self, *args, **kwargs):
         self.decision = kwargs.pop('decision')
         self.allow_attrs_redefine = kwargs.pop('allow_attrs_redefine', False)
+        self.batch = kwargs.pop('batch', None)
         custom_fields = kwargs.pop('fields', None)
         super().__init__(*args, **kwargs)
         if custom_fields:
@@ -127,7 +141,10 @@ class UploadBaseSerializer(serializers.ModelSerializer):
     def validate_identifier(self, value):
         if not self.instance:
             reports_model = getattr(self, 'Meta').model
-            if reports_model.objects.filter(identifier=value, decision=self.decision).exists():
+            if self.batch is not None:
+                if self.batch.identifier_exists(reports_model, value):
+                    self.fail('identifier_not_unique')
+            elif reports_model.objects.filter(identifier=value, decision=self.decision).exists():
                 self.fail('identifier_not_unique')
         return value
 
@@ -164,7 +181,9 @@ class UploadBaseSerializer(serializers.ModelSerializer):
 
     def parent_attributes(self, parent, select_fields=None):
         if not select_fields:
-            select_fields = ['name', 'value', 'compare', 'associate', 'data_id']
+            select_fields = ATTR_FIELDS
+        if self.batch is not None:
+            return self.batch.parent_attributes(parent, select_fields)
         parents_ids = parent.get_ancestors(include_self=True).values_list('id', flat=True)
         return list(ReportAttr.objects.filter(report_id__in=parents_ids)
                     .order_by('report_id', 'id').values(*select_fields))
@@ -209,7 +228,11 @@ class UploadBaseSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         attrs = validated_data.pop('attrs', [])
         instance = super().create(validated_data)
-        ReportAttr.objects.bulk_create(list(ReportAttr(report=instance, **attrdata) for attrdata in attrs))
+        new_attrs = list(ReportAttr(report=instance, **attrdata) for attrdata in attrs)
+        if self.batch is not None:
+            self.batch.attrs.extend(new_attrs)
+        else:
+            ReportAttr.objects.bulk_create(new_attrs)
         return instance
 
     def update(self, instance, validated_data):
@@ -322,7 +345,10 @@ class UploadLeafBaseSerializer(UploadBaseSerializer):
             validated_data['memory'] = validated_data['parent'].memory
         instance = super().create(validated_data)
         cache_obj.report = instance
-        cache_obj.save()
+        if self.batch is not None:
+            self.batch.caches.append(cache_obj)
+        else:
+            cache_obj.save()
         return instance
 
 
@@ -362,82 +388,167 @@ class ReportUnsafeSerializer(UploadLeafBaseSerializer):
     def get_cache_object(self, decision):
         return ReportUnsafeCache(decision=decision)
 
-    def __check_node(self, node):
-        if not isinstance(node, dict):
-            self.fail('wrong_format', detail="node is not a dictionary")
-
-        if node.get('type') not in {'function call', 'statement', 'action', 'thread', 'declaration', 'declarations'}:
-            self.fail('wrong_format', detail='unsupported node type "{}"'.format(node.get('type')))
-        if node['type'] == 'function call':
-            required_fields = ['line', 'file', 'source', 'children', 'display']
-        elif node['type'] == 'statement':
-            required_fields = ['line', 'file', 'source']
-        elif node['type'] == 'declaration':
-            required_fields = ['line', 'file', 'source']
-        elif node['type'] == 'action':
-            required_fields = ['line', 'file', 'display']
-        elif node['type'] == 'declarations':
-            required_fields = ['children']
-        else:
-            required_fields = ['thread']
-        for field_name in required_fields:
-            if field_name not in node or node[field_name] is None:
-                self.fail('wrong_format', detail='node field "{}" is required'.format(field_name))
-        if node.get('notes'):
-            if not isinstance(node['notes'], list):
-                self.fail('wrong_format', detail='notes should be a list')
-            for note in node['notes']:
-                if not isinstance(note, dict):
-                    self.fail('wrong_format', detail='note should be a dict')
-                if 'text' not in note or not isinstance(note['text'], str) or not note['text']:
-                    self.fail('wrong_format', detail='note should have a text')
-                if 'level' not in note or not isinstance(note['level'], int) or note['level'] < 0:
-                    self.fail('wrong_format', detail='note should have an unsigned int level')
-        if node.get('children'):
-            for child in node['children']:
-                self.__check_node(child)
-                if node['type'] == 'declarations' and child['type'] != 'declaration':
-                    self.fail('wrong_format', detail='declarations child has type "{}"'.format(child['type']))
-
     def validate_error_trace(self, archive):
         try:
             with zipfile.ZipFile(archive, mode='r') as zfp:
-                error_trace = json.loads(zfp.read(ERROR_TRACE_FILE).decode('utf8'))
+                with zfp.open(ERROR_TRACE_FILE) as fp:
+                    self._trace_stats = ErrorTraceValidator(fp).statistics
+                    # Read the rest of the file to check its CRC
+                    while fp.read(CHUNK_SIZE):
+                        pass
+        except ErrorTraceError as e:
+            self.fail('wrong_format', detail=str(e))
         except Exception as e:
             logger.exception(e)
             self.fail('wrong_format', detail='file does not exist or it is wrong JSON')
         archive.seek(0)
-        if not isinstance(error_trace, dict):
-            self.fail('wrong_format', detail='error trace is not a dictionary')
-        if not isinstance(error_trace.get('files'), list):
-            self.fail('wrong_format', detail='error trace does not have files or it is not a list')
-        if 'trace' not in error_trace:
-            self.fail('wrong_format', detail='error trace does not have "trace"')
-        if error_trace['trace']:
-            self.__check_node(error_trace['trace'])
-            if error_trace['trace']['type'] != 'thread':
-                self.fail('wrong_format', detail='root error trace node type should be a "thread"')
         return archive
 
+    def validate(self, value):
+        value = super(ReportUnsafeSerializer, self).validate(value)
+        value['trace_stats'] = getattr(self, '_trace_stats', None)
+        return value
+
     class Meta:
         model = ReportUnsafe
         fields = ('parent', 'identifier', 'error_trace', 'attrs')
 
 
+class LeavesBatch:
+    """
+    Consecutive leaf reports uploaded in one transaction. Their parents, the parents ancestors and attributes are got
+    with a few IN queries beforehand, so serializers validate leaves without additional queries per report.
+    New attributes, caches and leaves cache are saved with bulk_create when all leaves are created.
+    """
+    models = {'safe': ReportSafe, 'unsafe': ReportUnsafe, 'unknown': ReportUnknown}
+
+    def __init__(self, decision, reports):
+        self.decision = decision
+        self.attrs = []
+        self.caches = []
+        self.leaves = []
+        self.new_leaves = []
+        # Created objects with files, they are removed if the batch fails
+        self.stored = []
+
+        # Leaves model -> set of used identifiers
+        self._identifiers = {}
+        # Parent identifier -> ReportComponent
+        self._parents = {}
+        # Report id -> ReportComponent (parents and all their ancestors)
+        self._nodes = {}
+        # Report id -> list of its attributes
+        self._attrs = {}
+
+        self.__load(reports)
+
+    def __load(self, reports):
+        identifiers = {}
+        parents = set()
+        for data in reports:
+            model_identifiers = identifiers.setdefault(self.models[data['type']], set())
+            if data.get('identifier') is not None:
+                model_identifiers.add(str(data['identifier']))
+            if isinstance(data.get('parent'), str):
+                parents.add(data['parent'])
+
+        for model, model_identifiers in identifiers.items():
+            self._identifiers[model] = set(model.objects.filter(
+                decision=self.decision, identifier__in=model_identifiers
+            ).values_list('identifier', flat=True))
+
+        for report in ReportComponent.objects.filter(decision=self.decision, identifier__in=parents):
+            self._parents[report.identifier] = report
+            self._nodes[report.id] = report
+
+        # Ancestors are got level by level, tree branches are rather short
+        missing = set(report.parent_id for report in self._nodes.values() if report.parent_id) - set(self._nodes)
+        while missing:
+            for report in ReportComponent.objects.filter(id__in=missing).only('id', 'parent', 'verification'):
+                self._nodes[report.id] = report
+            missing = set(report.parent_id for report in self._nodes.values() if report.parent_id) - set(self._nodes)
+
+        for attr in ReportAttr.objects.filter(report_id__in=list(self._nodes))\
+                .order_by('report_id', 'id').values('report_id', *ATTR_FIELDS):
+            self._attrs.setdefault(attr.pop('report_id'), []).append(attr)
+
+    def identifier_exists(self, model, identifier):
+        used_identifiers = self._identifiers.setdefault(model, set())
+        if identifier in used_identifiers:
+            return True
+        used_identifiers.add(identifier)
+        return False
+
+    def get_parent(self, identifier):
+        if not isinstance(identifier, str):
+            return None
+        return self._parents.get(identifier)
+
+    def ancestors(self, report_id):
+        """
+        Get report with all its ancestors.
+        :param report_id: ReportComponent id
+        :return: list of ReportComponent instances starting from the tree root
+        """
+        ancestors = []
+        while report_id is not None:
+            ancestors.append(self._nodes[report_id])
+            report_id = ancestors[-1].parent_id
+        return list(reversed(ancestors))
+
+    def parent_attributes(self, parent, select_fields):
+        # The same order as ReportAttr.objects.filter(report_id__in=parents_ids).order_by('report_id', 'id')
+        parents_ids = sorted(report.id for report in self.ancestors(parent.id))
+        return list(
+            dict((field, attr[field]) for field in select_fields)
+            for report_id in parents_ids for attr in self._attrs.get(report_id, [])
+        )
+
+    def save(self):
+        ReportAttr.objects.bulk_create(self.attrs)
+        for cache_model in (ReportSafeCache, ReportUnsafeCache, ReportUnknownCache):
+            cache_objects = list(cache_obj for cache_obj in self.caches if isinstance(cache_obj, cache_model))
+            if cache_objects:
+                cache_model.objects.bulk_create(cache_objects)
+        ReportComponentLeaf.objects.bulk_create(self.leaves)
+
+    def remove_files(self):
+        for instance in self.stored:
+            remove_instance_files(instance=instance)
+        self.stored.clear()
+
+
+# Maximum number of seconds new leaves can wait to be connected with marks
+CONNECT_BATCH_TIME = 10
+
+# Maximum number of consecutive leaf reports uploaded in one transaction
+UPLOAD_BATCH_SIZE = 500
+
+
 class UploadReports:
     def __init__(self, decision):
         self.decision = decision
         self.archives = {}
         self._logger = ReportsLogging(self.decision.id)
 
-    def validate_archives(self, archives_list, archives):
+        # New leaves to be connected with marks in batches
+        self._new_leaves = {'safe': [], 'unsafe': [], 'unknown': []}
+        self._leaves_time = time.time()
+
+    def validate_archives(self, archives_list, archives, reports=()):
+        # CRC of error traces is checked when they are validated, so they are not read twice
+        error_traces = set(
+            report.get('error_trace') for report in reports
+            if isinstance(report, dict) and report.get('type') == 'unsafe'
+        )
         for arch_name in archives_list:
             if arch_name not in archives:
                 raise exceptions.ValidationError(detail={
                     'archive': 'Archive "{}" was not attached'.format(arch_name)
                 })
             arch = archives[arch_name]
-            if not zipfile.is_zipfile(arch) or zipfile.ZipFile(arch).testzip():
+            if not zipfile.is_zipfile(arch) or \
+                    arch_name not in error_traces and zipfile.ZipFile(arch).testzip():
                 raise exceptions.ValidationError(detail={
                     'archive': 'The archive "{}" is not a ZIP file'.format(arch_name)
                 })
@@ -446,14 +557,88 @@ class UploadReports:
 
     def upload_all(self, reports):
         # Check that all archives are valid ZIP files
+        try:
+            for reports_group in self.__group_leaves(reports):
+                if len(reports_group) > 1 and self.__upload_leaves(reports_group):
+                    continue
+                # Upload reports one by one if the bulk upload of leaves failed to get the proper error
+                for report in reports_group:
+                    try:
+                        self.__upload(report)
+                    except Exception as e:
+                        if str(e).__contains__('report_decision_id_identifier'):
+                            logger.error('UniqueError')
+                            logger.exception(e)
+                        self.__process_exception(e)
+        finally:
+            # Leaves uploaded before an error should be connected with marks too
+            self.__connect_leaves(force=True)
+
+    def __group_leaves(self, reports):
+        # Join consecutive leaf reports into groups, other reports are uploaded separately
+        leaves = []
         for report in reports:
-            try:
-                self.__upload(report)
-            except Exception as e:
-                if str(e).__contains__('report_decision_id_identifier'):
-                    logger.error('UniqueError')
-                    logger.exception(e)
-                self.__process_exception(e)
+            if isinstance(report, dict) and report.get('type') in LeavesBatch.models:
+                leaves.append(report)
+                if len(leaves) == UPLOAD_BATCH_SIZE:
+                    yield leaves
+                    leaves = []
+                continue
+            if leaves:
+                yield leaves
+                leaves = []
+            yield [report]
+        if leaves:
+            yield leaves
+
+    def __upload_leaves(self, reports):
+        leaf_actions = {
+            'unsafe': self.__create_report_unsafe,
+            'safe': self.__create_report_safe,
+            'unknown': self.__create_report_unknown
+        }
+        batch = None
+        try:
+            batch = LeavesBatch(self.decision, reports)
+            with transaction.atomic():
+                for data in reports:
+                    # Original data is required if reports are uploaded one by one later
+                    leaf_actions[data['type']](dict(data), batch=batch)
+                batch.save()
+        except Exception as e:
+            logger.exception("Uploading %s leaf reports in one transaction failed, upload them one by one: %s",
+                             len(reports), e)
+            self._logger.log("B0", len(reports), e)
+            # The transaction is rolled back, but files of created objects were already stored
+            if batch is not None:
+                batch.remove_files()
+            return False
+
+        # Connect reports with marks only after they were commited
+        for leaf_type, report_id in batch.new_leaves:
+            self.__add_leaf(leaf_type, report_id)
+        return True
+
+    def __connect_leaves(self, force=False):
+        if not force and time.time() - self._leaves_time < CONNECT_BATCH_TIME and \
+                all(len(reports_ids) < CONNECT_BATCH_SIZE for reports_ids in self._new_leaves.values()):
+            return
+        connect_tasks = {
+            'safe': connect_safe_reports,
+            'unsafe': connect_unsafe_reports,
+            'unknown': connect_unknown_reports
+        }
+        for leaf_type, reports_ids in self._new_leaves.items():
+            if reports_ids:
+                connect_tasks[leaf_type].delay(reports_ids[:])
+                if leaf_type == 'unsafe':
+                    build_error_trace_indexes.delay(reports_ids[:])
+                reports_ids.clear()
+        self._leaves_time = time.time()
+
+    def __add_leaf(self, leaf_type, report_id):
+        self._new_leaves[leaf_type].append(report_id)
+        self.__connect_leaves()
 
     def __process_exception(self, exc):
         if isinstance(exc, exceptions.ValidationError):
@@ -541,13 +726,31 @@ class UploadReports:
         except ReportComponent.DoesNotExist:
             raise exceptions.ValidationError(detail={'identifier': "The report wasn't found"})
 
-    def __ancestors_for_cache(self, report):
+    def __ancestors_for_cache(self, report, batch=None):
+        if batch is not None:
+            ancestors = batch.ancestors(report.parent_id)
+            if self.decision.is_lightweight:
+                ancestors = list(parent for parent in ancestors if parent.parent_id is None or parent.verification)
+            return list(parent.pk for parent in ancestors)
+
         ancestors_qs = report.get_ancestors()
         if self.decision.is_lightweight:
             # Update cache just for Core and verification reports as other reports will be deleted
             ancestors_qs = ancestors_qs.filter(Q(parent=None) | Q(reportcomponent__verification=True))
         return list(parent.pk for parent in ancestors_qs)
 
+    def __cache_leaf(self, leaf_type, report, ancestors_ids, batch=None):
+        # Caching leaves for each tree branch node
+        leaves = list(ReportComponentLeaf(report_id=parent_id, content_object=report) for parent_id in ancestors_ids)
+        if batch is not None:
+            batch.leaves.extend(leaves)
+            batch.new_leaves.append((leaf_type, report.id))
+            return
+        ReportComponentLeaf.objects.bulk_create(leaves)
+
+        # Connect report with marks
+        self.__add_leaf(leaf_type, report.id)
+
     def __create_report_component(self, data):
         self._logger.log("S0", data.get("identifier"))
         data['attr_data'] = self.__upload_attrs_files(self.__get_archive(data.get('attr_data')))
@@ -732,18 +935,20 @@ class UploadReports:
         self.__update_decision_cache(report.component, finished=True)
         self._logger.log("FV5", report.pk, report.parent_id)
 
-    def __create_report_unknown(self, data):
+    def __create_report_unknown(self, data, batch=None):
         self._logger.log("UN0", data.get('parent'))
 
         data['problem_description'] = self.__get_archive(data['problem_description'])
-        data['attr_data'] = self.__upload_attrs_files(self.__get_archive(data.get('attr_data')))
-        serializer = ReportUnknownSerializer(data=data, decision=self.decision)
+        data['attr_data'] = self.__upload_attrs_files(self.__get_archive(data.get('attr_data')), batch=batch)
+        serializer = ReportUnknownSerializer(data=data, decision=self.decision, batch=batch)
         serializer.is_valid(raise_exception=True)
         report = serializer.save()
+        if batch is not None:
+            batch.stored.append(report)
         self._logger.log("UN1", report.pk, report.parent_id)
 
         # Get ancestors before parent might me changed
-        ancestors_ids = self.__ancestors_for_cache(report)
+        ancestors_ids = self.__ancestors_for_cache(report, batch=batch)
 
         if self.decision.is_lightweight and not report.parent.verification:
             # Change parent to Core
@@ -751,57 +956,36 @@ class UploadReports:
             report.save()
             self._logger.log("UN2", report.pk, report.parent_id)
 
-        # Caching leaves for each tree branch node
-        ReportComponentLeaf.objects.bulk_create(list(
-            ReportComponentLeaf(report_id=parent_id, content_object=report) for parent_id in ancestors_ids
-        ))
-
-        # Connect report with marks
-        connect_unknown_report.delay(report.id)
-
+        self.__cache_leaf('unknown', report, ancestors_ids, batch=batch)
         self._logger.log("UN3", report.pk)
 
-    def __create_report_safe(self, data):
+    def __create_report_safe(self, data, batch=None):
         self._logger.log("SF0", data.get('parent'))
 
-        data['attr_data'] = self.__upload_attrs_files(self.__get_archive(data.get('attr_data')))
-        serializer = ReportSafeSerializer(data=data, decision=self.decision)
+        data['attr_data'] = self.__upload_attrs_files(self.__get_archive(data.get('attr_data')), batch=batch)
+        serializer = ReportSafeSerializer(data=data, decision=self.decision, batch=batch)
         serializer.is_valid(raise_exception=True)
         report = serializer.save()
 
         self._logger.log("SF1", report.pk, report.parent_id)
 
-        # Caching leaves for each tree branch node
-        ReportComponentLeaf.objects.bulk_create(list(
-            ReportComponentLeaf(report_id=parent_id, content_object=report)
-            for parent_id in self.__ancestors_for_cache(report)
-        ))
-
-        # Connect report with marks
-        connect_safe_report.delay(report.id)
-
+        self.__cache_leaf('safe', report, self.__ancestors_for_cache(report, batch=batch), batch=batch)
         self._logger.log("SF2", report.pk)
 
-    def __create_report_unsafe(self, data):
+    def __create_report_unsafe(self, data, batch=None):
         self._logger.log("UF0", data.get('parent'))
 
         data['error_trace'] = self.__get_archive(data.get('error_trace'))
-        data['attr_data'] = self.__upload_attrs_files(self.__get_archive(data.get('attr_data')))
-        serializer = ReportUnsafeSerializer(data=data, decision=self.decision)
+        data['attr_data'] = self.__upload_attrs_files(self.__get_archive(data.get('attr_data')), batch=batch)
+        serializer = ReportUnsafeSerializer(data=data, decision=self.decision, batch=batch)
         serializer.is_valid(raise_exception=True)
         report = serializer.save()
+        if batch is not None:
+            batch.stored.append(report)
 
         self._logger.log("UF1", report.pk, report.parent_id)
 
-        # Caching leaves for each tree branch node
-        ReportComponentLeaf.objects.bulk_create(list(
-            ReportComponentLeaf(report_id=parent_id, content_object=report)
-            for parent_id in self.__ancestors_for_cache(report)
-        ))
-
-        # Connect new unsafe with marks
-        connect_unsafe_report.delay(report.id)
-
+        self.__cache_leaf('unsafe', report, self.__ancestors_for_cache(report, batch=batch), batch=batch)
         self._logger.log("UF2", report.pk)
 
     def __upload_additional_sources(self, arch_name):
@@ -841,7 +1025,7 @@ class UploadReports:
             cache_obj.finished += 1
         cache_obj.save()
 
-    def __upload_attrs_files(self, archive):
+    def __upload_attrs_files(self, archive, batch=None):
         if not archive:
             return {}
         try:
@@ -857,6 +1041,8 @@ class UploadReports:
                 newfile = AttrFile(decision=self.decision)
                 with open(full_path, mode='rb') as fp:
                     newfile.file.save(os.path.basename(rel_path), File(fp), save=True)
+                if batch is not None:
+                    batch.stored.append(newfile)
                 db_files[rel_path] = newfile.pk
         return db_files
 
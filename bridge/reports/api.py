@@ -38,12 +38,14 @@ from tools.profiling import LoggedCallMixin
 
 from jobs.models import Decision
 from reports.models import (
-    Report, ReportComponent, OriginalSources, CoverageArchive, ReportAttr, CompareDecisionsInfo, ReportImage
+    Report, ReportComponent, ReportUnsafe, OriginalSources, CoverageArchive, ReportAttr, CompareDecisionsInfo,
+    ReportImage
 )
 
 from jobs.utils import JobAccess, DecisionAccess
 from reports.comparison import FillComparisonCache, ComparisonData
 from reports.coverage import GetCoverageData, ReportCoverageStatistics
+from reports.etv import UnsafeETV, ErrorTraceWindowError
 from reports.serializers import OriginalSourcesSerializer, PatchReportAttrSerializer, ReportImageSerializer
 from reports.source import GetSource
 from reports.UploadReport import UploadReports
@@ -113,9 +115,10 @@ class UploadReportView(LoggedCallMixin, APIView):
             raise exceptions.APIException('Reports can be uploaded only for processing decisions')
 
         reports_uploader = UploadReports(decision)
+        reports = json.loads(request.POST['reports'])
         if 'archives' in request.POST:
-            reports_uploader.validate_archives(json.loads(request.POST['archives']), request.FILES)
-        reports_uploader.upload_all(json.loads(request.POST['reports']))
+            reports_uploader.validate_archives(json.loads(request.POST['archives']), request.FILES, reports)
+        reports_uploader.upload_all(reports)
         return Response({})
 
 
@@ -130,6 +133,25 @@ class GetSourceCodeView(LoggedCallMixin, APIView):
         return HttpResponse(source_collector.get_html())
 
 
+class ErrorTraceWindowView(LoggedCallMixin, APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, unsafe_id):
+        report = get_object_or_404(ReportUnsafe.objects.select_related('decision__job'), id=unsafe_id)
+        if not JobAccess(self.request.user, report.decision.job).can_view:
+            raise exceptions.PermissionDenied(_("You don't have an access to the job"))
+        try:
+            window = int(self.request.query_params.get('window', 0))
+        except ValueError:
+            raise exceptions.ValidationError({'window': 'Error trace window should be an integer'})
+        try:
+            etv = UnsafeETV(report, self.request.user, window=window)
+        except ErrorTraceWindowError as e:
+            raise exceptions.ValidationError({'window': str(e)})
+        template = loader.get_template('reports/ErrorTraceRows.html')
+        return HttpResponse(template.render({'etv': etv}, request))
+
+
 class ClearVerificationFilesView(LoggedCallMixin, DestroyAPIView):
     unparallel = [Report]
     permission_classes = (IsAuthenticated,)
@@ -17,18 +17,20 @@
 
 import re
 import json
-from collections import OrderedDict
+import hashlib
+from collections import Counter, OrderedDict
 
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Count
+from django.db.models import Count, Max
 from django.urls import reverse
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
-from bridge.vars import COMPARE_VERDICT, DECISION_WEIGHT
+from bridge.vars import COMPARE_VERDICT, DECISION_WEIGHT, DECISION_STATUS
 from bridge.utils import BridgeException
 
 from reports.models import (
-    ReportAttr, CompareDecisionsInfo, ComparisonObject, ComparisonLink,
+    ReportAttr, CompareDecisionsInfo, ComparisonObject, ComparisonLink, LeafSignature,
     ReportSafe, ReportUnsafe, ReportUnknown, ReportComponent
 )
 from marks.models import MarkUnsafeReport, MarkSafeReport, MarkUnknownReport
@@ -36,6 +38,69 @@ from marks.models import MarkUnsafeReport, MarkSafeReport, MarkUnknownReport
 from reports.verdicts import safe_color, unsafe_color
 
 
+# Number of comparison objects created at once
+COMPARISON_BATCH_SIZE = 1000
+
+# Leaf signatures of decisions with these statuses are not changed anymore
+FINISHED_DECISION_STATUSES = {
+    DECISION_STATUS[3][0], DECISION_STATUS[4][0], DECISION_STATUS[5][0], DECISION_STATUS[7][0], DECISION_STATUS[8][0]
+}
+
+
+def leaf_signature(values):
+    """
+    Get signed 64-bit hash of attributes values.
+    :param values: list of attributes values
+    :return: int
+    """
+    return int.from_bytes(hashlib.md5(json.dumps(list(values)).encode('utf8')).digest()[:8], 'big', signed=True)
+
+
+def comparison_verdict(reports):
+    if len(reports) == 1:
+        if reports[0]['type'] == 'safe':
+            return COMPARE_VERDICT[0][0]
+        elif reports[0]['type'] == 'unknown':
+            return COMPARE_VERDICT[3][0]
+        return COMPARE_VERDICT[1][0]
+    has_unknown = False
+    for rep in reports:
+        if rep['type'] == 'safe':
+            return COMPARE_VERDICT[5][0]
+        elif rep['type'] == 'unknown':
+            if has_unknown:
+                return COMPARE_VERDICT[5][0]
+            has_unknown = True
+    return COMPARE_VERDICT[2][0] if has_unknown else COMPARE_VERDICT[1][0]
+
+
+def merge_signatures(signatures1, signatures2):
+    """
+    Join two streams of leaf signatures ordered by signature.
+    :param signatures1: iterator over LeafSignature objects of the first decision
+    :param signatures2: iterator over LeafSignature objects of the second decision
+    :return: generator of pairs of matched signatures, one of them is None for unmatched ones
+    """
+    sign1 = next(signatures1, None)
+    sign2 = next(signatures2, None)
+    while sign1 is not None or sign2 is not None:
+        if sign2 is None or sign1 is not None and sign1.signature < sign2.signature:
+            yield sign1, None
+            sign1 = next(signatures1, None)
+        elif sign1 is None or sign2.signature < sign1.signature:
+            yield None, sign2
+            sign2 = next(signatures2, None)
+        else:
+            if sign1.values == sign2.values:
+                yield sign1, sign2
+            else:
+                # Hash collision
+                yield sign1, None
+                yield None, sign2
+            sign1 = next(signatures1, None)
+            sign2 = next(signatures2, None)
+
+
 class GetComparisonObjects:
     def __init__(self, decision, names):
         self._decision = decision
@@ -43,14 +108,15 @@ class GetComparisonObjects:
 
     def __fill_leaf_objects(self, data, leaf_type):
         qs = ReportAttr.objects.filter(report__decision=self._decision, compare=True)\
-            .exclude(**{'report__report{}'.format(leaf_type): None})
-        for attr in qs:
-            if attr.report_id not in data:
-                data[attr.report_id] = {
+            .exclude(**{'report__report{}'.format(leaf_type): None})\
+            .values_list('report_id', 'name', 'value')
+        for report_id, name, value in qs.iterator():
+            if report_id not in data:
+                data[report_id] = {
                     'type': leaf_type,
                     'values': OrderedDict(list((attr_name, '-') for attr_name in self._names))
                 }
-            data[attr.report_id]['values'][attr.name] = attr.value
+            data[report_id]['values'][name] = value
 
     def get_leaf_values(self):
         data = {}
@@ -66,22 +132,65 @@ class GetComparisonObjects:
         return attr_data
 
 
+class LeafSignatures:
+    """
+    Leaves of the decision grouped by values of attributes to compare. Signatures of finished decisions are
+    calculated once and then are used for all comparisons with them.
+    """
+
+    def __init__(self, decision, names=None):
+        self._decision = decision
+        self._names = names
+
+    @property
+    def names(self):
+        if self._names is None:
+            self._names = list(sorted(set(
+                ReportAttr.objects.filter(report__decision=self._decision, compare=True)
+                .values_list('name', flat=True)
+            )))
+        return self._names
+
+    def __calculate(self):
+        data = GetComparisonObjects(self._decision, self.names).get_leaf_values()
+        return list(sorted((LeafSignature(
+            decision=self._decision, signature=leaf_signature(values_tuple), values=list(values_tuple),
+            verdict=comparison_verdict(data[values_tuple]), leaves=data[values_tuple]
+        ) for values_tuple in data), key=lambda x: x.signature))
+
+    def fill(self):
+        if self._decision.status not in FINISHED_DECISION_STATUSES:
+            return
+        if LeafSignature.objects.filter(decision=self._decision).exists():
+            return
+        # Signatures can be calculated concurrently with the same result
+        LeafSignature.objects.bulk_create(
+            self.__calculate(), batch_size=COMPARISON_BATCH_SIZE, ignore_conflicts=True
+        )
+
+    def __iter__(self):
+        if self._decision.status not in FINISHED_DECISION_STATUSES:
+            # Leaves of unfinished decisions can be changed
+            return iter(self.__calculate())
+        self.fill()
+        return LeafSignature.objects.filter(decision=self._decision).order_by('signature')\
+            .only('signature', 'values', 'verdict', 'leaves').iterator(chunk_size=COMPARISON_BATCH_SIZE)
+
+
 class FillComparisonCache:
     def __init__(self, user, decision1, decision2):
         self._decision1 = decision1
         self._decision2 = decision2
+        self._signatures1 = LeafSignatures(self._decision1)
+        self._signatures2 = LeafSignatures(self._decision2)
         self._names = self.__get_attr_names()
         self.info = self.__create_info(user)
         self.__fill_data()
 
     def __get_attr_names(self):
-        names1 = set(ReportAttr.objects.filter(report__decision=self._decision1, compare=True)
-                     .values_list('name', flat=True))
-        names2 = set(ReportAttr.objects.filter(report__decision=self._decision2, compare=True)
-                     .values_list('name', flat=True))
-        if names1 != names2:
+        if self._signatures1.names != self._signatures2.names:
             raise BridgeException(_("Jobs with different sets of attributes to compare can't be compared"))
-        return list(sorted(names1))
+        return self._signatures1.names
 
     def __create_info(self, user):
         return CompareDecisionsInfo.objects.create(
@@ -89,69 +198,38 @@ class FillComparisonCache:
         )
 
     def __fill_data(self):
-        ct_map = {
+        numbers = Counter()
+        batch = []
+        for sign1, sign2 in merge_signatures(iter(self._signatures1), iter(self._signatures2)):
+            verdicts = (
+                sign1.verdict if sign1 else COMPARE_VERDICT[4][0],
+                sign2.verdict if sign2 else COMPARE_VERDICT[4][0]
+            )
+            numbers[verdicts] += 1
+            batch.append((ComparisonObject(
+                info=self.info, values=(sign1 or sign2).values,
+                verdict1=verdicts[0], verdict2=verdicts[1], number=numbers[verdicts]
+            ), (sign1.leaves if sign1 else []) + (sign2.leaves if sign2 else [])))
+            if len(batch) >= COMPARISON_BATCH_SIZE:
+                self.__create_objects(batch)
+                batch = []
+        self.__create_objects(batch)
+
+    @cached_property
+    def _content_types(self):
+        return {
             'safe': ContentType.objects.get_for_model(ReportSafe),
             'unsafe': ContentType.objects.get_for_model(ReportUnsafe),
             'unknown': ContentType.objects.get_for_model(ReportUnknown),
         }
-        data1 = GetComparisonObjects(self._decision1, self._names).get_leaf_values()
-        data2 = GetComparisonObjects(self._decision2, self._names).get_leaf_values()
-
-        # Calculate total verdicts for each batch of attributes values
-        verdicts_data = {}
-        for values_tuple in data1:
-            verdicts_data[values_tuple] = {
-                'verdict1': self.__calc_verdict(data1[values_tuple]),
-                'verdict2': COMPARE_VERDICT[4][0]
-            }
-        for values_tuple in data2:
-            verdict2 = self.__calc_verdict(data2[values_tuple])
-            if values_tuple in verdicts_data:
-                verdicts_data[values_tuple]['verdict2'] = verdict2
-            else:
-                verdicts_data[values_tuple] = {'verdict1': COMPARE_VERDICT[4][0], 'verdict2': verdict2}
-
-        # Create new comparison objects
-        res = ComparisonObject.objects.bulk_create(list(ComparisonObject(
-            info=self.info, values=list(values_tuple),
-            verdict1=verdicts_data[values_tuple]['verdict1'],
-            verdict2=verdicts_data[values_tuple]['verdict2']
-        ) for values_tuple in sorted(verdicts_data)))
-        for new_obj in res:
-            verdicts_data[tuple(new_obj.values)]['pk'] = new_obj.pk
-
-        # Create new comparison links
-        new_links = []
-        for values_tuple in data1:
-            for report in data1[values_tuple]:
-                new_links.append(ComparisonLink(
-                    object_id=report['id'], content_type=ct_map[report['type']],
-                    comparison_id=verdicts_data[values_tuple]['pk']
-                ))
-        for values_tuple in data2:
-            for report in data2[values_tuple]:
-                new_links.append(ComparisonLink(
-                    object_id=report['id'], content_type=ct_map[report['type']],
-                    comparison_id=verdicts_data[values_tuple]['pk']
-                ))
-        ComparisonLink.objects.bulk_create(new_links)
-
-    def __calc_verdict(self, reports):
-        if len(reports) == 1:
-            if reports[0]['type'] == 'safe':
-                return COMPARE_VERDICT[0][0]
-            elif reports[0]['type'] == 'unknown':
-                return COMPARE_VERDICT[3][0]
-            return COMPARE_VERDICT[1][0]
-        has_unknown = False
-        for rep in reports:
-            if rep['type'] == 'safe':
-                return COMPARE_VERDICT[5][0]
-            elif rep['type'] == 'unknown':
-                if has_unknown:
-                    return COMPARE_VERDICT[5][0]
-                has_unknown = True
-        return COMPARE_VERDICT[2][0] if has_unknown else COMPARE_VERDICT[1][0]
+
+    def __create_objects(self, batch):
+        if not batch:
+            return
+        ComparisonObject.objects.bulk_create(list(cmp_obj for cmp_obj, _leaves in batch))
+        ComparisonLink.objects.bulk_create(list(ComparisonLink(
+            object_id=report['id'], content_type=self._content_types[report['type']], comparison_id=cmp_obj.pk
+        ) for cmp_obj, leaves in batch for report in leaves))
 
 
 class ComparisonTableData:
@@ -238,26 +316,33 @@ class ComparisonData:
         return v1, v2
 
     def __paginate(self, verdict=None, search_attrs=None):
-        # Filter queryset
+        # Filter queryset and get needed page
         qs_filters = {'info': self.info}
         if search_attrs:
             search_attr_values = json.loads(search_attrs)
             for i in range(len(self.info.names)):
                 if search_attr_values[i] != '__ANY__':
                     qs_filters['values__{}'.format(i)] = search_attr_values[i]
+            queryset = ComparisonObject.objects.filter(**qs_filters).order_by('id')
+            self.pages['total'] = queryset.count()
+            comparison = None
+            if 0 < self.pages['page'] <= self.pages['total']:
+                comparison = queryset[self.pages['page'] - 1]
         elif verdict is not None:
             qs_filters['verdict1'], qs_filters['verdict2'] = self.__get_verdicts(verdict)
+            # Comparison objects are numbered within each pair of verdicts, so just the needed one is read
+            queryset = ComparisonObject.objects.filter(**qs_filters)
+            self.pages['total'] = queryset.aggregate(total=Max('number'))['total'] or 0
+            comparison = queryset.filter(number=self.pages['page']).first()
         else:
             raise BridgeException()
-        queryset = ComparisonObject.objects.filter(**qs_filters).order_by('id')
 
-        # Get needed page and pages info
-        self.pages['total'] = queryset.count()
-        if self.pages['total'] < self.pages['page']:
+        # Get pages info
+        if comparison is None:
             raise BridgeException(_('Required reports were not found'))
         self.pages['backward'] = (self.pages['page'] > 1)
         self.pages['forward'] = (self.pages['page'] < self.pages['total'])
-        return queryset[self.pages['page'] - 1]
+        return comparison
 
     def __get_trees(self):
         tree1 = ComparisonTree()
@@ -17,6 +17,7 @@
 
 import re
 import json
+import zipfile
 from urllib.parse import unquote
 from wsgiref.util import FileWrapper
 
@@ -26,12 +27,42 @@ from django.utils.translation import gettext_lazy as _
 
 from bridge.vars import ETV_FORMAT, COVERAGE_FILE
 from bridge.utils import ArchiveFileContent, BridgeException, construct_url
+from bridge.json_stream import json_events, json_value, skip_json_value
 
 from reports.models import CoverageArchive, CoverageStatistics, CoverageDataStatistics
 
 ROOT_DIRS_ORDER = ['source files', 'specifications', 'generated models']
 
 
+def parse_coverage_file(fp, tree):
+    """
+    Parse common coverage file without loading it into memory. Files from "coverage statistics" are added to the tree,
+    values of "format" and "data statistics" are returned.
+    :param fp: binary file object with coverage JSON
+    :param tree: CoverageStatisticsTree instance
+    :return: dictionary with "format", "data statistics" and "coverage statistics" (set to True) if they are found
+    """
+    data = {}
+    events = json_events(fp)
+    if next(events)[0] != 'start_map':
+        raise ValueError('Coverage is not a dictionary')
+    for event, key in events:
+        if event == 'end_map':
+            break
+        event, value = next(events)
+        if key == 'coverage statistics' and event == 'start_map':
+            data[key] = True
+            for event, fname in events:
+                if event == 'end_map':
+                    break
+                tree.add_file(fname, json_value(events, *next(events)))
+        elif key in {'format', 'data statistics'}:
+            data[key] = json_value(events, event, value)
+        else:
+            skip_json_value(events, event)
+    return data
+
+
 def coverage_data_statistic(coverage):
     statistics = []
     active = True
@@ -220,87 +251,91 @@ class VerificationCoverageStatistics(CoverageStatisticsBase):
         return construct_url('reports:api-coverage-table', self._report.id)
 
 
-class FillCoverageStatistics:
+class CoverageStatisticsTree:
     file_sep = '/'
 
-    def __init__(self, coverage_obj):
+    def __init__(self, coverage_id):
         self.has_extra = False
+        self._coverage_id = coverage_id
+        self._cnt = 0
+        # Path tuple -> CoverageStatistics
+        self._objects = {}
+        # Parent identifier -> list of children
+        self._children = {}
+
+    def add_file(self, fname, cov_data):
+        if len(cov_data) == 4:
+            cov_lines, tot_lines, cov_funcs, tot_func = cov_data
+        else:
+            cov_lines = cov_funcs = None
+            tot_lines, tot_func = cov_data
+
+        path_l = tuple(fname.split(self.file_sep))
+        for i in range(len(path_l)):
+            curr_path = path_l[:(i + 1)]
+            if curr_path not in self._objects:
+                self._cnt += 1
+                parent_id = self._objects[path_l[:i]].identifier if i > 0 else None
+                self._objects[curr_path] = CoverageStatistics(
+                    coverage_id=self._coverage_id, identifier=self._cnt, parent=parent_id,
+                    is_leaf=bool(i + 1 == len(path_l)),
+                    name=path_l[i],
+                    path='/'.join(curr_path),
+                    depth=len(curr_path)
+                )
+                self._children.setdefault(parent_id, []).append(self._objects[curr_path])
+            if cov_lines is not None and cov_funcs is not None:
+                self._objects[curr_path].lines_covered += cov_lines
+                self._objects[curr_path].lines_total += tot_lines
+                self._objects[curr_path].funcs_covered += cov_funcs
+                self._objects[curr_path].funcs_total += tot_func
+                self._objects[curr_path].lines_covered_extra += cov_lines
+                self._objects[curr_path].funcs_covered_extra += cov_funcs
+            else:
+                self.has_extra = True
+            self._objects[curr_path].lines_total_extra += tot_lines
+            self._objects[curr_path].funcs_total_extra += tot_func
+
+    def ordered_objects(self):
+        # Root directories in the fixed order, then directories and files of each directory by names
+        ordered_objects = []
+        stack = list(reversed(list(
+            self._objects[(root_name,)] for root_name in ROOT_DIRS_ORDER if (root_name,) in self._objects
+        )))
+        while stack:
+            covstat_obj = stack.pop()
+            ordered_objects.append(covstat_obj)
+            if not covstat_obj.is_leaf:
+                children = sorted(self._children.get(covstat_obj.identifier, []), key=lambda x: (x.is_leaf, x.name))
+                stack.extend(reversed(children))
+        return ordered_objects
+
+
+class FillCoverageStatistics:
+    def __init__(self, coverage_obj):
         self.coverage_obj = coverage_obj
-        self._statistics, self._data_stat = self.__get_statistics()
+        self._tree = CoverageStatisticsTree(self.coverage_obj.id)
+        self._data_stat = self.__get_statistics()
+        self.has_extra = self._tree.has_extra
         self.__save_statistics()
         self.__save_data_statistics()
 
     def __get_statistics(self):
         try:
-            res = ArchiveFileContent(self.coverage_obj, 'archive', COVERAGE_FILE)
+            with zipfile.ZipFile(self.coverage_obj.archive.path, mode='r') as zfp:
+                with zfp.open(COVERAGE_FILE) as fp:
+                    data = parse_coverage_file(fp, self._tree)
         except Exception as e:
             raise BridgeException(_("Error while extracting source file: %(error)s") % {'error': str(e)})
-        data = json.loads(res.content.decode('utf8'))
         if data.get('format') != ETV_FORMAT:
             raise BridgeException(_('Code coverage format is not supported'))
         if 'coverage statistics' not in data:
             raise BridgeException(_('Common code coverage file does not contain statistics'))
-        return data['coverage statistics'], data['data statistics']
+        return data['data statistics']
 
     def __save_statistics(self):
         CoverageStatistics.objects.filter(coverage=self.coverage_obj).delete()
-
-        cnt = 0
-        new_objects = {}
-        for fname in self._statistics:
-            cov_data = self._statistics[fname]
-            if len(cov_data) == 4:
-                cov_lines, tot_lines, cov_funcs, tot_func = cov_data
-            else:
-                cov_lines = cov_funcs = None
-                tot_lines, tot_func = cov_data
-
-            path_l = tuple(fname.split(self.file_sep))
-            for i in range(len(path_l)):
-                curr_path = path_l[:(i + 1)]
-                if curr_path not in new_objects:
-                    cnt += 1
-                    parent_id = new_objects[path_l[:i]].identifier if i > 0 else None
-                    new_objects[curr_path] = CoverageStatistics(
-                        coverage_id=self.coverage_obj.id, identifier=cnt, parent=parent_id,
-                        is_leaf=bool(i + 1 == len(path_l)),
-                        name=path_l[i],
-                        path='/'.join(curr_path),
-                        depth=len(curr_path)
-                    )
-                if cov_lines is not None and cov_funcs is not None:
-                    new_objects[curr_path].lines_covered += cov_lines
-                    new_objects[curr_path].lines_total += tot_lines
-                    new_objects[curr_path].funcs_covered += cov_funcs
-                    new_objects[curr_path].funcs_total += tot_func
-                    new_objects[curr_path].lines_covered_extra += cov_lines
-                    new_objects[curr_path].funcs_covered_extra += cov_funcs
-                else:
-                    self.has_extra = True
-                new_objects[curr_path].lines_total_extra += tot_lines
-                new_objects[curr_path].funcs_total_extra += tot_func
-
-        ordered_objects_list = list(sorted(new_objects.values(), key=lambda x: (x.is_leaf, x.name)))
-
-        def __get_all_children(covstat_obj):
-            children = []
-            if covstat_obj.is_leaf:
-                return children
-            for obj in ordered_objects_list:
-                if obj.parent == covstat_obj.identifier:
-                    children.append(obj)
-                    children.extend(__get_all_children(obj))
-            return children
-
-        ordered_objects = []
-        for root_name in ROOT_DIRS_ORDER:
-            root_path = (root_name,)
-            if root_path not in new_objects:
-                continue
-            ordered_objects.append(new_objects[root_path])
-            ordered_objects.extend(__get_all_children(new_objects[root_path]))
-
-        CoverageStatistics.objects.bulk_create(ordered_objects)
+        CoverageStatistics.objects.bulk_create(self._tree.ordered_objects())
 
     def __save_data_statistics(self):
         CoverageDataStatistics.objects.filter(coverage=self.coverage_obj).delete()
@@ -15,41 +15,79 @@
 # limitations under the License.
 #
 
+import io
 import json
 
+from django.conf import settings
+from django.core.files import File
 from django.utils.functional import cached_property
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
+from bridge.vars import ERROR_TRACE_FILE
+from bridge.utils import ArchiveFileContent
+
+from reports.models import ErrorTraceIndexCache
 from reports.source import SourceLine
 
+# Number of error trace rows that are rendered at once
+ETV_WINDOW_SIZE = 2000
+
+
+def etv_settings(user=None):
+    # User settings that affect the error trace visualization, default ones are used without the user
+    if user is None:
+        return {
+            'notes_level': settings.DEF_USER['notes_level'],
+            'declarations_number': settings.DEF_USER['declarations_number'],
+            'triangles': bool(settings.DEF_USER['triangles']), 'assumptions': bool(settings.DEF_USER['assumptions'])
+        }
+    return {
+        'notes_level': user.notes_level, 'declarations_number': user.declarations_number,
+        'triangles': bool(user.triangles), 'assumptions': bool(user.assumptions)
+    }
+
+
+def etv_settings_key(etv_settings_data):
+    return '{notes_level}_{declarations_number}_{triangles:d}_{assumptions:d}'.format(**etv_settings_data)
 
-class GetETV:
+
+class ErrorTraceIndex:
+    """
+    Flattened error trace. Each row contains everything needed to render it, so any window of rows can be rendered
+    without parsing the whole error trace.
+    """
     global_thread = 'global'
 
-    def __init__(self, error_trace, user):
-        self.user = user
-        self.trace = json.loads(error_trace)
-        self._max_line_len = 0
+    def __init__(self, trace, user_settings, stats=None):
+        self.trace = trace
+        self.settings = user_settings
+        self.max_line_len = 0
         self._curr_scope = 0
         self.shown_scopes = set()
         self.assumptions = {}
         self._scope_assumptions = {}
 
-        self._threads = self.__get_threads()
-        self._html_collector = ETVHtml(self._threads, self._max_line_len, self.trace['files'])
+        if stats:
+            # Statistics were collected during the error trace validation
+            self.threads = stats['threads']
+            self.max_line_len = stats['max_line_len']
+        else:
+            self.threads = self.__get_threads()
+        self.files = self.trace['files']
 
-        self.html_trace = []
+        self.rows = []
         if 'global variable declarations' in self.trace:
-            self.html_trace.extend(self.__get_global_vars())
+            self.rows.extend(self.__get_global_vars())
         if self.trace['trace']:
-            self.html_trace.extend(self.__parse_node(self.trace['trace'], 0, None, 0))
+            self.rows.extend(self.__parse_node(self.trace['trace'], 0, None, 0))
 
     def __get_threads(self):
         threads = []
         if self.trace.get('global variable declarations'):
             threads.append(self.global_thread)
             for node in self.trace['global variable declarations']:
-                self._max_line_len = max(self._max_line_len, len(str(node['line'])))
+                self.max_line_len = max(self.max_line_len, len(str(node['line'])))
         if self.trace['trace']:
             threads.extend(self.__get_child_threads(self.trace['trace']))
         return threads
@@ -57,7 +95,7 @@ class GetETV:
     def __get_child_threads(self, node_obj):
         threads = []
         if node_obj.get('line'):
-            self._max_line_len = max(self._max_line_len, len(str(node_obj['line'])))
+            self.max_line_len = max(self.max_line_len, len(str(node_obj['line'])))
         if node_obj['type'] == 'thread':
             assert node_obj['thread'] != self.global_thread
             threads.append(node_obj['thread'])
@@ -86,6 +124,15 @@ class GetETV:
         self._curr_scope += 1
         return self._curr_scope
 
+    @staticmethod
+    def __line_number(thread, line=None, file=None, note_level=None):
+        return [thread, line, file, note_level]
+
+    @staticmethod
+    def __source(node):
+        # Node data that is required to render its source code
+        return dict((key, node[key]) for key in ('source', 'highlight', 'line', 'condition', 'display') if key in node)
+
     def __parse_node(self, node, depth, thread, scope):
 
         # Statement
@@ -123,14 +170,14 @@ class GetETV:
             'type': node['type'],
             'scope': scope,
             'has_note': len(notes_data) > 0,
-            'LN': self._html_collector.line_number(thread, line=node['line'], file=node['file']),
-            'LC': self._html_collector.statement_content(depth, node),
+            'LN': self.__line_number(thread, line=node['line'], file=node['file']),
+            'LC': ['statement', depth, self.__source(node)],
         }
         if len(notes_data) and notes_data[-1]['hide']:
             statement_data['commented'] = True
 
         # Add assumptions
-        if self.user.assumptions:
+        if self.settings['assumptions']:
             statement_data['old_assumptions'], statement_data['new_assumptions'] = self.__get_assumptions(node, scope)
 
         if notes_data:
@@ -145,8 +192,8 @@ class GetETV:
             'scope': scope,
             'commented': False,
             'has_note': len(notes_data) > 0,
-            'LN': self._html_collector.line_number(thread, line=node['line'], file=node['file']),
-            'LC': self._html_collector.declaration_content(depth, node)
+            'LN': self.__line_number(thread, line=node['line'], file=node['file']),
+            'LC': ['declaration', depth, self.__source(node)]
         }
 
         if len(notes_data):
@@ -163,7 +210,7 @@ class GetETV:
                 decl_data['scope'] = decl_scope
 
         # Add assumptions
-        if self.user.assumptions:
+        if self.settings['assumptions']:
             decl_data['old_assumptions'], decl_data['new_assumptions'] = self.__get_assumptions(node, decl_scope)
 
         if notes_data:
@@ -178,7 +225,7 @@ class GetETV:
             'scope': scope,
             'body_scope': self._new_scope,
             'opened': False,
-            'LN': self._html_collector.line_number(thread, line=node['line'], file=node['file'])
+            'LN': self.__line_number(thread, line=node['line'], file=node['file'])
         }
         if len(notes_data) and notes_data[-1]['hide']:
             func_enter['commented'] = True
@@ -193,17 +240,17 @@ class GetETV:
             # Open scope by default if its scope is shown and show function scope
             self.shown_scopes.add(scope)
             func_enter['opened'] = True
-        func_enter['LC'] = self._html_collector.function_content(depth, node, func_enter['opened'])
+        func_enter['LC'] = ['function', depth, self.__source(node), func_enter['opened']]
 
         # Add assumptions
-        if self.user.assumptions:
+        if self.settings['assumptions']:
             func_enter['old_assumptions'], func_enter['new_assumptions'] = self.__get_assumptions(node, scope)
 
         # Collect function trace
         func_trace = notes_data
         func_trace.append(func_enter)
         func_trace.extend(func_body)
-        if self.user.triangles:
+        if self.settings['triangles']:
             # Closing triangle
             func_trace.append(self.__closing_triangle(depth, thread, func_enter['body_scope']))
 
@@ -219,7 +266,7 @@ class GetETV:
             'scope': scope,
             'body_scope': self._new_scope,
             'opened': False,
-            'LN': self._html_collector.line_number(thread, line=node['line'], file=node['file'])
+            'LN': self.__line_number(thread, line=node['line'], file=node['file'])
         }
 
         # Get action body
@@ -232,11 +279,13 @@ class GetETV:
             # Open scope by default if its scope is shown and show action scope
             self.shown_scopes.add(scope)
             action_enter['opened'] = True
-        action_enter['LC'] = self._html_collector.action_content(depth, node, action_enter['opened'])
+        action_enter['LC'] = [
+            'action', depth, {'display': node['display'], 'relevant': node.get('relevant')}, action_enter['opened']
+        ]
 
         # Collect action trace
         action_trace = [action_enter] + action_body
-        if self.user.triangles:
+        if self.settings['triangles']:
             # Closing triangle
             action_trace.append(self.__closing_triangle(depth, thread, action_enter['body_scope']))
 
@@ -265,26 +314,25 @@ class GetETV:
                 decl_number += 1
 
         # If there low of them, then move everything outside the declarations scope and return it without header
-        if decl_number <= self.user.declarations_number and scope != 'global':
+        if decl_number <= self.settings['declarations_number'] and scope != 'global':
             for child in decl_body:
                 child['scope'] = scope
             return decl_body
 
-        decl_enter['LN'] = self._html_collector.line_number(thread)
-        display = _('Declarations') if scope != 'global' else _('Global variable declarations')
-        decl_enter['LC'] = self._html_collector.declarations_content(depth, display)
+        decl_enter['LN'] = self.__line_number(thread)
+        decl_enter['LC'] = ['declarations', depth, scope == 'global']
         return [decl_enter] + decl_body
 
     def __closing_triangle(self, depth, thread, scope):
         return {
             'type': 'exit',
             'scope': scope,
-            'LN': self._html_collector.line_number(thread),
-            'LC': self._html_collector.exit_content(depth, scope in self.shown_scopes)
+            'LN': self.__line_number(thread),
+            'LC': ['exit', depth, scope in self.shown_scopes]
         }
 
     def __get_assumptions(self, node, scope):
-        if not self.user.assumptions:
+        if not self.settings['assumptions']:
             return None, None
 
         old_assumptions = None
@@ -313,7 +361,7 @@ class GetETV:
 
         node_notes = []
         for note in node['notes']:
-            if note['level'] > self.user.notes_level:
+            if note['level'] > self.settings['notes_level']:
                 # Ignore the note
                 continue
             if note['level'] == 0 or note['level'] == 1:
@@ -333,8 +381,8 @@ class GetETV:
                 'level': note['level'],
                 'relevant': note['level'] < 2,
                 'hide': False,
-                'LN': self._html_collector.line_number(thread, line=node['line'], note_level=note['level']),
-                'LC': self._html_collector.note_content(depth, note['level'], note['text'], False)
+                'LN': self.__line_number(thread, line=node['line'], note_level=note['level']),
+                'LC': ['note', depth, note['level'], note['text'], False]
             })
 
         last_note = node_notes[-1]
@@ -347,11 +395,128 @@ class GetETV:
             'level': last_note['level'],
             'relevant': last_note['level'] < 2,
             'hide': note_hide,
-            'LN': self._html_collector.line_number(thread, line=node['line'], note_level=last_note['level']),
-            'LC': self._html_collector.note_content(depth, last_note['level'], last_note['text'], note_hide)
+            'LN': self.__line_number(thread, line=node['line'], note_level=last_note['level']),
+            'LC': ['note', depth, last_note['level'], last_note['text'], note_hide]
         })
         return notes_data
 
+    def save(self, fp):
+        """
+        Write the index as JSON lines: the header with offsets of windows and then the rows.
+        :param fp: binary file object
+        """
+        rows_data = io.BytesIO()
+        offsets = []
+        for i, row in enumerate(self.rows):
+            if i % ETV_WINDOW_SIZE == 0:
+                offsets.append(rows_data.tell())
+            rows_data.write(json.dumps(row, ensure_ascii=False).encode('utf8') + b'\n')
+        header = {
+            'threads': self.threads, 'max_line_len': self.max_line_len, 'files': self.files,
+            'shown_scopes': list(self.shown_scopes), 'assumptions': self.assumptions,
+            'rows': len(self.rows), 'window_size': ETV_WINDOW_SIZE, 'offsets': offsets
+        }
+        fp.write(json.dumps(header, ensure_ascii=False).encode('utf8') + b'\n')
+        fp.write(rows_data.getvalue())
+
+
+class ErrorTraceWindowError(ValueError):
+    pass
+
+
+def read_index_window(fp, window):
+    """
+    Read the window of rows from the error trace index that is saved by ErrorTraceIndex.save().
+    :param fp: binary file object
+    :param window: window number
+    :return: index header and list of rows
+    """
+    header = json.loads(fp.readline().decode('utf8'))
+    if window < 0 or window >= max(len(header['offsets']), 1):
+        raise ErrorTraceWindowError('Wrong error trace window: {}'.format(window))
+    rows = []
+    if header['offsets']:
+        fp.seek(fp.tell() + header['offsets'][window])
+        rows_number = min(header['window_size'], header['rows'] - window * header['window_size'])
+        rows = list(json.loads(fp.readline().decode('utf8')) for _ in range(rows_number))
+    return header, rows
+
+
+class ErrorTraceWindow:
+    """
+    Rendered window of the error trace rows.
+    """
+
+    def __init__(self, index_header, rows, window=0):
+        self.threads = index_header['threads']
+        self.shown_scopes = set(index_header['shown_scopes'])
+        self.assumptions = index_header['assumptions']
+        self.windows = max(len(index_header['offsets']), 1)
+        self.window = window
+        self._html_collector = ETVHtml(self.threads, index_header['max_line_len'], index_header['files'])
+        self.html_trace = list(self._html_collector.row(row) for row in rows)
+
+
+class GetETV(ErrorTraceWindow):
+    """
+    Rendered error trace without the index cache. All rows are rendered at once.
+    """
+
+    def __init__(self, error_trace, user, stats=None):
+        index = ErrorTraceIndex(json.loads(error_trace), etv_settings(user), stats=stats)
+        super().__init__({
+            'threads': index.threads, 'max_line_len': index.max_line_len, 'files': index.files,
+            'shown_scopes': index.shown_scopes, 'assumptions': index.assumptions, 'offsets': []
+        }, index.rows)
+
+
+class UnsafeETV(ErrorTraceWindow):
+    """
+    Rendered window of the unsafe error trace. The error trace index is cached for each set of user settings.
+    """
+
+    def __init__(self, report, user, window=0):
+        self._report = report
+        self.report_id = report.id
+        self._settings = etv_settings(user)
+        with self.__get_index().file.open(mode='rb') as fp:
+            header, rows = read_index_window(fp, window)
+        super().__init__(header, rows, window=window)
+
+    def __get_index(self):
+        cache_obj = ErrorTraceIndexCache.objects.filter(
+            report=self._report, settings=etv_settings_key(self._settings)
+        ).first()
+        if cache_obj:
+            ErrorTraceIndexCache.objects.filter(id=cache_obj.id).update(access_date=now())
+            return cache_obj
+        return build_error_trace_index(self._report, self._settings)
+
+
+def build_error_trace_index(report, user_settings):
+    """
+    Parse the unsafe error trace and cache its index for the given user settings.
+    :param report: ReportUnsafe object
+    :param user_settings: dictionary that is returned by etv_settings()
+    :return: ErrorTraceIndexCache object
+    """
+    settings_key = etv_settings_key(user_settings)
+    error_trace = ArchiveFileContent(report, 'error_trace', ERROR_TRACE_FILE).content.decode('utf8')
+    index = ErrorTraceIndex(json.loads(error_trace), user_settings, stats=report.trace_stats)
+    index_data = io.BytesIO()
+    index.save(index_data)
+    index_data.seek(0)
+
+    cache_obj = ErrorTraceIndexCache(report=report, settings=settings_key)
+    cache_obj.file.save('index.jsonl', File(index_data), save=False)
+
+    # The same index could be cached by another request at the same time
+    ErrorTraceIndexCache.objects.bulk_create([cache_obj], ignore_conflicts=True)
+    saved_obj = ErrorTraceIndexCache.objects.get(report=report, settings=settings_key)
+    if saved_obj.file.name != cache_obj.file.name:
+        cache_obj.file.delete(save=False)
+    return saved_obj
+
 
 class ETVHtml:
     max_source_length = 500
@@ -399,6 +564,32 @@ class ETVHtml:
         threads_html[self.global_thread] = html_pattern.format(' ' * threads_num)
         return threads_html
 
+    def row(self, row):
+        """
+        Render the error trace index row.
+        :param row: dictionary from ErrorTraceIndex.rows
+        :return: the row with line number and line content HTML
+        """
+        html_row = dict(row)
+        html_row['LN'] = self.line_number(*row['LN'])
+        content_type, depth, *args = row['LC']
+        if content_type == 'statement':
+            html_row['LC'] = self.statement_content(depth, *args)
+        elif content_type == 'declaration':
+            html_row['LC'] = self.declaration_content(depth, *args)
+        elif content_type == 'function':
+            html_row['LC'] = self.function_content(depth, *args)
+        elif content_type == 'action':
+            html_row['LC'] = self.action_content(depth, *args)
+        elif content_type == 'exit':
+            html_row['LC'] = self.exit_content(depth, *args)
+        elif content_type == 'note':
+            html_row['LC'] = self.note_content(depth, *args)
+        elif content_type == 'declarations':
+            display = _('Global variable declarations') if args[0] else _('Declarations')
+            html_row['LC'] = self.declarations_content(depth, display)
+        return html_row
+
     def line_number(self, thread, line=None, file=None, note_level=None):
         # Get line number with indentations
         line_str = '' if line is None else str(line)
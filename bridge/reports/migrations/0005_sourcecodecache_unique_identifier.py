@@ -0,0 +1,37 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from django.db import migrations, models
+
+
+def clear_source_code_cache(apps, schema_editor):
+    # Cached rendered HTML pages are incompatible with the new cache format
+    cache_model = apps.get_model('reports', 'SourceCodeCache')
+    for cache_obj in cache_model.objects.all():
+        cache_obj.file.delete(save=False)
+    cache_model.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [('reports', '0004_reportunsafe_trace_stats')]
+
+    operations = [
+        migrations.RunPython(clear_source_code_cache, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='sourcecodecache', name='identifier', field=models.CharField(max_length=256, unique=True)
+        ),
+    ]
@@ -0,0 +1,63 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from django.contrib.postgres.fields import ArrayField
+from django.db import migrations, models
+
+# Number existing comparison objects within each pair of verdicts in the order they were shown before
+NUMBER_COMPARISON_OBJECTS_SQL = """
+UPDATE cache_report_comparison_object AS obj SET number = numbered.number
+FROM (
+    SELECT id, row_number() OVER (PARTITION BY info_id, verdict1, verdict2 ORDER BY id) AS number
+    FROM cache_report_comparison_object
+) AS numbered
+WHERE obj.id = numbered.id
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('jobs', '0003_defaultdecisionconfiguration'), ('reports', '0005_sourcecodecache_unique_identifier')
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(name='comparisonobject', index_together=set()),
+        migrations.AddField(
+            model_name='comparisonobject', name='number', field=models.PositiveIntegerField(default=0)
+        ),
+        migrations.RunSQL(NUMBER_COMPARISON_OBJECTS_SQL, migrations.RunSQL.noop),
+        migrations.AlterIndexTogether(
+            name='comparisonobject', index_together={('info', 'verdict1', 'verdict2', 'number')}
+        ),
+        migrations.CreateModel(
+            name='LeafSignature',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signature', models.BigIntegerField()),
+                ('values', ArrayField(base_field=models.CharField(max_length=255), size=None)),
+                ('verdict', models.CharField(choices=[
+                    ('0', 'Total safe'), ('1', 'Found all unsafes'), ('2', 'Found not all unsafes'),
+                    ('3', 'Unknown'), ('4', 'Unmatched'), ('5', 'Broken')
+                ], max_length=1)),
+                ('leaves', models.JSONField()),
+                ('decision', models.ForeignKey(
+                    on_delete=models.deletion.CASCADE, related_name='+', to='jobs.decision'
+                )),
+            ],
+            options={'db_table': 'cache_report_leaf_signature', 'unique_together': {('decision', 'signature')}},
+        ),
+    ]
@@ -0,0 +1,41 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from django.db import migrations, models
+
+import bridge.utils
+
+
+class Migration(migrations.Migration):
+    dependencies = [('reports', '0006_leafsignature')]
+
+    operations = [
+        migrations.CreateModel(
+            name='ErrorTraceIndexCache',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('settings', models.CharField(max_length=64)),
+                ('file', models.FileField(upload_to='ErrorTraceIndex/%Y/%m')),
+                ('access_date', models.DateTimeField(auto_now=True)),
+                ('report', models.ForeignKey(
+                    on_delete=models.deletion.CASCADE, related_name='+', to='reports.reportunsafe'
+                )),
+            ],
+            options={'db_table': 'cache_error_trace_index', 'unique_together': {('report', 'settings')}},
+            bases=(bridge.utils.WithFilesMixin, models.Model),
+        ),
+    ]
@@ -69,7 +69,7 @@ def source_code_path(instance, filename):
     curr_date = now()
     return os.path.join(
         'SourceCode', str(curr_date.year), str(curr_date.month), str(curr_date.day),
-        'src-{}.html'.format(instance.identifier[:16])
+        'src-{}.json'.format(instance.identifier[:16])
     )
 
 
@@ -96,6 +96,7 @@ class Report(MPTTModel):
         db_table = 'report'
         unique_together = [('decision', 'identifier')]
         index_together = [('decision', 'identifier')]
+        indexes = [models.Index(fields=['decision', 'id'], name='report_decision_id_idx')]
 
 
 class AttrFile(WithFilesMixin, models.Model):
@@ -179,6 +180,11 @@ class ReportComponent(WithFilesMixin, Report):
         if not os.path.isfile(os.path.join(settings.MEDIA_ROOT, self.verifier_files.name)):
             raise RuntimeError('ReportComponent.verifier_files was not saved')
 
+    def file_is_used(self, name):
+        # Identical logs and verifier files of the decision are stored once when the job is uploaded
+        return ReportComponent.objects.filter(decision_id=self.decision_id, **{name: getattr(self, name).name})\
+            .exclude(id=self.id).exists()
+
     class Meta:
         db_table = 'report_component'
 
@@ -191,6 +197,9 @@ class ReportComponentLeaf(models.Model):
 
     class Meta:
         db_table = 'cache_report_component_leaf'
+        indexes = [
+            models.Index(fields=['report', 'content_type', 'object_id'], name='cache_leaf_report_object_idx')
+        ]
 
 
 class CoverageArchive(WithFilesMixin, models.Model):
@@ -312,6 +321,7 @@ class CoverageDataStatistics(models.Model):
 
 class ReportUnsafe(WithFilesMixin, Report):
     error_trace = models.FileField(upload_to='Unsafes/%Y/%m')
+    trace_stats = models.JSONField(null=True)
     leaves = GenericRelation(ReportComponentLeaf, related_query_name='unsafes')
 
     def add_trace(self, fp, save=False):
@@ -359,10 +369,24 @@ class ComparisonObject(models.Model):
     values = ArrayField(models.CharField(max_length=255))
     verdict1 = models.CharField(max_length=1, choices=COMPARE_VERDICT)
     verdict2 = models.CharField(max_length=1, choices=COMPARE_VERDICT)
+    # Position among comparison objects with the same pair of verdicts
+    number = models.PositiveIntegerField(default=0)
 
     class Meta:
         db_table = 'cache_report_comparison_object'
-        index_together = ["info", "verdict1", "verdict2"]
+        index_together = ["info", "verdict1", "verdict2", "number"]
+
+
+class LeafSignature(models.Model):
+    decision = models.ForeignKey(Decision, models.CASCADE, related_name='+')
+    signature = models.BigIntegerField()
+    values = ArrayField(models.CharField(max_length=255))
+    verdict = models.CharField(max_length=1, choices=COMPARE_VERDICT)
+    leaves = models.JSONField()
+
+    class Meta:
+        db_table = 'cache_report_leaf_signature'
+        unique_together = [('decision', 'signature')]
 
 
 class ComparisonLink(models.Model):
@@ -391,7 +415,7 @@ class DecisionCache(models.Model):
 
 
 class SourceCodeCache(WithFilesMixin, models.Model):
-    identifier = models.CharField(max_length=256, db_index=True)
+    identifier = models.CharField(max_length=256, unique=True)
     file = models.FileField(upload_to=source_code_path)
     access_date = models.DateTimeField(auto_now=True)
 
@@ -399,6 +423,18 @@ class SourceCodeCache(WithFilesMixin, models.Model):
         db_table = 'cache_source_code'
 
 
+class ErrorTraceIndexCache(WithFilesMixin, models.Model):
+    report = models.ForeignKey(ReportUnsafe, models.CASCADE, related_name='+')
+    # Error trace visualization user settings
+    settings = models.CharField(max_length=64)
+    file = models.FileField(upload_to='ErrorTraceIndex/%Y/%m')
+    access_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'cache_error_trace_index'
+        unique_together = [('report', 'settings')]
+
+
 class ReportImage(WithFilesMixin, models.Model):
     report = models.ForeignKey(ReportComponent, models.CASCADE, related_name='images')
     title = models.TextField()
@@ -420,4 +456,5 @@ post_delete.connect(remove_instance_files, sender=ReportUnsafe)
 post_delete.connect(remove_instance_files, sender=ReportUnknown)
 post_delete.connect(remove_instance_files, sender=CoverageArchive)
 post_delete.connect(remove_instance_files, sender=SourceCodeCache)
+post_delete.connect(remove_instance_files, sender=ErrorTraceIndexCache)
 post_delete.connect(remove_instance_files, sender=ReportImage)
@@ -15,26 +15,35 @@
 # limitations under the License.
 #
 
+import gzip
 import hashlib
 import io
 import json
-from collections import OrderedDict
+import zipfile
+from collections import Counter, OrderedDict
 from urllib.parse import unquote
 
 from django.core.files import File
-from django.db import transaction
 from django.template import loader
 from django.utils.timezone import now
-from django.utils.translation import gettext_lazy as _, get_language
+from django.utils.translation import gettext_lazy as _
 from django.utils.functional import cached_property
 
-from bridge.vars import ETV_FORMAT
+from bridge.vars import ETV_FORMAT, SOURCES_INDEX_FORMAT, ERROR_TRACE_FILE, MPTT_FIELDS
 from bridge.utils import ArchiveFileContent, BridgeException, logger
+from bridge.json_stream import json_events, json_value, skip_json_value
 
-from reports.models import ReportComponent, CoverageArchive, CoverageStatistics, SourceCodeCache
+from reports.models import (
+    ReportComponent, ReportUnsafe, CoverageArchive, CoverageStatistics, SourceCodeCache, OriginalSources
+)
 
 TAB_LENGTH = 4
 
+# Source files referred by error traces of the given number of unsafes are cached after decisions finish
+PREPARE_SOURCES_UNSAFES = 100
+# Maximum number of source files cached after decision finish
+PREPARE_SOURCES_FILES = 200
+
 HIGHLIGHT_CLASSES = {
     'C': 'SrcHlC',
     'CM': 'SrcHlCM',
@@ -288,58 +297,202 @@ class SourceLine:
                 raise ValueError('type of "{}" is "{}", int expected'.format(value, type(value)))
 
 
-class ParseSource:
+def source_ancestors(report):
+    """
+    Get report ancestors with source code archives.
+    :param report: Report instance
+    :return: ReportComponent queryset ordered from the report to the tree root
+    """
+    parents_ids = set(report.get_ancestors(include_self=True).exclude(
+        reportcomponent__additional_sources=None, reportcomponent__original_sources=None
+    ).values_list('id', flat=True))
+    return ReportComponent.objects.filter(id__in=parents_ids) \
+        .select_related('original_sources', 'additional_sources') \
+        .only('id', 'verification', 'original_sources_id', 'additional_sources_id', 'original_sources__identifier',
+              'original_sources__archive', 'additional_sources__archive') \
+        .order_by('-id')
+
+
+def extract_file(obj, name, field_name='archive', decode=True):
+    if obj is None:
+        return None
+    try:
+        res = ArchiveFileContent(obj, field_name, name, not_exists_ok=True)
+    except Exception as e:
+        raise BridgeException(_("Error while extracting source file: %(error)s") % {'error': str(e)})
+    if res.content is None:
+        return None
+    return res.content.decode('utf8') if decode else res.content
+
+
+def index_rows(index_data):
+    """
+    Convert sources index data stored by columns to lists of highlights and references.
+    :param index_data: dictionary with sources index data of SOURCES_INDEX_FORMAT
+    :return: dictionary with sources index data of ETV_FORMAT
+    """
+    highlight = index_data.get('highlight', {})
+    kinds = highlight.get('kinds', [])
+    rows = {
+        'format': ETV_FORMAT,
+        'highlight': list([kinds[kind], line, start, end] for kind, line, start, end in zip(
+            highlight.get('kind', []), highlight.get('line', []), highlight.get('start', []), highlight.get('end', [])
+        ))
+    }
+    for ref_type in ['referencesto', 'referencestodeclarations']:
+        refs = index_data.get(ref_type, {})
+        rows[ref_type] = list([
+            [line, start, end], [file_ind, [file_line] if ref_type == 'referencestodeclarations' else file_line]
+        ] for line, start, end, file_ind, file_line in zip(
+            refs.get('line', []), refs.get('start', []), refs.get('end', []), refs.get('file', []),
+            refs.get('file line', [])
+        ))
+    refs = index_data.get('referencesfrom', {})
+    rows['referencesfrom'] = list([[line, start, end], *ref_from] for line, start, end, ref_from in zip(
+        refs.get('line', []), refs.get('start', []), refs.get('end', []), refs.get('refs', [])
+    ))
+    if 'source files' in index_data:
+        rows['source files'] = index_data['source files']
+    return rows
+
+
+class SourceCodeData:
+    """
+    Highlighted source code lines with references. They depend just on source code archives and the file name,
+    so they are cached once for all reports and users that share these archives.
+    """
     index_postfix = '.idx.json'
-    coverage_postfix = '.cov.json'
 
-    def __init__(self, user, file_name, ancestors, coverage_qs, with_legend):
-        self._user = user
-        self._ancestors = ancestors
+    def __init__(self, file_name, ancestors):
         self.file_name = file_name
-        self._coverage_qs = coverage_qs
-        self.with_legend = with_legend
+        self._ancestors = ancestors
 
-        self._source_lines = self._references = self.coverage_id = None
+    @cached_property
+    def _archives(self):
+        archives = []
+        for report in self._ancestors:
+            if report.additional_sources_id:
+                archives.append(report.additional_sources)
+            if report.original_sources_id:
+                archives.append(report.original_sources)
+        return archives
 
-        self.file_content = self.__get_source_code()
+    @cached_property
+    def identifier(self):
+        # Original sources identifiers are based on their content, additional sources are unique for reports
+        identifier_data = json.dumps([self.file_name, list(
+            ['original', archive.identifier] if isinstance(archive, OriginalSources) else ['additional', archive.id]
+            for archive in self._archives
+        )]).encode('utf-8')
+        return hashlib.md5(identifier_data).hexdigest()
 
-    def __extract_file(self, obj, name, field_name='archive'):
-        if obj is None:
-            return None
-        try:
-            res = ArchiveFileContent(obj, field_name, name, not_exists_ok=True)
-        except Exception as e:
-            raise BridgeException(_("Error while extracting source file: %(error)s") % {'error': str(e)})
-        if res.content is None:
+    @cached_property
+    def data(self):
+        """
+        Get cached source code data or parse source code and cache it.
+        :return: dictionary with lines HTML, references and source files or None if the source file wasn't found
+        """
+        cache_obj = SourceCodeCache.objects.filter(identifier=self.identifier).only('id', 'file').first()
+        if cache_obj:
+            SourceCodeCache.objects.filter(id=cache_obj.id).update(access_date=now())
+            with open(cache_obj.file.path, mode='rb') as fp:
+                return json.loads(fp.read().decode('utf8'))
+
+        data = self.__parse()
+        self.__save(data)
+        return data
+
+    def prepare(self):
+        # Parse and cache source code if it isn't cached yet
+        if not SourceCodeCache.objects.filter(identifier=self.identifier).exists():
+            self.__save(self.__parse())
+
+    def __save(self, data):
+        cache_obj = SourceCodeCache(identifier=self.identifier)
+        cache_obj.file.save('SourceCode.json', File(io.BytesIO(json.dumps(data).encode('utf8'))), save=False)
+
+        # Source code could be parsed and cached by another request at the same time
+        SourceCodeCache.objects.bulk_create([cache_obj], ignore_conflicts=True)
+        if not SourceCodeCache.objects.filter(identifier=self.identifier, file=cache_obj.file.name).exists():
+            cache_obj.file.delete(save=False)
+
+    def __find_file(self, name, decode=True):
+        for archive in self._archives:
+            content = extract_file(archive, name, decode=decode)
+            if content:
+                return content
+        return None
+
+    def __get_indexes(self):
+        content = self.__find_file(self.file_name + self.index_postfix, decode=False)
+        if not content:
+            return {}
+        # Index data can be compressed
+        if content[:2] == b'\x1f\x8b':
+            content = gzip.decompress(content)
+        index_data = json.loads(content.decode('utf8'))
+        if index_data.get('format') == SOURCES_INDEX_FORMAT:
+            return index_rows(index_data)
+        if index_data.get('format') != ETV_FORMAT:
+            raise BridgeException(_('Sources indexing format is not supported'))
+        return index_data
+
+    def __parse(self):
+        file_content = self.__find_file(self.file_name)
+        if not file_content:
             return None
-        return res.content.decode('utf8')
+        indexes = self.__get_indexes()
 
-    def __get_source_code(self):
-        for report in self._ancestors:
-            for file_obj in [report.additional_sources, report.original_sources]:
-                content = self.__extract_file(file_obj, self.file_name)
-                if content:
-                    return content
-        raise SourceNotFound('The source file was not found')
+        highlights = {}
+        for h_name, line_num, start, end in indexes.get('highlight', []):
+            highlights.setdefault(line_num, [])
+            highlights[line_num].append((h_name, start, end))
+
+        references = {}
+        for ref_type in ['referencesto', 'referencesfrom', 'referencestodeclarations']:
+            references[ref_type] = {}
+            for ref_data in indexes.get(ref_type, []):
+                line_num = ref_data[0][0]
+                references[ref_type].setdefault(line_num, [])
+                references[ref_type][line_num].append(ref_data)
+
+        lines = []
+        references_data = []
+        for cnt, code in enumerate(file_content.split('\n'), start=1):
+            src_line = SourceLine(
+                code, highlights=highlights.get(cnt), filename=self.file_name, line=cnt,
+                references_to=references['referencesto'].get(cnt),
+                references_from=references['referencesfrom'].get(cnt),
+                references_declarations=references['referencestodeclarations'].get(cnt)
+            )
+            lines.append(src_line.html_code)
+            references_data.extend(src_line.references_data)
+            references_data.extend(src_line.declarations.values())
+
+        source_files = []
+        if 'source files' in indexes:
+            source_files = indexes['source files'] + [self.file_name]
+        return {'lines': lines, 'references': references_data, 'source_files': source_files}
 
-    @cached_property
-    def _indexes(self):
-        index_name = self.file_name + self.index_postfix
-        for report in self._ancestors:
-            for file_obj in [report.additional_sources, report.original_sources]:
-                content = self.__extract_file(file_obj, index_name)
-                if content:
-                    index_data = json.loads(content)
-                    if index_data.get('format') != ETV_FORMAT:
-                        raise BridgeException(_('Sources indexing format is not supported'))
-                    return index_data
-        return None
+
+class ParseSource:
+    coverage_postfix = '.cov.json'
+
+    def __init__(self, user, file_name, source_data, coverage_qs, with_legend):
+        self._user = user
+        self.file_name = file_name
+        self._source_data = source_data
+        self._coverage_qs = coverage_qs
+        self.with_legend = with_legend
+
+        self._source_lines = None
+        self.coverage_id = None
 
     @cached_property
     def _coverage(self):
         cov_name = self.file_name + self.coverage_postfix
         for cov_obj in self._coverage_qs:
-            content = self.__extract_file(cov_obj, cov_name)
+            content = extract_file(cov_obj, cov_name)
             if not content:
                 continue
             coverage_data = json.loads(content)
@@ -392,77 +545,34 @@ class ParseSource:
         return set(self._coverage['data'])
 
     def __parse_source(self):
-        highlights = {}
-        if self._indexes and 'highlight' in self._indexes:
-            for h_name, line_num, start, end in self._indexes['highlight']:
-                highlights.setdefault(line_num, [])
-                highlights[line_num].append((h_name, start, end))
-
-        references_to = {}
-        if self._indexes and 'referencesto' in self._indexes:
-            for ref_data in self._indexes['referencesto']:
-                line_num = ref_data[0][0]
-                references_to.setdefault(line_num, [])
-                references_to[line_num].append(ref_data)
-
-        references_from = {}
-        if self._indexes and 'referencesfrom' in self._indexes:
-            for ref_data in self._indexes['referencesfrom']:
-                line_num = ref_data[0][0]
-                references_from.setdefault(line_num, [])
-                references_from[line_num].append(ref_data)
-
-        references_declarations = {}
-        if self._indexes and 'referencestodeclarations' in self._indexes:
-            for ref_data in self._indexes['referencestodeclarations']:
-                line_num = ref_data[0][0]
-                references_declarations.setdefault(line_num, [])
-                references_declarations[line_num].append(ref_data)
-
-        cnt = 1
-        lines = self.file_content.split('\n')
-        total_lines_len = len(str(len(lines)))
-
+        # Add coverage to cached source code lines
+        total_lines_len = len(str(len(self._source_data['lines'])))
         lines_data = []
-        references_data = []
-        for code in lines:
-            src_line = SourceLine(
-                code, highlights=highlights.get(cnt), filename=self.file_name, line=cnt,
-                references_to=references_to.get(cnt),
-                references_from=references_from.get(cnt),
-                references_declarations=references_declarations.get(cnt)
-            )
+        for cnt, code in enumerate(self._source_data['lines'], start=1):
             linenum_str = str(cnt)
             lines_data.append({
-                'number': cnt, 'code': src_line.html_code,
+                'number': cnt, 'code': code,
                 'number_prefix': ' ' * (total_lines_len - len(linenum_str)),
                 'line_cov': self._line_coverage.get(linenum_str),
                 'func_cov': self._func_coverage.get(linenum_str),
                 'note': self.__get_coverage_note(linenum_str),
                 'has_data': (linenum_str in self._coverage_data)
             })
-            references_data.extend(src_line.references_data)
-            references_data.extend(src_line.declarations.values())
-            cnt += 1
-        return lines_data, references_data
+        return lines_data
 
     @property
     def source_lines(self):
         if self._source_lines is None:
-            self._source_lines, self._references = self.__parse_source()
+            self._source_lines = self.__parse_source()
         return self._source_lines
 
     @property
     def references(self):
-        if self._references is None:
-            self._source_lines, self._references = self.__parse_source()
-        return self._references
+        return self._source_data['references']
 
     @cached_property
     def source_files(self):
-        if self._indexes and 'source files' in self._indexes:
-            return list(enumerate(self._indexes['source files'] + [self.file_name]))
-        return []
+        return list(enumerate(self._source_data['source_files']))
 
     @cached_property
     def legend(self):
@@ -511,7 +621,6 @@ class GetSource:
         self._report = report
         self.file_name = self.__parse_file_name()
         self.with_legend = (self._request.query_params.get('with_legend') == 'true')
-        self.identifier = self.__get_cache_identifier()
 
     def __parse_file_name(self):
         file_name = self._request.query_params['file_name']
@@ -522,14 +631,7 @@ class GetSource:
 
     @cached_property
     def _ancestors(self):
-        parents_ids = set(self._report.get_ancestors(include_self=True).exclude(
-            reportcomponent__additional_sources=None, reportcomponent__original_sources=None
-        ).values_list('id', flat=True))
-        return ReportComponent.objects.filter(id__in=parents_ids) \
-            .select_related('original_sources', 'additional_sources') \
-            .only('id', 'verification', 'original_sources_id', 'additional_sources_id',
-                  'original_sources__archive', 'additional_sources__archive') \
-            .order_by('-id')
+        return source_ancestors(self._report)
 
     @cached_property
     def _coverage_qs(self):
@@ -547,34 +649,52 @@ class GetSource:
 
         return CoverageArchive.objects.filter(**qs_filters).order_by('-report_id')
 
-    def __get_cache_identifier(self):
-        identifier_data = json.dumps([
-            get_language(), self.file_name, self.with_legend,
-            list([r.id, r.original_sources_id, r.additional_sources_id] for r in self._ancestors),
-            list(ca.id for ca in self._coverage_qs)
-        ]).encode('utf-8')
-        return hashlib.md5(identifier_data).hexdigest()[:256]
-
-    def __render_html(self):
-        try:
-            data = ParseSource(self._request.user, self.file_name, self._ancestors, self._coverage_qs, self.with_legend)
-        except SourceNotFound:
-            data = None
-        template = loader.get_template('reports/SourceCode.html')
-        return template.render({'data': data}, self._request)
-
-    @transaction.atomic
     def get_html(self):
-        src_code = SourceCodeCache.objects.filter(identifier=self.identifier).select_for_update().first()
-        if src_code:
-            with open(src_code.file.path, mode='rb') as fp:
-                html_content_b = fp.read()
-            src_code.access_date = now()
-            src_code.save()
-        else:
-            html_content_b = self.__render_html().encode('utf8')
-            fp = io.BytesIO(html_content_b)
-            fp.seek(0)
-            src_code = SourceCodeCache(identifier=self.identifier)
-            src_code.file.save('SourceCode.html', File(fp), save=True)
-        return html_content_b
+        source_data = SourceCodeData(self.file_name, self._ancestors).data
+        data = None
+        if source_data is not None:
+            data = ParseSource(self._request.user, self.file_name, source_data, self._coverage_qs, self.with_legend)
+        template = loader.get_template('reports/SourceCode.html')
+        return template.render({'data': data}, self._request).encode('utf8')
+
+
+class PrepareSourceCode:
+    """
+    Parse and cache source files that are most frequently referred by error traces of the decision.
+    """
+
+    def __init__(self, decision_id):
+        sources = {}
+        references = Counter()
+        for report in ReportUnsafe.objects.filter(decision_id=decision_id).only('id', 'error_trace', *MPTT_FIELDS)\
+                .order_by('id')[:PREPARE_SOURCES_UNSAFES]:
+            ancestors = list(source_ancestors(report))
+            for file_name in self.__error_trace_files(report):
+                source_data = SourceCodeData(file_name[1:] if file_name.startswith('/') else file_name, ancestors)
+                sources[source_data.identifier] = source_data
+                references[source_data.identifier] += 1
+
+        for identifier, _count in references.most_common(PREPARE_SOURCES_FILES):
+            try:
+                sources[identifier].prepare()
+            except Exception as e:
+                logger.exception(e)
+
+    def __error_trace_files(self, report):
+        try:
+            with zipfile.ZipFile(report.error_trace.path, mode='r') as zfp:
+                with zfp.open(ERROR_TRACE_FILE) as fp:
+                    events = json_events(fp)
+                    next(events)
+                    for event, key in events:
+                        if event == 'end_map':
+                            break
+                        event, value = next(events)
+                        if key == 'files':
+                            files = json_value(events, event, value)
+                            return list(file_name for file_name in files if isinstance(file_name, str)) \
+                                if isinstance(files, list) else []
+                        skip_json_value(events, event)
+        except Exception as e:
+            logger.exception(e)
+        return []
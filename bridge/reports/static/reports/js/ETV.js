@@ -15,7 +15,28 @@
  * limitations under the License.
  */
 
-$(document).ready(function () {
+function load_etv_windows(etv_window, on_window) {
+    // Error trace rows are rendered by windows, the first one is rendered with the page
+    let windows_number = parseInt(etv_window.data('windows'), 10) || 1;
+
+    function load_window(window_num) {
+        if (window_num >= windows_number) return;
+        $.get(etv_window.data('url'), {window: window_num}, function (resp) {
+            let rows = $($.parseHTML(resp)),
+                assumptions = etv_window.children('span[id^="assumption_"]');
+            if (assumptions.length) assumptions.first().before(rows);
+            else etv_window.append(rows);
+            on_window(rows);
+            load_window(window_num + 1);
+        }).fail(function () {
+            // Rows of the next windows can't be shown without rows of this one
+            etv_window.append($('<div>', {'class': 'ui red message', text: $('#error__ajax_error').text()}));
+        });
+    }
+    load_window(1);
+}
+
+function initialize_etv() {
     let etv_window = $('#ETV_error_trace'),
         data_window = $('#ETV_data');
 
@@ -151,104 +172,107 @@ $(document).ready(function () {
         }
     }
 
-    $('.ETV_EnterLink').click(function (event) {
-        let node = $(this).parent().parent();
-        if (node.hasClass('scope_opened')) {
+    function bind_rows(rows) {
+        rows.find('.ETV_EnterLink').click(function (event) {
+            let node = $(this).parent().parent();
+            if (node.hasClass('scope_opened')) {
+                hide_scope(node, event.shiftKey, true);
+            }
+            else {
+                if (event.shiftKey) show_scope_shift(node);
+                else show_scope(node);
+            }
+        });
+        rows.find('.ETV_ExitLink').click(function (event) {
+            let node = $('span[data-scope="' + $(this).data('scope') + '"]').first();
             hide_scope(node, event.shiftKey, true);
-        }
-        else {
-            if (event.shiftKey) show_scope_shift(node);
-            else show_scope(node);
-        }
-    });
-    $('.ETV_ExitLink').click(function (event) {
-        let node = $('span[data-scope="' + $(this).data('scope') + '"]').first();
-        hide_scope(node, event.shiftKey, true);
-    });
-
-    $('.ETV_OpenEye').click(function () {
-        let node = $(this).parent().parent();
-        if ($(this).hasClass('hide')) hide_display(node);
-        else show_display(node);
-    });
-
-    $('.ETV_Declarations_Text').click(function () {
-        $(this).parent().find('.ETV_OpenEye').click();
-    });
+        });
 
-    $('.ETV_LINE').click(function () {
-        // Unselect everything first
-        unselect_etv_line();
+        rows.find('.ETV_OpenEye').click(function () {
+            let node = $(this).parent().parent();
+            if ($(this).hasClass('hide')) hide_display(node);
+            else show_display(node);
+        });
 
-        let node = $(this).parent().parent();
-        node[0].classList.forEach((c_name) => {
-            console.log(c_name);
-            if (c_name.startsWith('scope-')) {
-                const scope_id = c_name.replace('scope-', '');
-                $(`span[data-scope="${scope_id}"`).find('.ETV_OpenEye').switchClass('violet', 'pink');
-            }
+        rows.find('.ETV_Declarations_Text').click(function () {
+            $(this).parent().find('.ETV_OpenEye').click();
         });
 
-        // Select clicked line
-        node.addClass('ETVSelectedLine');
-
-        // Get source code if node has file and line number
-        let line_num = parseInt($(this).text(), 10),
-            filename = $(this).data('file');
-        if (filename && line_num) source_processor.get_source(line_num, filename);
-
-        // Show assumptions
-        if (data_window.length) {
-            // Show old assumptions
-            let old_assumes = node.find('.ETV_OldAssumptions');
-            if (old_assumes.length) {
-                $.each(old_assumes.text().split('_'), function (i, v) {
-                    let curr_assume = $('#assumption_' + v);
-                    if (curr_assume.length) data_window.append($('<p>', {text: curr_assume.text()}));
-                });
-            }
-            // Show new assumptions
-            let new_assumes = node.find('.ETV_NewAssumptions');
-            if (new_assumes.length) {
-                $.each(new_assumes.text().split('_'), function (i, v) {
-                    let curr_assume = $('#assumption_' + v);
-                    if (curr_assume.length) data_window.append($('<span>', {
-                        text: curr_assume.text(), 'class': 'ETV_NewAssumption'
-                    }));
-                });
-            }
-        }
-    });
+        rows.find('.ETV_LINE').click(function () {
+            // Unselect everything first
+            unselect_etv_line();
 
-    $('.ETV_Action,.ETV_RelevantAction').click(function () {
-        let node = $(this).parent().parent();
+            let node = $(this).parent().parent();
+            node[0].classList.forEach((c_name) => {
+                console.log(c_name);
+                if (c_name.startsWith('scope-')) {
+                    const scope_id = c_name.replace('scope-', '');
+                    $(`span[data-scope="${scope_id}"`).find('.ETV_OpenEye').switchClass('violet', 'pink');
+                }
+            });
 
-        // If action can be collapsed/expanded, do it
-        node.find('.ETV_EnterLink').click();
+            // Select clicked line
+            node.addClass('ETVSelectedLine');
+
+            // Get source code if node has file and line number
+            let line_num = parseInt($(this).text(), 10),
+                filename = $(this).data('file');
+            if (filename && line_num) source_processor.get_source(line_num, filename);
+
+            // Show assumptions
+            if (data_window.length) {
+                // Show old assumptions
+                let old_assumes = node.find('.ETV_OldAssumptions');
+                if (old_assumes.length) {
+                    $.each(old_assumes.text().split('_'), function (i, v) {
+                        let curr_assume = $('#assumption_' + v);
+                        if (curr_assume.length) data_window.append($('<p>', {text: curr_assume.text()}));
+                    });
+                }
+                // Show new assumptions
+                let new_assumes = node.find('.ETV_NewAssumptions');
+                if (new_assumes.length) {
+                    $.each(new_assumes.text().split('_'), function (i, v) {
+                        let curr_assume = $('#assumption_' + v);
+                        if (curr_assume.length) data_window.append($('<span>', {
+                            text: curr_assume.text(), 'class': 'ETV_NewAssumption'
+                        }));
+                    });
+                }
+            }
+        });
 
-        // Get source for the action
-        node.find('.ETV_LINE').click();
-    });
+        rows.find('.ETV_Action,.ETV_RelevantAction').click(function () {
+            let node = $(this).parent().parent();
 
-    $('.ETV_ShowCommentCode').click(function () {
-        let node = $(this).parent().parent().next('span');
-        if (node.is(':hidden')) {
-            node.show();
-            // If next node is function call with allowed collapsing then that node will have enter link, click it
+            // If action can be collapsed/expanded, do it
             node.find('.ETV_EnterLink').click();
+
+            // Get source for the action
             node.find('.ETV_LINE').click();
-        }
-        else {
-            // Collapse the scope first
-            if (node.hasClass('scope_opened')) node.find('.ETV_EnterLink').click();
-            node.hide();
-        }
-    });
+        });
 
-    $('.ETV_LINE_Note').click(function () {
-        $(this).parent().parent().next('span').find('.ETV_LINE').click();
-        $(this).addClass('ETV_LINE_Note_Selected');
-    });
+        rows.find('.ETV_ShowCommentCode').click(function () {
+            let node = $(this).parent().parent().next('span');
+            if (node.is(':hidden')) {
+                node.show();
+                // If next node is function call with allowed collapsing then that node will have enter link, click it
+                node.find('.ETV_EnterLink').click();
+                node.find('.ETV_LINE').click();
+            }
+            else {
+                // Collapse the scope first
+                if (node.hasClass('scope_opened')) node.find('.ETV_EnterLink').click();
+                node.hide();
+            }
+        });
+
+        rows.find('.ETV_LINE_Note').click(function () {
+            $(this).parent().parent().next('span').find('.ETV_LINE').click();
+            $(this).addClass('ETV_LINE_Note_Selected');
+        });
+    }
+    bind_rows(etv_window.children());
 
     etv_window.scroll(function () {
         $(this).find('.ETV_LN').css('left', $(this).scrollLeft());
@@ -285,4 +309,12 @@ $(document).ready(function () {
             codeSelector.mark(word, {caseSensitive: true});
         }
     });
+
+    // Rows of other windows are bound when they are loaded
+    return bind_rows;
+}
+
+$(document).ready(function () {
+    let bind_rows = initialize_etv();
+    if (bind_rows) load_etv_windows($('#ETV_error_trace'), bind_rows);
 });
@@ -20,9 +20,13 @@ from datetime import timedelta
 
 from django.utils.timezone import now
 
-from bridge.utils import BridgeException
-from reports.models import CoverageArchive, SourceCodeCache
+from bridge.utils import BridgeException, logger
+from jobs.models import Decision
+from reports.models import CoverageArchive, SourceCodeCache, ReportUnsafe, ErrorTraceIndexCache
 from reports.coverage import FillCoverageStatistics
+from reports.source import PrepareSourceCode
+from reports.comparison import LeafSignatures
+from reports.etv import build_error_trace_index, etv_settings, etv_settings_key
 
 
 @shared_task
@@ -41,3 +45,30 @@ def fill_coverage_statistics(carch_id):
 @shared_task
 def clear_old_source_code_cache(hours):
     SourceCodeCache.objects.filter(access_date__lt=now() - timedelta(hours=hours)).delete()
+
+
+@shared_task
+def prepare_source_code(decision_id):
+    PrepareSourceCode(decision_id)
+
+
+@shared_task
+def fill_leaf_signatures(decision_id):
+    LeafSignatures(Decision.objects.get(id=decision_id)).fill()
+
+
+@shared_task
+def build_error_trace_indexes(reports_ids):
+    # Most users don't change default error trace visualization settings
+    default_settings = etv_settings()
+    for report in ReportUnsafe.objects.filter(id__in=reports_ids):
+        try:
+            build_error_trace_index(report, default_settings)
+        except Exception as e:
+            logger.exception(e)
+
+
+@shared_task
+def clear_old_error_trace_index_cache(hours):
+    ErrorTraceIndexCache.objects.filter(access_date__lt=now() - timedelta(hours=hours))\
+        .exclude(settings=etv_settings_key(etv_settings())).delete()
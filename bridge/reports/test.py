@@ -22,16 +22,47 @@ from multiprocessing import Process, Pipe
 import random
 import requests
 import time
-from io import BytesIO
+import tracemalloc
+import zipfile
+from collections import Counter
+from io import BytesIO, BufferedReader, RawIOBase
+from unittest import mock
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.db.models import Q
-from django.test import Client
+from django.template import loader
+from django.test import Client, SimpleTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.timezone import now
 
-from bridge.vars import SCHEDULER_TYPE, JOB_ROLES
-from bridge.utils import KleverTestCase, logger, RMQConnect
+from rest_framework import exceptions
+
+from bridge.vars import (
+    SCHEDULER_TYPE, JOB_ROLES, COMPARE_VERDICT, DECISION_STATUS, DECISION_WEIGHT, PRESET_JOB_TYPE, PRIORITY,
+    ERROR_TRACE_FILE, USER_ROLES
+)
+from bridge.utils import KleverTestCase, BridgeException, logger, RMQConnect
+from bridge.json_stream import basic_parse, json_value
+
+from users.models import User
+from jobs.models import PresetJob, Job, JobFile, Scheduler, Decision
+from reports.models import (
+    Computer, Report, ReportComponent, ReportSafe, ReportUnsafe, ReportUnknown, ReportAttr, ReportComponentLeaf,
+    CoverageStatistics, OriginalSources, SourceCodeCache, LeafSignature, ComparisonObject, ComparisonLink
+)
+from caches.models import ReportSafeCache, ReportUnknownCache
+
+from reports.comparison import FillComparisonCache, ComparisonData, comparison_verdict, merge_signatures
+from reports.coverage import ROOT_DIRS_ORDER, CoverageStatisticsTree, parse_coverage_file
+from reports.etv import GetETV, ErrorTraceIndex, ErrorTraceWindow, read_index_window, etv_settings
+from reports.source import SourceCodeData, ParseSource, SourceLine, extract_file, index_rows
+from reports.trace_validator import ErrorTraceValidator, ErrorTraceError
+from reports.utils import SafesTable
 
 
 LINUX_ATTR = {'name': 'Linux kernel', 'value': [
@@ -40,6 +71,13 @@ LINUX_ATTR = {'name': 'Linux kernel', 'value': [
     {'name': 'Configuration', 'value': 'allmodconfig'}
 ]}
 LKVOG_ATTR = {'name': 'LKVOG strategy', 'value': [{'name': 'Name', 'value': 'separate modules'}]}
+# Size of the synthetic error trace and the memory ceiling for its validation
+SYNTHETIC_TRACE_SIZE = 32 * 1024 * 1024
+SYNTHETIC_TRACE_MEMORY = 16 * 1024 * 1024
+
+# Maximum number of seconds to build coverage statistics for 50000 files
+COVERAGE_BENCHMARK_TIME = 30
+
 COMPUTER = {
     'identifier': 'hellwig.intra.ispras.ru',
     'display': 'hellwig.intra.ispras.ru',
@@ -1862,3 +1900,773 @@ class TestCreateImages:
             resp.close()
             raise ResponseError('Unexpected status code returned: {}'.format(resp.status_code))
         return resp
+
+
+def create_job():
+    preset = PresetJob.objects.create(name='Preset', type=PRESET_JOB_TYPE[1][0], check_date=now())
+    return Job.objects.create(preset=preset, name='Job')
+
+
+def create_decision(job, **kwargs):
+    # Decision of the job without reports
+    return Decision.objects.create(
+        job=job, scheduler=Scheduler.objects.get_or_create(type=SCHEDULER_TYPE[0][0])[0],
+        configuration=JobFile.objects.get_or_create(hash_sum='hash', defaults={'file': 'conf.json'})[0],
+        priority=PRIORITY[0][0], **kwargs
+    )
+
+
+def create_computer():
+    return Computer.objects.create(identifier=COMPUTER['identifier'], display='', data=COMPUTER['data'])
+
+
+class TestLeavesBatch(KleverTestCase):
+    def setUp(self):
+        super().setUp()
+        self.job = create_job()
+
+    def __create_decision(self):
+        decision = create_decision(self.job)
+        computer = create_computer()
+        parent = None
+        for i, (identifier, component) in enumerate([('/', 'Core'), ('/vtg', 'VTG'), ('/vtg/w', 'VTGW')]):
+            parent = ReportComponent.objects.create(
+                decision=decision, parent=parent, identifier=identifier, component=component, computer=computer,
+                verification=(component == 'VTGW'), cpu_time=10, wall_time=20, memory=30
+            )
+            ReportAttr.objects.create(report=parent, name='Attr{}'.format(i), value=identifier, compare=True)
+        return decision
+
+    def __reports(self):
+        reports = []
+        for i in range(5):
+            attrs = [{'name': 'Verdict number', 'value': str(i), 'compare': True}]
+            if i == 0:
+                # Redefine compare flag of the inherited attribute
+                attrs.append({'name': 'Attr0', 'value': '/', 'associate': True})
+            reports.append({
+                'type': 'safe', 'parent': '/vtg/w', 'identifier': '/vtg/w/safe{}'.format(i), 'attrs': attrs
+            })
+        for parent in ['/vtg/w', '/vtg']:
+            reports.append({
+                'type': 'unknown', 'parent': parent, 'identifier': '{}/unknown'.format(parent),
+                'attrs': [], 'problem_description': 'problem.zip'
+            })
+        return reports
+
+    def __upload(self, decision):
+        # Reports uploading imports this module to log uploading
+        from reports.UploadReport import UploadReports
+
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, mode='w') as zfp:
+            zfp.writestr('problem desc.txt', 'Problem')
+        uploader = UploadReports(decision)
+        uploader.validate_archives(['problem.zip'], {
+            'problem.zip': SimpleUploadedFile('problem.zip', archive.getvalue())
+        })
+        upload_one = getattr(UploadReports, '_UploadReports__upload')
+        with mock.patch.object(UploadReports, '_UploadReports__connect_leaves'), \
+                mock.patch.object(UploadReports, '_UploadReports__upload', autospec=True,
+                                  side_effect=upload_one) as upload_mock:
+            uploader.upload_all(self.__reports())
+        # Return the number of reports uploaded one by one
+        return upload_mock.call_count
+
+    def __state(self, decision):
+        reports = dict(Report.objects.filter(decision=decision).values_list('id', 'identifier'))
+        return {
+            'reports': set(
+                (reports[r.id], reports.get(r.parent_id), r.cpu_time, r.wall_time, r.memory, r.level)
+                for r in Report.objects.filter(decision=decision)
+            ),
+            'attrs': sorted(
+                (reports[a.report_id], a.name, a.value, a.compare, a.associate)
+                for a in ReportAttr.objects.filter(report__decision=decision)
+            ),
+            'caches': sorted(
+                (reports[c.report_id], sorted(c.attrs.items()))
+                for model in (ReportSafeCache, ReportUnknownCache) for c in model.objects.filter(decision=decision)
+            ),
+            'leaves': sorted(
+                (reports[leaf.report_id], reports[leaf.object_id])
+                for leaf in ReportComponentLeaf.objects.filter(report__decision=decision)
+            )
+        }
+
+    def test_bulk_upload(self):
+        # Upload reports one by one
+        decision1 = self.__create_decision()
+        with mock.patch('reports.UploadReport.UPLOAD_BATCH_SIZE', 1):
+            self.assertEqual(self.__upload(decision1), len(self.__reports()))
+
+        # Upload all leaves in one batch
+        decision2 = self.__create_decision()
+        self.assertEqual(self.__upload(decision2), 0)
+
+        self.assertEqual(self.__state(decision1), self.__state(decision2))
+
+    def test_corrupted_archive(self):
+        # Reports uploading imports this module to log uploading
+        from reports.UploadReport import UploadReports
+
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, mode='w') as zfp:
+            zfp.writestr(ERROR_TRACE_FILE, '{"files": []}')
+        content = archive.getvalue().replace(b'files', b'fileZ', 1)
+
+        uploader = UploadReports(self.__create_decision())
+        with self.assertRaises(exceptions.ValidationError):
+            uploader.validate_archives(['trace.zip'], {'trace.zip': SimpleUploadedFile('trace.zip', content)})
+        # CRC of error traces is checked later
+        uploader.validate_archives(['trace.zip'], {'trace.zip': SimpleUploadedFile('trace.zip', content)}, [
+            {'type': 'unsafe', 'parent': '/vtg/w', 'identifier': '/vtg/w/unsafe', 'error_trace': 'trace.zip'}
+        ])
+
+    def test_failed_batch(self):
+        def problem_descriptions():
+            files = set()
+            for dir_path, _, file_names in os.walk(os.path.join(settings.MEDIA_ROOT, 'Unknowns')):
+                files.update(os.path.normpath(os.path.join(dir_path, file_name)) for file_name in file_names)
+            return files
+
+        files_before = problem_descriptions()
+        decision = self.__create_decision()
+        with mock.patch('reports.UploadReport.LeavesBatch.save', side_effect=RuntimeError('Batch failed')):
+            # Reports are uploaded one by one after the batch failure
+            self.assertEqual(self.__upload(decision), len(self.__reports()))
+
+        # Files stored by the failed batch are removed
+        unknowns = ReportUnknown.objects.filter(decision=decision)
+        self.assertEqual(len(unknowns), 2)
+        self.assertEqual(problem_descriptions() - files_before, set(
+            os.path.normpath(unknown.problem_description.path) for unknown in unknowns
+        ))
+
+
+class SyntheticErrorTrace(RawIOBase):
+    # Error trace JSON of the given size that is generated on the fly
+    statement = b'{"type": "statement", "line": 12345, "file": 0, "source": "x = y + 1;", ' \
+                b'"notes": [{"text": "Note", "level": 1}]}'
+    function_call = b'{"type": "function call", "line": 1, "file": 0, "source": "f();", "display": "f", "children": ['
+
+    def __init__(self, size, depth):
+        super().__init__()
+        self._chunks = self.__generate(size, depth)
+        self._buf = b''
+
+    def __generate(self, size, depth):
+        yield b'{"files": ["main.c"], "trace": {"type": "thread", "thread": "1", "children": ['
+        written = 0
+        while written < size:
+            statements = b','.join([self.statement] * 1000)
+            yield self.function_call * depth + statements + b']}' * depth + b','
+            written += (len(self.function_call) + 2) * depth + len(statements)
+        yield self.statement + b']}}'
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buf:
+            self._buf = next(self._chunks, None)
+            if self._buf is None:
+                return 0
+        size = min(len(b), len(self._buf))
+        b[:size] = self._buf[:size]
+        self._buf = self._buf[size:]
+        return size
+
+
+class TestErrorTraceValidator(SimpleTestCase):
+    def __validate(self, error_trace):
+        return ErrorTraceValidator(BytesIO(json.dumps(error_trace).encode('utf8'))).statistics
+
+    def test_errors(self):
+        thread = {'type': 'thread', 'thread': '1', 'children': []}
+        for error_trace, error in [
+            ('{"files": [', 'file does not exist or it is wrong JSON'),
+            ([], 'error trace is not a dictionary'),
+            ({'trace': None}, 'error trace does not have files or it is not a list'),
+            ({'files': []}, 'error trace does not have "trace"'),
+            ({'files': [], 'trace': dict(thread, children=[1])}, 'node is not a dictionary'),
+            ({'files': [], 'trace': dict(thread, type='action')}, 'node field "line" is required'),
+            ({'files': [], 'trace': {'type': 'statement', 'line': 1, 'file': 0, 'source': 'x;'}},
+             'root error trace node type should be a "thread"'),
+            ({'files': [], 'trace': dict(thread, children=[{'type': 'declarations', 'children': [thread]}])},
+             'declarations child has type "thread"'),
+            ({'files': [], 'trace': dict(thread, notes=[{'text': 'Note', 'level': -1}])},
+             'note should have an unsigned int level')
+        ]:
+            with self.assertRaisesMessage(ErrorTraceError, error):
+                if isinstance(error_trace, str):
+                    ErrorTraceValidator(BytesIO(error_trace.encode('utf8')))
+                else:
+                    self.__validate(error_trace)
+        self.assertEqual(self.__validate({'files': [], 'trace': None})['nodes'], 0)
+
+    def test_chunks(self):
+        # Tokens are split at every possible position between chunks
+        data = '[12.5, 1e5, -0.25E-3, 1E+2, 0, true, null, "a\\"b\\u0444", {"key": [10, "\u0444"], "": false}]'
+        encoded = data.encode('utf8')
+        for chunk_size in range(1, len(encoded) + 1):
+            events = basic_parse(BytesIO(encoded), chunk_size)
+            self.assertEqual(json_value(events, *next(events)), json.loads(data))
+
+    def test_statistics(self):
+        error_trace = {'files': ['main.c'], 'global variable declarations': [
+            {'line': 1, 'file': 0, 'source': 'int x;'}
+        ], 'trace': {'children': [
+            {'type': 'thread', 'thread': '2', 'children': [
+                {'type': 'statement', 'line': 100, 'file': 0, 'source': 'x;'}
+            ]},
+            {'type': 'thread', 'thread': '3', 'children': []},
+            {'type': 'thread', 'thread': '2', 'children': []}
+        ], 'type': 'thread', 'thread': '1'}}
+        stats = self.__validate(error_trace)
+        index = ErrorTraceIndex(json.loads(json.dumps(error_trace)), etv_settings())
+        self.assertEqual(stats['threads'], index.threads)
+        self.assertEqual(stats['max_line_len'], index.max_line_len)
+        self.assertEqual(stats['nodes'], 5)
+
+    def test_bounded_memory(self):
+        # The trace is much bigger than the memory ceiling and deeper than the recursion limit
+        tracemalloc.start()
+        try:
+            stats = ErrorTraceValidator(BufferedReader(SyntheticErrorTrace(SYNTHETIC_TRACE_SIZE, 2000))).statistics
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(stats['threads'], ['1'])
+        self.assertGreater(stats['nodes'], SYNTHETIC_TRACE_SIZE // len(SyntheticErrorTrace.statement))
+        self.assertLess(peak, SYNTHETIC_TRACE_MEMORY)
+
+
+def coverage_statistics_in_python(statistics):
+    # Reference implementation of the coverage statistics tree which scans all objects for each directory
+    cnt = 0
+    new_objects = {}
+    for fname, cov_data in statistics.items():
+        if len(cov_data) == 4:
+            cov_lines, tot_lines, cov_funcs, tot_func = cov_data
+        else:
+            cov_lines = cov_funcs = None
+            tot_lines, tot_func = cov_data
+        path_l = tuple(fname.split('/'))
+        for i in range(len(path_l)):
+            curr_path = path_l[:(i + 1)]
+            if curr_path not in new_objects:
+                cnt += 1
+                new_objects[curr_path] = CoverageStatistics(
+                    identifier=cnt, parent=new_objects[path_l[:i]].identifier if i > 0 else None,
+                    is_leaf=bool(i + 1 == len(path_l)), name=path_l[i], path='/'.join(curr_path), depth=len(curr_path)
+                )
+            if cov_lines is not None and cov_funcs is not None:
+                new_objects[curr_path].lines_covered += cov_lines
+                new_objects[curr_path].lines_total += tot_lines
+                new_objects[curr_path].funcs_covered += cov_funcs
+                new_objects[curr_path].funcs_total += tot_func
+                new_objects[curr_path].lines_covered_extra += cov_lines
+                new_objects[curr_path].funcs_covered_extra += cov_funcs
+            new_objects[curr_path].lines_total_extra += tot_lines
+            new_objects[curr_path].funcs_total_extra += tot_func
+
+    ordered_objects_list = list(sorted(new_objects.values(), key=lambda x: (x.is_leaf, x.name)))
+
+    def get_all_children(covstat_obj):
+        children = []
+        if covstat_obj.is_leaf:
+            return children
+        for obj in ordered_objects_list:
+            if obj.parent == covstat_obj.identifier:
+                children.append(obj)
+                children.extend(get_all_children(obj))
+        return children
+
+    ordered_objects = []
+    for root_name in ROOT_DIRS_ORDER:
+        if (root_name,) in new_objects:
+            ordered_objects.append(new_objects[(root_name,)])
+            ordered_objects.extend(get_all_children(new_objects[(root_name,)]))
+    return ordered_objects
+
+
+class TestCoverageStatistics(SimpleTestCase):
+    fields = [
+        'identifier', 'parent', 'is_leaf', 'name', 'path', 'depth', 'lines_covered', 'lines_total', 'funcs_covered',
+        'funcs_total', 'lines_covered_extra', 'lines_total_extra', 'funcs_covered_extra', 'funcs_total_extra'
+    ]
+
+    def __statistics(self, files_number, seed):
+        rnd = random.Random(seed)
+        roots = ['source files', 'specifications', 'generated models', 'other']
+        dirs = ['drivers', 'net', 'fs', 'include', 'usb', 'core', 'a.c']
+        statistics = {}
+        while len(statistics) < files_number:
+            path = [rnd.choice(roots)] + list(rnd.choice(dirs) for _ in range(rnd.randint(0, 6)))
+            path.append('file{}.c'.format(rnd.randint(0, files_number)))
+            lines, funcs = rnd.randint(0, 1000), rnd.randint(0, 50)
+            if rnd.random() < 0.8:
+                statistics['/'.join(path)] = [rnd.randint(0, lines), lines, rnd.randint(0, funcs), funcs]
+            else:
+                statistics['/'.join(path)] = [lines, funcs]
+        return statistics
+
+    def __rows(self, objects):
+        return list(tuple(getattr(obj, field) for field in self.fields) for obj in objects)
+
+    def __tree(self, statistics):
+        tree = CoverageStatisticsTree(None)
+        data = parse_coverage_file(BytesIO(json.dumps({
+            'format': 1, 'coverage statistics': statistics, 'most covered lines': ['a', 'b'],
+            'data statistics': {'data': [1, {'a': None}]}
+        }).encode('utf8')), tree)
+        self.assertEqual(data, {
+            'format': 1, 'coverage statistics': True, 'data statistics': {'data': [1, {'a': None}]}
+        })
+        return tree
+
+    def test_order(self):
+        for seed in range(5):
+            statistics = self.__statistics(2000, seed)
+            expected = self.__rows(coverage_statistics_in_python(statistics))
+            self.assertEqual(self.__rows(self.__tree(statistics).ordered_objects()), expected)
+
+    def test_benchmark(self):
+        statistics = self.__statistics(50000, 0)
+        start = time.time()
+        objects = self.__tree(statistics).ordered_objects()
+        logger.info('Coverage statistics tree for 50000 files is built in {:.2f}s'.format(time.time() - start))
+        self.assertGreater(len(objects), 0)
+        self.assertLess(time.time() - start, COVERAGE_BENCHMARK_TIME)
+
+
+class TestSourceCodeCache(KleverTestCase):
+    def test_shared_cache(self):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, mode='w') as zfp:
+            zfp.writestr('src/a.c', 'int main(void)\n{\n\treturn 0;\n}\n')
+        sources = OriginalSources(identifier='sources')
+        sources.add_archive(BytesIO(archive.getvalue()), save=True)
+
+        # Reports with the same original sources share cached source code
+        with mock.patch('reports.source.extract_file', wraps=extract_file) as extract_mock:
+            data = list(SourceCodeData('src/a.c', [ReportComponent(id=i, original_sources=sources)]).data
+                        for i in range(3))
+        self.assertEqual(data[0], data[1])
+        self.assertEqual(data[0], data[2])
+        self.assertEqual(len(data[0]['lines']), 5)
+        self.assertEqual(SourceCodeCache.objects.count(), 1)
+        # The source file and its index were extracted just once
+        self.assertEqual(extract_mock.call_count, 2)
+        self.assertIsNone(SourceCodeData('src/b.c', [ReportComponent(id=1, original_sources=sources)]).data)
+
+        # Coverage is added to cached lines for each request
+        parsed = ParseSource(User(), 'src/a.c', data[0], [], False)
+        self.assertEqual(list(line['code'] for line in parsed.source_lines), data[0]['lines'])
+        self.assertEqual(list(line['number'] for line in parsed.source_lines), [1, 2, 3, 4, 5])
+        self.assertIsNone(parsed.coverage_id)
+
+        SourceCodeCache.objects.all().delete()
+        sources.delete()
+
+
+def comparison_in_python(leaves1, leaves2):
+    # Reference implementation of decisions comparison
+    unmatched = COMPARE_VERDICT[4][0]
+    return dict((values, (
+        comparison_verdict(leaves1[values]) if values in leaves1 else unmatched,
+        comparison_verdict(leaves2[values]) if values in leaves2 else unmatched
+    )) for values in set(leaves1) | set(leaves2))
+
+
+class TestDecisionsComparison(KleverTestCase):
+    def setUp(self):
+        super().setUp()
+        self.random = random.Random(2019)
+        self.job = create_job()
+
+    def __create_decision(self, status):
+        decision = create_decision(self.job, status=status)
+        leaves = {}
+        attrs = []
+        for i in range(100):
+            leaf_type = self.random.choice(['safe', 'unsafe', 'unknown'])
+            identifier = '/{}{}'.format(leaf_type, i)
+            if leaf_type == 'safe':
+                report = ReportSafe.objects.create(decision=decision, identifier=identifier)
+            elif leaf_type == 'unsafe':
+                report = ReportUnsafe.objects.create(
+                    decision=decision, identifier=identifier, error_trace='error-trace.zip'
+                )
+            else:
+                report = ReportUnknown.objects.create(
+                    decision=decision, identifier=identifier, component='Core',
+                    problem_description='problem-description.zip'
+                )
+            values = (self.random.choice(['a', 'b', 'c']), self.random.choice(['x', 'y', '-']))
+            attrs.append(ReportAttr(report=report, name='Attr1', value=values[0], compare=True))
+            if values[1] != '-':
+                attrs.append(ReportAttr(report=report, name='Attr2', value=values[1], compare=True))
+            leaves.setdefault(values, [])
+            leaves[values].append({'id': report.id, 'type': leaf_type})
+        ReportAttr.objects.bulk_create(attrs)
+        return decision, leaves
+
+    def test_merge_signatures(self):
+        signatures1 = [LeafSignature(signature=s, values=[str(s)]) for s in [1, 3, 4, 7]]
+        signatures2 = [LeafSignature(signature=s, values=[str(s)]) for s in [2, 3, 7, 8]]
+        # Hash collision
+        signatures2[1].values = ['collision']
+        self.assertEqual(list(
+            (sign1.signature if sign1 else None, sign2.signature if sign2 else None)
+            for sign1, sign2 in merge_signatures(iter(signatures1), iter(signatures2))
+        ), [(1, None), (None, 2), (3, None), (None, 3), (4, None), (7, 7), (None, 8)])
+
+    def test_comparison(self):
+        decision1, leaves1 = self.__create_decision(DECISION_STATUS[3][0])
+        decision2, leaves2 = self.__create_decision(DECISION_STATUS[2][0])
+        user = User.objects.create(username='user')
+        info = FillComparisonCache(user, decision1, decision2).info
+
+        # Signatures are saved just for finished decisions
+        self.assertEqual(LeafSignature.objects.filter(decision=decision1).count(), len(leaves1))
+        self.assertEqual(LeafSignature.objects.filter(decision=decision2).count(), 0)
+
+        self.assertEqual(info.names, ['Attr1', 'Attr2'])
+        expected = comparison_in_python(leaves1, leaves2)
+        objects = ComparisonObject.objects.filter(info=info)
+        self.assertEqual(dict((tuple(obj.values), (obj.verdict1, obj.verdict2)) for obj in objects), expected)
+        for obj in objects:
+            self.assertEqual(
+                set(ComparisonLink.objects.filter(comparison=obj).values_list('object_id', flat=True)),
+                set(r['id'] for r in leaves1.get(tuple(obj.values), []) + leaves2.get(tuple(obj.values), []))
+            )
+
+        # Comparison objects are numbered within each pair of verdicts
+        verdicts = Counter(expected.values())
+        for (verdict1, verdict2), number in verdicts.items():
+            self.assertEqual(sorted(objects.filter(verdict1=verdict1, verdict2=verdict2)
+                                    .values_list('number', flat=True)), list(range(1, number + 1)))
+            with mock.patch.object(ComparisonData, '_ComparisonData__get_trees', return_value=(None, None)):
+                data = ComparisonData(info, number, 0, 1, verdict='{}_{}'.format(verdict1, verdict2))
+            self.assertEqual(data.comparison.number, number)
+            self.assertEqual(data.pages['total'], number)
+            self.assertFalse(data.pages['forward'])
+
+
+def random_error_trace(rnd, nodes_number=300):
+    # Generate error trace with all kinds of nodes
+    nodes = []
+
+    def new_node(node_type, **kwargs):
+        nodes.append(node_type)
+        node = {'type': node_type, 'line': rnd.randint(1, 20000), 'file': rnd.randint(0, 2), **kwargs}
+        if node_type in {'statement', 'declaration', 'function call'}:
+            node['source'] = rnd.choice(['a = b + 1;', 'x->y = &z;', 'return 0;', 'if (a < b)', 'f(\t"s", 1)'])
+            if rnd.random() < 0.3:
+                node['display'] = 'Display {}'.format(rnd.randint(0, 9))
+            if rnd.random() < 0.3:
+                node['assumption'] = ';'.join(rnd.sample(['a == 1', 'b > 0', 'c != 2', 'd'], rnd.randint(1, 2)))
+            if rnd.random() < 0.2:
+                node['condition'] = True
+            if rnd.random() < 0.2:
+                node['highlight'] = [['K', 0, 1]]
+            if rnd.random() < 0.4:
+                node['notes'] = list({'level': rnd.randint(0, 3), 'text': 'Note {}'.format(rnd.randint(0, 99))}
+                                     for _ in range(rnd.randint(1, 3)))
+            if rnd.random() < 0.2:
+                node['hide'] = True
+        return node
+
+    def new_children(depth):
+        children = []
+        for _ in range(rnd.randint(0, 5)):
+            if len(nodes) > nodes_number:
+                break
+            kind = rnd.random()
+            if depth < 6 and kind < 0.25:
+                children.append(new_node(
+                    'function call', display='func{}'.format(rnd.randint(0, 9)), children=new_children(depth + 1)
+                ))
+            elif depth < 6 and kind < 0.35:
+                children.append(new_node(
+                    'action', display='Action', relevant=(rnd.random() < 0.3), children=new_children(depth + 1)
+                ))
+            elif kind < 0.45:
+                nodes.append('declarations')
+                children.append({'type': 'declarations', 'children': list(
+                    new_node('declaration') for _ in range(rnd.randint(0, 6))
+                )})
+            else:
+                children.append(new_node('statement'))
+        return children
+
+    threads = list({'type': 'thread', 'thread': str(i + 1), 'children': new_children(0) + new_children(0)}
+                   for i in range(rnd.randint(1, 3)))
+    threads[0]['children'].extend(threads[1:])
+    error_trace = {'format': 1, 'files': ['a.c', 'b.c', 'c.h'], 'trace': threads[0]}
+    if rnd.random() < 0.5:
+        error_trace['global variable declarations'] = list(
+            new_node('declaration') for _ in range(rnd.randint(0, 6))
+        )
+    return error_trace
+
+
+class TestErrorTraceWindows(SimpleTestCase):
+    def test_windows(self):
+        template = loader.get_template('reports/ErrorTraceRows.html')
+        rnd = random.Random(2019)
+        for _ in range(30):
+            error_trace = random_error_trace(rnd)
+            user = User(
+                notes_level=rnd.randint(0, 3), declarations_number=rnd.randint(0, 4),
+                triangles=(rnd.random() < 0.5), assumptions=(rnd.random() < 0.5)
+            )
+            full_etv = GetETV(json.dumps(error_trace), user)
+
+            index_data = BytesIO()
+            with mock.patch('reports.etv.ETV_WINDOW_SIZE', rnd.randint(1, 50)):
+                ErrorTraceIndex(error_trace, etv_settings(user)).save(index_data)
+
+            # Render all windows of the saved index
+            windows = []
+            while not windows or len(windows) < windows[0].windows:
+                index_data.seek(0)
+                windows.append(ErrorTraceWindow(*read_index_window(index_data, len(windows)), window=len(windows)))
+
+            concatenated = windows[0]
+            concatenated.html_trace = list(row for etv in windows for row in etv.html_trace)
+            self.assertEqual(concatenated.html_trace, full_etv.html_trace)
+            self.assertEqual(concatenated.shown_scopes, full_etv.shown_scopes)
+            self.assertEqual(concatenated.assumptions, full_etv.assumptions)
+            self.assertEqual(template.render({'etv': concatenated}), template.render({'etv': full_etv}))
+            with self.assertRaises(ValueError):
+                index_data.seek(0)
+                read_index_window(index_data, len(windows))
+
+
+class TestErrorTraceWindowView(KleverTestCase):
+    def test_wrong_window(self):
+        # Producers can view their jobs
+        user = User.objects.create(username='user', role=USER_ROLES[1][0])
+        job = create_job()
+        job.author = user
+        job.save()
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, mode='w') as zfp:
+            zfp.writestr(ERROR_TRACE_FILE, json.dumps(random_error_trace(random.Random(2019))))
+        unsafe = ReportUnsafe.objects.create(
+            decision=create_decision(job), identifier='/unsafe',
+            error_trace=SimpleUploadedFile('error-trace.zip', archive.getvalue())
+        )
+
+        self.client.force_login(user)
+        url = reverse('reports:api-etv-window', args=[unsafe.id])
+        self.assertEqual(self.client.get(url, {'window': 0}).status_code, 200)
+        for window in ('first', '-1', '1'):
+            response = self.client.get(url, {'window': window})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('window', response.json())
+
+
+class TestSourcesIndex(SimpleTestCase):
+    def test_columns(self):
+        rows = {
+            'format': 1,
+            'source files': ['source files/a.h'],
+            'highlight': [['K', 1, 0, 6], ['N', 1, 7, 8], ['MacroDefRefTo', 2, 4, 8], ['N', 2, 9, 10]],
+            'referencesto': [[[2, 4, 8], [0, 3]]],
+            'referencestodeclarations': [[[1, 7, 8], [None, [2]]]],
+            'referencesfrom': [[[1, 7, 8], [0, [5, 6]], [None, [2]]]]
+        }
+        columns = {
+            'format': 2,
+            'source files': ['source files/a.h'],
+            'highlight': {
+                'kinds': ['K', 'N', 'MacroDefRefTo'], 'kind': [0, 1, 2, 1],
+                'line': [1, 1, 2, 2], 'start': [0, 7, 4, 9], 'end': [6, 8, 8, 10]
+            },
+            'referencesto': {'line': [2], 'start': [4], 'end': [8], 'file': [0], 'file line': [3]},
+            'referencestodeclarations': {'line': [1], 'start': [7], 'end': [8], 'file': [None], 'file line': [2]},
+            'referencesfrom': {'line': [1], 'start': [7], 'end': [8], 'refs': [[[0, [5, 6]], [None, [2]]]]}
+        }
+        self.assertEqual(index_rows(columns), rows)
+        self.assertEqual(index_rows({'format': 2}), {
+            'format': 1, 'highlight': [], 'referencesto': [], 'referencestodeclarations': [], 'referencesfrom': []
+        })
+
+        # Lines are rendered in the same way
+        for line_num, code in enumerate(['static x;', '    ABCD y;'], start=1):
+            def line_data(data, ref_type):
+                return list(ref for ref in data[ref_type] if ref[0][0] == line_num)
+
+            html = list(SourceLine(
+                code, highlights=list(h[0:1] + h[2:] for h in data['highlight'] if h[1] == line_num),
+                filename='a.c', line=line_num, references_to=line_data(data, 'referencesto'),
+                references_from=line_data(data, 'referencesfrom'),
+                references_declarations=line_data(data, 'referencestodeclarations')
+            ).html_code for data in (rows, index_rows(columns)))
+            self.assertEqual(html[0], html[1])
+
+
+class TestLeavesPagination(KleverTestCase):
+    # Queries to count leaves, to get leaves of the page and to get their attributes
+    FIRST_PAGE_QUERIES = 3
+    # Leaves are counted just for the first page
+    PAGE_QUERIES = 2
+    # Indexes to select leaves of the root report and of other reports
+    LEAVES_INDEXES = {'report_decision_id_idx', 'cache_leaf_report_object_idx'}
+
+    def setUp(self):
+        super().setUp()
+        self.random = random.Random(2019)
+        self.user = User.objects.create(username='user')
+        decision = create_decision(create_job(), weight=DECISION_WEIGHT[1][0])
+        computer = create_computer()
+        self.root = ReportComponent.objects.create(
+            decision=decision, identifier='/', component='Core', computer=computer
+        )
+        self.vtg = ReportComponent.objects.create(
+            decision=decision, parent=self.root, identifier='/vtg', component='VTG', computer=computer
+        )
+
+        # Safe identifier -> (CPU time, requirement)
+        self.safes = {}
+        content_type = ContentType.objects.get_for_model(ReportSafe)
+        for i in range(50):
+            # Some leaves have the same CPU time and some leaves do not have CPU time or requirement at all
+            cpu_time = self.random.choice([None, 10, 20, self.random.randint(0, 1000)])
+            requirement = self.random.choice([None, 'linux:mutex', 'linux:spinlock'])
+            safe = ReportSafe.objects.create(
+                decision=decision, parent=self.vtg, identifier='/vtg/safe{}'.format(i), cpu_time=cpu_time
+            )
+            ReportSafeCache.objects.create(
+                decision=decision, report=safe, attrs={'Requirement': requirement} if requirement else {}
+            )
+            ReportComponentLeaf.objects.bulk_create(list(
+                ReportComponentLeaf(report=parent, content_type=content_type, object_id=safe.id)
+                for parent in (self.root, self.vtg)
+            ))
+            self.safes[safe.id] = (cpu_time, requirement)
+
+    def __expected(self, ordering=None, descending=False, safes=None):
+        def key(safe_id):
+            if ordering is None:
+                return safe_id,
+            value = self.safes[safe_id][ordering]
+            # NULL values are the greatest ones
+            return value is None, value or 0, safe_id
+        return sorted(safes if safes is not None else self.safes, key=key, reverse=descending)
+
+    def __view(self, **kwargs):
+        view = {'is_unsaved': True, 'elements': [7], 'columns': ['report_verdict', 'verifier:cpu']}
+        view.update(kwargs)
+        return view
+
+    def __table(self, report, view, params, queries):
+        with CaptureQueriesContext(connection) as context:
+            table = SafesTable(self.user, report, view, params)
+            # Links to neighbour pages and the number of pages are rendered with the page
+            self.assertGreaterEqual(table.page.paginator.num_pages, 1)
+            if table.page.has_next():
+                table.page.next_page_number()
+            if table.page.has_previous():
+                table.page.previous_page_number()
+        self.assertEqual(len(context.captured_queries), queries)
+
+        # Leaves of the page are selected with LIMIT rather than by skipping leaves of previous pages
+        sql = next(query['sql'] for query in context.captured_queries if 'LIMIT' in query['sql'])
+        self.assertNotIn('OFFSET', sql)
+        # Tables are small, so make the planner use indexes if they fit the query
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_sort = off')
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+            nodes = [cursor.fetchone()[0][0]['Plan']]
+            cursor.execute('RESET enable_seqscan')
+            cursor.execute('RESET enable_sort')
+        for node in nodes:
+            nodes.extend(node.get('Plans', []))
+        self.assertEqual(nodes[0]['Node Type'], 'Limit')
+        node_types = set(node['Node Type'] for node in nodes)
+        self.assertNotIn('Seq Scan', node_types)
+        self.assertTrue(any(
+            node.get('Index Name') in self.LEAVES_INDEXES or node.get('Index Name', '').endswith('_gin')
+            for node in nodes
+        ))
+        # Leaves are ordered by identifiers with indexes, other orderings require sorting of filtered leaves
+        if 'order' not in view:
+            self.assertNotIn('Sort', node_types)
+        return table
+
+    def __pages(self, report, view, params=None, backward=False):
+        params = dict(params or {})
+        params['page'] = 'last' if backward else '1'
+        table = self.__table(report, view, params, self.FIRST_PAGE_QUERIES)
+        pages = [table.page]
+        while table.page.has_previous() if backward else table.page.has_next():
+            params['page'] = table.page.previous_page_number() if backward else table.page.next_page_number()
+            table = self.__table(report, view, params, self.PAGE_QUERIES)
+            pages.append(table.page)
+
+        if backward:
+            pages.reverse()
+        self.assertEqual(list(page.number for page in pages), list(range(1, len(pages) + 1)))
+        self.assertEqual(len(pages), pages[0].paginator.num_pages)
+        return list(safe.id for page in pages for safe in page)
+
+    def test_orderings(self):
+        for report in (self.root, self.vtg):
+            for backward in (False, True):
+                self.assertEqual(self.__pages(report, self.__view(), backward=backward), self.__expected())
+                self.assertEqual(
+                    self.__pages(report, self.__view(order=['up', 'parent_cpu', '']), backward=backward),
+                    self.__expected(0, True)
+                )
+                self.assertEqual(
+                    self.__pages(report, self.__view(order=['down', 'attr', 'Requirement']), backward=backward),
+                    self.__expected(1)
+                )
+
+    def test_filters(self):
+        spinlock = list(safe_id for safe_id, (_, requirement) in self.safes.items() if requirement == 'linux:spinlock')
+        self.assertEqual(self.__pages(
+            self.root, self.__view(order=['up', 'parent_cpu', '']),
+            {'attr_name': 'Requirement', 'attr_value': 'linux:spinlock'}
+        ), self.__expected(0, True, spinlock))
+
+        # Pages that are referred by numbers are still available
+        table = SafesTable(self.user, self.root, self.__view(), {'page': '3'})
+        self.assertEqual(list(safe.id for safe in table.page), self.__expected()[14:21])
+        with self.assertRaises(BridgeException):
+            SafesTable(self.user, self.root, self.__view(), {'page': 'kwrong'})
+
+    def test_out_of_range(self):
+        # Numbers of pages that do not exist any more refer to the last page
+        table = SafesTable(self.user, self.root, self.__view(), {'page': '100'})
+        self.assertEqual(table.page.number, 8)
+        self.assertTrue(table.page.has_previous())
+        self.assertFalse(table.page.has_next())
+        self.assertEqual(list(safe.id for safe in table.page), self.__expected()[49:])
+
+        # The only page does not refer to the previous one
+        table = SafesTable(self.user, self.root, self.__view(elements=[100]), {'page': '2'})
+        self.assertEqual(table.page.number, 1)
+        self.assertFalse(table.page.has_previous())
+        self.assertFalse(table.page.has_next())
+        self.assertEqual(list(safe.id for safe in table.page), self.__expected())
+
+    def test_empty_table(self):
+        params = {'attr_name': 'Requirement', 'attr_value': 'linux:unknown'}
+        for page in ('1', '2', 'last'):
+            params['page'] = page
+            table = SafesTable(self.user, self.root, self.__view(), params)
+            self.assertEqual(len(table.page), 0)
+            self.assertEqual(table.page.number, 1)
+            self.assertEqual(table.page.paginator.num_pages, 1)
+            self.assertFalse(table.page.has_previous())
+            self.assertFalse(table.page.has_next())
+            # Links to neighbour pages are rendered with numbers as there are no leaves to get cursors
+            self.assertEqual(table.page.previous_page_number(), 0)
+            self.assertEqual(table.page.next_page_number(), 2)
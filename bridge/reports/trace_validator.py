@@ -0,0 +1,303 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from bridge.json_stream import json_events
+
+GLOBAL_THREAD = 'global'
+
+NODE_TYPES = {'function call', 'statement', 'action', 'thread', 'declaration', 'declarations'}
+REQUIRED_FIELDS = {
+    'function call': ['line', 'file', 'source', 'children', 'display'],
+    'statement': ['line', 'file', 'source'],
+    'declaration': ['line', 'file', 'source'],
+    'action': ['line', 'file', 'display'],
+    'declarations': ['children'],
+    'thread': ['thread']
+}
+NODE_FIELDS = {'type', 'line', 'file', 'source', 'children', 'display', 'thread', 'notes'}
+
+
+class ErrorTraceError(ValueError):
+    pass
+
+
+class _SkipFrame:
+    def __init__(self, validator):
+        self._validator = validator
+        self._depth = 0
+
+    def send(self, event, value):
+        if event in {'start_map', 'start_array'}:
+            self._depth += 1
+        elif event in {'end_map', 'end_array'}:
+            self._depth -= 1
+            if not self._depth:
+                self._validator.pop()
+
+
+class _ValueFrame:
+    # Builds the whole value, should be used just for small values
+    def __init__(self, validator, callback):
+        self._validator = validator
+        self._callback = callback
+        self._containers = []
+        self._keys = []
+
+    def send(self, event, value):
+        if event == 'map_key':
+            self._keys[-1] = value
+            return
+        if event in {'start_map', 'start_array'}:
+            self._containers.append({} if event == 'start_map' else [])
+            self._keys.append(None)
+            return
+        if event in {'end_map', 'end_array'}:
+            value = self._containers.pop()
+            self._keys.pop()
+        if not self._containers:
+            self._validator.pop()
+            self._callback(value)
+        elif isinstance(self._containers[-1], list):
+            self._containers[-1].append(value)
+        else:
+            self._containers[-1][self._keys[-1]] = value
+
+
+class _MapFrame:
+    # Collects values of the given fields, other fields are skipped
+    fields = set()
+
+    def __init__(self, validator):
+        self._validator = validator
+        self.data = {}
+        self.keys = 0
+        self._key = None
+
+    def send(self, event, value):
+        if event == 'start_map' and self._key is None:
+            return
+        if event == 'map_key':
+            self._key = value
+            self.keys += 1
+        elif event == 'end_map':
+            self._validator.pop()
+            self.finish()
+        else:
+            self.field_value(self._key, event, value)
+
+    def set_field(self, key, value):
+        self.data[key] = value
+
+    def field_value(self, key, event, value):
+        if key not in self.fields:
+            if event in {'start_map', 'start_array'}:
+                self._validator.push(_SkipFrame(self._validator), event, value)
+        elif event in {'start_map', 'start_array'}:
+            self._validator.push(_ValueFrame(self._validator, lambda val: self.set_field(key, val)), event, value)
+        else:
+            self.data[key] = value
+
+    def finish(self):
+        pass
+
+
+class _ArrayFrame:
+    def __init__(self, validator, item_frame):
+        self._validator = validator
+        self._item_frame = item_frame
+        self._started = False
+        self.length = 0
+
+    def send(self, event, value):
+        if not self._started:
+            self._started = True
+            return
+        if event == 'end_array':
+            self._validator.pop()
+            return
+        self.length += 1
+        if self._item_frame:
+            self._item_frame(event, value)
+        elif event in {'start_map', 'start_array'}:
+            self._validator.push(_SkipFrame(self._validator), event, value)
+
+
+class _DeclarationFrame(_MapFrame):
+    fields = {'line'}
+
+    def finish(self):
+        if 'line' in self.data:
+            self._validator.add_line(self.data['line'])
+
+
+class _NodeFrame(_MapFrame):
+    fields = NODE_FIELDS
+
+    def __init__(self, validator, parent=None):
+        super().__init__(validator)
+        self.parent = parent
+        self.wrong_child_type = None
+        # Threads of the node subtree should follow the node thread
+        self._threads_pos = len(validator.threads)
+
+    def field_value(self, key, event, value):
+        if key == 'children' and event == 'start_array':
+            self.data[key] = []
+            self._validator.push(_ArrayFrame(self._validator, self.__child), event, value)
+        else:
+            super().field_value(key, event, value)
+
+    def __child(self, event, value):
+        if event != 'start_map':
+            self._validator.fail('node is not a dictionary')
+        self._validator.push(_NodeFrame(self._validator, parent=self), event, value)
+
+    def finish(self):
+        node = self.data
+        if self.parent is None and not self.keys:
+            # Empty trace
+            return
+
+        if node.get('type') not in NODE_TYPES:
+            self._validator.fail('unsupported node type "{}"'.format(node.get('type')))
+        for field_name in REQUIRED_FIELDS[node['type']]:
+            if node.get(field_name) is None:
+                self._validator.fail('node field "{}" is required'.format(field_name))
+        if node.get('notes'):
+            if not isinstance(node['notes'], list):
+                self._validator.fail('notes should be a list')
+            for note in node['notes']:
+                if not isinstance(note, dict):
+                    self._validator.fail('note should be a dict')
+                if 'text' not in note or not isinstance(note['text'], str) or not note['text']:
+                    self._validator.fail('note should have a text')
+                if 'level' not in note or not isinstance(note['level'], int) or note['level'] < 0:
+                    self._validator.fail('note should have an unsigned int level')
+        if node.get('children') and not isinstance(node['children'], list):
+            self._validator.fail('node is not a dictionary')
+        if node['type'] == 'declarations' and self.wrong_child_type is not None:
+            self._validator.fail('declarations child has type "{}"'.format(self.wrong_child_type))
+
+        if self.parent is None:
+            if node['type'] != 'thread':
+                self._validator.fail('root error trace node type should be a "thread"')
+        elif node['type'] != 'declaration' and self.parent.wrong_child_type is None:
+            self.parent.wrong_child_type = node['type']
+
+        self._validator.nodes += 1
+        if node.get('line'):
+            self._validator.add_line(node['line'])
+        if node['type'] == 'thread':
+            self._validator.threads.insert(self._threads_pos, node['thread'])
+
+
+class _TraceFrame(_MapFrame):
+    fields = {'files', 'trace', 'global variable declarations'}
+
+    def field_value(self, key, event, value):
+        if key == 'files':
+            self.data[key] = None
+            if event == 'start_array':
+                self.data[key] = _ArrayFrame(self._validator, None)
+                self._validator.push(self.data[key], event, value)
+            elif event == 'start_map':
+                self._validator.push(_SkipFrame(self._validator), event, value)
+        elif key == 'trace':
+            self.data[key] = True
+            if event == 'start_map':
+                self._validator.push(_NodeFrame(self._validator), event, value)
+            elif event == 'start_array':
+                self._validator.push(_ArrayFrame(self._validator, self.__not_node), event, value)
+            elif value:
+                self.__not_node(event, value)
+        elif key == 'global variable declarations' and event == 'start_array':
+            self.data[key] = _ArrayFrame(self._validator, self.__declaration)
+            self._validator.push(self.data[key], event, value)
+        elif event in {'start_map', 'start_array'}:
+            self._validator.push(_SkipFrame(self._validator), event, value)
+
+    def __not_node(self, event, value):
+        self._validator.fail('node is not a dictionary')
+
+    def __declaration(self, event, value):
+        if event == 'start_map':
+            self._validator.push(_DeclarationFrame(self._validator), event, value)
+        elif event == 'start_array':
+            self._validator.push(_SkipFrame(self._validator), event, value)
+
+    def finish(self):
+        if not isinstance(self.data.get('files'), _ArrayFrame):
+            self._validator.fail('error trace does not have files or it is not a list')
+        if 'trace' not in self.data:
+            self._validator.fail('error trace does not have "trace"')
+        self._validator.files = self.data['files'].length
+        global_vars = self.data.get('global variable declarations')
+        if global_vars is not None and global_vars.length:
+            self._validator.threads.insert(0, GLOBAL_THREAD)
+
+
+class ErrorTraceValidator:
+    """
+    Validates error trace JSON without loading it into memory and without recursion. Besides, it collects error trace
+    statistics required by the error trace visualizer, see reports.etv.ErrorTraceIndex.
+    """
+
+    def __init__(self, fp):
+        """
+        :param fp: binary file object with error trace JSON
+        """
+        self.threads = []
+        self.max_line_len = 0
+        self.nodes = 0
+        self.files = 0
+        self._stack = []
+        self.__validate(fp)
+
+    def __validate(self, fp):
+        events = json_events(fp)
+        try:
+            event, value = next(events)
+            if event != 'start_map':
+                self.fail('error trace is not a dictionary')
+            self.push(_TraceFrame(self), event, value)
+            for event, value in events:
+                self._stack[-1].send(event, value)
+        except ErrorTraceError:
+            raise
+        except Exception:
+            raise ErrorTraceError('file does not exist or it is wrong JSON')
+
+    @property
+    def statistics(self):
+        threads = []
+        for thread_id in self.threads:
+            if thread_id not in threads:
+                threads.append(thread_id)
+        return {'threads': threads, 'max_line_len': self.max_line_len, 'nodes': self.nodes, 'files': self.files}
+
+    def push(self, frame, event, value):
+        self._stack.append(frame)
+        frame.send(event, value)
+
+    def pop(self):
+        self._stack.pop()
+
+    def add_line(self, line):
+        self.max_line_len = max(self.max_line_len, len(str(line)))
+
+    def fail(self, detail):
+        raise ErrorTraceError(detail)
@@ -33,6 +33,7 @@ urlpatterns = [
     path('component/<int:report_id>/unknowns/', views.UnknownsListView.as_view(), name='unknowns'),
 
     path('unsafe/<int:unsafe_id>/download/', views.DownloadErrorTraceView.as_view(), name='unsafe-download'),
+    path('api/unsafe/<int:unsafe_id>/etv/', api.ErrorTraceWindowView.as_view(), name='api-etv-window'),
     path('report/<int:report_id>/source/', api.GetSourceCodeView.as_view(), name='api-get-source'),
 
     # Reports comparison
@@ -18,6 +18,7 @@
 import json
 import os
 from collections import OrderedDict
+from datetime import datetime, timezone
 from io import BytesIO
 from urllib.parse import unquote
 from wsgiref.util import FileWrapper
@@ -38,7 +39,7 @@ from reports.models import (
 )
 from caches.models import ReportSafeCache, ReportUnsafeCache, ReportUnknownCache
 
-from users.utils import HumanizedValue, paginate_queryset
+from users.utils import HumanizedValue, paginate_by_keyset, ordering_keys
 from reports.verdicts import safe_color, unsafe_color, bug_status_color
 
 
@@ -176,6 +177,13 @@ def get_report_data_type(component, data):
     return 'Unknown'
 
 
+def leaves_filters(report):
+    # All leaves of the decision are leaves of its root report, so there is no need to join the table of leaves
+    if report.parent_id is None:
+        return {'decision_id': report.decision_id}
+    return {'leaves__report': report}
+
+
 class ReportAttrsTable:
     def __init__(self, report):
         self._report = report
@@ -202,7 +210,7 @@ class SafesTable:
         self.paginator, self.page = self.__get_queryset(report)
 
         if not self.view['is_unsaved'] and self.paginator.count == 1:
-            safe_obj = self.paginator.object_list.first()
+            safe_obj = self.page[0]
             self.redirect = reverse('reports:safe', args=[safe_obj.decision.identifier, safe_obj.identifier])
 
             # Do not collect reports' values if page will be redirected
@@ -245,9 +253,9 @@ class SafesTable:
         return value
 
     def __get_queryset(self, report):
-        qs_filters = {'leaves__report': report}
+        qs_filters = leaves_filters(report)
         annotations = {}
-        ordering = 'id'
+        ordering = None
 
         # Filter by verdict
         if 'verdict' in self._params:
@@ -262,7 +270,7 @@ class SafesTable:
 
         # Order by cpu time
         if 'order' in self.view and self.view['order'][1] == 'parent_cpu':
-            ordering = 'cpu_time'
+            ordering = F('cpu_time'), 0
 
         # Filter by wall time
         if 'parent_wall' in self.view:
@@ -271,7 +279,7 @@ class SafesTable:
 
         # Order by wall time
         if 'order' in self.view and self.view['order'][1] == 'parent_wall':
-            ordering = 'wall_time'
+            ordering = F('wall_time'), 0
 
         # Filter by memory
         if 'parent_memory' in self.view:
@@ -286,7 +294,7 @@ class SafesTable:
 
         # Order by memory
         if 'order' in self.view and self.view['order'][1] == 'parent_memory':
-            ordering = 'memory'
+            ordering = F('memory'), 0
 
         # Filter by marks number
         if self._manual is True:
@@ -309,13 +317,9 @@ class SafesTable:
 
         # Filter by attribute(s)
         if 'attr_name' in self._params and 'attr_value' in self._params:
-            attr_name = unquote(self._params['attr_name'])
-            attr_value = unquote(self._params['attr_value'])
-            annotations['attr_value'] = RawSQL(
-                "\"{}\".\"attrs\"->>%s".format(self._cache_db_table),
-                (attr_name,)
-            )
-            qs_filters['attr_value'] = attr_value
+            qs_filters['cache__attrs__contains'] = {
+                unquote(self._params['attr_name']): unquote(self._params['attr_value'])
+            }
         elif 'attr' in self.view:
             annotations['attr_value'] = RawSQL(
                 "\"{}\".\"attrs\"->>%s".format(self._cache_db_table),
@@ -325,23 +329,20 @@ class SafesTable:
 
         # Sorting by attribute value
         if 'order' in self.view and self.view['order'][1] == 'attr':
-            annotations['ordering_attr'] = RawSQL(
+            ordering = RawSQL(
                 "\"{}\".\"attrs\"->>%s".format(self._cache_db_table),
-                (self.view['order'][2],)
-            )
-            ordering = 'ordering_attr'
+                (self.view['order'][2],), output_field=CharField()
+            ), ''
 
         # Order direction
-        if 'order' in self.view and self.view['order'][0] == 'up':
-            ordering = '-' + ordering
+        keys = ordering_keys(annotations, ordering, 'order' in self.view and self.view['order'][0] == 'up')
 
         queryset = ReportSafe.objects
         if annotations:
             queryset = queryset.annotate(**annotations)
-        queryset = queryset.filter(**qs_filters).exclude(cache=None)\
-            .order_by(ordering).select_related('cache', 'decision')
+        queryset = queryset.filter(**qs_filters).exclude(cache=None).select_related('cache', 'decision')
         num_per_page = self.view['elements'][0] if self.view['elements'] else None
-        return paginate_queryset(queryset, self._params.get('page', 1), num_per_page)
+        return paginate_by_keyset(queryset, keys, self._params.get('page', 1), num_per_page)
 
     def __get_title(self):
         title = _('Safes')
@@ -472,7 +473,7 @@ class UnsafesTable:
         self.paginator, self.page = self.__get_queryset(report)
 
         if not self.view['is_unsaved'] and self.paginator.count == 1:
-            unsafe_obj = self.paginator.object_list.first()
+            unsafe_obj = self.page[0]
             self.redirect = reverse('reports:unsafe', args=[unsafe_obj.decision.identifier, unsafe_obj.identifier])
             # Do not collect reports' values if page will be redirected
             return
@@ -515,9 +516,9 @@ class UnsafesTable:
         return value
 
     def __get_queryset(self, report):
-        qs_filters = {'leaves__report': report}
+        qs_filters = leaves_filters(report)
         annotations = {}
-        ordering = 'id'
+        ordering = None
 
         # Filter by verdict
         if 'verdict' in self._params:
@@ -532,7 +533,7 @@ class UnsafesTable:
 
         # Order by cpu time
         if 'order' in self.view and self.view['order'][1] == 'parent_cpu':
-            ordering = 'cpu_time'
+            ordering = F('cpu_time'), 0
 
         # Filter by wall time
         if 'parent_wall' in self.view:
@@ -541,7 +542,7 @@ class UnsafesTable:
 
         # Order by wall time
         if 'order' in self.view and self.view['order'][1] == 'parent_wall':
-            ordering = 'wall_time'
+            ordering = F('wall_time'), 0
 
         # Filter by memory
         if 'parent_memory' in self.view:
@@ -556,7 +557,7 @@ class UnsafesTable:
 
         # Order by memory
         if 'order' in self.view and self.view['order'][1] == 'parent_memory':
-            ordering = 'memory'
+            ordering = F('memory'), 0
 
         # Filter by marks number
         if self._manual is True:
@@ -579,11 +580,9 @@ class UnsafesTable:
 
         # Filter by attribute(s)
         if 'attr_name' in self._params and 'attr_value' in self._params:
-            annotations['attr_value'] = RawSQL(
-                "\"{}\".\"attrs\"->>%s".format(self._cache_db_table),
-                (unquote(self._params['attr_name']),)
-            )
-            qs_filters['attr_value'] = unquote(self._params['attr_value'])
+            qs_filters['cache__attrs__contains'] = {
+                unquote(self._params['attr_name']): unquote(self._params['attr_value'])
+            }
         elif 'attr' in self.view:
             annotations['attr_value'] = RawSQL(
                 "\"{}\".\"attrs\"->>%s".format(self._cache_db_table),
@@ -593,23 +592,20 @@ class UnsafesTable:
 
         # Order by attribute value
         if 'order' in self.view and self.view['order'][1] == 'attr':
-            annotations['ordering_attr'] = RawSQL(
+            ordering = RawSQL(
                 "\"{}\".\"attrs\"->>%s".format(self._cache_db_table),
-                (self.view['order'][2],)
-            )
-            ordering = 'ordering_attr'
+                (self.view['order'][2],), output_field=CharField()
+            ), ''
 
         # Order direction
-        if 'order' in self.view and self.view['order'][0] == 'up':
-            ordering = '-' + ordering
+        keys = ordering_keys(annotations, ordering, 'order' in self.view and self.view['order'][0] == 'up')
 
         queryset = ReportUnsafe.objects
         if annotations:
             queryset = queryset.annotate(**annotations)
-        queryset = queryset.filter(**qs_filters).exclude(cache=None).order_by(ordering)\
-            .select_related('cache', 'decision')
+        queryset = queryset.filter(**qs_filters).exclude(cache=None).select_related('cache', 'decision')
         num_per_page = self.view['elements'][0] if self.view['elements'] else None
-        return paginate_queryset(queryset, self._params.get('page', 1), num_per_page)
+        return paginate_by_keyset(queryset, keys, self._params.get('page', 1), num_per_page)
 
     def __get_title(self):
         title = _('Unsafes')
@@ -742,7 +738,7 @@ class UnknownsTable:
         self.paginator, self.page = self.__get_queryset(report)
 
         if not self.view['is_unsaved'] and self.paginator.count == 1:
-            unknown_obj = self.paginator.object_list.first()
+            unknown_obj = self.page[0]
             self.redirect = reverse('reports:unknown', args=[unknown_obj.decision.identifier, unknown_obj.identifier])
             # Do not collect reports' values if page will be redirected
             return
@@ -783,9 +779,9 @@ class UnknownsTable:
         return value
 
     def __get_queryset(self, report):
-        qs_filters = {'leaves__report': report}
+        qs_filters = leaves_filters(report)
         annotations = {}
-        ordering = 'id'
+        ordering = None
 
         # Filter by cpu time
         if 'parent_cpu' in self.view:
@@ -794,7 +790,7 @@ class UnknownsTable:
 
         # Order by cpu time
         if 'order' in self.view and self.view['order'][1] == 'parent_cpu':
-            ordering = 'cpu_time'
+            ordering = F('cpu_time'), 0
 
         # Filter by wall time
         if 'parent_wall' in self.view:
@@ -803,7 +799,7 @@ class UnknownsTable:
 
         # Order by wall time
         if 'order' in self.view and self.view['order'][1] == 'parent_wall':
-            ordering = 'wall_time'
+            ordering = F('wall_time'), 0
 
         # Filter by memory
         if 'parent_memory' in self.view:
@@ -818,7 +814,7 @@ class UnknownsTable:
 
         # Order by memory
         if 'order' in self.view and self.view['order'][1] == 'parent_memory':
-            ordering = 'memory'
+            ordering = F('memory'), 0
 
         # Filter by marks number
         if self._manual is True:
@@ -837,11 +833,9 @@ class UnknownsTable:
 
         # Filter by attribute(s)
         if 'attr_name' in self._params and 'attr_value' in self._params:
-            annotations['attr_value'] = RawSQL(
-                "\"{}\".\"attrs\"->>%s".format(self._cache_db_table),
-                (unquote(self._params['attr_name']),)
-            )
-            qs_filters['attr_value'] = unquote(self._params['attr_value'])
+            qs_filters['cache__attrs__contains'] = {
+                unquote(self._params['attr_name']): unquote(self._params['attr_value'])
+            }
         elif 'attr' in self.view:
             annotations['attr_value'] = RawSQL(
                 "\"{}\".\"attrs\"->>%s".format(self._cache_db_table),
@@ -851,11 +845,10 @@ class UnknownsTable:
 
         # Order by attribute value
         if 'order' in self.view and self.view['order'][1] == 'attr':
-            annotations['ordering_attr'] = RawSQL(
+            ordering = RawSQL(
                 "\"{}\".\"attrs\"->>%s".format(self._cache_db_table),
-                (self.view['order'][2],)
-            )
-            ordering = 'ordering_attr'
+                (self.view['order'][2],), output_field=CharField()
+            ), ''
 
         # Filter by component
         if 'component' in self._params:
@@ -874,16 +867,14 @@ class UnknownsTable:
             qs_filters['cache__problems__has_key'] = self.view['problem'][0].strip()
 
         # Order direction
-        if 'order' in self.view and self.view['order'][0] == 'up':
-            ordering = '-' + ordering
+        keys = ordering_keys(annotations, ordering, 'order' in self.view and self.view['order'][0] == 'up')
 
         queryset = ReportUnknown.objects
         if annotations:
             queryset = queryset.annotate(**annotations)
-        queryset = queryset.filter(**qs_filters).exclude(cache=None).order_by(ordering)\
-            .select_related('cache', 'decision')
+        queryset = queryset.filter(**qs_filters).exclude(cache=None).select_related('cache', 'decision')
         num_per_page = self.view['elements'][0] if self.view['elements'] else None
-        return paginate_queryset(queryset, self._params.get('page', 1), num_per_page)
+        return paginate_by_keyset(queryset, keys, self._params.get('page', 1), num_per_page)
 
     def __get_title(self):
         title = _('Unknowns')
@@ -1002,7 +993,7 @@ class ReportChildrenTable:
         self.view = view
 
         num_per_page = view['elements'][0] if view['elements'] else None
-        self.paginator, self.page = paginate_queryset(self.__get_queryset(), page, num_per_page)
+        self.paginator, self.page = paginate_by_keyset(*self.__get_queryset(), page, num_per_page)
 
         self.titles = REP_MARK_TITLES
         self.columns, self.values = self.__component_data()
@@ -1024,30 +1015,21 @@ class ReportChildrenTable:
             qs_filters['sorting_attr__' + self.view['attr'][1]] = self.view['attr'][2]
 
         # Get queryset ordering
-        ordering = 'id'
+        ordering = None
         if self.view['order']:
             if self.view['order'][1] == 'component':
-                ordering = 'component'
+                ordering = F('component'), ''
             elif self.view['order'][1] == 'date':
-                ordering = 'finish_date'
+                ordering = F('finish_date'), datetime.fromtimestamp(0, timezone.utc)
             elif self.view['order'][1] == 'attr':
-                annotations['ordering_attr'] = Max(Case(
+                ordering = Max(Case(
                     When(attrs__name=self.view['order'][2], then=F('attrs__value')),
                     output_field=CharField(null=True)
-                ))
-                ordering = 'ordering_attr'
+                )), ''
+        keys = ordering_keys(annotations, ordering, bool(self.view['order']) and self.view['order'][0] == 'up', True)
 
-            ordering = F(ordering)
-            if self.view['order'][0] == 'up':
-                ordering = ordering.desc(nulls_last=True)
-            else:
-                ordering = ordering.asc(nulls_last=True)
-
-        queryset = ReportComponent.objects
-        if annotations:
-            queryset = queryset.values('id').annotate(**annotations)
-        return queryset.filter(**qs_filters).order_by(ordering).select_related('decision')\
-            .only('id', 'identifier', 'decision_id', 'decision__identifier', 'component')
+        return ReportComponent.objects.annotate(**annotations).filter(**qs_filters).select_related('decision')\
+            .only('id', 'identifier', 'decision_id', 'decision__identifier', 'component'), keys
 
     def __component_data(self):
         report_ids = list(report.id for report in self.page)
@@ -1224,7 +1206,7 @@ class ReportData:
             self.data = self.data[0]
             # Do not visualize data type. Before this type was already saved explicitly.
             del self.data['type']
-        elif self.type == 'EMG':
+        elif self.type in {'EMG', 'VTG'}:
             # Like for PFG above
             self.data = self.data[0]
             del self.data['type']
@@ -106,6 +106,7 @@ def unsafe_verdicts_sum(*args):
 class BugStatusCollector:
     def __init__(self):
         self._incompatible = set()
+        self._not_bugs = set()
         self._statuses = {}
 
     def add(self, report_id, mark_verdict, mark_status):
@@ -113,12 +114,15 @@ class BugStatusCollector:
             return
         if mark_verdict == MARK_UNSAFE[1][0]:
             self._statuses.setdefault(report_id, mark_status)
-            if self._statuses[report_id] != mark_status:
+            # Bug + NotABug = Incompatible marks regardless of the order marks are added
+            if self._statuses[report_id] != mark_status or report_id in self._not_bugs:
+                self._incompatible.add(report_id)
+                self._statuses.pop(report_id)
+        else:
+            self._not_bugs.add(report_id)
+            if report_id in self._statuses:
                 self._incompatible.add(report_id)
                 self._statuses.pop(report_id)
-        elif report_id in self._statuses:
-            self._incompatible.add(report_id)
-            self._statuses.pop(report_id)
 
     @property
     def result(self):
@@ -128,6 +132,7 @@ class BugStatusCollector:
         for report_id, status in self._statuses.items():
             result_data[report_id] = status
         self._incompatible = set()
+        self._not_bugs = set()
         self._statuses = {}
         return result_data
 
@@ -22,7 +22,7 @@ from django.utils.translation import gettext as _
 from django.views.generic.base import TemplateView
 from django.views.generic.detail import SingleObjectMixin, DetailView
 
-from bridge.vars import VIEW_TYPES, ERROR_TRACE_FILE, PROBLEM_DESC_FILE, DECISION_WEIGHT
+from bridge.vars import VIEW_TYPES, PROBLEM_DESC_FILE, DECISION_WEIGHT
 from bridge.utils import logger, ArchiveFileContent, BridgeException, BridgeErrorResponse
 from bridge.CustomViews import DataViewMixin, StreamingResponseView
 from tools.profiling import LoggedCallMixin
@@ -41,7 +41,7 @@ from reports.coverage import (
     GetCoverageStatistics, LeafCoverageStatistics, CoverageGenerator,
     ReportCoverageStatistics, VerificationCoverageStatistics
 )
-from reports.etv import GetETV
+from reports.etv import UnsafeETV
 from reports.utils import (
     report_resources, get_parents, report_attributes_with_parents, leaf_verifier_files_url,
     ReportStatus, ReportData, ReportAttrsTable, ReportChildrenTable, SafesTable, UnsafesTable, UnknownsTable,
@@ -287,8 +287,7 @@ class ReportUnsafeView(LoginRequiredMixin, LoggedCallMixin, DataViewMixin, Detai
         if not JobAccess(self.request.user, self.object.decision.job).can_view:
             raise BridgeException(code=400)
         try:
-            etv = GetETV(ArchiveFileContent(self.object, 'error_trace', ERROR_TRACE_FILE).content.decode('utf8'),
-                         self.request.user)
+            etv = UnsafeETV(self.object, self.request.user)
         except Exception as e:
             logger.exception(e)
             etv = None
@@ -358,10 +357,7 @@ class FullscreenReportUnsafe(LoginRequiredMixin, LoggedCallMixin, DetailView):
     def get_context_data(self, **kwargs):
         if not JobAccess(self.request.user, self.object.decision.job).can_view:
             raise BridgeException(code=400)
-        return {'report': self.object, 'include_jquery_ui': True, 'etv': GetETV(
-            ArchiveFileContent(self.object, 'error_trace', ERROR_TRACE_FILE).content.decode('utf8'),
-            self.request.user
-        )}
+        return {'report': self.object, 'include_jquery_ui': True, 'etv': UnsafeETV(self.object, self.request.user)}
 
 
 class DownloadErrorTraceView(LoginRequiredMixin, LoggedCallMixin, SingleObjectMixin, StreamingResponseView):
@@ -31,14 +31,17 @@ from tools.profiling import LoggedCallMixin
 
 from users.models import SchedulerUser
 from jobs.models import Decision, Scheduler
-from service.models import Task, Solution, VerificationTool, NodesConfiguration
+from service.models import Task, TaskBlob, Solution, VerificationTool, NodesConfiguration
 
 from jobs.serializers import decision_status_changed
 from service.serializers import (
     TaskSerializer, SolutionSerializer, SchedulerUserSerializer, DecisionSerializer,
     UpdateToolsSerializer, SchedulerSerializer, NodeConfSerializer
 )
-from service.utils import FinishDecision, TaskArchiveGenerator, SolutionArchiveGenerator, ReadDecisionConfiguration
+from service.utils import (
+    FinishDecision, TaskArchiveGenerator, TaskBlobGenerator, SolutionArchiveGenerator, ReadDecisionConfiguration,
+    ServiceError, save_task_blobs
+)
 
 
 class TaskAPIViewset(LoggedCallMixin, ModelViewSet):
@@ -87,6 +90,43 @@ class DownloadTaskArchiveView(StreamingResponseAPIView):
         return TaskArchiveGenerator(task)
 
 
+class DownloadTaskBlobView(StreamingResponseAPIView):
+    permission_classes = (ServicePermission,)
+
+    def get_generator(self):
+        task = get_object_or_404(Task, pk=self.kwargs['pk'])
+        if task.status not in {TASK_STATUS[0][0], TASK_STATUS[1][0]}:
+            raise exceptions.APIException('The task status is {}'.format(task.status))
+        return TaskBlobGenerator(get_object_or_404(TaskBlob, decision_id=task.decision_id,
+                                                   checksum=self.kwargs['checksum']))
+
+
+class MissingTaskBlobsView(LoggedCallMixin, APIView):
+    permission_classes = (ServicePermission,)
+
+    def post(self, request):
+        decision = get_object_or_404(Decision, identifier=request.data.get('job'))
+        checksums = request.data.get('checksums', [])
+        existing = set(TaskBlob.objects.filter(decision=decision, checksum__in=checksums)
+                       .values_list('checksum', flat=True))
+        return Response({'missing': [checksum for checksum in checksums if checksum not in existing]})
+
+
+class UploadTaskBlobsView(LoggedCallMixin, APIView):
+    permission_classes = (ServicePermission,)
+    unparallel = [TaskBlob]
+
+    def post(self, request):
+        decision = get_object_or_404(Decision, identifier=request.data.get('job'))
+        if decision.status != DECISION_STATUS[2][0]:
+            raise exceptions.ValidationError({'job': 'The job is not processing'})
+        try:
+            saved = save_task_blobs(decision, dict(request.FILES.items()))
+        except ServiceError as e:
+            raise exceptions.ValidationError({'blobs': str(e)})
+        return Response({'saved': saved})
+
+
 class SolutionCreateView(LoggedCallMixin, CreateAPIView):
     serializer_class = SolutionSerializer
     permission_classes = (ServicePermission,)
@@ -0,0 +1,37 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('jobs', '0001_initial'),
+        ('service', '0002_alter_solution_description_alter_task_description'),
+    ]
+
+    operations = [
+        migrations.CreateModel(name='TaskBlob', fields=[
+            ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ('checksum', models.CharField(max_length=64)),
+            ('file', models.FileField(upload_to='Service')),
+            ('decision', models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, related_name='task_blobs', to='jobs.decision'
+            )),
+        ], options={'db_table': 'task_blob', 'unique_together': {('decision', 'checksum')}}),
+    ]
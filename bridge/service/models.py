@@ -92,5 +92,16 @@ class Solution(WithFilesMixin, models.Model):
         db_table = 'solution'
 
 
+class TaskBlob(WithFilesMixin, models.Model):
+    decision = models.ForeignKey(Decision, models.CASCADE, related_name='task_blobs')
+    checksum = models.CharField(max_length=64)
+    file = models.FileField(upload_to=SERVICE_DIR)
+
+    class Meta:
+        db_table = 'task_blob'
+        unique_together = ('decision', 'checksum')
+
+
 post_delete.connect(remove_instance_files, sender=Task)
 post_delete.connect(remove_instance_files, sender=Solution)
+post_delete.connect(remove_instance_files, sender=TaskBlob)
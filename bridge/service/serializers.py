@@ -15,6 +15,8 @@
 # limitations under the License.
 #
 
+import re
+import json
 import pika
 import zipfile
 
@@ -25,18 +27,36 @@ from django.utils.translation import gettext_lazy as _
 
 from rest_framework import serializers, exceptions, fields
 
-from bridge.vars import DECISION_STATUS, PRIORITY, SCHEDULER_TYPE, SCHEDULER_STATUS, TASK_STATUS
+from bridge.vars import DECISION_STATUS, PRIORITY, SCHEDULER_TYPE, SCHEDULER_STATUS, TASK_STATUS, TASK_BLOBS_MANIFEST
 from bridge.utils import logger, require_lock, RMQConnect
 from bridge.serializers import TimeStampField, DynamicFieldsModelSerializer
 
 from users.models import SchedulerUser
 from jobs.models import Scheduler, Decision
-from service.models import Task, Solution, VerificationTool, NodesConfiguration, Node, Workload
+from service.models import Task, TaskBlob, Solution, VerificationTool, NodesConfiguration, Node, Workload
 
 from users.utils import HumanizedValue
 from jobs.serializers import decision_status_changed
 
 
+def task_archive_blobs(archive):
+    """
+    Get checksums of blobs that are referenced by the manifest of the task archive.
+
+    :param archive: File object of the task archive.
+    :return: Set of checksums.
+    """
+    with zipfile.ZipFile(archive) as zfp:
+        manifest = json.loads(zfp.read(TASK_BLOBS_MANIFEST)) if TASK_BLOBS_MANIFEST in zfp.namelist() else {}
+    archive.seek(0)
+
+    if not isinstance(manifest, dict) or \
+            not all(isinstance(checksum, str) and re.fullmatch(r'[0-9a-f]{64}', checksum)
+                    for checksum in manifest.values()):
+        raise ValueError('Wrong manifest of task blobs')
+    return set(manifest.values())
+
+
 def on_task_change(task_id, task_status, scheduler_type):
     with RMQConnect() as channel:
         channel.basic_publish(
@@ -152,6 +172,16 @@ class TaskSerializer(DynamicFieldsModelSerializer):
             elif 'error' not in attrs:
                 attrs['error'] = "The scheduler hasn't given error description"
 
+        if 'archive' in attrs and 'job' in attrs:
+            # Files uploaded as blobs before the task should be available for schedulers
+            try:
+                checksums = task_archive_blobs(attrs['archive'])
+            except ValueError as e:
+                raise exceptions.ValidationError({'archive': str(e)})
+            if checksums and TaskBlob.objects.filter(decision=attrs['job'], checksum__in=checksums)\
+                    .count() != len(checksums):
+                raise exceptions.ValidationError({'archive': 'The task archive refers blobs that were not uploaded'})
+
         if 'description' in attrs and 'decision' in attrs:
             # Validate task priority
             job_priority = attrs['decision'].priority
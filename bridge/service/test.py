@@ -15,23 +15,31 @@
 # limitations under the License.
 #
 
+import io
 import os
 import json
+import hashlib
+import zipfile
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.db.models import Q
 from django.test import Client
 from django.urls import reverse
 
-from bridge.vars import SCHEDULER_TYPE, SCHEDULER_STATUS, PRIORITY, NODE_STATUS
+from bridge.vars import (
+    SCHEDULER_TYPE, SCHEDULER_STATUS, PRIORITY, NODE_STATUS, USER_ROLES, DECISION_STATUS, TASK_STATUS,
+    TASK_BLOBS_MANIFEST
+)
 from bridge.utils import KleverTestCase
 
 from users.models import User, SchedulerUser
-from jobs.models import Job, Scheduler
-from service.models import Task, Solution, VerificationTool, Node, NodesConfiguration, Workload
+from jobs.models import Job, Scheduler, Decision
+from service.models import Task, TaskBlob, Solution, VerificationTool, Node, NodesConfiguration, Workload
+from service.utils import FinishDecision
 
-from reports.test import COMPUTER
+from reports.test import COMPUTER, create_job, create_decision
 
 
 TEST_NODES_DATA = [
@@ -903,3 +911,134 @@ class TestService(KleverTestCase):
             SchedulerUser.objects.get(user__username='manager', login='sch_user', password='sch_passwd')
         except ObjectDoesNotExist:
             self.fail()
+
+
+class TestTaskBlobs(KleverTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create(username='service', role=USER_ROLES[4][0]))
+        self.decision = create_decision(create_job(), status=DECISION_STATUS[2][0])
+        self.blobs = {}
+        for content in (b'int x;\n' * 1000, b'int y;\n' * 1000, b'int z;\n' * 1000):
+            self.blobs[hashlib.sha256(content).hexdigest()] = content
+        self.checksums = sorted(self.blobs)
+
+    def __upload_blobs(self, blobs):
+        data = {'job': str(self.decision.identifier)}
+        for checksum, content in blobs.items():
+            data[checksum] = SimpleUploadedFile(checksum, content)
+        return self.client.post('/service/blobs/', data)
+
+    def __missing_blobs(self, checksums):
+        response = self.client.post('/service/blobs/missing/', json.dumps({
+            'job': str(self.decision.identifier), 'checksums': checksums
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['missing']
+
+    def __create_task(self, manifest):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, mode='w') as zfp:
+            zfp.writestr('benchmark.xml', '<benchmark/>')
+            zfp.writestr(TASK_BLOBS_MANIFEST, json.dumps(manifest))
+        return self.client.post('/service/tasks/', {
+            'job': str(self.decision.identifier),
+            'description': json.dumps({'priority': PRIORITY[3][0]}),
+            'archive': SimpleUploadedFile('task.zip', archive.getvalue(), 'application/zip')
+        })
+
+    def test_upload_blobs(self):
+        self.assertEqual(self.__missing_blobs(self.checksums), self.checksums)
+
+        response = self.__upload_blobs({checksum: self.blobs[checksum] for checksum in self.checksums[:2]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'saved': 2})
+        self.assertEqual(self.__missing_blobs(self.checksums), self.checksums[2:])
+
+        # Blobs that were uploaded for other tasks are not saved again
+        response = self.__upload_blobs({checksum: self.blobs[checksum] for checksum in self.checksums[1:]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'saved': 1})
+        self.assertEqual(self.__missing_blobs(self.checksums), [])
+        for blob in TaskBlob.objects.filter(decision=self.decision):
+            with blob.file.open('rb') as fp:
+                self.assertEqual(fp.read(), self.blobs[blob.checksum])
+
+    def test_blob_checksum(self):
+        response = self.__upload_blobs({self.checksums[0]: self.blobs[self.checksums[1]]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('blobs', response.json())
+        self.assertFalse(TaskBlob.objects.exists())
+
+        # Blobs can be uploaded just for processing decisions
+        self.decision.status = DECISION_STATUS[3][0]
+        self.decision.save()
+        response = self.__upload_blobs({self.checksums[0]: self.blobs[self.checksums[0]]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('job', response.json())
+        self.assertFalse(TaskBlob.objects.exists())
+
+    def test_task_archive_blobs(self):
+        manifest = {'merged.c': self.checksums[0], 'model.c': self.checksums[1]}
+        self.__upload_blobs({self.checksums[0]: self.blobs[self.checksums[0]]})
+
+        # Schedulers would not get files of tasks that refer blobs that were not uploaded
+        response = self.__create_task(manifest)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('archive', response.json())
+        response = self.__create_task(['merged.c'])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('archive', response.json())
+        self.assertFalse(Task.objects.exists())
+
+        self.__upload_blobs({self.checksums[1]: self.blobs[self.checksums[1]]})
+        response = self.__create_task(manifest)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Task.objects.filter(id=response.json()['id'], decision=self.decision).exists())
+
+    def test_download_blob(self):
+        self.__upload_blobs({self.checksums[0]: self.blobs[self.checksums[0]]})
+        task_id = self.__create_task({'merged.c': self.checksums[0]}).json()['id']
+
+        response = self.client.get('/service/tasks/{}/blobs/{}/'.format(task_id, self.checksums[0]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.blobs[self.checksums[0]])
+        response = self.client.get('/service/tasks/{}/blobs/{}/'.format(task_id, self.checksums[1]))
+        self.assertEqual(response.status_code, 404)
+
+        # Blobs are available just for tasks that should be solved
+        Task.objects.filter(id=task_id).update(status=TASK_STATUS[3][0], error='Error')
+        response = self.client.get('/service/tasks/{}/blobs/{}/'.format(task_id, self.checksums[0]))
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(response.streaming)
+
+    def test_finish_decision(self):
+        self.__upload_blobs(self.blobs)
+        task_id = self.__create_task({'merged.c': self.checksums[0]}).json()['id']
+        paths = list(blob.file.path for blob in TaskBlob.objects.filter(decision=self.decision))
+        self.assertEqual(len(paths), 3)
+
+        # Blobs are kept while tasks can be solved
+        FinishDecision(Decision.objects.get(id=self.decision.id), DECISION_STATUS[4][0], 'Error')
+        self.assertEqual(TaskBlob.objects.filter(decision=self.decision).count(), 3)
+
+        Decision.objects.filter(id=self.decision.id).update(status=DECISION_STATUS[2][0])
+        Task.objects.filter(id=task_id).update(status=TASK_STATUS[3][0], error='Error')
+        FinishDecision(Decision.objects.get(id=self.decision.id), DECISION_STATUS[4][0], 'Error')
+        self.assertEqual(Decision.objects.get(id=self.decision.id).status, DECISION_STATUS[4][0])
+        self.assertFalse(Task.objects.filter(decision=self.decision).exists())
+        self.assertFalse(TaskBlob.objects.filter(decision=self.decision).exists())
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_stop_decision(self):
+        self.__upload_blobs(self.blobs)
+        self.__create_task({'merged.c': self.checksums[0]})
+        paths = list(blob.file.path for blob in TaskBlob.objects.filter(decision=self.decision))
+
+        self.client.force_login(User.objects.create(username='manager', role=USER_ROLES[2][0]))
+        response = self.client.post(reverse('jobs:api-cancel-decision', args=[self.decision.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decision.objects.get(id=self.decision.id).status, DECISION_STATUS[6][0])
+        self.assertFalse(Task.objects.filter(decision=self.decision).exists())
+        self.assertFalse(TaskBlob.objects.filter(decision=self.decision).exists())
+        self.assertFalse(any(os.path.exists(path) for path in paths))
@@ -29,6 +29,9 @@ urlpatterns = [
     path('', include(router.urls)),
     path('get_token/', obtain_auth_token),
     path('tasks/<int:pk>/download/', api.DownloadTaskArchiveView.as_view()),
+    path('tasks/<int:pk>/blobs/<str:checksum>/', api.DownloadTaskBlobView.as_view()),
+    path('blobs/', api.UploadTaskBlobsView.as_view()),
+    path('blobs/missing/', api.MissingTaskBlobsView.as_view()),
 
     path('solution/', api.SolutionCreateView.as_view()),
     path('solution/<int:task_id>/', api.SolutionDetailView.as_view()),
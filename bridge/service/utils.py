@@ -16,8 +16,10 @@
 #
 
 import json
+import hashlib
 from wsgiref.util import FileWrapper
 
+from django.db import transaction
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
@@ -27,7 +29,8 @@ from bridge.utils import logger, BridgeException
 from users.models import SchedulerUser
 from jobs.models import FileSystem
 from reports.models import ReportUnknown, ReportComponent
-from service.models import Task, Solution, Node, NodesConfiguration, Workload
+from reports.tasks import prepare_source_code, fill_leaf_signatures
+from service.models import Task, TaskBlob, Solution, Node, NodesConfiguration, Workload
 
 from jobs.serializers import decision_status_changed
 from service.serializers import SchedulerUserSerializer
@@ -74,6 +77,13 @@ class FinishDecision:
         self.decision.save()
         decision_status_changed(self.decision)
 
+        decision_id = self.decision.id
+        # Leaves are not changed anymore, so they can be prepared for comparisons
+        transaction.on_commit(lambda: fill_leaf_signatures.delay(decision_id))
+        if self.status == DECISION_STATUS[3][0]:
+            # Cache source code that will be most likely opened by users
+            transaction.on_commit(lambda: prepare_source_code.delay(decision_id))
+
     def __remove_tasks(self):
         if self.decision.status == DECISION_STATUS[1][0]:
             return
@@ -86,6 +96,7 @@ class FinishDecision:
         elif self.decision.tasks.filter(status=TASK_STATUS[2][0], solution=None).count() > 0:
             raise ServiceError('There are finished tasks without solutions')
         self.decision.tasks.all().delete()
+        self.decision.task_blobs.all().delete()
 
     def __get_status(self, status):
         if status not in set(x[0] for x in DECISION_STATUS):
@@ -241,9 +252,43 @@ class TaskArchiveGenerator(FileWrapper):
         super().__init__(self._task.archive, 8192)
 
 
+class TaskBlobGenerator(FileWrapper):
+    def __init__(self, blob: TaskBlob):
+        self._blob = blob
+        self.size = len(self._blob.file)
+        self.name = self._blob.checksum
+        super().__init__(self._blob.file, 8192)
+
+
 class SolutionArchiveGenerator(FileWrapper):
     def __init__(self, solution: Solution):
         self._solution = solution
         self.size = len(self._solution.archive)
         self.name = self._solution.filename
         super().__init__(self._solution.archive, 8192)
+
+
+def save_task_blobs(decision, files):
+    """
+    Save files that are referenced by task archives of the decision by their checksums. Files that were already saved
+    are skipped, so several Klever Core processes can upload the same blobs.
+
+    :param decision: Decision object.
+    :param files: Dictionary with checksums and uploaded files.
+    :return: Number of new blobs.
+    """
+    existing = set(TaskBlob.objects.filter(decision=decision, checksum__in=list(files))
+                   .values_list('checksum', flat=True))
+    saved = 0
+    for checksum, file in files.items():
+        sha256 = hashlib.sha256()
+        for chunk in file.chunks():
+            sha256.update(chunk)
+        if sha256.hexdigest() != checksum:
+            raise ServiceError('The checksum of blob "{}" does not match its content'.format(checksum))
+        if checksum in existing:
+            continue
+        blob = TaskBlob(decision=decision, checksum=checksum)
+        blob.file.save(checksum, file, save=True)
+        saved += 1
+    return saved
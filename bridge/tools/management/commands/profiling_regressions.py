@@ -0,0 +1,62 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now, make_aware, is_naive
+
+from tools.profiling import QueryProfileRegressions
+
+
+def parse_date(value):
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError('Wrong date format: {}'.format(value))
+    return make_aware(date) if is_naive(date) else date
+
+
+class Command(BaseCommand):
+    help = 'Reports views and tasks which execute more queries or spend more SQL time than before.'
+    requires_migrations_checks = True
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=int, default=24,
+            help='Compare last HOURS hours with previous HOURS hours if windows are not specified.'
+        )
+        parser.add_argument('--base', nargs=2, metavar=('START', 'END'), help='Base time window in ISO format.')
+        parser.add_argument('--current', nargs=2, metavar=('START', 'END'), help='Current time window in ISO format.')
+        parser.add_argument('--threshold', type=float, default=1.5, help='Minimal ratio of averages to report.')
+
+    def handle(self, *args, **options):
+        window = timedelta(hours=options['hours'])
+        current = tuple(map(parse_date, options['current'])) if options['current'] else (now() - window, now())
+        base = tuple(map(parse_date, options['base'])) if options['base'] else (current[0] - window, current[0])
+
+        regressions = QueryProfileRegressions(base, current, threshold=options['threshold']).regressions
+        if not regressions:
+            self.stdout.write('There are no regressions')
+            return
+        for data in regressions:
+            self.stdout.write('{name} ({calls[0]} -> {calls[1]} calls)'.format(**data))
+            self.stdout.write('  queries: {0:.1f} -> {1:.1f}'.format(*data['queries']))
+            self.stdout.write('  SQL time: {0:.3f}s -> {1:.3f}s'.format(*data['sql_time']))
+            self.stdout.write('  duration: {0:.3f}s -> {1:.3f}s'.format(*data['duration']))
+            for fingerprint in data['new_duplicates']:
+                self.stdout.write('  new duplicated query: {}'.format(fingerprint))
@@ -0,0 +1,37 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [('tools', '0001_initial')]
+
+    operations = [
+        migrations.CreateModel(name='QueryProfile', fields=[
+            ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ('kind', models.CharField(choices=[('0', 'Request'), ('1', 'Task')], max_length=1)),
+            ('name', models.CharField(db_index=True, max_length=128)),
+            ('date', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ('duration', models.FloatField(default=0)),
+            ('queries', models.PositiveIntegerField(default=0)),
+            ('sql_time', models.FloatField(default=0)),
+            ('duplicates', models.JSONField(default=list)),
+            ('slowest', models.JSONField(default=list)),
+        ], options={'db_table': 'tools_query_profile'}),
+    ]
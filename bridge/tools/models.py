@@ -16,6 +16,9 @@
 #
 
 from django.db import models
+from django.utils.timezone import now
+
+from bridge.vars import QUERY_PROFILE_KIND
 
 
 class LockTable(models.Model):
@@ -41,3 +44,19 @@ class CallLogs(models.Model):
 
     class Meta:
         db_table = 'tools_call_logs'
+
+
+class QueryProfile(models.Model):
+    kind = models.CharField(max_length=1, choices=QUERY_PROFILE_KIND)
+    name = models.CharField(max_length=128, db_index=True)
+    date = models.DateTimeField(default=now, db_index=True)
+    duration = models.FloatField(default=0)
+    queries = models.PositiveIntegerField(default=0)
+    sql_time = models.FloatField(default=0)
+    # List of [fingerprint, number of executions] for queries executed more than once
+    duplicates = models.JSONField(default=list)
+    # List of [sql, execution time] for the slowest queries
+    slowest = models.JSONField(default=list)
+
+    class Meta:
+        db_table = 'tools_query_profile'
@@ -18,13 +18,18 @@
 import os
 import re
 import time
+import heapq
 from datetime import datetime
 
 from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.db.models import Avg, Count
 from django.db.models.base import ModelBase
 
+from bridge.vars import QUERY_PROFILE_KIND
 from bridge.utils import BridgeException, logger
-from tools.models import LockTable, CallLogs
+from tools.models import LockTable, CallLogs, QueryProfile
 
 # Waiting while other function try to lock with DB table + try to lock with DB table
 # So maximum waiting time is (MAX_WAITING * 2) in seconds.
@@ -192,6 +197,151 @@ class LoggedCallMixin:
         pass
 
 
+def sql_fingerprint(sql):
+    """
+    Get SQL query without literals and parameters, so queries that differ just by them have the same fingerprint.
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'%s|\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(...)', sql)
+    sql = re.sub(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+', '(...)', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper that collects the number of queries, the total SQL time, fingerprints of queries
+    executed several times (usually N+1 problem) and the slowest statements.
+    """
+
+    def __init__(self, top=None):
+        self.top = top or settings.QUERY_PROFILING_TOP
+        self.queries = 0
+        self.sql_time = 0.0
+        self.duration = 0.0
+        self._fingerprints = {}
+        self._slowest = []
+        self._start = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.__add(sql, time.perf_counter() - start)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        self._start = time.perf_counter()
+        connection.execute_wrappers.append(self)
+
+    def stop(self):
+        if self in connection.execute_wrappers:
+            connection.execute_wrappers.remove(self)
+        self.duration = time.perf_counter() - self._start
+
+    @property
+    def duplicates(self):
+        duplicates = list([sql, cnt] for sql, cnt in self._fingerprints.items() if cnt > 1)
+        return sorted(duplicates, key=lambda x: -x[1])[:self.top]
+
+    @property
+    def slowest(self):
+        return list([sql, exec_time] for exec_time, sql in sorted(self._slowest, reverse=True))
+
+    def save(self, kind, name):
+        """
+        Save collected data. Only last settings.QUERY_PROFILING_BUFFER profiles are kept.
+        """
+        profile = QueryProfile.objects.create(
+            kind=kind, name=name[:128], duration=self.duration, queries=self.queries, sql_time=self.sql_time,
+            duplicates=self.duplicates, slowest=self.slowest
+        )
+        QueryProfile.objects.filter(id__lte=profile.id - settings.QUERY_PROFILING_BUFFER).delete()
+        return profile
+
+    def __add(self, sql, exec_time):
+        self.queries += 1
+        self.sql_time += exec_time
+        fingerprint = sql_fingerprint(sql)
+        self._fingerprints[fingerprint] = self._fingerprints.get(fingerprint, 0) + 1
+        if len(self._slowest) < self.top:
+            heapq.heappush(self._slowest, (exec_time, sql))
+        elif exec_time > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (exec_time, sql))
+
+
+class QueryProfilingMiddleware:
+    def __init__(self, get_response):
+        if not settings.ENABLE_QUERY_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        view_name = request.resolver_match.view_name if request.resolver_match else request.path
+        try:
+            recorder.save(QUERY_PROFILE_KIND[0][0], '{} {}'.format(request.method, view_name))
+        except Exception as e:
+            logger.exception(e)
+        return response
+
+
+class QueryProfileRegressions:
+    """
+    Compare average numbers of queries and SQL time of views and tasks in two time windows.
+    """
+
+    def __init__(self, base, current, threshold=1.5):
+        """
+        :param base: tuple (start, end) of datetimes.
+        :param current: tuple (start, end) of datetimes.
+        :param threshold: the minimal ratio of current and base averages that is considered as regression.
+        """
+        self._threshold = threshold
+        self._base = self.__collect(*base)
+        self._current = self.__collect(*current)
+        self.regressions = self.__compare()
+
+    def __collect(self, start, end):
+        data = {}
+        queryset = QueryProfile.objects.filter(date__gte=start, date__lt=end)
+        for row in queryset.values('kind', 'name').annotate(
+                calls=Count('id'), avg_queries=Avg('queries'), avg_sql_time=Avg('sql_time'),
+                avg_duration=Avg('duration')
+        ):
+            row['duplicates'] = set()
+            data[(row['kind'], row['name'])] = row
+        for kind, name, duplicates in queryset.values_list('kind', 'name', 'duplicates'):
+            data[(kind, name)]['duplicates'].update(fingerprint for fingerprint, _ in duplicates)
+        return data
+
+    def __compare(self):
+        regressions = []
+        for key in sorted(set(self._base) & set(self._current)):
+            base, current = self._base[key], self._current[key]
+            queries_ratio = current['avg_queries'] / max(base['avg_queries'], 1)
+            sql_time_ratio = current['avg_sql_time'] / base['avg_sql_time'] if base['avg_sql_time'] else 0
+            if queries_ratio < self._threshold and sql_time_ratio < self._threshold:
+                continue
+            regressions.append({
+                'kind': key[0], 'name': key[1],
+                'calls': (base['calls'], current['calls']),
+                'queries': (base['avg_queries'], current['avg_queries']),
+                'sql_time': (base['avg_sql_time'], current['avg_sql_time']),
+                'duration': (base['avg_duration'], current['avg_duration']),
+                'new_duplicates': sorted(current['duplicates'] - base['duplicates'])
+            })
+        return sorted(regressions, key=lambda x: x['sql_time'][0] - x['sql_time'][1])
+
+
 class ProfileData:
     default_around_seconds = 300
 
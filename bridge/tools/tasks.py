@@ -18,8 +18,15 @@
 import time
 
 from celery import shared_task
+from celery.signals import task_prerun, task_postrun
+from django.conf import settings
 
+from bridge.vars import QUERY_PROFILE_KIND
 from tools.models import CallLogs
+from tools.profiling import QueryRecorder
+
+# Task id -> query recorder of the running task
+_TASKS_RECORDERS = {}
 
 
 @shared_task
@@ -32,3 +39,18 @@ def clear_call_logs(num_of_days):
     # 30 days exactly
     border_time = time.time() - 86400 * num_of_days
     CallLogs.objects.filter(enter_time__lt=border_time).delete()
+
+
+@task_prerun.connect
+def start_task_profiling(task_id=None, **kwargs):
+    if settings.ENABLE_QUERY_PROFILING:
+        _TASKS_RECORDERS[task_id] = QueryRecorder()
+        _TASKS_RECORDERS[task_id].start()
+
+
+@task_postrun.connect
+def finish_task_profiling(task_id=None, task=None, **kwargs):
+    recorder = _TASKS_RECORDERS.pop(task_id, None)
+    if recorder is not None:
+        recorder.stop()
+        recorder.save(QUERY_PROFILE_KIND[1][0], task.name)
@@ -0,0 +1,95 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from datetime import timedelta
+
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+
+from bridge.utils import KleverTestCase
+from bridge.vars import QUERY_PROFILE_KIND
+
+from users.models import User
+from tools.models import QueryProfile
+from tools.profiling import sql_fingerprint, QueryRecorder, QueryProfileRegressions
+
+
+def _execute(sql, params, many, context):
+    return sql
+
+
+class TestQueryRecorder(SimpleTestCase):
+    def test_fingerprint(self):
+        self.assertEqual(
+            sql_fingerprint('SELECT "t"."id" FROM "t"\n WHERE "t"."id" IN (%s, %s, %s) AND "t"."name" = \'a\'\'b\''),
+            'SELECT "t"."id" FROM "t" WHERE "t"."id" IN (...) AND "t"."name" = ?'
+        )
+        self.assertEqual(
+            sql_fingerprint('INSERT INTO "t" ("a", "b") VALUES (%s, %s), (%s, %s) LIMIT 21'),
+            'INSERT INTO "t" ("a", "b") VALUES (...) LIMIT ?'
+        )
+
+    def test_recorder(self):
+        recorder = QueryRecorder(top=2)
+        for report_id in range(5):
+            recorder(_execute, 'SELECT * FROM "report" WHERE "id" = {}'.format(report_id), None, False, {})
+        recorder(_execute, 'SELECT * FROM "job"', None, False, {})
+        self.assertEqual(recorder.queries, 6)
+        self.assertEqual(recorder.duplicates, [['SELECT * FROM "report" WHERE "id" = ?', 5]])
+        self.assertEqual(len(recorder.slowest), 2)
+        self.assertGreaterEqual(recorder.slowest[0][1], recorder.slowest[1][1])
+
+
+class TestQueryProfiling(KleverTestCase):
+    query_budgets = {'users:login': 2}
+
+    def test_query_budget(self):
+        # Anonymous user just gets the form
+        response = self.client.get(reverse('users:login'))
+        self.assertEqual(response.status_code, 200)
+
+        User.objects.create_superuser('user', '', 'top_secret')
+        with self.assertRaises(AssertionError):
+            self.client.post(reverse('users:login'), {'username': 'user', 'password': 'top_secret'})
+
+    @override_settings(QUERY_PROFILING_BUFFER=3)
+    def test_ring_buffer(self):
+        for i in range(5):
+            with QueryRecorder() as recorder:
+                User.objects.filter(username='user{}'.format(i)).exists()
+            recorder.save(QUERY_PROFILE_KIND[0][0], 'view')
+        self.assertEqual(QueryProfile.objects.count(), 3)
+        self.assertEqual(QueryProfile.objects.order_by('id').last().queries, 1)
+
+    def test_regressions(self):
+        date = now()
+        base = (date - timedelta(hours=2), date - timedelta(hours=1))
+        current = (date - timedelta(hours=1), date)
+        for name, base_queries, current_queries in [('fast', 2, 2), ('slow', 2, 10)]:
+            QueryProfile.objects.create(
+                kind=QUERY_PROFILE_KIND[0][0], name=name, date=base[0], queries=base_queries, sql_time=0.1
+            )
+            QueryProfile.objects.create(
+                kind=QUERY_PROFILE_KIND[0][0], name=name, date=current[0], queries=current_queries, sql_time=0.1,
+                duplicates=[['SELECT ?', current_queries]]
+            )
+        regressions = QueryProfileRegressions(base, current).regressions
+        self.assertEqual(len(regressions), 1)
+        self.assertEqual(regressions[0]['name'], 'slow')
+        self.assertEqual(regressions[0]['queries'], (2, 10))
+        self.assertEqual(regressions[0]['new_duplicates'], ['SELECT ?'])
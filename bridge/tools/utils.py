@@ -41,9 +41,11 @@ from marks.models import (
 )
 from reports.models import (
     ReportComponent, ReportSafe, ReportUnsafe, ReportUnknown, ReportComponentLeaf,
-    CoverageArchive, OriginalSources, DecisionCache, SourceCodeCache, ORIGINAL_SOURCES_DIR
+    CoverageArchive, OriginalSources, DecisionCache, ORIGINAL_SOURCES_DIR
+)
+from marks.tasks import (
+    connect_safe_reports, connect_unsafe_reports, connect_unknown_reports, connect_reports_in_batches
 )
-from marks.tasks import connect_safe_report, connect_unsafe_report, connect_unknown_report
 
 from caches.utils import RecalculateSafeCache, RecalculateUnsafeCache, RecalculateUnknownCache
 from reports.coverage import FillCoverageStatistics
@@ -63,20 +65,23 @@ def objects_without_relations(table):
 def recalculate_safe_links(decisions):
     MarkSafeReport.objects.filter(report__decision__in=decisions).delete()
     # It could be long
-    for report_id in ReportSafe.objects.filter(decision__in=decisions).values_list('id', flat=True):
-        connect_safe_report.delay(report_id)
+    connect_reports_in_batches(
+        connect_safe_reports, ReportSafe.objects.filter(decision__in=decisions).values_list('id', flat=True)
+    )
 
 
 def recalculate_unsafe_links(decisions):
     MarkUnsafeReport.objects.filter(report__decision__in=decisions).delete()
-    for report_id in ReportUnsafe.objects.filter(decision__in=decisions).values_list('id', flat=True):
-        connect_unsafe_report.delay(report_id)
+    connect_reports_in_batches(
+        connect_unsafe_reports, ReportUnsafe.objects.filter(decision__in=decisions).values_list('id', flat=True)
+    )
 
 
 def recalculate_unknown_links(decisions):
     MarkUnknownReport.objects.filter(report__decision__in=decisions).delete()
-    for report_id in ReportUnknown.objects.filter(decision__in=decisions).values_list('id', flat=True):
-        connect_unknown_report.delay(report_id)
+    connect_reports_in_batches(
+        connect_unknown_reports, ReportUnknown.objects.filter(decision__in=decisions).values_list('id', flat=True)
+    )
 
 
 class ClearFiles:
@@ -412,11 +417,6 @@ class RemoveDuplicates:
         ids_to_delete = self.__collect_ids_to_remove(qs)
         UnsafeConvertionCache.objects.filter(id__in=ids_to_delete).delete()
 
-        # Clear converted traces cache
-        qs = self.__source_code_cache_qs()
-        ids_to_delete = self.__collect_ids_to_remove(qs)
-        SourceCodeCache.objects.filter(id__in=ids_to_delete).delete()
-
     def __collect_ids_to_remove(self, qs):
         ids_to_delete = set()
         for obj in qs:
@@ -431,11 +431,6 @@ class RemoveDuplicates:
             .annotate(duplicates=Count('id'), ids_list=ArrayAgg('id'))\
             .filter(duplicates__gt=1).values('ids_list')
 
-    def __source_code_cache_qs(self):
-        return SourceCodeCache.objects.values('identifier')\
-            .annotate(duplicates=Count('id'), ids_list=ArrayAgg('id'))\
-            .filter(duplicates__gt=1).values('ids_list')
-
 
 class ErrorTraceAnanlizer:
     def __init__(self, error_trace):
@@ -16,10 +16,13 @@
 #
 
 import json
+import base64
+from collections.abc import Sequence
 from datetime import date
 
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Q
+from django.db.models import Case, When, Q, IntegerField, Value
+from django.db.models.functions import Coalesce
 from django.template import Template, Context
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
@@ -598,3 +601,175 @@ def paginate_queryset(queryset, page, num_per_page=None):
     except EmptyPage:
         values = paginator.page(paginator.num_pages)
     return paginator, values
+
+
+class KeysetPage(Sequence):
+    def __init__(self, object_list, number, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def previous_page_number(self):
+        if not self.object_list:
+            # There are no objects to get the cursor, so neighbour pages are referred by numbers
+            return self.number - 1
+        return self.paginator.get_cursor(self.number - 1, False, self.object_list[0])
+
+    def next_page_number(self):
+        if not self.object_list:
+            return self.number + 1
+        return self.paginator.get_cursor(self.number + 1, True, self.object_list[-1])
+
+
+class KeysetPaginator:
+    """
+    Paginator that gets pages by values of ordering keys of the neighbour page objects instead of OFFSET, so late pages
+    are got as fast as first ones. Page "numbers" of neighbour pages are cursors with these values that also keep the
+    number of objects counted for the first requested page.
+    """
+    cursor_prefix = 'k'
+
+    def __init__(self, queryset, keys, per_page):
+        """
+        :param queryset: Not ordered queryset.
+        :param keys: Names of fields or annotations to order by like for order_by(). They must not be NULL and the
+            last one must be unique, e.g. 'id' or '-id'.
+        :param per_page: Number of objects per page.
+        """
+        self.object_list = queryset
+        self.keys = keys
+        self.per_page = per_page
+        self._count = None
+
+    @property
+    def count(self):
+        if self._count is None:
+            self._count = self.object_list.count()
+        return self._count
+
+    @property
+    def num_pages(self):
+        return max((self.count + self.per_page - 1) // self.per_page, 1)
+
+    def get_cursor(self, number, forward, obj):
+        values = list(getattr(obj, key.lstrip('-')) for key in self.keys)
+        data = json.dumps([number, self.count, forward, values], default=str).encode('utf8')
+        return self.cursor_prefix + base64.urlsafe_b64encode(data).decode('utf8').rstrip('=')
+
+    def __parse_cursor(self, cursor):
+        data = cursor[len(self.cursor_prefix):]
+        number, self._count, forward, values = json.loads(base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)))
+        if not isinstance(number, int) or number < 1 or not isinstance(self._count, int) or \
+                len(values) != len(self.keys):
+            raise ValueError('Wrong cursor')
+        return number, forward, values
+
+    def __ordering(self, forward):
+        if forward:
+            return self.keys
+        return list(key[1:] if key.startswith('-') else '-' + key for key in self.keys)
+
+    def __after(self, keys, values):
+        # Objects that follow the given values of keys in the order of these keys
+        condition = Q()
+        for i, key in enumerate(keys):
+            name = key.lstrip('-')
+            key_condition = Q(**{'{}__{}'.format(name, 'lt' if key.startswith('-') else 'gt'): values[i]})
+            for prev_key, value in zip(keys[:i], values):
+                key_condition &= Q(**{prev_key.lstrip('-'): value})
+            condition |= key_condition
+        return condition
+
+    def __select(self, forward, values=None, limit=None):
+        ordering = self.__ordering(forward)
+        queryset = self.object_list
+        if values is not None:
+            queryset = queryset.filter(self.__after(ordering, values))
+        objects = list(queryset.order_by(*ordering)[:(limit or self.per_page) + 1])
+        more = len(objects) > (limit or self.per_page)
+        objects = objects[:limit or self.per_page]
+        if not forward:
+            objects.reverse()
+        return objects, more
+
+    def page(self, page):
+        if isinstance(page, str) and page.startswith(self.cursor_prefix):
+            try:
+                number, forward, values = self.__parse_cursor(page)
+            except (ValueError, TypeError):
+                raise BridgeException()
+            objects, more = self.__select(forward, values)
+            if objects:
+                if forward:
+                    return KeysetPage(objects, number, self, True, more)
+                return KeysetPage(objects, number, self, more, True)
+            # Neighbour pages can disappear if objects were deleted
+            page = 1
+
+        if page == 'last':
+            # The last page is the first one in the reversed order
+            number = self.num_pages
+            objects, more = self.__select(False, limit=self.count - (number - 1) * self.per_page or self.per_page)
+            return KeysetPage(objects, number, self, more, False)
+
+        try:
+            number = int(page)
+        except ValueError:
+            raise BridgeException()
+        if number > 1:
+            # Pages that are referred by numbers, e.g. bookmarked ones, can be got just with OFFSET
+            number = min(number, self.num_pages)
+            offset = (number - 1) * self.per_page
+            objects = list(self.object_list.order_by(*self.keys)[offset:offset + self.per_page])
+            return KeysetPage(objects, number, self, number > 1, number < self.num_pages)
+
+        objects, more = self.__select(True)
+        return KeysetPage(objects, 1, self, False, more)
+
+
+def ordering_keys(annotations, ordering, descending, nulls_last=False):
+    """
+    Get keys for keyset pagination. Objects are ordered by values of the given expression and then by their
+    identifiers. By default, like PostgreSQL does, NULL values are considered as the greatest ones, but keys are not
+    NULL.
+
+    :param annotations: Dictionary with queryset annotations where annotations for keys are added.
+    :param ordering: None to order just by identifiers, name of the field or annotation that is never NULL or a pair of
+        expression and its value to use instead of NULL.
+    :param descending: Whether objects should be ordered in descending order.
+    :param nulls_last: Whether objects with NULL values should be the last ones regardless of the order.
+    :return: List of keys.
+    """
+    keys = ['id']
+    if isinstance(ordering, str):
+        keys = [ordering, 'id']
+    elif ordering is not None:
+        annotations['ordering_raw'] = ordering[0]
+        annotations['ordering_null'] = Case(
+            When(ordering_raw=None, then=Value(1)), default=Value(0), output_field=IntegerField()
+        )
+        annotations['ordering_value'] = Coalesce('ordering_raw', Value(ordering[1]))
+        keys = ['ordering_null', 'ordering_value', 'id']
+    if descending:
+        keys = list(key if nulls_last and key == 'ordering_null' else '-' + key for key in keys)
+    return keys
+
+
+def paginate_by_keyset(queryset, keys, page, num_per_page=None):
+    num_per_page = max(int(num_per_page), 1) if num_per_page else DEF_NUMBER_OF_ELEMENTS
+    paginator = KeysetPaginator(queryset, keys, num_per_page)
+    return paginator, paginator.page(page)
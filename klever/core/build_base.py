@@ -0,0 +1,125 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import json
+
+BUILD_BASE_META_FORMAT_VERSION = 1
+
+
+class CommonPrefix:
+    """
+    Common prefix of many strings that is computed incrementally, so strings do not need to be kept in memory. It is
+    the same as os.path.commonprefix() returns for the list of all added strings.
+    """
+
+    def __init__(self):
+        self.value = None
+
+    def add(self, string):
+        if self.value is None:
+            self.value = string
+        elif not string.startswith(self.value):
+            self.value = os.path.commonprefix([self.value, string])
+
+    def __str__(self):
+        return self.value or ''
+
+
+def _get_files_prefix(clade, cmd_types, files_kind):
+    prefix = CommonPrefix()
+    for cmd_type in cmd_types:
+        for cmd in clade.get_all_cmds_by_type(cmd_type):
+            for file in cmd[files_kind] or ():
+                # Sometimes some auxiliary stuff is built in addition to normal C source files that are most likely
+                # located in a place we would like to get.
+                if not file.startswith('/tmp') and file != '/dev/null':
+                    prefix.add(os.path.join(cmd['cwd'], file))
+    return os.path.dirname(str(prefix))
+
+
+def _get_func_def_lines(clade):
+    func_def_lines = {}
+    for file_name, funcs in clade.Functions.yield_functions_by_file():
+        if file_name != 'unknown':
+            func_def_lines[file_name] = sorted(int(func_info['line']) for func_info in funcs[file_name].values())
+    return func_def_lines
+
+
+# Collectors of build base meta information by its keys. Keys are collected and cached separately since, say, common
+# prefixes are needed just when working source trees are not specified while loading all commands takes much time.
+_BUILD_BASE_META_COLLECTORS = {
+    'CC/CL input files prefix': lambda clade: _get_files_prefix(clade, ('CC', 'CL'), 'in'),
+    'LD/Link output files prefix': lambda clade: _get_files_prefix(clade, ('LD', 'Link'), 'out'),
+    'function definition lines': _get_func_def_lines
+}
+
+
+def collect_build_base_meta(clade, keys):
+    """
+    Get build base meta information with given keys, i.e. common prefixes of CC/CL input files and LD/Link output files
+    and function definition lines for each source file. Each of them is got in one pass over commands or function
+    definitions of the build base.
+
+    :param clade: Clade object.
+    :param keys: Iterable of keys of build base meta information.
+    :return: Dictionary with build base meta information.
+    """
+    return {key: _BUILD_BASE_META_COLLECTORS[key](clade) for key in keys}
+
+
+def get_build_base_meta(logger, clade, keys):
+    """
+    Get build base meta information with given keys from the cache in the build base directory or collect it and try to
+    cache it there together with information cached before. Cached information is keyed by the Clade UUID, so it is not
+    reused for rebuilt build bases.
+
+    :param logger: Logger object.
+    :param clade: Clade object.
+    :param keys: Iterable of keys of build base meta information.
+    :return: Dictionary with build base meta information.
+    """
+    cache_file = os.path.join(clade.work_dir, 'klever meta {0}.json'.format(clade.get_uuid()))
+
+    cached_meta = {}
+    try:
+        with open(cache_file, encoding='utf-8') as fp:
+            cached_meta = json.load(fp)
+        if not isinstance(cached_meta, dict) or cached_meta.get('format') != BUILD_BASE_META_FORMAT_VERSION:
+            cached_meta = {}
+    except (OSError, ValueError):
+        pass
+
+    missing_keys = [key for key in keys if key not in cached_meta]
+    if not missing_keys:
+        logger.debug('Use cached build base meta information from "%s"', cache_file)
+        return {key: cached_meta[key] for key in keys}
+
+    cached_meta.update(collect_build_base_meta(clade, missing_keys))
+    cached_meta['format'] = BUILD_BASE_META_FORMAT_VERSION
+
+    # Build bases can be shared by several jobs that are decided simultaneously. Information cached by them at the same
+    # time can be lost, but it is just collected once more next time.
+    tmp_cache_file = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+    try:
+        with open(tmp_cache_file, 'w', encoding='utf-8') as fp:
+            json.dump(cached_meta, fp)
+        os.replace(tmp_cache_file, cache_file)
+    except OSError as e:
+        logger.warning('Cannot cache build base meta information in "%s": %s', cache_file, e)
+
+    return {key: cached_meta[key] for key in keys}
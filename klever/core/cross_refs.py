@@ -15,16 +15,144 @@
 # limitations under the License.
 #
 
+import gzip
+import hashlib
+import json
 import os
+import shutil
 
 import klever.core.utils
 from klever.core.highlight import Highlight
 
 
+def get_raw_refs(clade, file_names):
+    """
+    Get raw references to/from for many source files at once since each query to Clade has a considerable overhead.
+
+    :param clade: Clade object.
+    :param file_names: List of source file names.
+    :return: Dictionary with pairs of raw references to and raw references from for each given source file.
+    """
+    clade_refs_to = clade.get_ref_to(file_names) or {}
+    clade_refs_from = clade.get_ref_from(file_names) or {}
+
+    raw_refs = {}
+    for file_name in file_names:
+        raw_refs_to = {
+            'decl_func': [],
+            'def_func': [],
+            'def_macro': []
+        }
+        raw_refs_to.update(clade_refs_to.get(file_name, {}))
+
+        raw_refs_from = {
+            'call': [],
+            'expand': []
+        }
+        raw_refs_from.update(clade_refs_from.get(file_name, {}))
+
+        raw_refs[file_name] = (raw_refs_to, raw_refs_from)
+
+    return raw_refs
+
+
+class CrossRefsStore:
+    """
+    Local store of index data of source files that is shared by different build bases. Index data is keyed by
+    checksums of source file contents and of raw references to/from, so it is reused for source files that were not
+    changed when a build base is rebuilt. The store is limited by size, so least recently used index data is removed
+    when it is exceeded.
+    """
+
+    def __init__(self, store_dir, max_size):
+        """
+        :param store_dir: Store directory.
+        :param max_size: Maximum total size of stored index data in bytes.
+        """
+        self.store_dir = os.path.realpath(store_dir)
+        self.max_size = max_size
+
+    def get_key(self, cross_refs, raw_refs):
+        """
+        Get key of index data of a given source file.
+
+        :param cross_refs: CrossRefs object.
+        :param raw_refs: Pair of raw references to and raw references from.
+        :return: String.
+        """
+        refs_checksum = klever.core.utils.get_file_name_checksum(json.dumps(
+            [raw_refs, cross_refs.common_dirs, cross_refs.common_prefix, cross_refs.conf.get('compress index data')],
+            sort_keys=True))
+        return hashlib.sha256('{0}-{1}-{2}'.format(
+            cross_refs.INDEX_DATA_FORMAT_VERSION, klever.core.utils.get_file_checksum(cross_refs.new_file_name),
+            refs_checksum).encode('utf-8')).hexdigest()
+
+    def __get_path(self, key):
+        return os.path.join(self.store_dir, key[:2], key + '.idx.json')
+
+    def get(self, key, idx_file):
+        """
+        Copy index data from the store if it is there.
+
+        :return: True if index data was copied and False otherwise.
+        """
+        path = self.__get_path(key)
+        try:
+            shutil.copyfile(path, idx_file)
+            # Modification time of index data tells when it was used last time.
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    def put(self, key, idx_file):
+        path = self.__get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Several workers can index the same source file simultaneously, so replace stored index data atomically.
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        shutil.copyfile(idx_file, tmp_path)
+        os.replace(tmp_path, path)
+
+    def prune(self):
+        """
+        Remove least recently used index data until the store fits its maximum size.
+
+        :return: Number of removed files.
+        """
+        stored = []
+        total_size = 0
+        for dirpath, _, filenames in os.walk(self.store_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                # Other workers can remove index data simultaneously.
+                except FileNotFoundError:
+                    continue
+                stored.append((st.st_mtime, path, st.st_size))
+                total_size += st.st_size
+
+        removed = 0
+        for _, path, size in sorted(stored):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+        return removed
+
+
 class CrossRefs:
-    INDEX_DATA_FORMAT_VERSION = 1
+    INDEX_DATA_FORMAT_VERSION = 2
 
-    def __init__(self, conf, logger, clade, file_name, new_file_name, common_dirs, common_prefix=''):
+    def __init__(self, conf, logger, clade, file_name, new_file_name, common_dirs, common_prefix='', raw_refs=None,
+                 store=None):
         self.conf = conf
         self.logger = logger
         self.clade = clade
@@ -32,36 +160,37 @@ class CrossRefs:
         self.new_file_name = new_file_name
         self.common_dirs = common_dirs
         self.common_prefix = common_prefix
+        # Raw references to/from obtained in advance by get_raw_refs().
+        self.raw_refs = raw_refs
+        # CrossRefsStore object.
+        self.store = store
 
     def get_cross_refs(self):
+        """
+        Generate index data for a given source file or take it from the store.
+
+        :return: True if index data was generated and False otherwise.
+        """
         with open(self.new_file_name) as fp:
             try:
                 src = fp.read()
             # Source files with non UTF-8 encoding will not be analyzed. There should not be many such source files.
             except UnicodeDecodeError:
-                return
+                return False
 
-        highlight = Highlight(self.logger, src)
-        highlight.highlight()
+        if self.raw_refs:
+            raw_refs_to, raw_refs_from = self.raw_refs
+        else:
+            raw_refs_to, raw_refs_from = get_raw_refs(self.clade, [self.file_name])[self.file_name]
 
-        # Get raw references to/from for a given source file. There is the only key-value pair in dictionaries
-        # returned by Clade where keys are always source file names.
-        raw_refs_to = {
-            'decl_func': [],
-            'def_func': [],
-            'def_macro': []
-        }
-        clade_refs_to = self.clade.get_ref_to([self.file_name])
-        if clade_refs_to:
-            raw_refs_to.update(list(clade_refs_to.values())[0])
+        idx_file = self.new_file_name + '.idx.json'
+        if self.store:
+            key = self.store.get_key(self, (raw_refs_to, raw_refs_from))
+            if self.store.get(key, idx_file):
+                return False
 
-        raw_refs_from = {
-            'call': [],
-            'expand': []
-        }
-        clade_refs_from = self.clade.get_ref_from([self.file_name])
-        if clade_refs_from:
-            raw_refs_from.update(list(clade_refs_from.values())[0])
+        highlight = Highlight(self.logger, src)
+        highlight.highlight()
 
         # Get full list of referred source file names.
         ref_src_files = set()
@@ -80,35 +209,32 @@ class CrossRefs:
         ref_src_files_dict = {ref_src_file: i for i, ref_src_file in enumerate(ref_src_files)}
         ref_src_files_dict[self.file_name] = None
 
-        # Convert references to.
+        # Convert references to. Remember locations of references to macro definitions and function definitions to
+        # filter out references to function definitions/declarations at the same places without scanning these lists.
         refs_to_func_defs = []
         refs_to_func_decls = []
         refs_to_macro_defs = []
+        macro_def_locs = set()
+        func_def_locs = set()
         for ref_to_kind in ('def_macro', 'def_func', 'decl_func'):
             refs_to = refs_to_func_defs if ref_to_kind == 'def_func' else refs_to_func_decls \
                 if ref_to_kind == 'decl_func' else refs_to_macro_defs
             for raw_ref_to in raw_refs_to[ref_to_kind]:
+                loc = tuple(raw_ref_to[0])
+
                 # Do not add references to function definitions/declarations if there are already references to macro
                 # definitions at the same places.
-                if ref_to_kind != 'def_macro':
-                    is_exist = False
-                    for ref_to_macro_def in refs_to_macro_defs:
-                        if ref_to_macro_def[0] == raw_ref_to[0]:
-                            is_exist = True
-                            break
-                    if is_exist:
-                        continue
+                if ref_to_kind == 'def_macro':
+                    macro_def_locs.add(loc)
+                elif loc in macro_def_locs:
+                    continue
 
                 # Do not add references to function declarations if there are already references to function definitions
                 # at the same places.
-                if ref_to_kind == 'decl_func':
-                    is_exist = False
-                    for ref_to_func_def in refs_to_func_defs:
-                        if ref_to_func_def[0] == raw_ref_to[0]:
-                            is_exist = True
-                            break
-                    if is_exist:
-                        continue
+                if ref_to_kind == 'def_func':
+                    func_def_locs.add(loc)
+                elif ref_to_kind == 'decl_func' and loc in func_def_locs:
+                    continue
 
                 # TODO: will it work if there will be multiple declarations of the same entity in the same source file?
                 refs_to.append([
@@ -125,9 +251,9 @@ class CrossRefs:
         # Convert references from.
         refs_from_func_calls = []
         refs_from_macro_expansions = []
-        cur_entity_location = None
         for ref_from_kind in ('call', 'expand'):
             refs_from = refs_from_func_calls if ref_from_kind == 'call' else refs_from_macro_expansions
+            cur_entity_location = None
             for raw_ref_from in raw_refs_from[ref_from_kind]:
                 ref_from = [
                     # Convert referring source file name to index in source files list.
@@ -185,11 +311,55 @@ class CrossRefs:
         cross_ref = {
             'format': self.INDEX_DATA_FORMAT_VERSION,
             'source files': short_ref_src_files,
-            'referencesto': refs_to_func_defs + refs_to_macro_defs,
-            'referencestodeclarations': refs_to_func_decls,
-            'referencesfrom': refs_from_func_calls + refs_from_macro_expansions,
-            'highlight': highlight.highlights
+            'referencesto': self.__refs_to_columns(refs_to_func_defs + refs_to_macro_defs),
+            'referencestodeclarations': self.__refs_to_columns(refs_to_func_decls, declarations=True),
+            'referencesfrom': self.__refs_from_columns(refs_from_func_calls + refs_from_macro_expansions),
+            'highlight': self.__highlights_columns(highlight.highlights)
+        }
+
+        if self.conf.get('compress index data'):
+            with gzip.open(idx_file, 'wt', encoding='utf-8') as fp:
+                klever.core.utils.json_dump(cross_ref, fp, False)
+        else:
+            with open(idx_file, 'w') as fp:
+                klever.core.utils.json_dump(cross_ref, fp, self.conf['keep intermediate files'])
+
+        if self.store:
+            self.store.put(key, idx_file)
+
+        return True
+
+    # Index data is stored by columns since there may be very many references and highlights. Bridge converts them
+    # back to lists of references and highlights.
+    @staticmethod
+    def __refs_to_columns(refs_to, declarations=False):
+        return {
+            'line': [r[0][0] for r in refs_to],
+            'start': [r[0][1] for r in refs_to],
+            'end': [r[0][2] for r in refs_to],
+            'file': [r[1][0] for r in refs_to],
+            'file line': [r[1][1][0] if declarations else r[1][1] for r in refs_to]
         }
 
-        with open(os.path.join(self.new_file_name + '.idx.json'), 'w') as fp:
-            klever.core.utils.json_dump(cross_ref, fp, self.conf['keep intermediate files'])
+    @staticmethod
+    def __refs_from_columns(refs_from):
+        return {
+            'line': [r[0][0] for r in refs_from],
+            'start': [r[0][1] for r in refs_from],
+            'end': [r[0][2] for r in refs_from],
+            'refs': [r[1:] for r in refs_from]
+        }
+
+    @staticmethod
+    def __highlights_columns(highlights):
+        kinds = {}
+        for h in highlights:
+            kinds.setdefault(h[0], len(kinds))
+
+        return {
+            'kinds': list(kinds),
+            'kind': [kinds[h[0]] for h in highlights],
+            'line': [h[1] for h in highlights],
+            'start': [h[2] for h in highlights],
+            'end': [h[3] for h in highlights]
+        }
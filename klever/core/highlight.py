@@ -15,17 +15,292 @@
 # limitations under the License.
 #
 
+import functools
+import itertools
 import re
+import string
+
 from pygments import lex
 from pygments.lexers import CLexer  #pylint:disable=no-name-in-module
 from pygments.token import Comment, Error, Keyword, Literal, Name, Operator, Punctuation, Text
 
 
+# Marker of rule groups that are scanned once again from the initial state like pygments.lexer.using(this) does.
+_SCAN = object()
+
+_WS1 = r'\s*(?:/[*].*?[*]/\s*)?'
+_HEXPART = r"[0-9a-fA-F](\'?[0-9a-fA-F])*"
+_DECPART = r"\d(\'?\d)*"
+_INTSUFFIX = r'(([uU][lL]{0,2})|[lL]{1,2}[uU]?)?'
+_IDENT = r'(?!\d)(?:[\w$]|\\u[0-9a-fA-F]{4}|\\U[0-9a-fA-F]{8})+'
+_NAMESPACED_IDENT = r'(?!\d)(?:[\w$]|\\u[0-9a-fA-F]{4}|\\U[0-9a-fA-F]{8}|::)+'
+
+# ASCII characters which strings matched by rules can start with. Non-ASCII characters are matched by all rules.
+_SPACES = ''.join(c for c in map(chr, range(128)) if c.isspace())
+_IDENT_FIRST = string.ascii_letters + '_$\\'
+_NUMBER_FIRST = string.digits + '-.'
+_WS1_FIRST = _SPACES + '/'
+
+
+def _words(*words):
+    return r'(?:{0})\b'.format('|'.join(words))
+
+
+class CScanner:
+    """
+    Dedicated scanner of C source files that produces exactly the same tokens as pygments.lex() with CLexer (the
+    latter is kept as a reference, see test_highlight.py). Rules of each lexer state are joined into one regular
+    expression, so the scanner makes one match per token rather than tries rules one by one.
+    """
+
+    # Rules are (regular expression, token type or tuple of token types of groups, new state, ASCII characters which
+    # matched strings can start with or None if they can start with any character).
+    _WHITESPACE = [
+        (r'^#if\s+0', Comment.Preproc, 'if0', '#'),
+        (r'^#', Comment.Preproc, 'macro', '#'),
+        (r'^(' + _WS1 + r')(#if\s+0)', (_SCAN, Comment.Preproc), 'if0', _WS1_FIRST + '#'),
+        (r'^(' + _WS1 + r')(#)', (_SCAN, Comment.Preproc), 'macro', _WS1_FIRST + '#'),
+        (r'(^[ \t]*)(?!(?:public|private|protected|default)\b)(' + _IDENT + r')(\s*)(:)(?!:)',
+         (Text.Whitespace, Name.Label, Text.Whitespace, Punctuation), None, ' \t' + _IDENT_FIRST),
+        (r'\n', Text.Whitespace, None, '\n'),
+        (r'[^\S\n]+', Text.Whitespace, None, _SPACES),
+        (r'\\\n', Text, None, '\\'),
+        (r'//(\n|[\w\W]*?[^\\]\n)', Comment.Single, None, '/'),
+        (r'/(\\\n)?[*][\w\W]*?[*](\\\n)?/', Comment.Multiline, None, '/'),
+        (r'/(\\\n)?[*][\w\W]*', Comment.Multiline, None, '/')
+    ]
+    _KEYWORDS = [
+        (_words('_Alignas', '_Alignof', '_Noreturn', '_Generic', '_Thread_local', '_Static_assert', '_Imaginary',
+                'noreturn', 'imaginary', 'complex'), Keyword, None, _IDENT_FIRST),
+        (r'(struct|union)(\s+)', (Keyword, Text.Whitespace), 'classname', 'su'),
+        (r'case\b', Keyword, 'case-value', 'c'),
+        (_words('asm', 'auto', 'break', 'const', 'continue', 'default', 'do', 'else', 'enum', 'extern', 'for', 'goto',
+                'if', 'register', 'restricted', 'return', 'sizeof', 'struct', 'static', 'switch', 'typedef',
+                'volatile', 'while', 'union', 'thread_local', 'alignas', 'alignof', 'static_assert', '_Pragma'),
+         Keyword, None, _IDENT_FIRST),
+        (_words('inline', '_inline', '__inline', 'naked', 'restrict', 'thread'), Keyword.Reserved, None, _IDENT_FIRST),
+        (r'(__m(128i|128d|128|64))\b', Keyword.Reserved, None, '_'),
+        (_words('__asm', '__based', '__except', '__stdcall', '__cdecl', '__fastcall', '__declspec', '__finally',
+                '__try', '__leave', '__w64', '__unaligned', '__raise', '__noop', '__identifier', '__forceinline',
+                '__assume'), Keyword.Reserved, None, '_')
+    ]
+    _TYPES = [
+        (_words('_Bool', '_Complex', '_Atomic'), Keyword.Type, None, '_'),
+        (_words('__int8', '__int16', '__int32', '__int64', '__wchar_t'), Keyword.Reserved, None, '_'),
+        (_words('bool', 'int', 'long', 'float', 'short', 'double', 'char', 'unsigned', 'signed', 'void'), Keyword.Type,
+         None, _IDENT_FIRST)
+    ]
+    _STATEMENTS = _KEYWORDS + _TYPES + [
+        (r'([LuU]|u8)?(")', (Literal.String.Affix, Literal.String), 'string', 'LuU"'),
+        (r"([LuU]|u8)?(')(\\.|\\[0-7]{1,3}|\\x[a-fA-F0-9]{1,2}|[^\\\'\n])(')",
+         (Literal.String.Affix, Literal.String.Char, Literal.String.Char, Literal.String.Char), None, 'LuU\''),
+        (r'0[xX](' + _HEXPART + r'\.' + _HEXPART + r'|\.' + _HEXPART + r'|' + _HEXPART + r')[pP][+-]?' + _HEXPART +
+         r'[lL]?', Literal.Number.Float, None, '0'),
+        (r'(-)?(' + _DECPART + r'\.' + _DECPART + r'|\.' + _DECPART + r'|' + _DECPART + r')[eE][+-]?' + _DECPART +
+         r'[fFlL]?', Literal.Number.Float, None, _NUMBER_FIRST),
+        (r'(-)?((' + _DECPART + r'\.(' + _DECPART + r')?|\.' + _DECPART + r')[fFlL]?)|(' + _DECPART + r'[fFlL])',
+         Literal.Number.Float, None, _NUMBER_FIRST),
+        (r'(-)?0[xX]' + _HEXPART + _INTSUFFIX, Literal.Number.Hex, None, '-0'),
+        (r"(-)?0[bB][01](\'?[01])*" + _INTSUFFIX, Literal.Number.Bin, None, '-0'),
+        (r"(-)?0(\'?[0-7])+" + _INTSUFFIX, Literal.Number.Oct, None, '-0'),
+        (r'(-)?' + _DECPART + _INTSUFFIX, Literal.Number.Integer, None, _NUMBER_FIRST),
+        (r'[~!%^&*+=|?:<>/-]', Operator, None, '~!%^&*+=|?:<>/-'),
+        (r'[()\[\],.]', Punctuation, None, '()[],.'),
+        (r'(true|false|NULL)\b', Name.Builtin, None, 'tfN'),
+        (_IDENT, Name, None, _IDENT_FIRST)
+    ]
+    _STATES = {
+        'root': _WHITESPACE + _KEYWORDS + [
+            # Function definitions.
+            (r'(' + _NAMESPACED_IDENT + r'(?:[&*\s])+)(' + _NAMESPACED_IDENT + r')(\s*\([^;]*?\))([^;{]*)(\{)',
+             (_SCAN, Name.Function, _SCAN, _SCAN, Punctuation), 'function', _IDENT_FIRST + ':'),
+            # Function declarations.
+            (r'(' + _NAMESPACED_IDENT + r'(?:[&*\s])+)(' + _NAMESPACED_IDENT + r')(\s*\([^;]*?\))([^;]*)(;)',
+             (_SCAN, Name.Function, _SCAN, _SCAN, Punctuation), None, _IDENT_FIRST + ':')
+        ] + _TYPES + [
+            (r'', None, 'statement', None)
+        ],
+        'statement': _WHITESPACE + _STATEMENTS + [
+            (r'\}', Punctuation, None, '}'),
+            (r'[{;]', Punctuation, '#pop', '{;')
+        ],
+        'function': _WHITESPACE + _STATEMENTS + [
+            (r';', Punctuation, None, ';'),
+            (r'\{', Punctuation, '#push', '{'),
+            (r'\}', Punctuation, '#pop', '}')
+        ],
+        'string': [
+            (r'"', Literal.String, '#pop', '"'),
+            (r'\\([\\abfnrtv"\']|x[a-fA-F0-9]{2,4}|u[a-fA-F0-9]{4}|U[a-fA-F0-9]{8}|[0-7]{1,3})', Literal.String.Escape,
+             None, '\\'),
+            (r'[^\\"\n]+', Literal.String, None, None),
+            (r'\\\n', Literal.String, None, '\\'),
+            (r'\\', Literal.String, None, '\\')
+        ],
+        'macro': [
+            (r'(' + _WS1 + r')(include)(' + _WS1 + r')("[^"]+")([^\n]*)',
+             (_SCAN, Comment.Preproc, _SCAN, Comment.PreprocFile, Comment.Single), None, _WS1_FIRST + 'i'),
+            (r'(' + _WS1 + r')(include)(' + _WS1 + r')(<[^>]+>)([^\n]*)',
+             (_SCAN, Comment.Preproc, _SCAN, Comment.PreprocFile, Comment.Single), None, _WS1_FIRST + 'i'),
+            (r'[^/\n]+', Comment.Preproc, None, None),
+            (r'/[*](.|\n)*?[*]/', Comment.Multiline, None, '/'),
+            (r'//.*?\n', Comment.Single, '#pop', '/'),
+            (r'/', Comment.Preproc, None, '/'),
+            (r'(?<=\\)\n', Comment.Preproc, None, '\n'),
+            (r'\n', Comment.Preproc, '#pop', '\n')
+        ],
+        'if0': [
+            (r'^\s*#if.*?(?<!\\)\n', Comment.Preproc, '#push', _SPACES + '#'),
+            (r'^\s*#el(?:se|if).*\n', Comment.Preproc, '#pop', _SPACES + '#'),
+            (r'^\s*#endif.*?(?<!\\)\n', Comment.Preproc, '#pop', _SPACES + '#'),
+            (r'.*?\n', Comment, None, None)
+        ],
+        'classname': [
+            (_IDENT, Name.Class, '#pop', _IDENT_FIRST),
+            (r'\s*(?=>)', Text, '#pop', _SPACES + '>'),
+            (r'', None, '#pop', None)
+        ],
+        'case-value': [
+            (r'(?<!:)(:)(?!:)', Punctuation, '#pop', ':'),
+            (_IDENT, Name.Constant, None, _IDENT_FIRST)
+        ] + _WHITESPACE + _STATEMENTS
+    }
+
+    # Names of standard types that are highlighted like keywords.
+    _TYPE_NAMES = frozenset(CLexer.stdlib_types | CLexer.c99_types | CLexer.c11_atomic_types | CLexer.linux_types)
+
+    @staticmethod
+    def _join(rules):
+        # Join rules into one regular expression where each rule is a group. Remember indexes of these groups to find
+        # out matched rules and their nested groups.
+        # No rule can match if there are no rules at all.
+        regex = re.compile('|'.join('({0})'.format(rule[0]) for rule in rules) or '(?!)', re.MULTILINE)
+        actions = {}
+        index = 1
+        for rule_regex, action, new_state, _first in rules:
+            actions[index] = (action, new_state, index)
+            index += re.compile(rule_regex).groups + 1
+        return regex.match, actions
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _compile(cls):
+        # For each state and each ASCII character prepare a regular expression that includes just rules that can match
+        # strings starting with this character. Other characters and the end of source are matched by all rules.
+        compiled_states = {}
+        for state, rules in cls._STATES.items():
+            joined = {}
+            table = []
+            for c in map(chr, range(128)):
+                selected = tuple(i for i, rule in enumerate(rules) if rule[3] is None or c in rule[3])
+                if selected not in joined:
+                    joined[selected] = cls._join([rules[i] for i in selected])
+                table.append(joined[selected])
+            compiled_states[state] = (table, cls._join(rules))
+
+        return compiled_states
+
+    def tokens(self, src):
+        """
+        Get tokens of a given source in the same way as pygments.lex() does.
+
+        :param src: String.
+        :return: Generator of pairs of token types and token texts.
+        """
+        # Prepare source like pygments.lexer.Lexer#get_tokens does with default options.
+        if src.startswith('\ufeff'):
+            src = src[len('\ufeff'):]
+        src = src.replace('\r\n', '\n').replace('\r', '\n').strip('\n')
+        if not src.endswith('\n'):
+            src += '\n'
+
+        return self._scan(src)
+
+    def _scan(self, text):
+        states = self._compile()
+        type_names = self._TYPE_NAMES
+        pos = 0
+        end = len(text)
+        stack = ['root']
+        table, default = states['root']
+        while True:
+            c = ord(text[pos]) if pos < end else 128
+            match, actions = table[c] if c < 128 else default
+            m = match(text, pos)
+            if m:
+                action, new_state, index = actions[m.lastindex]
+                if action is Name:
+                    value = m.group()
+                    yield Keyword.Type if value in type_names else Name, value
+                elif action.__class__ is tuple:
+                    for group_index, group_action in enumerate(action, index + 1):
+                        value = m.group(group_index)
+                        if group_action is _SCAN:
+                            if value is not None:
+                                yield from self._scan(value)
+                        elif value:
+                            yield group_action, value
+                elif action is not None:
+                    yield action, m.group()
+                pos = m.end()
+
+                if new_state is not None:
+                    if new_state == '#pop':
+                        if len(stack) > 1:
+                            stack.pop()
+                    elif new_state == '#push':
+                        stack.append(stack[-1])
+                    else:
+                        stack.append(new_state)
+                    table, default = states[stack[-1]]
+            elif pos < end:
+                # At the end of line reset the state.
+                if text[pos] == '\n':
+                    stack = ['root']
+                    table, default = states['root']
+                    yield Text, '\n'
+                else:
+                    yield Error, text[pos]
+                pos += 1
+            else:
+                break
+
+
+@functools.lru_cache(maxsize=None)
+def get_highlight_kind(token_type):
+    # Get all capital letters from token type consisting of several parts.
+    return ''.join([''.join(re.findall("[A-Z]", k)) for k in tuple(token_type)])
+
+
 class Highlight:
-    def __init__(self, logger, src):
+    # Token types that do not need special processing.
+    SIMPLE_TOKEN_TYPES = frozenset((
+        Comment.PreprocFile,
+        Keyword,
+        Keyword.Type,
+        Keyword.Reserved,
+        Literal.Number.Float,
+        Literal.Number.Hex,
+        Literal.Number.Integer,
+        Literal.Number.Oct,
+        Literal.String,
+        Literal.String.Affix,
+        Literal.String.Char,
+        Literal.String.Escape,
+        Name,
+        Name.Builtin,
+        Name.Class,
+        Name.Function,
+        Name.Label,
+        Operator
+    ))
+    NON_WHITESPACES = re.compile(r'\S+')
+
+    def __init__(self, logger, src, reference=False):
         self.logger = logger
 
-        self.tokens = lex(src, CLexer())
+        # Lexing with pygments is much slower, it is kept as a reference for CScanner.
+        self.tokens = lex(src, CLexer()) if reference else CScanner().tokens(src)
 
         # Current token line number.
         self.cur_line_numb = 1
@@ -33,7 +308,10 @@ class Highlight:
         self.cur_start_offset = 0
 
         # List of entities (each represented as kind, line number, start and end offsets) to be highlighted
-        self.highlights = []
+        self._highlights = []
+        # Identifiers of removed highlights and highlights by line numbers, see extra_highlight().
+        self._removed = set()
+        self._lines = None
 
         # Workaround for missed "\n" at the beginning of source file that do not become tokens.
         self.initial_new_lines_numb = 0
@@ -57,40 +335,18 @@ class Highlight:
         if not token_len:
             return
 
-        # Get all capital letters from token type consisting of several parts.
-        highlight_kind = ''.join([''.join(re.findall("[A-Z]", k)) for k in tuple(token_type)])
+        highlight_kind = get_highlight_kind(token_type)
 
         # Some tokens (perhaps just comments to which preprocessor directives belong) can include whitespaces. Later
         # this can cause complicated cases when, say, we will need to add several references within such tokens. So
         # let's split them by whitespaces.
         if split:
-            cur_end_offset = cur_start_offset = self.cur_start_offset
-            for c in token_text:
-                # Skip all whitespaces shifting current start and end offsets appropriately.
-                if c.isspace():
-                    # Highlight current token if so.
-                    if cur_end_offset > cur_start_offset:
-                        self.highlights.append([
-                            highlight_kind,
-                            self.cur_line_numb,
-                            cur_start_offset,
-                            cur_end_offset
-                        ])
-                        cur_start_offset = cur_end_offset
-
-                    cur_start_offset += 1
-                    cur_end_offset = cur_start_offset
-                # Accumulate current token length.
-                else:
-                    cur_end_offset += 1
-
-            # Highlight last token if so.
-            if cur_end_offset > cur_start_offset:
+            for m in self.NON_WHITESPACES.finditer(token_text):
                 self.highlights.append([
                     highlight_kind,
                     self.cur_line_numb,
-                    cur_start_offset,
-                    cur_end_offset
+                    self.cur_start_offset + m.start(),
+                    self.cur_start_offset + m.end()
                 ])
         else:
             self.highlights.append([
@@ -104,8 +360,7 @@ class Highlight:
         self.cur_start_offset += token_len
 
     def highlight(self):
-        for token in self.tokens:
-            token_type, token_text = tuple(token)
+        for token_type, token_text in self.tokens:
             token_len = len(token_text)
 
             # Workaround for missed "\n" at the beginning of source file that do not become tokens.
@@ -116,82 +371,68 @@ class Highlight:
                 self.initial_new_lines_numb = 0
 
             # Handle token types that do not need special processing.
-            if token_type in (
-                Comment.PreprocFile,
-                Keyword,
-                Keyword.Type,
-                Keyword.Reserved,
-                Literal.Number.Float,
-                Literal.Number.Hex,
-                Literal.Number.Integer,
-                Literal.Number.Oct,
-                Literal.String,
-                Literal.String.Affix,
-                Literal.String.Char,
-                Literal.String.Escape,
-                Name,
-                Name.Builtin,
-                Name.Class,
-                Name.Function,
-                Name.Label,
-                Operator
-            ):
+            if token_type in self.SIMPLE_TOKEN_TYPES:
                 self.highlight_token(token_type, token_len)
             # Trailing "\n" may be included into single line comment and preprocessor directives.
-            if token_type in (
-                Comment,
-                Comment.Preproc,
-                Comment.Single
-            ):
-                split = token_type == Comment.Preproc
+            elif token_type is Comment or token_type is Comment.Preproc or token_type is Comment.Single:
+                split = token_type is Comment.Preproc
                 if token_text[-1] == '\n':
                     self.highlight_token(token_type, token_len - 1, split, token_text if split else None)
                     self.go_to_next_line()
                 else:
                     self.highlight_token(token_type, token_len, split, token_text if split else None)
             # Multiline comments include "\n".
-            if token_type is Comment.Multiline:
-                cur_end_offset = self.cur_start_offset
-
-                for c in token_text:
+            elif token_type is Comment.Multiline:
+                lines = token_text.split('\n')
+                for line in lines[:-1]:
                     # Finish handling of current comment line.
-                    if c == '\n':
-                        self.highlight_token(token_type, cur_end_offset - self.cur_start_offset)
-                        self.go_to_next_line()
-                        cur_end_offset = 0
-                    else:
-                        cur_end_offset += 1
+                    self.highlight_token(token_type, len(line))
+                    self.go_to_next_line()
 
                 # Add last multiline comment line.
-                self.highlight_token(token_type, cur_end_offset - self.cur_start_offset)
-            # There is no special highlighting for punctuation.
-            if token_type is Punctuation:
+                self.highlight_token(token_type, len(lines[-1]))
+            # There is no special highlighting for punctuation and we can not do anything with lexer failures.
+            elif token_type is Punctuation or token_type is Error:
                 # Update current start offset for following tokens.
                 self.cur_start_offset += token_len
             # There is no special highlighting for text but there may be one or more "\n" at the beginning, in the
             # middle or at the end.
-            if token_type is Text or token_type is Text.Whitespace:
-                for c in token_text:
-                    if not self.go_to_next_line(c):
-                        # Update current start offset for following tokens.
-                        self.cur_start_offset += 1
-
-            # We can not do anything with lexer failures.
-            if token_type is Error:
-                # Update current start offset for following tokens.
-                self.cur_start_offset += token_len
+            elif token_type is Text or token_type is Text.Whitespace:
+                new_lines_numb = token_text.count('\n')
+                if new_lines_numb:
+                    self.cur_line_numb += new_lines_numb
+                    self.cur_start_offset = token_len - token_text.rindex('\n') - 1
+                else:
+                    # Update current start offset for following tokens.
+                    self.cur_start_offset += token_len
             else:
                 self.logger.warning("Does not support token \"{0}\" of type \"{1}\"".format(token_text, token_type))
 
+    @property
+    def highlights(self):
+        # Drop highlights removed by klever.core.highlight.Highlight#extra_highlight.
+        if self._removed:
+            self._highlights = [highlight for highlight in self._highlights if id(highlight) not in self._removed]
+            self._removed = set()
+
+        return self._highlights
+
     # In klever.core.highlight.Highlight#highlight we assume that highlighted entity locations do not overlap. But there
     # may be other more important sources for highlighting, e.g. for cross referencing, so, we may need to remove
     # overlaps.
     def extra_highlight(self, extra_highlights):
+        # Highlights are looked up by line numbers since there may be very many highlights and extra highlights. The
+        # index is built once since all highlights are added with this method after
+        # klever.core.highlight.Highlight#highlight.
+        if self._lines is None:
+            self._lines = {}
+            for highlight in self.highlights:
+                self._lines.setdefault(highlight[1], []).append(highlight)
+
         # Remove previous less important highlights that are overlapped with extra ones.
         # Store highlights to be removed and remove them later at once rather than create new list of highlights each
-        # time when some highlights should be removed. This should work much faster since we expect that there are very
-        # many highlights and just few highlights should be removed
-        highlights_to_be_removed = []
+        # time when some highlights should be removed.
+        highlights_to_be_removed = set()
         # Sometimes rather than to remove highlights completely we will remain some parts of them. For instance, this
         # is vital for macro definitions each of which corresponds to the only highlights list element and which can
         # include macro expansion reference from in the middle.
@@ -199,37 +440,39 @@ class Highlight:
         for extra_highlight in extra_highlights:
             extra_highlight_line_numb, extra_highlight_start_offset, extra_highlight_end_offset = extra_highlight[1:]
 
-            for highlight in self.highlights:
+            for highlight in self._lines.get(extra_highlight_line_numb, ()):
                 highlight_kind, highlight_line_numb, highlight_start_offset, highlight_end_offset = highlight
-                if highlight_line_numb == extra_highlight_line_numb:
-                    if highlight_start_offset <= extra_highlight_end_offset \
-                            and highlight_end_offset >= extra_highlight_start_offset:
-                        highlights_to_be_removed.append(highlight)
-                        if highlight_kind == 'CP':
-                            if highlight_start_offset < extra_highlight_start_offset:
-                                highlights_to_be_added.append([
-                                    'CP',
-                                    highlight_line_numb,
-                                    highlight_start_offset,
-                                    extra_highlight_start_offset
-                                ])
-                            if extra_highlight_end_offset < highlight_end_offset:
-                                highlights_to_be_added.append([
-                                    'CP',
-                                    highlight_line_numb,
-                                    extra_highlight_end_offset,
-                                    highlight_end_offset
-                                ])
+                if highlight_start_offset <= extra_highlight_end_offset \
+                        and highlight_end_offset >= extra_highlight_start_offset:
+                    highlights_to_be_removed.add(id(highlight))
+                    if highlight_kind == 'CP':
+                        if highlight_start_offset < extra_highlight_start_offset:
+                            highlights_to_be_added.append([
+                                'CP',
+                                highlight_line_numb,
+                                highlight_start_offset,
+                                extra_highlight_start_offset
+                            ])
+                        if extra_highlight_end_offset < highlight_end_offset:
+                            highlights_to_be_added.append([
+                                'CP',
+                                highlight_line_numb,
+                                extra_highlight_end_offset,
+                                highlight_end_offset
+                            ])
 
+        # Equal highlights are always removed together since they overlap the same extra highlights.
         if highlights_to_be_removed:
-            self.highlights = [highlight for highlight in self.highlights if highlight not in highlights_to_be_removed]
+            self._removed |= highlights_to_be_removed
+            for line_numb in {extra_highlight[1] for extra_highlight in extra_highlights}:
+                if line_numb in self._lines:
+                    self._lines[line_numb] = [highlight for highlight in self._lines[line_numb]
+                                              if id(highlight) not in highlights_to_be_removed]
 
         # Add extra highlights.
-        for extra_highlight in extra_highlights:
-            self.highlights.append(extra_highlight)
-
-        for highlight_to_be_added in highlights_to_be_added:
-            self.highlights.append(highlight_to_be_added)
+        for highlight in itertools.chain(extra_highlights, highlights_to_be_added):
+            self._highlights.append(highlight)
+            self._lines.setdefault(highlight[1], []).append(highlight)
 
 
 # This is intended for testing purposes, when one has a build base and a source file and would like to debug its
@@ -31,7 +31,8 @@ from clade import Clade
 import klever.core.utils
 import klever.core.session
 import klever.core.components
-from klever.core.cross_refs import CrossRefs
+from klever.core.build_base import get_build_base_meta
+from klever.core.cross_refs import CrossRefs, CrossRefsStore, get_raw_refs
 from klever.core.progress import PW
 from klever.core.coverage import JCR
 
@@ -463,6 +464,9 @@ class Job(klever.core.components.Component):
         'VTG',
         'VRP'
     ]
+    SRC_FILES_BATCH_SIZE = 100
+    # Default maximum size of the cross references store in megabytes.
+    CROSS_REFS_STORE_SIZE = 1024
 
     def __init__(self, conf, logger, parent_id, mqs, vals, cur_id=None, work_dir=None, attrs=None,
                  separate_from_parent=True, include_child_resources=False, components_common_conf=None):
@@ -475,6 +479,7 @@ class Job(klever.core.components.Component):
                                                                                        'additional sources')
 
         self.clade = None
+        self.build_base_meta = {}
         self.components = []
 
     def decide_job_or_sub_job(self):
@@ -606,25 +611,10 @@ class Job(klever.core.components.Component):
             work_src_trees = clade_meta['working source trees']
         # Otherwise try to find out them automatically as described above.
         else:
-            in_files = []
-            for cmd in self.clade.get_all_cmds_by_type("CC") + self.clade.get_all_cmds_by_type("CL"):
-                if cmd['in']:
-                    for in_file in cmd['in']:
-                        # Sometimes some auxiliary stuff is built in addition to normal C source files that are most
-                        # likely located in a place we would like to get.
-                        if not in_file.startswith('/tmp') and in_file != '/dev/null':
-                            in_files.append(os.path.join(cmd['cwd'], in_file))
-            in_files_prefix = os.path.dirname(os.path.commonprefix(in_files))
+            build_base_meta = self.__get_build_base_meta('CC/CL input files prefix', 'LD/Link output files prefix')
+            in_files_prefix = build_base_meta['CC/CL input files prefix']
             self.logger.info('Common prefix of CC/CL input files is "%s"', in_files_prefix)
-
-            out_files = []
-            for cmd in self.clade.get_all_cmds_by_type("LD") + self.clade.get_all_cmds_by_type("Link"):
-                if cmd['out']:
-                    for out_file in cmd['out']:
-                        # Like above.
-                        if not out_file.startswith('/tmp') and out_file != '/dev/null':
-                            out_files.append(os.path.join(cmd['cwd'], out_file))
-            out_files_prefix = os.path.dirname(os.path.commonprefix(out_files))
+            out_files_prefix = build_base_meta['LD/Link output files prefix']
             self.logger.info('Common prefix of LD/Link output files is "%s"', out_files_prefix)
 
             # Meaningful paths look like "/dir...".
@@ -655,6 +645,13 @@ class Job(klever.core.components.Component):
             , '\n'.join(['  {0}'.format(t) for t in work_src_trees]))
         self.common_components_conf['working source trees'] = work_src_trees
 
+    def __get_build_base_meta(self, *keys):
+        missing_keys = [key for key in keys if key not in self.build_base_meta]
+        if missing_keys:
+            self.build_base_meta.update(get_build_base_meta(self.logger, self.clade, missing_keys))
+
+        return self.build_base_meta
+
     def __refer_original_sources(self, src_id):
         klever.core.utils.report(
             self.logger,
@@ -669,38 +666,63 @@ class Job(klever.core.components.Component):
         )
 
     def __process_source_files(self):
-        for file_name in self.clade.src_info:
-            self.mqs['file names'].put(file_name)
+        # Workers get source files in batches to query Clade for references to/from for many source files at once.
+        file_names = list(self.clade.src_info)
+        for i in range(0, len(file_names), self.SRC_FILES_BATCH_SIZE):
+            self.mqs['file names'].put(file_names[i:i + self.SRC_FILES_BATCH_SIZE])
 
         for _ in range(self.workers_num):
             self.mqs['file names'].put(None)
 
     def __process_source_file(self):
+        # Index data of original sources can be kept between jobs to reuse it for unchanged source files of rebuilt
+        # build bases. This is enabled by specifying the store directory.
+        store = None
+        if 'cross references store' in self.common_components_conf:
+            store = CrossRefsStore(self.common_components_conf['cross references store'],
+                                   self.common_components_conf.get('cross references store size',
+                                                                   self.CROSS_REFS_STORE_SIZE) * 1024 ** 2)
+
+        processed = indexed = 0
         while True:
-            file_name = self.mqs['file names'].get()
-
-            if not file_name:
+            file_names = self.mqs['file names'].get()
+
+            if not file_names:
+                if processed:
+                    self.logger.info('%d of %d source files were indexed, index data of other ones was reused',
+                                     indexed, processed)
+                if store:
+                    removed = store.prune()
+                    if removed:
+                        self.logger.info('%d least recently used index data files were removed from the store',
+                                         removed)
                 return
 
-            src_file_name = klever.core.utils.make_relative_path(self.common_components_conf['working source trees'],
-                                                                 file_name)
+            raw_refs = get_raw_refs(self.clade, file_names)
+
+            for file_name in file_names:
+                src_file_name = klever.core.utils.make_relative_path(
+                    self.common_components_conf['working source trees'], file_name)
 
-            if src_file_name != file_name:
-                src_file_name = os.path.join('source files', src_file_name)
+                if src_file_name != file_name:
+                    src_file_name = os.path.join('source files', src_file_name)
 
-            new_file_name = os.path.join('original sources', src_file_name.lstrip(os.path.sep))
-            os.makedirs(os.path.dirname(new_file_name), exist_ok=True)
-            shutil.copy(self.clade.get_storage_path(file_name), new_file_name)
+                new_file_name = os.path.join('original sources', src_file_name.lstrip(os.path.sep))
+                os.makedirs(os.path.dirname(new_file_name), exist_ok=True)
+                shutil.copy(self.clade.get_storage_path(file_name), new_file_name)
 
-            cross_refs = CrossRefs(self.common_components_conf, self.logger, self.clade,
-                                   file_name, new_file_name,
-                                   self.common_components_conf['working source trees'], 'source files')
-            cross_refs.get_cross_refs()
+                cross_refs = CrossRefs(self.common_components_conf, self.logger, self.clade,
+                                       file_name, new_file_name,
+                                       self.common_components_conf['working source trees'], 'source files',
+                                       raw_refs[file_name], store)
+                processed += 1
+                indexed += int(cross_refs.get_cross_refs())
 
     def __get_original_sources_basic_info(self):
         self.logger.info('Get information on original sources for following visualization of uncovered source files')
 
         # For each source file we need to know the total number of lines and places where functions are defined.
+        func_def_lines = self.__get_build_base_meta('function definition lines')['function definition lines']
         src_files_info = {}
         for file_name, file_size in self.clade.src_info.items():
             src_file_name = klever.core.utils.make_relative_path(self.common_components_conf['working source trees'],
@@ -718,14 +740,7 @@ class Job(klever.core.components.Component):
             src_files_info[src_file_name].append(file_size['loc'])
 
             # Store source file function definition lines.
-            func_def_lines = []
-            funcs = self.clade.get_functions_by_file([file_name], False)
-
-            if funcs:
-                for _, func_info in list(funcs.values())[0].items():
-                    func_def_lines.append(int(func_info['line']))
-
-            src_files_info[src_file_name].append(sorted(func_def_lines))
+            src_files_info[src_file_name].append(func_def_lines.get(file_name, []))
 
         # Dump obtain information (huge data!) to load it when reporting total code coverage if everything will be okay.
         with open('original sources basic information.json', 'w') as fp:
@@ -15,12 +15,161 @@
 # limitations under the License.
 #
 
+import sys
+import json
+import math
 import time
 import copy
 import multiprocessing
 import klever.core.utils
 import klever.core.components
 
+# Z-score of the two-sided 90% confidence interval of the normal distribution
+CONFIDENCE_Z = 1.645
+# Minimal number of processed tasks to start estimating the remaining time
+MIN_OBSERVATIONS = 5
+# Name of the file with events of tasks that is recorded when intermediate files are kept
+TRACE_FILE = 'progress trace.jsonl'
+
+
+class RunningCost:
+    """
+    Mean and variance of task costs that are updated online (Welford's algorithm).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        """
+        Take into account a new observation.
+
+        :param value: Float.
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+
+class TasksETA:
+    """
+    Estimate the remaining time of solving verification tasks on the base of their events.
+
+    Like klever.core.vtg.scheduling.CostAwareQueue, the model assumes that the cost of a task is the weight of its
+    program fragment multiplied by the duration of processing a unit of weight by its requirement specification. The
+    remaining work consists of tasks that are queued in VTG and tasks that VTG has not generated yet. The latter are
+    estimated with the average task duration. The remaining time is the remaining work divided by the number of tasks
+    that were processed in parallel on average.
+    """
+
+    def __init__(self):
+        # Requirement specification -> seconds per unit of weight
+        self._rates = {}
+        self._all_rates = RunningCost()
+        self._durations = RunningCost()
+        # Sub-job -> (requirement specification, weight) -> number of queued tasks
+        self._queued = {}
+        self._start = None
+        self._last = None
+        self._busy = 0.0
+
+    @property
+    def observations(self):
+        return self._durations.count
+
+    @property
+    def queued_tasks(self):
+        return sum(n for tasks in self._queued.values() for n in tasks.values())
+
+    def queued(self, job_id, requirement, weight):
+        """
+        Remember a task generated by VTG.
+
+        :param job_id: Sub-job identifier.
+        :param requirement: Requirement specification identifier.
+        :param weight: Weight of the program fragment.
+        """
+        tasks = self._queued.setdefault(job_id, {})
+        tasks[(requirement, weight)] = tasks.get((requirement, weight), 0) + 1
+
+    def processed(self, job_id, requirement, weight, wall_time, now):
+        """
+        Take into account a finished or failed task.
+
+        :param job_id: Sub-job identifier.
+        :param requirement: Requirement specification identifier.
+        :param weight: Weight of the program fragment.
+        :param wall_time: Wall time of processing the task in seconds or None if it is unknown.
+        :param now: Time of the event.
+        """
+        tasks = self._queued.get(job_id, {})
+        if tasks.get((requirement, weight)):
+            tasks[(requirement, weight)] -= 1
+            if not tasks[(requirement, weight)]:
+                del tasks[(requirement, weight)]
+
+        if wall_time is None:
+            return
+
+        rate = wall_time / weight
+        self._rates.setdefault(requirement, RunningCost()).add(rate)
+        self._all_rates.add(rate)
+        self._durations.add(wall_time)
+        self._busy += wall_time
+        self._start = min(self._start, now - wall_time) if self._start is not None else now - wall_time
+        self._last = now
+
+    def forget(self, job_id):
+        """
+        Do not expect tasks of the given sub-job any more, e.g. when it failed.
+
+        :param job_id: Sub-job identifier.
+        """
+        self._queued.pop(job_id, None)
+
+    def estimate(self, rest, now):
+        """
+        Estimate the remaining time.
+
+        :param rest: Number of tasks that are not finished or failed yet.
+        :param now: Current time.
+        :return: None if there is not enough observations or a tuple with the expected remaining time and bounds of its
+                 confidence interval in seconds.
+        """
+        if self.observations < MIN_OBSERVATIONS:
+            return None
+
+        mean = 0.0
+        variance = 0.0
+        known = 0
+        for tasks in self._queued.values():
+            for (requirement, weight), number in tasks.items():
+                cost = self._rates.get(requirement)
+                if not cost or cost.count < 2:
+                    cost = self._all_rates
+                mean += number * weight * cost.mean
+                variance += number * weight * weight * cost.variance
+                known += number
+
+        unknown = max(rest - known, 0)
+        mean += unknown * self._durations.mean
+        variance += unknown * self._durations.variance
+
+        # Average number of tasks that were processed in parallel
+        elapsed = self._last - self._start
+        parallelism = self._busy / elapsed if elapsed > 0 else 1.0
+
+        expected = mean / parallelism - (now - self._last)
+        half_width = CONFIDENCE_Z * math.sqrt(variance) / parallelism
+        return expected, max(expected - half_width, 0.0), expected + half_width
+
 
 class PW(klever.core.components.Component):
 
@@ -48,6 +197,7 @@ class PW(klever.core.components.Component):
         self.report_cache = {}
         self.cached_tasks_progress = None
         self.cached_subjobs_progress = None
+        self.eta = TasksETA()
 
     @property
     def solved_subjobs(self):
@@ -106,8 +256,18 @@ class PW(klever.core.components.Component):
 
     def watch_progress(self):
         self.logger.info("Start progress calculator")
-        tasks_start_time = None
-        task_update_time = None
+        trace = open(TRACE_FILE, 'w', encoding='utf-8') if self.conf.get('keep intermediate files') else None
+        try:
+            self.__watch_progress(trace)
+        finally:
+            if trace:
+                trace.close()
+
+        self.logger.info("Finish progress calculation")
+
+    main = watch_progress
+
+    def __watch_progress(self, trace):
         subjobs_update_time = None
         subjobs_start_time = time.time()
         first_task_appeared = False
@@ -137,8 +297,17 @@ class PW(klever.core.components.Component):
             # Drain queue to wait for the whole tasks in background
             klever.core.utils.drain_queue(task_messages, self.mqs['finished and failed tasks'])
             if len(task_messages) > 0:
-                while len(task_messages) > 0:
-                    job_id, status = task_messages.pop()
+                now = time.time()
+                # Events of the same task should be processed in order
+                for job_id, status, requirement, weight, wall_time in task_messages:
+                    if trace:
+                        trace.write(json.dumps({'time': now, 'job': job_id, 'status': status,
+                                                'requirement': requirement, 'weight': weight,
+                                                'wall time': wall_time}) + '\n')
+                    if status == 'queued':
+                        self.eta.queued(job_id, requirement, weight)
+                        continue
+
                     self.finished_tasks_data.setdefault(job_id, 0)
                     self.failed_tasks_data.setdefault(job_id, 0)
                     if status == 'finished':
@@ -147,7 +316,8 @@ class PW(klever.core.components.Component):
                         self.failed_tasks_data[job_id] += 1
                     else:
                         raise ValueError('Unknown status {!r} received from subjob {!r}'.format(status, job_id))
-                task_update_time = time.time()
+                    self.eta.processed(job_id, requirement, weight, wall_time, now)
+                task_messages.clear()
 
             # Drain queue to wait for the whole tasks in background
             if not isinstance(self.total_tasks, int):
@@ -161,7 +331,6 @@ class PW(klever.core.components.Component):
                 self.logger.info('The first task is submitted, starting the time counter')
                 data_report["tasks_started"] = True
                 first_task_appeared = True
-                tasks_start_time = time.time()
 
             # Total number of tasks is determined
             if isinstance(self.total_tasks, int) and not total_tasks_determined:
@@ -174,6 +343,7 @@ class PW(klever.core.components.Component):
                 for job_id in (i for i, stat in self.subjobs.items() if stat == 'failed' and
                                                                         i not in self.subjobs_cache):
                     self.logger.debug("The job %r has failed", job_id)
+                    self.eta.forget(job_id)
                     if job_id in self.total_tasks_data:
                         number = self.total_tasks_data[job_id] - \
                                  (self.finished_tasks_data[job_id] if job_id in self.finished_tasks_data else 0) - \
@@ -201,8 +371,7 @@ class PW(klever.core.components.Component):
             if isinstance(self.total_tasks, int) and isinstance(self.tasks_progress, int):
                 self.logger.info("Current tasks progress is %s", self.tasks_progress)
                 self.logger.debug("Left to solve %s tasks of %s in total", self.rest_tasks, self.total_tasks)
-                task_estimation = self._estimate_time(tasks_start_time, task_update_time, self.solved_tasks,
-                                                      self.rest_tasks, self.tasks_progress, given_finish_time)
+                task_estimation = self._estimate_tasks_time(self.rest_tasks, self.tasks_progress, given_finish_time)
                 data_report["failed_ts"] = self.failed_tasks
                 data_report["solved_ts"] = self.solved_tasks
                 if isinstance(task_estimation, int):
@@ -234,16 +403,15 @@ class PW(klever.core.components.Component):
                     (self.job_mode and self.tasks_progress == 100):
                 break
 
-            # Wait for 1, 2, 3, ..., 10, 10, 10, ... seconds.
-            time.sleep(delay)
+            # Wake up as soon as new events of tasks come but wait for them at most 1, 2, 3, ..., 10, 10, 10, ...
+            # seconds since subjobs statuses do not come through the queue.
+            task_messages = klever.core.utils.get_waiting_first(self.mqs['finished and failed tasks'], timeout=delay)
             data_report = None
-            if delay < 10:
+            if task_messages:
+                delay = 1
+            elif delay < 10:
                 delay += 1
 
-        self.logger.info("Finish progress calculation")
-
-    main = watch_progress
-
     def _estimate_time(self, start_time, update_time, solved, rest, progress, given_finish_time):
         def formula():
             delta_time = round(time.time() - update_time)
@@ -271,6 +439,26 @@ class PW(klever.core.components.Component):
         self.logger.info("Solution progress: %s, time estimation: %s", progress, ret)
         return ret
 
+    def _estimate_tasks_time(self, rest, progress, given_finish_time):
+        if progress == 100:
+            ret = 0
+        else:
+            estimation = self.eta.estimate(rest, time.time())
+            if not estimation:
+                ret = 'Estimating time'
+            else:
+                expected, low, high = estimation
+                self.logger.debug("Expect solving the rest %s tasks (%s of them are generated) in %ds, 90%% confidence"
+                                  " interval is [%ds, %ds]", rest, self.eta.queued_tasks, expected, low, high)
+                ret = round(expected)
+                if given_finish_time:
+                    ret = max(round(given_finish_time - time.time()), ret)
+                if ret <= 0:
+                    ret = 'Reestimating time' if progress <= 90 else 'Solution is about to finish'
+
+        self.logger.info("Solution progress: %s, time estimation: %s", progress, ret)
+        return ret
+
     def _send_report(self, report):
         send_report = False
         new_report = {}
@@ -339,3 +527,56 @@ class PW(klever.core.components.Component):
             self.logger.info("Sending progress report: %s", str(new_report))
             self.session.submit_progress(new_report)
             self.report_cache = copy.copy(report)
+
+
+def replay(events):
+    """
+    Replay recorded events of tasks and compare remaining times estimated after each processed task with actual ones.
+
+    :param events: List of events recorded by PW in the order of their receiving.
+    :return: List of tuples with progress in percents, the actual remaining time, the estimated remaining time, bounds
+             of its confidence interval and the remaining time extrapolated linearly.
+    """
+    processed_events = [event for event in events if event['status'] != 'queued']
+    if not processed_events:
+        return []
+
+    total = len(processed_events)
+    start = events[0]['time']
+    finish = processed_events[-1]['time']
+    eta = TasksETA()
+    processed = 0
+    results = []
+    for event in events:
+        if event['status'] == 'queued':
+            eta.queued(event['job'], event['requirement'], event['weight'])
+            continue
+
+        eta.processed(event['job'], event['requirement'], event['weight'], event['wall time'], event['time'])
+        processed += 1
+        rest = total - processed
+        estimation = eta.estimate(rest, event['time'])
+        if rest and estimation:
+            linear = rest / processed * (event['time'] - start)
+            results.append((100 * processed / total, finish - event['time'], *estimation, linear))
+
+    return results
+
+
+# This is intended for evaluating the estimation of the remaining time on traces recorded by PW in working directories
+# of Klever Core when intermediate files are kept.
+if __name__ == '__main__':
+    for trace_file in sys.argv[1:]:
+        with open(trace_file, encoding='utf-8') as fp:
+            replayed = replay([json.loads(line) for line in fp])
+
+        print('{}: {} estimations'.format(trace_file, len(replayed)))
+        print('{:>8} {:>14} {:>15} {:>10}'.format('progress', 'model error, s', 'linear error, s', 'coverage'))
+        for decile in range(10):
+            selected = [r for r in replayed if decile * 10 <= r[0] < (decile + 1) * 10]
+            if selected:
+                print('{:>7}% {:>14.1f} {:>15.1f} {:>9.0f}%'.format(
+                    decile * 10,
+                    sum(abs(r[2] - r[1]) for r in selected) / len(selected),
+                    sum(abs(r[5] - r[1]) for r in selected) / len(selected),
+                    100 * sum(1 for r in selected if r[3] <= r[1] <= r[4]) / len(selected)))
@@ -90,10 +90,20 @@ class Session:
                                 {'job format': job_format},
                                 archive)
 
-    def schedule_task(self, task_file, archive):
+    def schedule_task(self, task_file, archive, blobs=None):
         with open(task_file, 'r', encoding='utf-8') as fp:
             data = fp.read()
 
+        # Upload just files that were not uploaded for other tasks yet
+        if blobs:
+            resp = self.__request('service/blobs/missing/', 'POST',
+                                  json={'job': str(self.job_id), 'checksums': list(blobs)})
+            missing = resp.json()['missing']
+            self.logger.debug('Upload {0} of {1} blobs of the task'.format(len(missing), len(blobs)))
+            if missing:
+                self.__upload_archives('service/blobs/', {'job': str(self.job_id)},
+                                       {checksum: blobs[checksum] for checksum in missing})
+
         resp = self.__upload_archives('service/tasks/',
                                       {
                                           'job': str(self.job_id),
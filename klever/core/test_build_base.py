@@ -0,0 +1,125 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import logging
+
+import pytest
+
+from klever.core.build_base import CommonPrefix, collect_build_base_meta, get_build_base_meta
+
+
+class FakeFunctions:
+    def __init__(self, funcs_by_file):
+        self.funcs_by_file = funcs_by_file
+
+    def yield_functions_by_file(self):
+        for file_name, funcs in self.funcs_by_file.items():
+            yield file_name, {file_name: funcs}
+
+
+class FakeClade:
+    def __init__(self, work_dir, uuid='uuid'):
+        self.work_dir = work_dir
+        self.uuid = uuid
+        self.cmds = {
+            'CC': [
+                {'cwd': '/src/linux', 'in': ['drivers/usb/core.c'], 'out': ['drivers/usb/core.o']},
+                {'cwd': '/src/linux', 'in': ['/dev/null'], 'out': []},
+                {'cwd': '/src/linux/drivers', 'in': ['net/e1000.c', '/tmp/check.c'], 'out': []},
+                {'cwd': '/src/linux', 'in': [], 'out': []}
+            ],
+            'CL': [],
+            'LD': [{'cwd': '/build/linux', 'in': [], 'out': ['drivers/usb/usbcore.ko', 'drivers/net/e1000.ko']}],
+            'Link': []
+        }
+        self.Functions = FakeFunctions({
+            '/src/linux/drivers/usb/core.c': {'usb_init': {'line': '20'}, 'usb_probe': {'line': '5'}},
+            'unknown': {'printk': {'line': None}}
+        })
+        self.queries = 0
+
+    def get_uuid(self):
+        return self.uuid
+
+    def get_all_cmds_by_type(self, cmd_type):
+        self.queries += 1
+        return self.cmds[cmd_type]
+
+
+@pytest.mark.parametrize('strings', [[], ['/a/b'], ['/a/bc', '/a/bd', '/a/b'], ['/a/b/c', '/x'], ['/abc', '/abd']])
+def test_common_prefix(strings):
+    prefix = CommonPrefix()
+    for string in strings:
+        prefix.add(string)
+    assert str(prefix) == os.path.commonprefix(strings)
+
+
+BUILD_BASE_META_KEYS = ('CC/CL input files prefix', 'LD/Link output files prefix', 'function definition lines')
+
+
+def test_collect(tmpdir):
+    assert collect_build_base_meta(FakeClade(str(tmpdir)), BUILD_BASE_META_KEYS) == {
+        'CC/CL input files prefix': '/src/linux/drivers',
+        'LD/Link output files prefix': '/build/linux/drivers',
+        'function definition lines': {'/src/linux/drivers/usb/core.c': [5, 20]}
+    }
+
+
+def test_cache(tmpdir):
+    clade = FakeClade(str(tmpdir))
+    meta = get_build_base_meta(logging.getLogger(), clade, BUILD_BASE_META_KEYS)
+    assert os.path.isfile(os.path.join(str(tmpdir), 'klever meta uuid.json'))
+
+    clade = FakeClade(str(tmpdir))
+    assert get_build_base_meta(logging.getLogger(), clade, BUILD_BASE_META_KEYS) == meta
+    assert clade.queries == 0
+
+    # Rebuilt build bases get new UUIDs
+    clade = FakeClade(str(tmpdir), 'new uuid')
+    clade.cmds['CC'] = clade.cmds['CC'][:1]
+    assert get_build_base_meta(logging.getLogger(), clade, ['CC/CL input files prefix']) == \
+        {'CC/CL input files prefix': '/src/linux/drivers/usb'}
+    assert clade.queries == 2
+
+
+def test_lazy_keys(tmpdir):
+    # Commands are not loaded when just function definition lines are needed, e.g. when working source trees are
+    # specified in the build base
+    clade = FakeClade(str(tmpdir))
+    assert get_build_base_meta(logging.getLogger(), clade, ['function definition lines']) == \
+        {'function definition lines': {'/src/linux/drivers/usb/core.c': [5, 20]}}
+    assert clade.queries == 0
+
+    # Keys that are collected later are cached together with ones cached before
+    clade = FakeClade(str(tmpdir))
+    prefixes = ['CC/CL input files prefix', 'LD/Link output files prefix']
+    assert get_build_base_meta(logging.getLogger(), clade, prefixes) == \
+        {'CC/CL input files prefix': '/src/linux/drivers', 'LD/Link output files prefix': '/build/linux/drivers'}
+    assert clade.queries == 4
+
+    clade = FakeClade(str(tmpdir))
+    clade.Functions = None
+    assert get_build_base_meta(logging.getLogger(), clade, BUILD_BASE_META_KEYS) == \
+        collect_build_base_meta(FakeClade(str(tmpdir)), BUILD_BASE_META_KEYS)
+    assert clade.queries == 0
+
+
+def test_read_only_build_base(tmpdir):
+    clade = FakeClade(os.path.join(str(tmpdir), 'missing'))
+    assert get_build_base_meta(logging.getLogger(), clade, BUILD_BASE_META_KEYS) == \
+        collect_build_base_meta(clade, BUILD_BASE_META_KEYS)
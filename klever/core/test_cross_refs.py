@@ -0,0 +1,199 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import gzip
+import json
+import logging
+import tempfile
+import time
+
+import pytest
+
+from klever.core.cross_refs import CrossRefs, CrossRefsStore, get_raw_refs
+
+
+SOURCES = {
+    '/src/main.c': 'int func(void);\n\nint main(void)\n{\n\treturn func();\n}\n',
+    '/src/func.c': 'int func(void)\n{\n\treturn 0;\n}\n',
+    '/src/other.c': 'static int other;\n'
+}
+
+
+class BuildBase:
+    """Minimal substitute for Clade that provides references to/from and counts queries."""
+
+    def __init__(self, sources):
+        self.sources = sources
+        self.queries = 0
+
+    def get_ref_to(self, files):
+        self.queries += 1
+        return {f: {'decl_func': [[[5, 8, 12], ['/src/func.c', 1]]]} for f in files if f == '/src/main.c'}
+
+    def get_ref_from(self, files):
+        self.queries += 1
+        return {f: {'call': [[[1, 4, 8], ['/src/main.c', [5]]]]} for f in files if f == '/src/func.c'}
+
+
+def _index(tmpdir, clade, store):
+    work_dir = tempfile.mkdtemp(dir=str(tmpdir))
+    raw_refs = get_raw_refs(clade, list(clade.sources))
+
+    indexed = []
+    for file_name, src in clade.sources.items():
+        new_file_name = os.path.join(work_dir, os.path.basename(file_name))
+        with open(new_file_name, 'w') as fp:
+            fp.write(src)
+        cross_refs = CrossRefs({'keep intermediate files': False}, logging.getLogger(), clade, file_name,
+                               new_file_name, ['/src'], 'source files', raw_refs[file_name], store)
+        if cross_refs.get_cross_refs():
+            indexed.append(file_name)
+
+        with open(new_file_name + '.idx.json') as fp:
+            assert json.load(fp)['format'] == CrossRefs.INDEX_DATA_FORMAT_VERSION
+
+    return indexed, work_dir
+
+
+@pytest.fixture
+def store(tmpdir):
+    return CrossRefsStore(os.path.join(str(tmpdir), 'store'), 1024 ** 2)
+
+
+def test_batched_queries():
+    clade = BuildBase(SOURCES)
+    raw_refs = get_raw_refs(clade, list(SOURCES))
+    assert clade.queries == 2
+    assert raw_refs['/src/main.c'][0]['decl_func'] and not raw_refs['/src/main.c'][1]['call']
+    assert raw_refs['/src/func.c'][1]['call'] and not raw_refs['/src/func.c'][0]['decl_func']
+    assert raw_refs['/src/other.c'] == ({'decl_func': [], 'def_func': [], 'def_macro': []},
+                                        {'call': [], 'expand': []})
+
+
+def test_rebuilt_build_base(tmpdir, store):
+    indexed, first_dir = _index(tmpdir, BuildBase(SOURCES), store)
+    assert sorted(indexed) == sorted(SOURCES)
+
+    # Only the changed source file is indexed once again for the rebuilt build base
+    sources = dict(SOURCES)
+    sources['/src/other.c'] = 'static int other = 1;\n'
+    indexed, second_dir = _index(tmpdir, BuildBase(sources), store)
+    assert indexed == ['/src/other.c']
+
+    for name in ('main.c', 'func.c'):
+        with open(os.path.join(first_dir, name + '.idx.json')) as fp1, \
+                open(os.path.join(second_dir, name + '.idx.json')) as fp2:
+            assert json.load(fp1) == json.load(fp2)
+
+
+def test_changed_references(tmpdir, store):
+    _index(tmpdir, BuildBase(SOURCES), store)
+
+    # Source files are the same, but references to them have changed
+    clade = BuildBase(SOURCES)
+    clade.get_ref_from = lambda files: {}
+    indexed, _ = _index(tmpdir, clade, store)
+    assert indexed == ['/src/func.c']
+
+
+def test_store_size(tmpdir, store):
+    _index(tmpdir, BuildBase(SOURCES), store)
+    paths = [os.path.join(dirpath, name) for dirpath, _, names in os.walk(store.store_dir) for name in names]
+    assert len(paths) == len(SOURCES)
+    assert store.prune() == 0
+
+    # Index data that was used recently is kept
+    for i, path in enumerate(sorted(paths)):
+        os.utime(path, (i, i))
+    store.max_size = sum(os.path.getsize(path) for path in paths) - 1
+    assert store.prune() == 1
+    assert not os.path.exists(sorted(paths)[0])
+    assert all(os.path.exists(path) for path in sorted(paths)[1:])
+
+    # Only the removed index data is generated once again
+    indexed, _ = _index(tmpdir, BuildBase(SOURCES), store)
+    assert len(indexed) == 1
+
+
+def _generated_source(expansions_numb, per_line=10):
+    lines = ['#define M(x) ((x) + 1)']
+    for _ in range(expansions_numb // per_line):
+        lines.append('\tv = ' + ' + '.join(['M(v)'] * per_line) + ';')
+    src = '\n'.join(lines) + '\n'
+
+    expansions = []
+    for line_numb in range(2, len(lines) + 1):
+        for i in range(per_line):
+            start = 5 + 7 * i
+            expansions.append([[line_numb, start, start + 1], ['/src/macros.c', [1]]])
+    macro_defs = [[[line_numb, start, end], ['/src/macros.c', 1]] for (line_numb, start, end), _ in expansions]
+    return src, ({'decl_func': [], 'def_func': macro_defs[::2], 'def_macro': macro_defs},
+                 {'call': [], 'expand': [[[1, 8, 9], ['/src/macros.c', [1]]]] + expansions})
+
+
+def test_macro_expansions_benchmark(tmpdir):
+    src, raw_refs = _generated_source(100000)
+    new_file_name = os.path.join(str(tmpdir), 'macros.c')
+    with open(new_file_name, 'w') as fp:
+        fp.write(src)
+
+    start = time.perf_counter()
+    CrossRefs({'keep intermediate files': False}, logging.getLogger(), None, '/src/macros.c', new_file_name, ['/src'],
+              'source files', raw_refs).get_cross_refs()
+    logging.getLogger().info('Index data for 100000 macro expansions is generated in %.2fs',
+                             time.perf_counter() - start)
+
+    with open(new_file_name + '.idx.json') as fp:
+        cross_ref = json.load(fp)
+    # References to function definitions at places of references to macro definitions are skipped
+    assert len(cross_ref['referencesto']['line']) == 100000
+    assert len(cross_ref['referencesfrom']['line']) == 100001
+    kinds = cross_ref['highlight']['kinds']
+    assert cross_ref['highlight']['kind'].count(kinds.index('MacroExpansionRefFrom')) == 100001
+
+
+def test_references_conversion(tmpdir):
+    new_file_name = os.path.join(str(tmpdir), 'main.c')
+    with open(new_file_name, 'w') as fp:
+        fp.write(SOURCES['/src/main.c'])
+
+    raw_refs_to = {
+        'def_macro': [[[5, 8, 12], ['/src/b.c', 7]]],
+        'def_func': [[[5, 8, 12], ['/src/a.c', 1]], [[3, 4, 8], ['/src/a.c', 2]], [[3, 4, 8], ['/src/b.c', 3]]],
+        'decl_func': [[[3, 4, 8], ['/src/a.c', 4]], [[1, 4, 8], ['/src/b.c', 5]], [[1, 4, 8], ['/src/a.c', 6]]]
+    }
+    raw_refs_from = {
+        'call': [[[3, 4, 8], ['/src/a.c', [1]]], [[3, 4, 8], ['/src/b.c', [2, 3]]]],
+        'expand': [[[3, 4, 8], ['/src/main.c', [4]]]]
+    }
+    CrossRefs({'keep intermediate files': False, 'compress index data': True}, logging.getLogger(), None,
+              '/src/main.c', new_file_name, ['/src'], 'source files', (raw_refs_to, raw_refs_from)).get_cross_refs()
+
+    with gzip.open(new_file_name + '.idx.json', 'rt') as fp:
+        cross_ref = json.load(fp)
+    assert cross_ref['source files'] == ['source files/a.c', 'source files/b.c']
+    # References at places of other more important references are skipped, other ones keep their order
+    assert cross_ref['referencesto'] == {
+        'line': [3, 3, 5], 'start': [4, 4, 8], 'end': [8, 8, 12], 'file': [0, 1, 1], 'file line': [2, 3, 7]
+    }
+    assert cross_ref['referencestodeclarations'] == {
+        'line': [1, 1], 'start': [4, 4], 'end': [8, 8], 'file': [1, 0], 'file line': [5, 6]
+    }
+    assert cross_ref['referencesfrom'] == {
+        'line': [3, 3], 'start': [4, 4], 'end': [8, 8], 'refs': [[[0, [1]], [1, [2, 3]]], [[None, [4]]]]
+    }
@@ -0,0 +1,87 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import glob
+import json
+import logging
+import re
+
+import pytest
+from pygments import lex
+from pygments.lexers import CLexer  #pylint:disable=no-name-in-module
+
+from klever.core.highlight import CScanner, Highlight
+
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cli', 'descs')
+
+SNIPPETS = [
+    '',
+    '\n\n\nint x;',
+    '\ufeff#include <linux/module.h>\r\n#include "file.h" // comment\r\nstatic int x = 0x1fUL;\r',
+    '#if 0\nint a;\n#if 1\n#endif\n#else\nint b;\n#endif\n',
+    '  /* c */ #define M(a) \\\n\t((a) + 1) /* d\n e */ // f\n',
+    'struct s {\n\tunsigned long f : 3;\n};\nunion u;\nstruct\n',
+    'int f(int a, char *b)\n{\n\tswitch (a) {\n\tcase CONST: break;\n\tdefault: return -1;\n\t}\nlabel:\n'
+    '\treturn sizeof(b) + \'\\n\' + L"w\\x41\\"" + u8"s" - 1.5e-3f + .5 + 0b101 + 017 + 0x1.8p3;\n}\n',
+    'void g(void);\nsize_t h(uint32_t x) { return true ? NULL : x; }\n_Static_assert(1, "");\n',
+    'int идентификатор = 1; @ `\n',
+    '/* unterminated comment\n int x;',
+    'char *s = "unterminated\nint y;\n'
+]
+
+
+def _highlights(src, reference):
+    highlight = Highlight(logging.getLogger(), src, reference)
+    highlight.highlight()
+    return json.dumps(highlight.highlights)
+
+
+@pytest.mark.parametrize('src', SNIPPETS)
+def test_snippets(src):
+    assert list(CScanner().tokens(src)) == list(lex(src, CLexer()))
+    assert _highlights(src, False) == _highlights(src, True)
+
+
+def test_sources():
+    c_files = glob.glob(os.path.join(TESTS_DIR, '**', '*.c'), recursive=True)
+    assert c_files
+
+    for c_file in c_files:
+        with open(c_file, encoding='utf-8') as fp:
+            src = fp.read()
+        assert _highlights(src, False) == _highlights(src, True), c_file
+
+
+def test_first_chars():
+    # Rules never match strings starting with ASCII characters that they do not expect
+    srcs = list(SNIPPETS)
+    for c_file in sorted(glob.glob(os.path.join(TESTS_DIR, '**', '*.c'), recursive=True))[:100]:
+        with open(c_file, encoding='utf-8') as fp:
+            srcs.append(fp.read())
+
+    states = CScanner._STATES  #pylint:disable=protected-access
+    rules = {(rule[0], rule[3]) for state_rules in states.values() for rule in state_rules}
+    for rule_regex, first in rules:
+        if first is not None:
+            # Find matches at all positions at once
+            regex = re.compile('(?=(?:{0}))'.format(rule_regex), re.MULTILINE)
+            for src in srcs:
+                for m in regex.finditer(src):
+                    c = src[m.start():m.start() + 1]
+                    assert not c or ord(c) >= 128 or c in first, (rule_regex, src[m.start():m.start() + 20])
@@ -0,0 +1,88 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import random
+import statistics
+
+import pytest
+
+from klever.core.progress import RunningCost, TasksETA, MIN_OBSERVATIONS, replay
+
+
+def _trace(workers=4):
+    """Simulate VTG that solves cheap tasks of one requirement first and expensive tasks of another one then."""
+    rnd = random.Random(2019)
+    tasks = [('cheap', rnd.choice((10, 20))) for _ in range(60)] + \
+        [('expensive', rnd.choice((10, 20))) for _ in range(60)]
+    events = [{'time': 0.0, 'job': 'job', 'status': 'queued', 'requirement': requirement, 'weight': weight,
+               'wall time': None} for requirement, weight in tasks]
+    finish_times = [0.0] * workers
+    processed = []
+    for requirement, weight in tasks:
+        wall_time = weight * (0.1 if requirement == 'cheap' else 2.0) * rnd.uniform(0.8, 1.2)
+        worker = finish_times.index(min(finish_times))
+        finish_times[worker] += wall_time
+        processed.append({'time': finish_times[worker], 'job': 'job', 'status': 'finished',
+                          'requirement': requirement, 'weight': weight, 'wall time': wall_time})
+    return events + sorted(processed, key=lambda event: event['time'])
+
+
+def test_running_cost():
+    values = [random.Random(i).uniform(0, 100) for i in range(100)]
+    cost = RunningCost()
+    for value in values:
+        cost.add(value)
+
+    assert cost.count == len(values)
+    assert cost.mean == pytest.approx(statistics.mean(values))
+    assert cost.variance == pytest.approx(statistics.variance(values))
+
+
+def test_estimate():
+    eta = TasksETA()
+    for _ in range(4):
+        eta.queued('job', 'slow', 10)
+        eta.queued('job', 'fast', 10)
+    for i in range(MIN_OBSERVATIONS):
+        assert eta.estimate(6, 10.0) is None
+        requirement = 'slow' if i % 2 else 'fast'
+        eta.processed('job', requirement, 10, 10.0 if requirement == 'slow' else 1.0, 10.0)
+    assert eta.observations == MIN_OBSERVATIONS
+    assert eta.queued_tasks == 3
+
+    # All tasks were processed in parallel so there are 2 slow tasks, 1 fast task and 1 task that is not generated yet
+    expected, low, high = eta.estimate(4, 10.0)
+    parallelism = (2 * 10.0 + 3 * 1.0) / 10.0
+    assert expected == pytest.approx((2 * 10.0 + 1.0 + (2 * 10.0 + 3 * 1.0) / 5) / parallelism)
+    assert low <= expected <= high
+
+    # Tasks of failed sub-jobs are not expected any more
+    eta.forget('job')
+    assert eta.queued_tasks == 0
+
+
+def test_replay():
+    results = replay(_trace())
+    assert results
+    assert all(0 < progress < 100 for progress, *_ in results)
+
+    # Cheap tasks are solved first so the linear extrapolation underestimates the remaining time while the cost model
+    # accounts for queued expensive tasks as soon as their first ones are solved
+    late = [r for r in results if r[0] >= 60]
+    model_error = sum(abs(expected - actual) for _, actual, expected, _, _, _ in late)
+    linear_error = sum(abs(linear - actual) for _, actual, _, _, _, linear in late)
+    assert model_error < linear_error / 2
@@ -34,6 +34,9 @@ import traceback
 
 import klever
 
+# Member of task archives that maps names of files uploaded separately as blobs to their checksums
+TASK_BLOBS_MANIFEST = 'blobs.json'
+
 
 class Cd:
     def __init__(self, path):
@@ -757,7 +760,8 @@ def json_dump(obj, fp, pretty=True):
     if pretty:
         json.dump(obj, fp, ensure_ascii=True, sort_keys=True, indent=4)
     else:
-        json.dump(obj, fp, ensure_ascii=True)
+        # Unlike json.dump(), json.dumps() uses the much faster C encoder.
+        fp.write(json.dumps(obj, ensure_ascii=True))
 
 
 def save_program_fragment_description(program_fragment_desc, file_name):
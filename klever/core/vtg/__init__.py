@@ -24,12 +24,15 @@ import importlib
 import collections
 import multiprocessing
 import resource
+import time
 
 import klever.core.components
 import klever.core.utils
 import klever.core.session
 
 from klever.scheduler.schedulers.global_config import clear_workers_cpu_cores
+from klever.core.vtg.scheduling import CostAwareQueue
+from klever.core.vtg.utils import CIL_CACHE_DIR, get_cil_cache_statistics, get_shared_stages_dir, SharedStagesUsers
 
 # Classes for queue transfer
 Abstract = collections.namedtuple('AbstractTask', 'fragment rule_class')
@@ -72,6 +75,9 @@ class VTG(klever.core.components.Component):
         REQ_SPEC_CLASSES = self.req_spec_classes
         FRAGMENT_DESC_FIELS = self.fragment_descs
 
+        # Workers report their wall time to estimate costs of items since items spend much time in queues as well
+        self.vals['VTG workers wall time'] = multiprocessing.Manager().dict()
+
         # Start plugins
         subcomponents = [('AAVTDG', self.__generate_all_abstract_verification_task_descs), VTGWL]
         self.launch_subcomponents(*subcomponents)
@@ -312,12 +318,15 @@ class VTG(klever.core.components.Component):
         # Statuses
         waiting = 0
         solving = 0
-        prepare = []
+        plugins_threads = klever.core.utils.get_parallel_threads_num(self.logger, self.conf, 'Plugins')
+        prepare = CostAwareQueue(self.fragment_descs, plugins_threads)
         atask_work_dirs = {}
         atask_tasks = {}
 
         max_tasks = int(self.conf['max solving tasks per sub-job'])
         keep_dirs = self.conf['keep intermediate files']
+        shared_stages_users = SharedStagesUsers(self.logger, keep_dirs)
+        share_emg_stages = self.conf.get('share EMG stages', False)
 
         self.logger.info('Generate all abstract verification task descriptions')
 
@@ -333,6 +342,9 @@ class VTG(klever.core.components.Component):
                     self.logger.debug('Create abstract task %s', task)
                     prepare.append(task)
 
+                if share_emg_stages:
+                    shared_stages_users.add(fragment, len(self.req_spec_classes))
+
         self.logger.info('There are %s abstract tasks in total', len(prepare))
 
         # Get the number of abstract tasks
@@ -362,10 +374,15 @@ class VTG(klever.core.components.Component):
             for kind, desc, *other in new_items:
                 waiting -= 1
                 self.logger.debug('Received item %s', kind)
+                worker_wall_time = self.vals['VTG workers wall time'].pop((kind, tuple(desc)), None)
                 if kind == Abstract.__name__:
                     atask = Abstract(*desc)
+                    prepare.finished(atask, worker_wall_time)
                     left_abstract_tasks -= 1
                     models = None
+
+                    # Delete results of EMG stages when all requirement classes of the fragment got them
+                    shared_stages_users.release(atask.fragment)
                     if other:
                         aworkdir, models = other
 
@@ -384,13 +401,18 @@ class VTG(klever.core.components.Component):
                                     atask_tasks[atask].add(new)
 
                                 prepare.append(new)
+                                self.mqs['finished and failed tasks'].put(
+                                    (self.conf['sub-job identifier'], 'queued', rule, prepare.weight(new.fragment),
+                                     None))
                                 if not single_model:
                                     total_tasks += 1
                     else:
                         self.logger.warning('There is no tasks generated for %s', atask)
                         if single_model:
-                            for _ in self.req_spec_classes[atask.rule_class]:
-                                self.mqs['finished and failed tasks'].put((self.conf['sub-job identifier'], 'failed'))
+                            for rule in self.req_spec_classes[atask.rule_class]:
+                                self.mqs['finished and failed tasks'].put(
+                                    (self.conf['sub-job identifier'], 'failed', rule, prepare.weight(atask.fragment),
+                                     None))
 
                     if not single_model and left_abstract_tasks == 0:
                         # Submit the number of tasks
@@ -400,6 +422,7 @@ class VTG(klever.core.components.Component):
                         self.logger.debug('Wait for abstract tasks %s', left_abstract_tasks)
                 else:
                     task = Task(*desc)
+                    wall_time = prepare.finished(task, worker_wall_time)
 
                     # Check solution
                     if other:
@@ -410,7 +433,8 @@ class VTG(klever.core.components.Component):
                         status = 'failed'
 
                     # Send status to the progress watcher
-                    self.mqs['finished and failed tasks'].put((self.conf['sub-job identifier'], status))
+                    self.mqs['finished and failed tasks'].put(
+                        (self.conf['sub-job identifier'], status, task.rule, prepare.weight(task.fragment), wall_time))
 
                     # Delete abstract task working directory (with EMG dir)
                     if not keep_dirs:
@@ -426,6 +450,17 @@ class VTG(klever.core.components.Component):
                             del atask_tasks[atask]
                             del atask_work_dirs[atask]
 
+        predicted, actual = prepare.makespan()
+        self.logger.info('Predicted makespan of generating verification tasks is %.1fs, actual makespan is %.1fs, '
+                         'mean absolute error of predicted durations is %.1fs',
+                         predicted, actual, prepare.estimation_error())
+
+        cil_cache_stats = get_cil_cache_statistics(os.path.join(self.conf['cache directory'], CIL_CACHE_DIR))
+        if cil_cache_stats['hits'] or cil_cache_stats['misses']:
+            self.logger.info('CIL cache hits: %s, misses: %s, size of input files that were not merged again: %s',
+                             cil_cache_stats['hits'], cil_cache_stats['misses'], cil_cache_stats['saved bytes'])
+            self.send_data_report_if_necessary(self.id, {'type': 'VTG', 'CIL cache': cil_cache_stats})
+
         # Close the queue
         self.mqs['prepare'].put(None)
         self.mqs['processed'].close()
@@ -467,6 +502,10 @@ class VTGWL(klever.core.components.Component):
             identifier = "EMGW/{}/{}".format(task.fragment, task.rule_class)
             workdir = os.path.join(task.fragment, "rule_class_{}".format(task.rule_class))
             plugin_conf = next(iter(self.req_spec_classes[task.rule_class].values()))['plugins'][0]
+            if self.conf.get('share EMG stages', False):
+                plugin_conf = copy.deepcopy(plugin_conf)
+                plugin_conf.setdefault('options', {})['shared stages directory'] = \
+                    get_shared_stages_dir(task.fragment)
         else:
             task = Task(*args)
             worker_class = PLUGINS
@@ -496,8 +535,10 @@ class VTGW(klever.core.components.Component):
 
         self.fragment_desc = fragment_desc
         self.prepared_tasks = []
+        self.start_time = None
 
     def tasks_generator_worker(self):
+        self.start_time = time.time()
         self._submit_attrs()
         self._generate_abstract_verification_task_desc()
         if not self.vals['task solving flag'].value:
@@ -546,6 +587,7 @@ class VTGW(klever.core.components.Component):
 
     def plugin_fail_processing(self):
         self.logger.debug('Submit the information about the failure to the Job processing class')
+        self._submit_wall_time()
         data = type(self.task).__name__, tuple(self.task)
         self.mqs['processed'].put(data)
         if 'verification statuses' in self.mqs:
@@ -559,6 +601,11 @@ class VTGW(klever.core.components.Component):
                 'data': self.conf.get('data')
             })
 
+    def _submit_wall_time(self):
+        # This should be done before VTG gets the item back
+        self.vals['VTG workers wall time'][(type(self.task).__name__, tuple(self.task))] = \
+            time.time() - self.start_time
+
     def _submit_attrs(self):
         # Prepare program fragment description file
         files_list_file = 'files list.txt'
@@ -620,6 +667,7 @@ class EMGW(VTGW):
         prepared_data = type(self.task).__name__, tuple(self.task), self.work_dir, triples
 
         self.logger.info("Now send the data to the VTG for %s", self.task)
+        self._submit_wall_time()
         self.mqs['processed'].put(prepared_data)
 
     def _generate_abstract_verification_task_desc(self):
@@ -713,11 +761,17 @@ class PLUGINS(VTGW):
         # VTG will consume this abstract verification task description file.
         if os.path.isfile(os.path.join(plugin_work_dir, 'task.json')) and \
                 os.path.isfile(os.path.join(plugin_work_dir, 'task files.zip')):
+            blobs = None
+            if os.path.isfile(os.path.join(plugin_work_dir, 'task blobs.json')):
+                with open(os.path.join(plugin_work_dir, 'task blobs.json'), encoding='utf-8') as fp:
+                    blobs = json.load(fp)
+
             session = klever.core.session.Session(self.logger, self.conf['Klever Bridge'], self.conf['identifier'])
             task_id = session.schedule_task(os.path.join(plugin_work_dir, 'task.json'),
-                                            os.path.join(plugin_work_dir, 'task files.zip'))
+                                            os.path.join(plugin_work_dir, 'task files.zip'), blobs)
 
             # Plan for checking status
+            self._submit_wall_time()
             self.mqs['pending tasks'].put(
                 [str(task_id), tuple(self.task), final_task_data["result processing"], self.fragment_desc,
                  final_task_data['verifier'], final_task_data['additional sources'],
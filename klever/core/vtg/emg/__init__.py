@@ -22,6 +22,7 @@ from klever.core.utils import report, report_image
 from klever.core.vtg.plugins import Plugin
 from klever.core.vtg.emg.common import get_or_die
 from klever.core.vtg.emg.generators import generate_processes
+from klever.core.vtg.emg.shared_stages import prepare_shared_stages
 from klever.core.vtg.emg.common.process import ProcessCollection
 from klever.core.vtg.emg.translation import translate_intermediate_model
 from klever.core.vtg.emg.decomposition import decompose_intermediate_model
@@ -44,16 +45,7 @@ class EMG(Plugin):
         :return: None
         """
         self.logger.info("Start environment model generator %s", self.id)
-
-        # Initialization of EMG
-        self.logger.info("Import results of source analysis")
-        sa = create_source_representation(self.logger, self.conf, self.abstract_task_desc)
-
-        # Generate processes
-        self.logger.info("Generate processes of an environment model")
-        collection = ProcessCollection()
-        generate_processes(self.logger, self.conf, collection, self.abstract_task_desc, sa)
-        self.logger.info("An intermediate environment model has been prepared")
+        sa, collection, shared_stages = self.__prepare_intermediate_model()
 
         # Import additional aspect files
         program_fragment = self.abstract_task_desc['fragment']
@@ -65,6 +57,8 @@ class EMG(Plugin):
             "envmodel_attrs": {},
             "UDEMSes": {}
         }
+        if shared_stages:
+            data_report["shared_stages"] = shared_stages
         images = []
         for number, model in enumerate(decompose_intermediate_model(self.logger, self.conf, collection)):
             model.name = str(number)
@@ -98,3 +92,30 @@ class EMG(Plugin):
                              self.mqs['report files'], self.vals['report id'], self.conf['main working directory'])
 
     main = generate_environment
+
+    def __generate_intermediate_model(self):
+        # Initialization of EMG
+        self.logger.info("Import results of source analysis")
+        sa = create_source_representation(self.logger, self.conf, self.abstract_task_desc)
+
+        # Generate processes
+        self.logger.info("Generate processes of an environment model")
+        collection = ProcessCollection()
+        generate_processes(self.logger, self.conf, collection, self.abstract_task_desc, sa)
+        self.logger.info("An intermediate environment model has been prepared")
+
+        return sa, collection
+
+    def __prepare_intermediate_model(self):
+        """
+        Get results of source analysis and the intermediate environment model. If VTG provides a directory for shared
+        stages, then these results are saved there to be reused by other requirement classes of the same program
+        fragment that differ only in decomposition and translation options.
+
+        :return: Source object, ProcessCollection object, dict with statistics or None.
+        """
+        if not self.conf.get('shared stages directory'):
+            return (*self.__generate_intermediate_model(), None)
+
+        (sa, collection), stats = prepare_shared_stages(self.logger, self.conf, self.__generate_intermediate_model)
+        return sa, collection, stats
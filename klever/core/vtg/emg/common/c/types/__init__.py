@@ -203,6 +203,30 @@ def import_declaration(declaration, ast=None, track_typedef=False):
     return ret, typedef
 
 
+def export_type_collection():
+    """
+    Get the collected types and typedefs to save them with objects that refer to them.
+
+    :return: A tuple with the type collection state.
+    """
+    return _type_collection, _typedefs, _noname_identifier
+
+
+def import_type_collection(state):
+    """
+    Replace collected types and typedefs by ones previously obtained by export_type_collection.
+
+    :param state: A tuple with the type collection state.
+    :return: None
+    """
+    global _noname_identifier
+
+    type_collection, typedefs, _noname_identifier = state
+    for collection, items in ((_type_collection, list(type_collection.items())), (_typedefs, list(typedefs.items()))):
+        collection.clear()
+        collection.update(items)
+
+
 def dump_types(file_name):
     with open(file_name, 'w') as fp:
         json.dump({str(k): v.dump() for k, v in _type_collection.items()}, fp, indent=2, sort_keys=True)
@@ -18,6 +18,8 @@
 import re
 import copy
 import string
+import weakref
+import contextlib
 import collections
 import graphviz
 import sortedcontainers
@@ -31,6 +33,100 @@ from klever.core.vtg.emg.common.process.actions import Actions, Subprocess, Acti
 Peer = collections.namedtuple('Peer', 'process action')
 
 
+class _SharedValue:
+    """A value shared by a process and its clones until they access it."""
+
+    def __init__(self, value, owner):
+        self.value = value
+        self.owner = weakref.ref(owner)
+        self.pending = weakref.WeakValueDictionary()
+
+
+class CopyOnWriteDescriptor:
+    """
+    The descriptor implements copy-on-write for process attributes that are expensive to clone. A clone shares the
+    value with the original process and gets its own copy only when it accesses the attribute for the first time. If
+    the original process accesses the attribute first, then clones waiting for their copies get them at this moment
+    to not observe further changes. If the value is replaced before reading it, no copy is made at all.
+    """
+
+    def __init__(self, copier):
+        self.copier = copier
+        self.attribute = None
+
+    def __set_name__(self, owner, name):
+        self.attribute = f'_{name}'
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+
+        value = obj.__dict__[self.attribute]
+        if isinstance(value, _SharedValue):
+            value = self._detach(obj, value)
+        return value
+
+    def __set__(self, obj, value):
+        current = obj.__dict__.get(self.attribute)
+        if isinstance(current, _SharedValue):
+            if current.owner() is obj:
+                self._detach(obj, current)
+            else:
+                current.pending.pop(id(obj), None)
+        obj.__dict__[self.attribute] = value
+
+    def share(self, obj, clone):
+        """
+        Make the clone share the attribute value with the given object.
+
+        :param obj: Original object.
+        :param clone: Its clone.
+        :return: None
+        """
+        value = obj.__dict__[self.attribute]
+        if not isinstance(value, _SharedValue):
+            value = _SharedValue(value, obj)
+            obj.__dict__[self.attribute] = value
+        value.pending[id(clone)] = clone
+        clone.__dict__[self.attribute] = value
+
+    @contextlib.contextmanager
+    def borrowed(self, obj):
+        """
+        Let the object read the shared value without copying it. The value must not be modified meanwhile.
+
+        :param obj: Object which attribute can be shared.
+        :return: None
+        """
+        value = obj.__dict__[self.attribute]
+        if isinstance(value, _SharedValue):
+            obj.__dict__[self.attribute] = value.value
+            try:
+                yield
+            finally:
+                obj.__dict__[self.attribute] = value
+        else:
+            yield
+
+    def _detach(self, obj, shared):
+        if shared.owner() is obj:
+            # Give copies to waiting clones before the owner changes the value
+            for clone in list(shared.pending.values()):
+                clone.__dict__[self.attribute] = self.copier(shared.value)
+            shared.pending.clear()
+            value = shared.value
+        else:
+            shared.pending.pop(id(obj), None)
+            if shared.owner() is None and not shared.pending:
+                # Nobody else can access the value
+                value = shared.value
+            else:
+                value = self.copier(shared.value)
+
+        obj.__dict__[self.attribute] = value
+        return value
+
+
 class Process:
     """
     Represents a process.
@@ -44,6 +140,9 @@ class Process:
     label_re = re.compile(r'%(\w+)((?:\.\w*)*)%')
     _name_re = re.compile(r'\w+')
 
+    actions = CopyOnWriteDescriptor(lambda actions: actions.clone())
+    labels = CopyOnWriteDescriptor(lambda labels: {lbl.name: copy.copy(lbl) for lbl in labels.values()})
+
     def __init__(self, name, category: str = None):
         if not self._name_re.fullmatch(name):
             raise ValueError("Process identifier {!r} should be just a simple name string".format(name))
@@ -65,6 +164,15 @@ class Process:
     def __str__(self):
         return '%s/%s' % (self._category, self._name)
 
+    def __getstate__(self):
+        # Shared values are saved as copies, since they refer to other processes that should not be changed
+        state = dict(self.__dict__)
+        for descriptor in (Process.actions, Process.labels):
+            value = state[descriptor.attribute]
+            if isinstance(value, _SharedValue):
+                state[descriptor.attribute] = descriptor.copier(value.value)
+        return state
+
     def __hash__(self):
         return hash(str(self))
 
@@ -82,8 +190,8 @@ class Process:
 
     def clone(self):
         """
-        Copy the instance and return a new one. The copy method is recursive, to get a shallow copy use the copy.copy
-        method.
+        Copy the instance and return a new one. The copy is not shallow, but actions and labels are copied only when
+        they are accessed for the first time.
 
         :return: Process.
         """
@@ -91,23 +199,26 @@ class Process:
 
         # Set simple attributes
         for att, val in self.__dict__.items():
+            if att in ('_actions', '_labels'):
+                continue
             if isinstance(val, (list, dict)):
                 setattr(inst, att, copy.copy(val))
             else:
                 setattr(inst, att, val)
 
-        inst.actions = self.actions.clone()
+        # Actions and labels are copied on demand
+        for descriptor in (Process.actions, Process.labels):
+            descriptor.share(self, inst)
 
         # Change declarations and definition keys
         for collection in (self.declarations, self.definitions):
             for item in collection:
                 collection[item] = copy.copy(collection[item])
 
-        # Copy labels
-        inst.labels = {lbl.name: copy.copy(lbl) for lbl in self.labels.values()}
-
-        # Recalculate accesses
-        inst.accesses(refresh=True)
+        # Recalculate accesses if there are no cached ones, this does not change actions
+        if not inst._accesses:
+            with Process.actions.borrowed(inst):
+                inst.accesses(refresh=True)
 
         return inst
 
@@ -538,7 +649,7 @@ class ProcessCollection:
         deleted = set()
         while iterate:
             iterate = False
-            for key, process in self.environment.items():
+            for key, process in list(self.environment.items()):
                 receives = set(map(str, (a for a in process.actions.filter(include={Receive}) if a.replicative)))
                 all_peers = {a for acts in process.peers.values() for a in acts}
 
@@ -549,9 +660,6 @@ class ProcessCollection:
                     deleted.add(key)
                     iterate = True
 
-            if iterate:
-                self.establish_peers()
-
         return deleted
 
     def extend_model_name(self, process_name, attribute):
@@ -561,9 +669,13 @@ class ProcessCollection:
 
     def remove_process(self, process_name):
         if process_name in self.environment:
+            process = self.environment[process_name]
             del self.environment[process_name]
         else:
+            process = self.entry
             self.entry = None
+        if isinstance(process, Process):
+            self._forget_peers(process)
         self.extend_model_name(process_name, 'Removed')
 
     def copy_declarations_to_init(self, process: Process):
@@ -574,26 +686,81 @@ class ProcessCollection:
                 getattr(self.entry, attr).setdefault(file, {})
                 getattr(self.entry, attr)[file].update(getattr(process, attr)[file])
 
-    def establish_peers(self):
+    def establish_peers(self, processes=None):
         """
         Get processes and guarantee that all peers are correctly set for both receivers and dispatchers. The function
         replaces dispatches expressed by strings to object references as it is expected in translation.
 
+        Only processes that have signals with the same name and the same number of parameters are compared. If some
+        processes are given, then only their peers are recalculated, for instance, after adding them to the collection.
+
+        :param processes: An iterable with processes of the collection to update peers for or None to update all.
         :return: None
         """
-        # Delete all previous peers to avoid keeping the old deleted processes
-        for process in self.processes:
-            process.peers.clear()
+        ordered = self.processes
+        positions = {id(process): index for index, process in enumerate(ordered)}
+
+        if processes is None:
+            # Delete all previous peers to avoid keeping the old deleted processes
+            for process in ordered:
+                process.peers.clear()
+            updated = None
+        else:
+            updated = {positions[id(process)] for process in processes}
+            for index in updated:
+                self._forget_peers(ordered[index])
+
+        candidates = self._peer_candidates(ordered, updated)
 
         # First check models
-        for model in self.models.values():
-            for process in list(self.environment.values()) + ([self.entry] if self.entry else []):
-                model.establish_peers(process)
-
-        processes = self.processes
-        for i, process in enumerate(processes):
-            for pair in processes[i+1:]:
-                process.establish_peers(pair)
+        models = {positions[id(model)] for model in self.models.values()}
+        for index in sorted(models):
+            for pair in sorted(candidates[index].difference(models)):
+                ordered[index].establish_peers(ordered[pair])
+
+        for index, process in enumerate(ordered):
+            for pair in sorted(p for p in candidates[index] if p > index):
+                process.establish_peers(ordered[pair])
+
+    @staticmethod
+    def _peer_candidates(processes, restrict_to=None):
+        """
+        Build an index from signal names and numbers of parameters to dispatching and receiving processes and collect
+        pairs of processes that may be peers.
+
+        :param processes: A list of processes.
+        :param restrict_to: A set of indexes of processes in the list which peers are needed or None to get all pairs.
+        :return: A list with sets of indexes of possible peers for each process.
+        """
+        index = {}
+        for position, process in enumerate(processes):
+            for action in process.actions.filter(include={Signal}):
+                dispatchers, receivers = index.setdefault((str(action), len(action.parameters)), (set(), set()))
+                if isinstance(action, Dispatch):
+                    dispatchers.add(position)
+                else:
+                    receivers.add(position)
+
+        candidates = [set() for _ in processes]
+        for dispatchers, receivers in index.values():
+            for dispatcher in dispatchers:
+                for receiver in receivers:
+                    if dispatcher != receiver and \
+                            (restrict_to is None or dispatcher in restrict_to or receiver in restrict_to):
+                        candidates[dispatcher].add(receiver)
+                        candidates[receiver].add(dispatcher)
+
+        return candidates
+
+    def _forget_peers(self, process):
+        """Remove peers of the given process and references to it from its previous peers."""
+        for name in process.peers:
+            try:
+                peer = self.find_process(name)
+            except KeyError:
+                continue
+            peer.peers.pop(str(process), None)
+        process.peers.clear()
 
     def save_digraphs(self, directory):
         """
@@ -20,7 +20,7 @@ import pytest
 from klever.core.vtg.emg.common.process import Process
 from klever.core.vtg.emg.common.process.labels import Label
 from klever.core.vtg.emg.common.process.parser import parse_process
-from klever.core.vtg.emg.common.process.actions import Receive, Dispatch, Block
+from klever.core.vtg.emg.common.process.actions import Actions, Receive, Dispatch, Block
 
 
 @pytest.fixture
@@ -74,3 +74,34 @@ def test_clone_behaviours(process, clone):
     assert clone.actions['d']
     assert clone.actions.behaviour('d').pop()
     assert len(clone.actions.behaviour('d').pop().my_operator) == len(operator) + 1
+
+
+def test_original_keeps_actions(process):
+    actions = process.actions
+    first = process.clone()
+    second = first.clone()
+
+    # The original process is not affected by cloning
+    assert process.actions is actions
+    del process.actions['d']
+
+    for clone in (first, second):
+        assert clone.actions is not actions
+        assert 'd' in clone.actions
+        assert clone.actions.behaviour('d').pop().description is clone.actions['d']
+    assert first.actions is not second.actions
+
+
+def test_replaced_actions(process):
+    actions = process.actions
+    clone = process.clone()
+    clone.actions = Actions()
+
+    assert process.actions is actions
+    assert 'd' in process.actions
+    assert 'd' not in clone.actions
+
+
+def test_cloned_accesses(process, clone):
+    assert set(process.accesses().keys()) == set(clone.accesses().keys())
+    assert clone.resolve_access('%l1%').label is clone.labels['l1']
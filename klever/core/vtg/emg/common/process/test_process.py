@@ -19,6 +19,7 @@ import pytest
 
 from klever.core.vtg.emg.common.process import Process
 from klever.core.vtg.emg.common.process.parser import parse_process
+from klever.core.vtg.emg.common.process.model_for_testing import model_preset
 from klever.core.vtg.emg.common.process.actions import Receive, Dispatch, Block, Concatenation, Choice
 
 
@@ -126,3 +127,46 @@ def test_insert_choice(process):
     assert isinstance(operator, Concatenation)
     assert str(operator[0].description) == 'x3'
     assert str(operator[1].description) == 'x1'
+
+
+def _peers_by_all_pairs(model):
+    for process in model.processes:
+        process.peers.clear()
+    processes = model.processes
+    for i, process in enumerate(processes):
+        for pair in processes[i+1:]:
+            process.establish_peers(pair)
+    return {str(p): {k: set(v) for k, v in p.peers.items()} for p in processes}
+
+
+def _current_peers(model):
+    return {str(p): {k: set(v) for k, v in p.peers.items()} for p in model.processes}
+
+
+def test_indexed_peers():
+    model = model_preset()
+    expected = _peers_by_all_pairs(model)
+
+    model.establish_peers()
+    assert _current_peers(model) == expected
+    assert any(peers for peers in expected.values())
+
+
+def test_incremental_peers():
+    model = model_preset()
+    model.establish_peers()
+
+    # Peers of a removed process should disappear from other processes
+    name = next(n for n, p in model.environment.items() if p.peers)
+    model.remove_process(name)
+    removed = _current_peers(model)
+    assert all(name not in peers for peers in removed.values())
+    assert removed == _peers_by_all_pairs(model)
+
+    # Add the process back and update only its peers
+    restored = model_preset()
+    restored.establish_peers()
+    process = restored.environment[name]
+    model.environment[name] = process
+    model.establish_peers([process])
+    assert _current_peers(model) == _current_peers(restored)
@@ -17,10 +17,12 @@
 
 import copy
 import json
+import pickle
 import logging
 import pytest
 
 from klever.core.vtg.emg.common.process import ProcessCollection, ProcessDescriptor
+from klever.core.vtg.emg.common.process.actions import Actions
 from klever.core.vtg.emg.common.process.serialization import CollectionDecoder, CollectionEncoder
 from klever.core.vtg.emg.common.process.model_for_testing import raw_model_preset, model_preset, source_preset
 
@@ -67,6 +69,24 @@ def test_export_model(source, model):
     _compare_models(raw1, raw2)
 
 
+def test_pickled_model(raw_model, model):
+    # Shared EMG stages are stored with pickle, so cloned processes must survive it with their own actions
+    clone = model.environment['c1/p1'].clone()
+    clone.actions = Actions()
+    unpickled = pickle.loads(pickle.dumps(model))
+    raw2 = json.loads(json.dumps(unpickled, cls=CollectionEncoder))
+    _compare_models(raw_model, raw2)
+    assert len(pickle.loads(pickle.dumps(clone)).actions) == 0
+
+    # Pickling does not make clones get their own copies of shared actions and labels
+    clone = model.environment['c1/p1'].clone()
+    shared = clone.__dict__['_actions']
+    unpickled = pickle.loads(pickle.dumps(clone))
+    assert clone.__dict__['_actions'] is shared
+    assert set(unpickled.actions) == set(model.environment['c1/p1'].actions)
+    assert set(unpickled.labels) == set(model.environment['c1/p1'].labels)
+
+
 def test_requirements_field(source, raw_model):
     test_raw_model = copy.deepcopy(raw_model)
     assert 'c1/p1' in test_raw_model['environment processes']['c1/p2']['actions']['register_c1p2']['require']['processes']
@@ -140,13 +140,29 @@ class ModelFactory:
     def __init__(self, logger: logging.Logger, conf: dict):
         self.conf = conf
         self.logger = logger
+        self.statistics = {'candidates': 0, 'pruned candidates': 0, 'skipped models': 0}
 
     def __call__(self, processes_to_scenarios: dict, model: ProcessCollection):
         yield from self._cached_yield(self._factory_iterator(processes_to_scenarios, model))
+        self.logger.info(f"Model factory statistics: {self.statistics['candidates']} candidates, "
+                         f"{self.statistics['pruned candidates']} pruned before construction, "
+                         f"{self.statistics['skipped models']} skipped after construction")
 
     def _factory_iterator(self, processes_to_scenarios: dict, model: ProcessCollection):
         selector = self.strategy(self.logger, self.conf, processes_to_scenarios, model)
+        seen_signatures = set()
         for batch, related_process in selector():
+            self.statistics['candidates'] += 1
+
+            # Do not clone processes for a selection of scenarios that has been already processed
+            signature = self._batch_signature(batch, related_process, model)
+            if signature is not None:
+                if signature in seen_signatures:
+                    self.statistics['pruned candidates'] += 1
+                    self.logger.debug(f"Skip batch '{batch.attributed_name}' with the same scenarios as a previous one")
+                    continue
+                seen_signatures.add(signature)
+
             new = ProcessCollection(batch.name)
             new.attributes = copy.deepcopy(batch.attributes)
             original_name = batch.attributed_name
@@ -224,9 +240,32 @@ class ModelFactory:
                 model_cache.add(model.attributed_name)
                 yield model
             else:
+                self.statistics['skipped models'] += 1
                 self.logger.info("Skip cached model {!r}".format(model.attributed_name))
                 continue
 
+    @staticmethod
+    def _batch_signature(batch: ScenarioCollection, related_process: str, model: ProcessCollection):
+        """
+        Predict attributes of a model before building it from the given batch. The factory names models by their
+        attributes and keeps only the first model with a particular name, thus, batches with equal signatures can be
+        skipped without cloning any processes. Processes removed later as unused are not taken into account here, so
+        such models are still filtered out after their construction.
+
+        :param batch: ScenarioCollection.
+        :param related_process: Name of the process which savepoint is used or None.
+        :param model: ProcessCollection with the original model.
+        :return: A hashable tuple.
+        """
+        attributes = dict(batch.attributes)
+        if related_process and related_process in batch.environment and batch.environment[related_process] and \
+                batch.environment[related_process].savepoint and model.entry:
+            attributes[str(model.entry)] = 'Removed'
+        for process_name in model.non_models:
+            attributes.setdefault(process_name, 'base')
+
+        return tuple(sorted(attributes.items()))
+
     @staticmethod
     def _process_copy(process: Process):
         clone = process.clone()
@@ -15,14 +15,17 @@
 # limitations under the License.
 #
 
+import time
 import logging
 import pytest
 
 from klever.core.vtg.emg.decomposition.modelfactory import ModelFactory
 from klever.core.vtg.emg.decomposition.separation.reqs import ReqsStrategy
 from klever.core.vtg.emg.decomposition.separation import SeparationStrategy
+from klever.core.vtg.emg.decomposition.separation.linear import LinearStrategy
 from klever.core.vtg.emg.common.process.model_for_testing import model_preset
 from klever.core.vtg.emg.decomposition.modelfactory.savepoints import SavepointsFactory
+from klever.core.vtg.emg.decomposition.modelfactory.combinatorial import CombinatorialFactory
 import klever.core.vtg.emg.decomposition.modelfactory.decomposition_models as test_models
 
 
@@ -219,6 +222,46 @@ def test_double_init_selected(logger, double_init_with_deps_model):
     _expect_models_with_attrs(models, expected)
 
 
+class _NoPruningFactory(CombinatorialFactory):
+
+    @staticmethod
+    def _batch_signature(batch, related_process, model):
+        return None
+
+
+def _obtain_combinatorial_models(logger, model, factory_class):
+    factory = factory_class(logger, {})
+    scenario_generator = LinearStrategy(logger, {})
+    processes_to_scenarios = {str(process): list(scenario_generator(process, model))
+                              for process in model.non_models.values()}
+    start = time.perf_counter()
+    models = list(factory(processes_to_scenarios, model))
+    return factory.statistics, models, time.perf_counter() - start
+
+
+@pytest.mark.parametrize('model_preset_name', ['driver_model', 'fs_model', 'fs_simplified', 'driver_double_init',
+                                               'fs_savepoint_deps', 'driver_double_init_with_deps'])
+def test_early_pruning(logger, model_preset_name):
+    statistics, models, pruned_time = _obtain_combinatorial_models(
+        logger, getattr(test_models, model_preset_name)(), CombinatorialFactory)
+    reference_statistics, reference_models, reference_time = _obtain_combinatorial_models(
+        logger, getattr(test_models, model_preset_name)(), _NoPruningFactory)
+    logger.info(f"Combinatorial factory on '{model_preset_name}': {pruned_time:.3f}s with early pruning and"
+                f" {reference_time:.3f}s without it")
+
+    # Pruning must not change the result
+    assert [m.attributed_name for m in models] == [m.attributed_name for m in reference_models]
+    for new, reference in zip(models, reference_models):
+        assert set(new.environment.keys()) == set(reference.environment.keys())
+        assert str(new.entry) == str(reference.entry)
+
+    # But it must save the construction of duplicated models
+    assert reference_statistics['pruned candidates'] == 0
+    assert statistics['candidates'] == reference_statistics['candidates']
+    assert statistics['pruned candidates'] > 0
+    assert statistics['skipped models'] <= reference_statistics['skipped models']
+
+
 def _to_sorted_attr_str(attrs):
     return ", ".join(f"{k}: {attrs[k]}" for k in sorted(attrs.keys()))
 
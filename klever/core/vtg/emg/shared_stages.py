@@ -0,0 +1,112 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import json
+import time
+import fcntl
+import pickle
+import hashlib
+
+from klever.core.vtg.emg.common.c.types import export_type_collection, import_type_collection
+
+# Configuration options that are used only by decomposition and translation
+CLASS_SPECIFIC_OPTIONS = (
+    'translation options',
+    'single environment model per fragment',
+    'scenario separation',
+    'add scenarios without dispatches',
+    'select scenarios',
+    'cover scenarios',
+    'must contain',
+    'must not contain',
+    'greedy selection',
+    'skip origin model',
+    'skip savepoints',
+    'savepoints',
+    'shared stages directory'
+)
+
+
+def prepare_shared_stages(logger, conf, build):
+    """
+    Get results of EMG stages that do not depend on decomposition and translation options. The first requirement class
+    builds them and saves them to the shared stages directory, while other requirement classes of the same program
+    fragment with the same configuration wait for it and load saved results. If results cannot be saved, requirement
+    classes build them on their own without waiting for each other.
+
+    :param logger: Logger object.
+    :param conf: EMG configuration with the shared stages directory.
+    :param build: Function without arguments that builds results. They are saved together with the type collection.
+    :return: Results and dict with statistics.
+    """
+    shared_dir = conf['shared stages directory']
+    options = {k: v for k, v in conf.items() if k not in CLASS_SPECIFIC_OPTIONS}
+    key = hashlib.sha224(json.dumps(options, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    cache_file = os.path.join(shared_dir, f'{key}.pickle')
+    stats_file = os.path.join(shared_dir, f'{key}.json')
+    failed_file = os.path.join(shared_dir, f'{key}.failed')
+    os.makedirs(shared_dir, exist_ok=True)
+
+    # Other requirement classes wait until the first one prepares results
+    with open(os.path.join(shared_dir, f'{key}.lock'), 'w', encoding='utf-8') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if os.path.isfile(cache_file) and os.path.isfile(stats_file):
+            logger.info("Reuse the intermediate environment model from %s", cache_file)
+            start = time.time()
+            with open(cache_file, 'rb') as fp:
+                results, types = pickle.load(fp)
+            import_type_collection(types)
+            load_time = time.time() - start
+
+            with open(stats_file, 'r', encoding='utf-8') as fp:
+                build_time = json.load(fp)['build time']
+
+            return results, {
+                'reused': True,
+                'build_time': round(build_time, 2),
+                'load_time': round(load_time, 2),
+                'saved_time': round(build_time - load_time, 2)
+            }
+
+        if not os.path.isfile(failed_file):
+            start = time.time()
+            results = build()
+            build_time = time.time() - start
+
+            try:
+                with open(f'{cache_file}.tmp', 'wb') as fp:
+                    pickle.dump((results, export_type_collection()), fp, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(f'{cache_file}.tmp', cache_file)
+                with open(stats_file, 'w', encoding='utf-8') as fp:
+                    json.dump({'build time': build_time}, fp)
+                logger.info("The intermediate environment model is saved to %s", cache_file)
+            except (pickle.PicklingError, RecursionError, TypeError, AttributeError) as err:
+                logger.warning("Cannot save the intermediate environment model to share it: %s", err)
+                if os.path.isfile(f'{cache_file}.tmp'):
+                    os.remove(f'{cache_file}.tmp')
+                # Let waiting requirement classes know that they should not wait for each other
+                with open(failed_file, 'w', encoding='utf-8'):
+                    pass
+
+            return results, {'reused': False, 'build_time': round(build_time, 2)}
+
+    logger.info("The intermediate environment model cannot be shared, so build it without waiting")
+    start = time.time()
+    results = build()
+    return results, {'reused': False, 'build_time': round(time.time() - start, 2)}
@@ -0,0 +1,133 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import time
+import logging
+import multiprocessing
+
+from klever.core.vtg.utils import get_shared_stages_dir, SharedStagesUsers
+from klever.core.vtg.emg.shared_stages import prepare_shared_stages
+
+
+class Builder:
+    """Build results of stages and record when it happened."""
+
+    def __init__(self, log_file, duration=0.0, picklable=True):
+        self.log_file = log_file
+        self.duration = duration
+        self.picklable = picklable
+
+    def __call__(self):
+        start = time.time()
+        time.sleep(self.duration)
+        with open(self.log_file, 'a', encoding='utf-8') as fp:
+            fp.write('{} {}\n'.format(start, time.time()))
+        if self.picklable:
+            return 'sa', ['process']
+        return 'sa', [lambda: 'process']
+
+    def builds(self):
+        if not os.path.isfile(self.log_file):
+            return []
+        with open(self.log_file, encoding='utf-8') as fp:
+            return sorted(tuple(float(t) for t in line.split()) for line in fp)
+
+
+def _conf(tmpdir, **options):
+    conf = {'shared stages directory': str(tmpdir.join('shared')), 'entry point': 'main'}
+    conf.update(options)
+    return conf
+
+
+def _prepare(conf, builder, queue):
+    results, stats = prepare_shared_stages(logging.getLogger(), conf, builder)
+    queue.put((results[0], stats['reused']))
+
+
+def _prepare_in_parallel(conf, builder, number):
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_prepare, args=(conf, builder, queue)) for _ in range(number)]
+    for process in processes:
+        process.start()
+    results = [queue.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    return results
+
+
+def test_cache_hit_and_miss(tmpdir):
+    builder = Builder(str(tmpdir.join('builds')))
+    results, stats = prepare_shared_stages(logging.getLogger(), _conf(tmpdir), builder)
+    assert results == ('sa', ['process'])
+    assert not stats['reused']
+
+    # Decomposition and translation options do not matter
+    results, stats = prepare_shared_stages(logging.getLogger(), _conf(tmpdir, savepoints=False), builder)
+    assert results == ('sa', ['process'])
+    assert stats['reused']
+    assert set(stats) == {'reused', 'build_time', 'load_time', 'saved_time'}
+    assert len(builder.builds()) == 1
+
+    _, stats = prepare_shared_stages(logging.getLogger(), _conf(tmpdir, **{'entry point': 'init'}), builder)
+    assert not stats['reused']
+    assert len(builder.builds()) == 2
+
+
+def test_pickling_failure(tmpdir):
+    builder = Builder(str(tmpdir.join('builds')), picklable=False)
+    for _ in range(2):
+        results, stats = prepare_shared_stages(logging.getLogger(), _conf(tmpdir), builder)
+        assert results[0] == 'sa'
+        assert not stats['reused']
+    assert len(builder.builds()) == 2
+    assert not any(name.endswith('.pickle') or name.endswith('.tmp') for name in os.listdir(str(tmpdir.join('shared'))))
+
+
+def test_processes_wait_for_shared_stages(tmpdir):
+    builder = Builder(str(tmpdir.join('builds')), duration=0.5)
+    results = _prepare_in_parallel(_conf(tmpdir), builder, 2)
+    assert sorted(results) == [('sa', False), ('sa', True)]
+    assert len(builder.builds()) == 1
+
+
+def test_processes_do_not_wait_for_unshareable_stages(tmpdir):
+    builder = Builder(str(tmpdir.join('builds')), duration=1, picklable=False)
+    results = _prepare_in_parallel(_conf(tmpdir), builder, 3)
+    assert results == [('sa', False)] * 3
+
+    # The first process builds results holding the lock, while others build them at the same time after it
+    (_, first_finish), (second_start, second_finish), (third_start, _) = builder.builds()
+    assert second_start >= first_finish
+    assert third_start < second_finish
+
+
+def test_shared_stages_users(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    for keep_dirs in (False, True):
+        users = SharedStagesUsers(logging.getLogger(), keep_dirs)
+        users.add('drivers/usb.ko', 2)
+        os.makedirs(get_shared_stages_dir('drivers/usb.ko'))
+
+        assert not users.release('drivers/usb.ko')
+        assert os.path.isdir(get_shared_stages_dir('drivers/usb.ko'))
+        assert users.release('drivers/usb.ko') is not keep_dirs
+        assert os.path.isdir(get_shared_stages_dir('drivers/usb.ko')) is keep_dirs
+
+        # Fragments without shared stages are ignored
+        assert not users.release('drivers/net.ko')
@@ -17,10 +17,16 @@
 
 import os
 import re
-import zipfile
+import gzip
 import json
+import fcntl
+import shutil
+import zipfile
 import sortedcontainers
 import klever.core.utils
+from klever.core.vtg.utils import CIL_CACHE_DIR, CIL_CACHE_STATS_FILE, get_cil_cache_statistics
+# Smaller files are put into task archives as is since uploading them separately costs more than they weigh
+TASK_BLOB_MIN_SIZE = 4096
 
 
 def merge_files(logger, conf, abstract_task_desc):
@@ -34,64 +40,109 @@ def merge_files(logger, conf, abstract_task_desc):
     """
     if os.path.isfile('cil.i'):
         logger.info('CIL file exists, we do not need to run CIL again')
-    else:
-        logger.info('Merge source files by means of CIL')
-
-        ordered_c_files = sortedcontainers.SortedSet()
-        for extra_c_file in abstract_task_desc['extra C files']:
-            if 'C file' in extra_c_file:
-                ordered_c_files.add(os.path.join(conf['main working directory'], extra_c_file['C file']))
-
-        with open('input files', 'w', encoding='utf-8') as fp:
-            for c_file in ordered_c_files:
-                fp.write(c_file + '\n')
-
-        args = ['toplevel.opt'] + \
-            conf.get('CIL additional opts', []) + \
-            [
-                # This disables searching for add-ons enabled by default. One still is able to load plugins manually.
-                '-no-autoload-plugins', '-no-findlib',
-                # Copy user or internal errors to "problem desc.txt" explicitly since CIL does not output them to STDERR.
-                '-kernel-log', 'e:problem desc.txt',
-                '-machdep', conf['CIL']['machine'],
-                # Compatibility with C11 (ISO/IEC 9899:2011).
-                '-c11',
-                # In our mode this is the only warning resulting to errors by default.
-                '-kernel-warn-key', 'CERT:MSC:38=active',
-                # Removing unused functions helps to reduce CPAchecker computational resources consumption very-very
-                # considerably.
-                '-remove-unused-inline-functions', '-remove-unused-static-functions',
-                # This helps to reduce considerable memory consumption by CIL itself since input files are processed more
-                # sequentially.
-                '-no-annot',
-                # This allows to avoid temporary variables to hold return values for all functions and returns at the end of
-                # functions even when returning in the middle.
-                '-no-single-return',
-                # Avoid temporary variables as much as possible since witnesses will refer them otherwise.
-                '-fold-temp-vars',
-                # Remove redundant zero initializers of global variables that are specified in original sources (rarely) or
-                # added by CIL itself.
-                '-shrink-initializers',
-                # Rest options.
-                '-keep-logical-operators',
-                '-aggressive-merging',
-                '-print', '-print-lines', '-no-print-annot',
-                '-ocode', 'cil.i',
-                '-more-files', 'input files'
-            ]
-
-        klever.core.utils.execute(logger, args=args, enforce_limitations=True,
-                                  cpu_time_limit=conf["resource limits"]["CPU time for executed commands"],
-                                  memory_limit=conf["resource limits"]["memory size for executed commands"])
-        # There will be empty file if CIL succeeded. Remove it to avoid unknown reports of whole FVTP later.
-        if os.path.isfile('problem desc.txt'):
-            os.unlink('problem desc.txt')
-
-        logger.debug('Merged source files was outputted to "cil.i"')
+        return 'cil.i'
+
+    ordered_c_files = sortedcontainers.SortedSet()
+    for extra_c_file in abstract_task_desc['extra C files']:
+        if 'C file' in extra_c_file:
+            ordered_c_files.add(os.path.join(conf['main working directory'], extra_c_file['C file']))
+
+    args = ['toplevel.opt'] + \
+        conf.get('CIL additional opts', []) + \
+        [
+            # This disables searching for add-ons enabled by default. One still is able to load plugins manually.
+            '-no-autoload-plugins', '-no-findlib',
+            # Copy user or internal errors to "problem desc.txt" explicitly since CIL does not output them to STDERR.
+            '-kernel-log', 'e:problem desc.txt',
+            '-machdep', conf['CIL']['machine'],
+            # Compatibility with C11 (ISO/IEC 9899:2011).
+            '-c11',
+            # In our mode this is the only warning resulting to errors by default.
+            '-kernel-warn-key', 'CERT:MSC:38=active',
+            # Removing unused functions helps to reduce CPAchecker computational resources consumption very-very
+            # considerably.
+            '-remove-unused-inline-functions', '-remove-unused-static-functions',
+            # This helps to reduce considerable memory consumption by CIL itself since input files are processed more
+            # sequentially.
+            '-no-annot',
+            # This allows to avoid temporary variables to hold return values for all functions and returns at the end of
+            # functions even when returning in the middle.
+            '-no-single-return',
+            # Avoid temporary variables as much as possible since witnesses will refer them otherwise.
+            '-fold-temp-vars',
+            # Remove redundant zero initializers of global variables that are specified in original sources (rarely) or
+            # added by CIL itself.
+            '-shrink-initializers',
+            # Rest options.
+            '-keep-logical-operators',
+            '-aggressive-merging',
+            '-print', '-print-lines', '-no-print-annot',
+            '-ocode', 'cil.i',
+            '-more-files', 'input files'
+        ]
+
+    if not conf.get('cache CIL merging', True):
+        _run_cil(logger, conf, ordered_c_files, args)
+        return 'cil.i'
+
+    # Requirement specifications often bring the same woven in C files, e.g. ones of the same program fragment. These
+    # files refer original sources by line directives, so the result of CIL depends just on their contents and order as
+    # well as on the CIL command-line options including the machine.
+    cache_dir = os.path.join(conf['cache directory'], CIL_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    key = klever.core.utils.get_file_name_checksum(json.dumps(
+        [args, [klever.core.utils.get_file_checksum(c_file) for c_file in ordered_c_files]]))
+    cache_file = os.path.join(cache_dir, f'{key}.i')
+
+    # Other tasks with the same input files wait until the first one merges them
+    with open(os.path.join(cache_dir, f'{key}.lock'), 'w', encoding='utf-8') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if os.path.isfile(cache_file):
+            logger.info('Get merged source files from CIL cache')
+            shutil.copyfile(cache_file, 'cil.i')
+            _update_cil_cache_statistics(cache_dir, 'hits', sum(os.path.getsize(f) for f in ordered_c_files))
+        else:
+            _run_cil(logger, conf, ordered_c_files, args)
+            logger.info('Store merged source files to CIL cache')
+            shutil.copyfile('cil.i', f'{cache_file}.tmp')
+            os.replace(f'{cache_file}.tmp', cache_file)
+            _update_cil_cache_statistics(cache_dir, 'misses', 0)
 
     return 'cil.i'
 
 
+def _run_cil(logger, conf, c_files, args):
+    logger.info('Merge source files by means of CIL')
+
+    with open('input files', 'w', encoding='utf-8') as fp:
+        for c_file in c_files:
+            fp.write(c_file + '\n')
+
+    klever.core.utils.execute(logger, args=args, enforce_limitations=True,
+                              cpu_time_limit=conf["resource limits"]["CPU time for executed commands"],
+                              memory_limit=conf["resource limits"]["memory size for executed commands"])
+    # There will be empty file if CIL succeeded. Remove it to avoid unknown reports of whole FVTP later.
+    if os.path.isfile('problem desc.txt'):
+        os.unlink('problem desc.txt')
+
+    logger.debug('Merged source files was outputted to "cil.i"')
+
+
+def _update_cil_cache_statistics(cache_dir, event, saved_bytes):
+    with open(os.path.join(cache_dir, f'{CIL_CACHE_STATS_FILE}.lock'), 'w', encoding='utf-8') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        stats = get_cil_cache_statistics(cache_dir)
+        stats[event] += 1
+        stats['saved bytes'] += saved_bytes
+
+        stats_file = os.path.join(cache_dir, CIL_CACHE_STATS_FILE)
+        with open(f'{stats_file}.tmp', 'w', encoding='utf-8') as fp:
+            json.dump(stats, fp)
+        os.replace(f'{stats_file}.tmp', stats_file)
+
+
 def get_verifier_opts_and_safe_prps(logger, resource_limits, conf):
     """
     Collect verifier options from a user provided description, template and profile and prepare a final list of
@@ -245,11 +296,43 @@ def prepare_verification_task_files_archive(files):
     """
     Generate archive for verification task files in the current directory. The archive name should be 'task files.zip'.
 
+    Files that are not smaller than TASK_BLOB_MIN_SIZE, e.g. merged source files, often repeat in tasks of different
+    requirement specifications. Thus, they are not put into the archive but compressed separately and listed in its
+    manifest by checksums of compressed files, so they can be uploaded just once. Paths of compressed files are saved
+    to 'task blobs.json' by their checksums.
+
     :param files: A list of files.
     :return: None
     """
+    blobs = {}
+    manifest = {}
     with open('task files.zip', mode='w+b', buffering=0) as fp:
         with zipfile.ZipFile(fp, mode='w', compression=zipfile.ZIP_DEFLATED) as zfp:
             for file in files:
-                zfp.write(file)
+                if os.path.getsize(file) >= TASK_BLOB_MIN_SIZE:
+                    blob = _compress_task_blob(file)
+                    checksum = os.path.basename(blob)
+                    manifest[zipfile.ZipInfo.from_file(file).filename] = checksum
+                    blobs[checksum] = blob
+                else:
+                    zfp.write(file)
+            if manifest:
+                zfp.writestr(klever.core.utils.TASK_BLOBS_MANIFEST, json.dumps(manifest, sort_keys=True))
             os.fsync(zfp.fp)
+
+    if blobs:
+        with open('task blobs.json', 'w', encoding='utf-8') as fp:
+            json.dump(blobs, fp, sort_keys=True)
+
+
+def _compress_task_blob(file):
+    # Compressed files should not depend on names and modification times of original ones to have the same checksums
+    os.makedirs('task blobs', exist_ok=True)
+    tmp_blob = os.path.join('task blobs', 'blob.tmp')
+    with open(file, 'rb') as in_fp, open(tmp_blob, 'wb') as fp:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=fp, mtime=0) as gzip_fp:
+            shutil.copyfileobj(in_fp, gzip_fp)
+
+    blob = os.path.abspath(os.path.join('task blobs', klever.core.utils.get_file_checksum(tmp_blob)))
+    os.replace(tmp_blob, blob)
+    return blob
@@ -0,0 +1,201 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import json
+import random
+import shutil
+import logging
+import zipfile
+
+import pytest
+
+import klever.core.utils
+from klever.core.utils import TASK_BLOBS_MANIFEST
+from klever.core.vtg.fvtp.common import merge_files, prepare_verification_task_files_archive
+from klever.core.vtg.utils import CIL_CACHE_DIR, get_cil_cache_statistics
+from klever.scheduler.utils import extract_task_files
+
+
+@pytest.fixture
+def cil(monkeypatch):
+    runs = []
+
+    def execute(_logger, args, **_kwargs):
+        # Pretend that CIL merges files by concatenating them
+        with open(args[args.index('-more-files') + 1], encoding='utf-8') as fp:
+            c_files = fp.read().splitlines()
+        with open(args[args.index('-ocode') + 1], 'w', encoding='utf-8') as fp:
+            for c_file in c_files:
+                with open(c_file, encoding='utf-8') as in_fp:
+                    fp.write(in_fp.read())
+        runs.append(c_files)
+
+    monkeypatch.setattr(klever.core.utils, 'execute', execute)
+    return runs
+
+
+def _merge(tmpdir, task, files, machine='gcc_x86_64'):
+    main_work_dir = str(tmpdir)
+    conf = {
+        'main working directory': main_work_dir,
+        'cache directory': os.path.join(main_work_dir, 'cache'),
+        'CIL': {'machine': machine},
+        'resource limits': {'CPU time for executed commands': 0, 'memory size for executed commands': 0}
+    }
+    abstract_task_desc = {'extra C files': []}
+    for name, contents in files.items():
+        c_file = os.path.join(task, 'weaver', name)
+        os.makedirs(os.path.join(main_work_dir, os.path.dirname(c_file)), exist_ok=True)
+        with open(os.path.join(main_work_dir, c_file), 'w', encoding='utf-8') as fp:
+            fp.write(contents)
+        abstract_task_desc['extra C files'].append({'C file': c_file})
+
+    task_work_dir = os.path.join(main_work_dir, task, 'fvtp')
+    os.makedirs(task_work_dir)
+    cwd = os.getcwd()
+    os.chdir(task_work_dir)
+    try:
+        merged = merge_files(logging.getLogger(), conf, abstract_task_desc)
+        with open(merged, encoding='utf-8') as fp:
+            return fp.read(), get_cil_cache_statistics(os.path.join(conf['cache directory'], CIL_CACHE_DIR))
+    finally:
+        os.chdir(cwd)
+
+
+def test_reuse(tmpdir, cil):
+    files = {'module.i': 'int module;\n', 'model.i': 'int model;\n'}
+    merged, stats = _merge(tmpdir, 'rule1', files)
+    assert stats == {'hits': 0, 'misses': 1, 'saved bytes': 0}
+
+    # Woven in files of another requirement specification are located in another directory but they are the same
+    assert _merge(tmpdir, 'rule2', files) == (merged, {'hits': 1, 'misses': 1, 'saved bytes': 23})
+    assert len(cil) == 1
+
+
+def test_different_inputs(tmpdir, cil):
+    _merge(tmpdir, 'rule1', {'module.i': 'int module;\n', 'model.i': 'int model;\n'})
+    merged, _ = _merge(tmpdir, 'rule2', {'module.i': 'int module;\n', 'model.i': 'int another_model;\n'})
+    assert merged == 'int another_model;\nint module;\n'
+    _, stats = _merge(tmpdir, 'rule3', {'module.i': 'int module;\n', 'model.i': 'int model;\n'}, 'gcc_x86_32')
+    assert stats == {'hits': 0, 'misses': 3, 'saved bytes': 0}
+    assert len(cil) == 3
+
+
+class BlobServer:
+    # Pretend to be Bridge that keeps blobs uploaded by Klever Core
+    def __init__(self):
+        self.blobs = {}
+        self.uploaded = 0
+        self.downloaded = 0
+
+    def upload(self, blobs):
+        for checksum, path in blobs.items():
+            if checksum not in self.blobs:
+                self.blobs[checksum] = path
+                self.uploaded += os.path.getsize(path)
+
+    def pull_task_blob(self, _identifier, checksum, file):
+        if checksum not in self.blobs:
+            return False
+        shutil.copyfile(self.blobs[checksum], file)
+        self.downloaded += os.path.getsize(file)
+        return True
+
+
+def _prepare_task(task_dir, files):
+    os.makedirs(task_dir)
+    cwd = os.getcwd()
+    os.chdir(task_dir)
+    try:
+        for name, contents in files.items():
+            with open(name, 'w', encoding='utf-8') as fp:
+                fp.write(contents)
+        prepare_verification_task_files_archive(list(files))
+        blobs = {}
+        if os.path.isfile('task blobs.json'):
+            with open('task blobs.json', encoding='utf-8') as fp:
+                blobs = json.load(fp)
+        return os.path.join(task_dir, 'task files.zip'), blobs
+    finally:
+        os.chdir(cwd)
+
+
+def _source(rnd, lines):
+    return ''.join('int {}_{} = {};\n'.format(rnd.choice(('ldv', 'drv', 'var')), rnd.getrandbits(32), i)
+                   for i in range(lines))
+
+
+def test_archive_round_trip(tmpdir):
+    rnd = random.Random(0)
+    files = {'benchmark.xml': '<benchmark/>\n', 'cil.i': _source(rnd, 1000)}
+    archive, blobs = _prepare_task(os.path.join(str(tmpdir), 'task'), files)
+    with zipfile.ZipFile(archive) as zfp:
+        assert set(zfp.namelist()) == {TASK_BLOBS_MANIFEST, 'benchmark.xml'}
+        checksum, = json.loads(zfp.read(TASK_BLOBS_MANIFEST)).values()
+    assert list(blobs) == [checksum]
+    assert os.path.getsize(blobs[checksum]) < len(files['cil.i'])
+
+    server = BlobServer()
+    server.upload(blobs)
+    blob_store = os.path.join(str(tmpdir), 'blobs')
+    # The second task reuses the downloaded file while the third one does not use the blob store at all
+    for task, store, download in (('first', blob_store, True), ('second', blob_store, False), ('third', None, True)):
+        directory = os.path.join(str(tmpdir), task)
+        downloaded = extract_task_files(server, task, archive, directory, store)
+        assert downloaded == (os.path.getsize(blobs[checksum]) if download else 0)
+        assert sorted(os.listdir(directory)) == sorted(files)
+        for name, contents in files.items():
+            with open(os.path.join(directory, name), encoding='utf-8') as fp:
+                assert fp.read() == contents
+
+
+def test_job_transfer(tmpdir):
+    # Synthetic job: requirement specifications of the same class share models, so tasks for a program fragment
+    # often get the same merged source file
+    rnd = random.Random(2019)
+    fragments = {'fragment{}'.format(i): _source(rnd, rnd.randint(500, 3000)) for i in range(10)}
+    models = {'class{}'.format(i): _source(rnd, 50) for i in range(3)}
+    requirements = {'rule{}'.format(i): 'class{}'.format(i % 3) for i in range(12)}
+
+    server = BlobServer()
+    blob_store = os.path.join(str(tmpdir), 'node blobs')
+    before = after = 0
+    for fragment, source in fragments.items():
+        for requirement, requirement_class in requirements.items():
+            task = '{}.{}'.format(fragment, requirement)
+            files = {
+                'benchmark.xml': '<benchmark tool="CPAchecker"><option>{}</option></benchmark>\n'.format(task),
+                'property.prp': 'CHECK( init(main()), LTL(G ! call(ldv_assert_{}())) )\n'.format(requirement),
+                'cil.i': source + models[requirement_class]
+            }
+            # Before: the whole archive is uploaded by Klever Core and downloaded by the scheduler client
+            archive = os.path.join(str(tmpdir), 'full', task + '.zip')
+            os.makedirs(os.path.dirname(archive), exist_ok=True)
+            with zipfile.ZipFile(archive, mode='w', compression=zipfile.ZIP_DEFLATED) as zfp:
+                for name, contents in files.items():
+                    zfp.writestr(name, contents)
+            before += 2 * os.path.getsize(archive)
+
+            archive, blobs = _prepare_task(os.path.join(str(tmpdir), 'tasks', task), files)
+            uploaded, downloaded = server.uploaded, server.downloaded
+            server.upload(blobs)
+            extract_task_files(server, task, archive, os.path.join(str(tmpdir), 'solutions', task), blob_store)
+            after += 2 * os.path.getsize(archive) + server.uploaded - uploaded + server.downloaded - downloaded
+
+    assert len(server.blobs) == len(fragments) * len(models)
+    assert after * 2 < before
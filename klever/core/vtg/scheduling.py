@@ -0,0 +1,168 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import time
+import heapq
+import itertools
+
+
+class CostAwareQueue:
+    """
+    Queue of abstract tasks and verification tasks that returns the most expensive work first.
+
+    The cost of an item is the weight of its program fragment multiplied by the observed duration of processing a unit
+    of weight by the same requirement class (abstract tasks) or requirement (verification tasks). Items of different
+    kinds are returned in turn to keep both EMG and PLUGINS workers busy.
+    """
+
+    def __init__(self, fragment_descs, workers=1):
+        """
+        :param fragment_descs: Dictionary with program fragment descriptions.
+        :param workers: Number of workers that process items in parallel.
+        """
+        self._fragment_descs = fragment_descs
+        self._workers = max(workers, 1)
+        # Kind -> key -> heap with items
+        self._heaps = {}
+        self._counter = itertools.count()
+        self._length = 0
+        self._last_kind = None
+        # Key -> [total duration, total weight]
+        self._history = {}
+        # Item -> (submission time, key, weight, estimated duration)
+        self._submitted = {}
+        # (Estimated duration, measured duration)
+        self._processed = []
+        self._start = None
+        self._finish = None
+
+    def __len__(self):
+        return self._length
+
+    def __bool__(self):
+        return self._length > 0
+
+    def append(self, item):
+        """
+        Add a new abstract task or verification task.
+
+        :param item: Abstract or Task namedtuple.
+        """
+        kind, key = self._key(item)
+        heap = self._heaps.setdefault(kind, {}).setdefault(key, [])
+        heapq.heappush(heap, (-self.weight(item.fragment), next(self._counter), item))
+        self._length += 1
+
+    def pop(self):
+        """
+        Get the most expensive item of the kind that was not returned last time if there are such items.
+
+        :return: Abstract or Task namedtuple.
+        """
+        if not self._length:
+            raise IndexError('pop from empty queue')
+
+        kinds = [kind for kind, heaps in self._heaps.items() if any(heaps.values())]
+        if len(kinds) > 1 and self._last_kind in kinds:
+            kinds.remove(self._last_kind)
+        kind, key = max(((kind, key) for kind in kinds for key, heap in self._heaps[kind].items() if heap),
+                        key=lambda pair: -self._heaps[pair[0]][pair[1]][0][0] * self.rate(pair[1]))
+        _, _, item = heapq.heappop(self._heaps[kind][key])
+        self._length -= 1
+        self._last_kind = kind
+
+        now = time.time()
+        if self._start is None:
+            self._start = now
+        weight = self.weight(item.fragment)
+        self._submitted[item] = (now, key, weight, weight * self.rate(key))
+        return item
+
+    def finished(self, item, wall_time=None):
+        """
+        Remember how long it took to process the given item.
+
+        :param item: Abstract or Task namedtuple.
+        :param wall_time: Wall time of the worker that processed the item in seconds. Otherwise the time since the item
+                          was returned by pop() is used, though it includes the time the item waited for a worker.
+        :return: Wall time of processing the item in seconds or None if the item was not returned by pop().
+        """
+        if item not in self._submitted:
+            return None
+
+        submitted, key, weight, estimate = self._submitted.pop(item)
+        self._finish = time.time()
+        if wall_time is None:
+            wall_time = self._finish - submitted
+        duration, total_weight = self._history.setdefault(key, [0.0, 0])
+        self._history[key] = [duration + wall_time, total_weight + weight]
+        self._processed.append((estimate, wall_time))
+        return wall_time
+
+    def weight(self, fragment):
+        """
+        Get the weight of the program fragment, that is, its size or the number of its groups if the size is unknown.
+
+        :param fragment: Program fragment name.
+        :return: Positive int.
+        """
+        desc = self._fragment_descs.get(fragment, {})
+        return int(desc.get('size', 0) or 0) or len(desc.get('grps', [])) or 1
+
+    def rate(self, key):
+        """
+        Get the average duration of processing a unit of fragment weight. If there is no history for the given key,
+        then use the history of all keys of the same kind.
+
+        :param key: Tuple with kind and requirement class or requirement.
+        :return: Float.
+        """
+        for selected in ([key], [k for k in self._history if k[0] == key[0]], list(self._history)):
+            duration = sum(self._history[k][0] for k in selected if k in self._history)
+            weight = sum(self._history[k][1] for k in selected if k in self._history)
+            if weight:
+                return duration / weight
+        return 1.0
+
+    def makespan(self):
+        """
+        Compare the makespan predicted by the cost model with the actual one. Durations of items are predicted when they
+        are returned by pop(), so only the history collected before that is taken into account.
+
+        :return: Predicted makespan and actual makespan in seconds.
+        """
+        if self._start is None or self._finish is None:
+            return 0.0, 0.0
+
+        predicted = sum(estimate for estimate, _ in self._processed) / self._workers
+        return predicted, self._finish - self._start
+
+    def estimation_error(self):
+        """
+        Get the mean absolute error of durations of items predicted when they were returned by pop().
+
+        :return: Error in seconds.
+        """
+        if not self._processed:
+            return 0.0
+
+        return sum(abs(estimate - duration) for estimate, duration in self._processed) / len(self._processed)
+
+    @staticmethod
+    def _key(item):
+        kind = type(item).__name__
+        return kind, (kind, item.rule if hasattr(item, 'rule') else item.rule_class)
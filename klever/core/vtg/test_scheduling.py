@@ -0,0 +1,104 @@
+#
+# Copyright (c) 2019 ISP RAS (http://www.ispras.ru)
+# Ivannikov Institute for System Programming of the Russian Academy of Sciences
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import pytest
+
+from klever.core.vtg import Abstract, Task
+from klever.core.vtg.scheduling import CostAwareQueue
+
+
+@pytest.fixture
+def fragment_descs():
+    return {
+        'small': {'size': '10', 'grps': [{}]},
+        'medium': {'size': '100', 'grps': [{}, {}]},
+        'large': {'size': '1000', 'grps': [{}, {}, {}]},
+        'unknown': {'grps': [{}, {}]}
+    }
+
+
+def _task(fragment, rule):
+    return Task(fragment, 0, 'base', rule, f'{fragment}/{rule}', ())
+
+
+def test_weights(fragment_descs):
+    queue = CostAwareQueue(fragment_descs)
+    assert queue.weight('large') == 1000
+    assert queue.weight('unknown') == 2
+    assert queue.weight('missing') == 1
+
+
+def test_longest_first(fragment_descs):
+    queue = CostAwareQueue(fragment_descs)
+    for fragment in ('small', 'large', 'unknown', 'medium'):
+        queue.append(Abstract(fragment, 0))
+
+    assert len(queue) == 4
+    assert [queue.pop().fragment for _ in range(4)] == ['large', 'medium', 'small', 'unknown']
+    assert not queue
+    with pytest.raises(IndexError):
+        queue.pop()
+
+
+def test_interleaving(fragment_descs):
+    queue = CostAwareQueue(fragment_descs)
+    for fragment in ('small', 'medium'):
+        queue.append(Abstract(fragment, 0))
+        queue.append(_task(fragment, 'rule'))
+
+    kinds = [type(queue.pop()).__name__ for _ in range(4)]
+    assert kinds[0] != kinds[1] and kinds[2] != kinds[3]
+
+
+def test_history(fragment_descs):
+    queue = CostAwareQueue(fragment_descs, workers=2)
+    queue.append(_task('small', 'slow'))
+    queue.append(_task('small', 'fast'))
+    for item in (queue.pop(), queue.pop()):
+        queue.finished(item, 100.0 if item.rule == 'slow' else 1.0)
+    assert queue.rate(('Task', 'slow')) == pytest.approx(10.0)
+    assert queue.rate(('Task', 'fast')) == pytest.approx(0.1)
+
+    queue.append(_task('medium', 'fast'))
+    queue.append(_task('small', 'slow'))
+    assert queue.pop().rule == 'slow'
+    assert queue.finished(queue.pop(), 30.0) == 30.0
+
+
+def test_makespan(fragment_descs):
+    queue = CostAwareQueue(fragment_descs, workers=2)
+    queue.append(_task('small', 'rule'))
+    queue.finished(queue.pop(), 20.0)
+
+    # Durations are predicted when items are popped, so later history does not change predictions
+    queue.append(_task('small', 'rule'))
+    queue.append(_task('medium', 'rule'))
+    medium, small = queue.pop(), queue.pop()
+    queue.finished(medium, 50.0)
+    queue.finished(small, 2.0)
+
+    predicted, actual = queue.makespan()
+    assert predicted == pytest.approx((10 * 1.0 + 100 * 2.0 + 10 * 2.0) / 2)
+    assert actual >= 0
+    assert queue.estimation_error() == pytest.approx((10.0 + 150.0 + 18.0) / 3)
+
+
+def test_default_wall_time(fragment_descs):
+    queue = CostAwareQueue(fragment_descs)
+    assert queue.finished(Abstract('small', 0)) is None
+    queue.append(Abstract('small', 0))
+    assert queue.finished(queue.pop()) >= 0
@@ -16,10 +16,18 @@
 #
 
 import os
+import json
 
 from clade.extensions.opts import filter_opts
 import klever.core.utils
 
+# Subdirectory of the cache directory to keep results of CIL
+CIL_CACHE_DIR = 'CIL'
+CIL_CACHE_STATS_FILE = 'statistics.json'
+
+# Directory to keep results of EMG stages shared by requirement classes
+SHARED_STAGES_DIR = 'EMG shared stages'
+
 
 def define_arch_dependent_macro(conf):
     return '-DLDV_{0}'.format(conf['architecture'].upper().replace('-', '_'))
@@ -38,6 +46,63 @@ def get_cif_or_aspectator_exec(conf, exec_cmd):
     return conf['CIF']['cross compile prefix'] + exec_cmd
 
 
+def get_cil_cache_statistics(cache_dir):
+    """
+    Get statistics of reusing results of CIL.
+
+    :param cache_dir: CIL cache directory.
+    :return: Dictionary with numbers of cache hits and misses and the size of input files that were not merged again.
+    """
+    stats_file = os.path.join(cache_dir, CIL_CACHE_STATS_FILE)
+    if not os.path.isfile(stats_file):
+        return {'hits': 0, 'misses': 0, 'saved bytes': 0}
+
+    with open(stats_file, 'r', encoding='utf-8') as fp:
+        return json.load(fp)
+
+
+def get_shared_stages_dir(fragment):
+    return os.path.abspath(os.path.join(SHARED_STAGES_DIR, fragment))
+
+
+class SharedStagesUsers:
+    """
+    Count requirement classes of program fragments that did not get shared EMG stages yet and delete directories with
+    these stages when they are not needed anymore.
+    """
+
+    def __init__(self, logger, keep_dirs):
+        self.logger = logger
+        self.keep_dirs = keep_dirs
+        self._users = {}
+
+    def add(self, fragment, users):
+        self._users[fragment] = users
+
+    def release(self, fragment):
+        """
+        Remember that one more requirement class of the program fragment got shared EMG stages.
+
+        :param fragment: Program fragment name.
+        :return: True if the directory with shared stages was deleted.
+        """
+        if fragment not in self._users:
+            return False
+
+        self._users[fragment] -= 1
+        if self._users[fragment]:
+            return False
+
+        del self._users[fragment]
+        shared_dir = get_shared_stages_dir(fragment)
+        if self.keep_dirs or not os.path.isdir(shared_dir):
+            return False
+
+        self.logger.debug('Delete shared EMG stages of fragment %s', fragment)
+        klever.core.utils.reliable_rmtree(self.logger, shared_dir)
+        return True
+
+
 def prepare_cif_opts(opts, clade, model_opts=False):
     new_opts = []
     meta = clade.get_meta()
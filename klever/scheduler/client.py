@@ -21,13 +21,13 @@ import json
 import os
 import sys
 import traceback
-import zipfile
 import shutil
 import re
 
 from klever.core.utils import time_units_converter
 from klever.scheduler.server import Server
-from klever.scheduler.utils import execute, process_task_results, submit_task_results, memory_units_converter
+from klever.scheduler.utils import execute, process_task_results, submit_task_results, memory_units_converter, \
+    extract_task_files
 
 
 def run_benchexec(mode, conf):
@@ -154,8 +154,9 @@ def solve_task(logger, conf, srv):
                     "so we have nothing to do there")
         os._exit(1)
 
-    with zipfile.ZipFile('task files.zip') as zfp:
-        zfp.extractall()
+    downloaded = extract_task_files(srv, conf["identifier"], 'task files.zip', os.path.curdir,
+                                    conf['client'].get('blob store'))
+    logger.debug("Downloaded {} bytes of task files that are not in the task archive".format(downloaded))
 
     os.makedirs("output".encode("utf-8"), exist_ok=True)
 
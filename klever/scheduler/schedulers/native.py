@@ -330,6 +330,8 @@ class Native(runners.TryLessMemoryRunner):
             client_conf["common"]["working directory"] = work_dir
             for name in ("verifier", "upload verifier input files"):
                 client_conf[name] = configuration[name]
+            # Files shared by tasks of the same job are downloaded once per node
+            client_conf["client"]["blob store"] = os.path.join(self.work_dir, "blobs", configuration["job id"])
 
             # Speculative flag
             if configuration.get('speculative'):
@@ -520,6 +522,8 @@ class Native(runners.TryLessMemoryRunner):
                     not self.conf["scheduler"]["keep working directory"]:
                 self.logger.debug("Clean task working directory {} for {}".format(work_dir, identifier))
                 shutil.rmtree(work_dir)
+            if mode == 'job':
+                shutil.rmtree(os.path.join(self.work_dir, "blobs", identifier), ignore_errors=True)
 
         if mode == 'task':
             if task_results:
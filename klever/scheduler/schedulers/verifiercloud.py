@@ -241,7 +241,10 @@ class VerifierCloud(runners.Runner):
                                  "so we have nothing to do there")
                 os._exit(1)
             self.logger.debug("Unpack archive {!r} to {!r}".format(archive, task_data_dir))
-            shutil.unpack_archive(archive, task_data_dir)
+            downloaded = utils.extract_task_files(self.server, identifier, archive, task_data_dir,
+                                                  os.path.join(self.work_dir, "blobs", job_id))
+            if downloaded:
+                self.logger.debug("Downloaded {} bytes of task files shared with other tasks".format(downloaded))
 
             # Update description
             description.update(self.__get_credentials(job_id))
@@ -599,6 +602,7 @@ class VerifierCloud(runners.Runner):
             if not any(t for t in self.__tasks.values() if t.job == job_id):
                 # There is no more tasks with the same job identifier and we can try to drop user credentials
                 del self.__credentials_cache[job_id]
+                shutil.rmtree(os.path.join(self.work_dir, "blobs", job_id), ignore_errors=True)
 
     @staticmethod
     def __make_fake_benchexec(description, path):
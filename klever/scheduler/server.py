@@ -125,6 +125,18 @@ class Server:
         self.logger.debug(f'Pull task {identifier} data')
         return self.session.get_archive("service/tasks/{}/download/".format(identifier), archive=archive)
 
+    @_robust_request
+    def pull_task_blob(self, identifier, checksum, file):
+        """
+        Download a file that is referenced by the verification task archive by its checksum.
+
+        :param identifier: Verification task identifier.
+        :param checksum: Checksum of the file.
+        :param file: Path to save the file.
+        """
+        self.logger.debug(f'Pull blob {checksum} of task {identifier}')
+        return self.session.get_file("service/tasks/{}/blobs/{}/".format(identifier, checksum), file)
+
     @_robust_request
     def submit_solution(self, identifier, description, archive):
         """
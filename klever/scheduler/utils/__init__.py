@@ -20,6 +20,7 @@ import logging.config
 import argparse
 import os
 import json
+import gzip
 import shutil
 import subprocess
 import time
@@ -32,7 +33,7 @@ import sys
 from xml.etree import ElementTree
 
 from klever.scheduler.utils import consul
-from klever.core.utils import memory_units_converter, StreamQueue
+from klever.core.utils import memory_units_converter, StreamQueue, get_file_checksum, TASK_BLOBS_MANIFEST
 
 # This should prevent rumbling of urllib3
 logging.getLogger("urllib3").setLevel(logging.WARNING)
@@ -185,6 +186,58 @@ def split_archive_name(path):
     return name, extension
 
 
+def extract_task_files(server, identifier, archive, directory, blob_store=None):
+    """
+    Extract the verification task archive and decompress files that are referenced by its manifest near other ones.
+    These files are downloaded only if the blob store misses them.
+
+    :param server: Server object.
+    :param identifier: Verification task identifier.
+    :param archive: Path to the task archive.
+    :param directory: Directory to extract files to.
+    :param blob_store: Directory to keep downloaded files by their checksums or None.
+    :return: The number of downloaded bytes.
+    """
+    with zipfile.ZipFile(archive) as zfp:
+        zfp.extractall(directory)
+
+    manifest_file = os.path.join(directory, TASK_BLOBS_MANIFEST)
+    if not os.path.isfile(manifest_file):
+        return 0
+
+    with open(manifest_file, encoding='utf-8') as fp:
+        manifest = json.load(fp)
+    os.remove(manifest_file)
+
+    if blob_store:
+        os.makedirs(blob_store, exist_ok=True)
+
+    downloaded = 0
+    for name, checksum in manifest.items():
+        path = os.path.normpath(os.path.join(directory, name))
+        if os.path.isabs(name) or os.path.relpath(path, directory).startswith(os.pardir):
+            raise ValueError('Task file {!r} is out of the task directory'.format(name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        blob = os.path.join(blob_store if blob_store else directory, checksum)
+        if not os.path.isfile(blob):
+            # Several clients can download the same blob simultaneously
+            tmp_blob = '{}.{}.tmp'.format(blob, os.getpid())
+            if not server.pull_task_blob(identifier, checksum, tmp_blob) or get_file_checksum(tmp_blob) != checksum:
+                if os.path.isfile(tmp_blob):
+                    os.remove(tmp_blob)
+                raise ValueError('Cannot download task file {!r}'.format(name))
+            os.replace(tmp_blob, blob)
+            downloaded += os.path.getsize(blob)
+
+        with gzip.open(blob, 'rb') as gzip_fp, open(path, 'wb') as fp:
+            shutil.copyfileobj(gzip_fp, fp)
+        if not blob_store:
+            os.remove(blob)
+
+    return downloaded
+
+
 def get_output(command):
     """
     Return STDOUT of the command.
@@ -132,6 +132,30 @@ class Session:
                     resp.close()
         return True
 
+    def get_file(self, endpoint, file):
+        """
+        Download a file from server.
+
+        :param endpoint: URL endpoint.
+        :param file: Path to save the file.
+        :return: True if the file was downloaded.
+        """
+        resp = None
+        try:
+            resp = self.__request(endpoint, 'GET', stream=True)
+            if not resp:
+                return False
+
+            self.logger.debug('Write file to {}'.format(file))
+            with open(file, 'wb') as fp:
+                for chunk in resp.iter_content(1024 * 1024):
+                    fp.write(chunk)
+        finally:
+            if resp:
+                resp.close()
+
+        return True
+
     def push_archive(self, endpoint, data, archive):
         """
         Upload an archive to server.